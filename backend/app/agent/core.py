@@ -354,7 +354,7 @@ class AgentService:
                             tool_args = json.loads(tool_args_str)
                             
                             # 执行工具
-                            tool_result = execute_tool(tool_name, member_id=member_id, **tool_args)
+                            tool_result = await execute_tool(tool_name, member_id=member_id, **tool_args)
                             
                             print(f"[AgentService] 工具执行成功")
                             print(f"[AgentService] 工具结果: {tool_result}")
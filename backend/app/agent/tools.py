@@ -4,12 +4,28 @@ AI Agent Tools for Database Access
 This module provides tool functions for AI agents to interact with the database.
 All database operations use raw SQL (no ORM) with parameterized queries to prevent SQL injection.
 """
-from datetime import datetime, timedelta
+import asyncio
+import functools
+from datetime import datetime, time, timedelta
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field
-import random
 
+from ..async_database import AsyncUnitOfWork
 from ..database import get_db
+from ..services.availability import (
+    availability_settings,
+    busy_range_query,
+    courts_query,
+    free_court_ids,
+    merge_busy,
+    next_available,
+)
+from ..services.court_slots import claim_court_slots
+from ..services.orders import generate_order_no
+from ..services.pricing import CourtNotFound, court_amount, court_price, quote
+from ..services.wallet import InsufficientBalance, MemberNotFound, debit, ensure_member
+from ..services.slot_holds import has_held_conflict, held_rows
+from ..services.reservation_index import note_reservation_booked, reservation_index
 
 
 # ============================================================================
@@ -32,6 +48,16 @@ class BookCourtArgs(BaseModel):
     end_hour: int = Field(..., ge=0, le=23, description="结束小时 (0-23)")
 
 
+class FindNextAvailableArgs(BaseModel):
+    """Arguments for finding the earliest free court slots"""
+    sport_type: Optional[str] = Field(None, description="运动类型，例如：羽毛球、篮球、瑜伽")
+    duration_hours: float = Field(1, gt=0, le=12, description="需要的时长（小时），例如 2")
+    from_date: Optional[str] = Field(None, description="从哪天开始找，格式：YYYY-MM-DD，默认今天")
+    days: int = Field(7, ge=1, le=31, description="向后找多少天，例如\"这周\"填 7")
+    earliest_hour: Optional[int] = Field(None, ge=0, le=23, description="每天最早开始的小时，默认营业开始")
+    latest_hour: Optional[int] = Field(None, ge=1, le=23, description="每天最晚结束的小时，默认营业结束")
+
+
 class GetGymRulesArgs(BaseModel):
     """Arguments for getting gym rules (no parameters needed)"""
     pass
@@ -41,7 +67,7 @@ class GetGymRulesArgs(BaseModel):
 # Tool Functions
 # ============================================================================
 
-def search_courts_tool(
+async def search_courts_tool(
     sport_type: Optional[str] = None,
     target_date: str = "",
     start_hour: int = 9,
@@ -51,11 +77,12 @@ def search_courts_tool(
     搜索可用场地
     
     根据日期和时间段，查询状态为"可用"且未被预约的场地。
+    只读查询，走异步连接池，不阻塞 Agent 所在的事件循环。
     
     核心逻辑：
     1. 构造目标时间段的 datetime 对象
-    2. 查询该时间段内已被占用的场地 ID（排除已取消的预约）
-    3. 查询所有可用场地，排除已占用的场地
+    2. 查询所有可用场地
+    3. 一次范围查询取出该时间段内的占用（排除已取消的预约），在内存中排除已占用的场地
     
     冲突检测公式：
     NOT (end_time <= new_start_time OR start_time >= new_end_time)
@@ -74,7 +101,7 @@ def search_courts_tool(
         - price: 每小时价格
     
     Example:
-        >>> search_courts_tool(sport_type="羽毛球", target_date="2025-01-26", start_hour=14, end_hour=16)
+        >>> await search_courts_tool(sport_type="羽毛球", target_date="2025-01-26", start_hour=14, end_hour=16)
         [
             {"id": 1, "name": "1号羽毛球场", "type": "羽毛球", "price": 50.0},
             {"id": 2, "name": "2号羽毛球场", "type": "羽毛球", "price": 50.0}
@@ -102,61 +129,108 @@ def search_courts_tool(
     start_dt = date_obj.replace(hour=start_hour, minute=0, second=0)
     end_dt = date_obj.replace(hour=end_hour, minute=0, second=0)
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
+    async with AsyncUnitOfWork() as db:
+        cursor = await db.cursor(dictionary=True)
+        try:
+            # 3. 查询所有可用场地
+            available_sql = """
+                SELECT id, name, type, price_per_hour AS price, status, location
+                FROM courts
+                WHERE status = '可用'
+            """
+            params: List[Any] = []
+        
+            # 添加运动类型过滤
+            if sport_type:
+                available_sql += " AND type = %s"
+                params.append(sport_type)
+        
+            available_sql += " ORDER BY id ASC"
+        
+            await cursor.execute(available_sql, params)
+            courts = await cursor.fetchall()
+        
+            # 4. 占用区间优先取进程内区间索引，否则一次范围查询；连同会员未过期的预留，在内存中排除已占用的场地
+            busy_rows = await asyncio.to_thread(reservation_index.busy_rows, start_dt, end_dt)
+            if busy_rows is None:
+                busy_sql, busy_params = busy_range_query(start_dt, end_dt, sport_type)
+                await cursor.execute(busy_sql, busy_params)
+                busy_rows = await cursor.fetchall()
+            busy_rows = list(busy_rows) + await asyncio.to_thread(held_rows, start_dt, end_dt)
+            free_ids = set(free_court_ids(courts, merge_busy(busy_rows), start_dt, end_dt))
+            courts = [c for c in courts if int(c["id"]) in free_ids]
+        
+            # 5. 格式化返回结果
+            result = []
+            for court in courts:
+                result.append({
+                    "id": court["id"],
+                    "name": court["name"],
+                    "type": court["type"],
+                    "price": float(court["price"] or 0),
+                })
+        
+            return result
+    
+        finally:
+            await cursor.close()
+
+
+async def find_next_available_tool(
+    sport_type: Optional[str] = None,
+    duration_hours: float = 1,
+    from_date: Optional[str] = None,
+    days: int = 7,
+    earliest_hour: Optional[int] = None,
+    latest_hour: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    查找最近的空闲时段（"这周最早什么时候有 2 小时的羽毛球场？"）
     
+    一次取出日期范围内的占用（区间索引或一次范围查询，连同会员预留），在内存中逐场地找空档，
+    返回最早的 5 个时段及价格；只读查询，走异步连接池。
+    """
     try:
-        # 3. 查询该时间段内已被占用的场地 ID
-        # 冲突检测：NOT (end_time <= start_dt OR start_time >= end_dt)
-        occupied_sql = """
-            SELECT DISTINCT court_id
-            FROM court_reservations
-            WHERE status <> '已取消'
-              AND NOT (end_time <= %s OR start_time >= %s)
-        """
-        cursor.execute(occupied_sql, (start_dt, end_dt))
-        occupied_rows = cursor.fetchall()
-        occupied_ids = [row["court_id"] for row in occupied_rows]
-        
-        # 4. 查询所有可用场地，排除已占用的场地
-        available_sql = """
-            SELECT id, name, type, price_per_hour AS price, status, location
-            FROM courts
-            WHERE status = '可用'
-        """
-        params: List[Any] = []
-        
-        # 添加运动类型过滤
-        if sport_type:
-            available_sql += " AND type = %s"
-            params.append(sport_type)
-        
-        # 排除已占用的场地
-        if occupied_ids:
-            placeholders = ", ".join(["%s"] * len(occupied_ids))
-            available_sql += f" AND id NOT IN ({placeholders})"
-            params.extend(occupied_ids)
-        
-        available_sql += " ORDER BY id ASC"
-        
-        cursor.execute(available_sql, params)
-        courts = cursor.fetchall()
-        
-        # 5. 格式化返回结果
-        result = []
-        for court in courts:
-            result.append({
-                "id": court["id"],
-                "name": court["name"],
-                "type": court["type"],
-                "price": float(court["price"] or 0),
-            })
-        
-        return result
-    
-    finally:
-        cursor.close()
-        db.close()
+        first_day = datetime.strptime(from_date, "%Y-%m-%d").date() if from_date else datetime.now().date()
+    except ValueError:
+        raise ValueError("from_date 格式不正确，应为 YYYY-MM-DD")
+    
+    day_list = [first_day + timedelta(days=i) for i in range(days)]
+    rules = await asyncio.to_thread(availability_settings)
+    day_from = time(earliest_hour, 0) if earliest_hour is not None else rules["open_time"]
+    day_to = time(latest_hour, 0) if latest_hour is not None else rules["close_time"]
+    if day_to <= day_from:
+        raise ValueError("latest_hour 必须大于 earliest_hour")
+    start_dt = datetime.combine(day_list[0], day_from)
+    end_dt = datetime.combine(day_list[-1], day_to)
+    
+    async with AsyncUnitOfWork() as db:
+        cursor = await db.cursor(dictionary=True)
+        try:
+            sql, params = courts_query(sport_type, with_price=True)
+            await cursor.execute(sql, params)
+            courts = await cursor.fetchall()
+            
+            busy_rows = await asyncio.to_thread(reservation_index.busy_rows, start_dt, end_dt)
+            if busy_rows is None:
+                busy_sql, busy_params = busy_range_query(start_dt, end_dt, sport_type)
+                await cursor.execute(busy_sql, busy_params)
+                busy_rows = await cursor.fetchall()
+            busy_rows = list(busy_rows) + await asyncio.to_thread(held_rows, start_dt, end_dt)
+        finally:
+            await cursor.close()
+    
+    return await asyncio.to_thread(
+        next_available,
+        courts,
+        merge_busy(busy_rows),
+        day_list,
+        day_from,
+        day_to,
+        int(round(duration_hours * 60)),
+        not_before=datetime.now(),
+        price_of=court_amount,
+    )
 
 
 def get_gym_rules_tool() -> str:
@@ -275,6 +349,12 @@ def book_court_tool(
     if start_dt < datetime.now():
         raise ValueError("不能预订过去的时间，请选择当前时间之后的时段")
     
+    # 预检：进程内区间索引已能确定冲突时，不再开事务
+    if reservation_index.has_conflict(court_id, start_dt, end_dt):
+        raise ValueError(f"该时间段已被预约，请重新选择其他时间或场地")
+    if has_held_conflict(court_id, start_dt, end_dt):
+        raise ValueError(f"该时间段已被其他会员预留，请重新选择其他时间或场地")
+    
     # ========================================================================
     # 开始数据库事务
     # ========================================================================
@@ -287,102 +367,57 @@ def book_court_tool(
         # 2. 锁定与冲突检测 (Double Check)
         # ====================================================================
         
-        # 再次查询该时间段是否已被占用（防止并发问题）
-        conflict_sql = """
-            SELECT COUNT(*) AS cnt
-            FROM court_reservations
-            WHERE court_id = %s
-              AND status <> '已取消'
-              AND NOT (end_time <= %s OR start_time >= %s)
-        """
-        cursor.execute(conflict_sql, (court_id, start_dt, end_dt))
-        conflict_row = cursor.fetchone()
-        
-        if (conflict_row.get("cnt") or 0) > 0:
-            raise ValueError(f"该时间段已被预约，请重新选择其他时间或场地")
+        # 锁定该场地当天的位图行并置位，并发预订同一时段时只有一个能成功
+        # 冲突时抛出 SlotConflict（ValueError 子类），由下方统一回滚
+        claim_court_slots(court_id, start_dt, end_dt, cursor=cursor)
         
         # ====================================================================
         # 3. 获取价格与计算
         # ====================================================================
         
-        # 查询场地信息
-        cursor.execute(
-            "SELECT id, name, type, price_per_hour, status FROM courts WHERE id = %s",
-            (court_id,)
-        )
-        court = cursor.fetchone()
-        
-        if not court:
+        # 场地信息与价格取自统一计价引擎的缓存价格表，会员折扣与其他下单入口一致
+        try:
+            court = court_price(court_id, cursor)
+        except CourtNotFound:
             raise ValueError(f"场地ID {court_id} 不存在")
         
-        if court["status"] != "可用":
-            raise ValueError(f"场地 {court['name']} 当前状态为 {court['status']}，无法预订")
-        
-        court_name = court["name"]
-        court_type = court.get("type")
-        price_per_hour = float(court["price_per_hour"] or 0)
+        if court.status != "可用":
+            raise ValueError(f"场地 {court.name} 当前状态为 {court.status}，无法预订")
         
+        court_name = court.name
+        court_type = court.type
+        price_per_hour = court.price_per_hour
+        duration_hours = end_hour - start_hour
         if price_per_hour <= 0:
             raise ValueError("场地价格未配置，无法预订")
         
         # 计算总价
-        duration_hours = end_hour - start_hour
-        total_amount = round(price_per_hour * duration_hours, 2)
+        total_amount = quote(
+            [{"court_id": court_id, "start": start_dt, "end": end_dt}], member_id, cursor=cursor
+        )["total_amount"]
         
         # ====================================================================
-        # 4. 余额检查与扣款 (核心财务逻辑)
+        # 4-5. 余额检查、扣款与交易流水 (核心财务逻辑)
         # ====================================================================
         
-        # 查询会员余额
-        cursor.execute(
-            "SELECT id, name, balance FROM members WHERE id = %s",
-            (member_id,)
-        )
-        member = cursor.fetchone()
-        
-        if not member:
+        # 会员信息（不加锁）
+        try:
+            member_name = ensure_member(cursor, member_id, require_active=False)["name"]
+        except MemberNotFound:
             raise ValueError(f"会员ID {member_id} 不存在，请先注册会员")
         
-        current_balance = float(member["balance"] or 0)
-        member_name = member["name"]
-        
-        # 余额检查
-        if current_balance < total_amount:
-            raise ValueError(
-                f"余额不足，需支付 ¥{total_amount:.2f} 元，当前余额 ¥{current_balance:.2f} 元。请先充值。"
-            )
-        
-        # 执行扣款
-        cursor.execute(
-            "UPDATE members SET balance = balance - %s WHERE id = %s",
-            (total_amount, member_id)
-        )
-        
-        # 计算扣款后余额
-        balance_after = round(current_balance - total_amount, 2)
-        
-        # ====================================================================
-        # 5. 记录交易流水 (Audit Log)
-        # ====================================================================
-        
+        # 一条条件更新完成余额检查与扣款，并写入交易流水 (Audit Log)
         transaction_remark = f"AI助手自动预订: {court_name} {target_date} {start_hour:02d}:00-{end_hour:02d}:00"
-        
-        cursor.execute(
-            """
-            INSERT INTO member_transactions
-                (member_id, type, amount, balance_after, remark, created_at)
-            VALUES (%s, %s, %s, %s, %s, NOW())
-            """,
-            (
-                member_id,
-                "消费",
-                -total_amount,  # 负数表示扣款
-                balance_after,
-                transaction_remark
+        try:
+            charged = debit(cursor, member_id, total_amount, transaction_remark)
+        except InsufficientBalance as e:
+            raise ValueError(
+                f"余额不足，需支付 ¥{total_amount:.2f} 元，当前余额 ¥{e.balance:.2f} 元。请先充值。"
             )
-        )
         
-        transaction_id = cursor.lastrowid
+        balance_after = charged.balance
+        current_balance = round(balance_after + total_amount, 2)
+        transaction_id = charged.transaction_id
         
         # ====================================================================
         # 6. 创建预约记录
@@ -414,9 +449,8 @@ def book_court_tool(
         # 7. 创建订单记录 (Orders Table)
         # ====================================================================
         
-        # 生成订单号：GYM-C-{YYYYMMDDHHMMSS}{3位随机数}
-        now = datetime.now()
-        order_no = f"GYM-C-{now.strftime('%Y%m%d%H%M%S')}{random.randint(100, 999)}"
+        # 生成订单号：与后台下单同一生成器（前缀取系统设置，不查库、不重复）
+        order_no = generate_order_no("court", cursor)
         
         cursor.execute(
             """
@@ -447,6 +481,7 @@ def book_court_tool(
         # ====================================================================
         
         db.commit()
+        note_reservation_booked(reservation_id, court_id, start_dt, end_dt)
         
         # ====================================================================
         # 7. 返回成功结果
@@ -509,6 +544,11 @@ AVAILABLE_TOOLS = {
         "args_model": BookCourtArgs,
         "description": "预订场地。当用户明确表示要下单、预订某个具体的场地时调用此工具。会自动从会员余额扣款并记录交易流水。",
     },
+    "find_next_available": {
+        "function": find_next_available_tool,
+        "args_model": FindNextAvailableArgs,
+        "description": "查找最近的空闲场地时段。当用户问\"最早什么时候有空场\"、\"这周哪天有 2 小时的羽毛球场\"这类不确定具体日期/时间的问题时调用，返回最早的几个可预订时段及价格",
+    },
     "get_gym_rules": {
         "function": get_gym_rules_tool,
         "args_model": GetGymRulesArgs,
@@ -537,10 +577,13 @@ def get_tool_schemas() -> List[Dict[str, Any]]:
     return schemas
 
 
-def execute_tool(tool_name: str, **kwargs) -> Any:
+async def execute_tool(tool_name: str, **kwargs) -> Any:
     """
     执行指定的工具函数
     
+    异步工具直接 await；同步工具（如带事务的 book_court_tool）放到线程池执行，
+    避免阻塞 Agent 的事件循环。
+    
     Args:
         tool_name: 工具名称
         **kwargs: 工具参数（包含 LLM 生成的参数和上下文参数如 member_id）
@@ -583,4 +626,6 @@ def execute_tool(tool_name: str, **kwargs) -> Any:
         call_args["member_id"] = context_params["member_id"]
     
     # 执行工具函数
-    return function(**call_args)
+    if inspect.iscoroutinefunction(function):
+        return await function(**call_args)
+    return await asyncio.to_thread(functools.partial(function, **call_args))
@@ -0,0 +1,202 @@
+"""
+异步数据库连接池（aiomysql）
+
+同步路由运行在 anyio 约 40 个线程的线程池里，并发上限由线程数决定；
+Agent 等 async 代码直接调用 mysql-connector 还会阻塞事件循环。
+这里提供与 database.py 对应的异步路径，热点读接口改为 async def 后使用：
+
+1. 连接池懒加载，绑定当前事件循环（测试中每个 TestClient 的事件循环不同，会各自建池）
+2. 借连接最长等待 DB_POOL_TIMEOUT 秒，超时抛出 PoolTimeoutError，与同步池一致
+3. AsyncUnitOfWork / get_async_uow 与同步的 UnitOfWork / get_uow 用法一致：
+   一个请求共用一条连接，请求结束归还，未提交的事务回滚
+
+aiomysql 为可选依赖，只有走到异步路径时才导入。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from .config import settings
+from .database import PoolTimeoutError, dbconfig
+
+logger = logging.getLogger(__name__)
+
+_async_pool = None
+_async_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_pool_lock: Optional[asyncio.Lock] = None
+
+# 借连接统计，字段与同步池 stats() 对齐
+_async_stats: Dict[str, Any] = {
+    "checkouts": 0,
+    "waits": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+    "timeouts": 0,
+}
+
+
+def _import_aiomysql():
+    try:
+        import aiomysql
+    except ImportError as e:  # pragma: no cover - 取决于部署环境
+        raise RuntimeError("异步数据库路径需要安装 aiomysql：pip install aiomysql") from e
+    return aiomysql
+
+
+async def _init_async_pool():
+    """初始化异步连接池（每个事件循环一个单例）"""
+    global _async_pool, _async_pool_loop, _async_pool_lock
+    loop = asyncio.get_running_loop()
+    if _async_pool is not None and _async_pool_loop is loop:
+        return _async_pool
+
+    if _async_pool_lock is None or _async_pool_loop is not loop:
+        _async_pool_lock = asyncio.Lock()
+        _async_pool_loop = loop
+        _async_pool = None
+
+    async with _async_pool_lock:
+        if _async_pool is None:
+            aiomysql = _import_aiomysql()
+            _async_pool = await aiomysql.create_pool(
+                host=dbconfig["host"],
+                port=dbconfig["port"],
+                user=dbconfig["user"],
+                password=dbconfig["password"],
+                db=dbconfig["database"],
+                charset=dbconfig["charset"],
+                minsize=settings.DB_ASYNC_POOL_MIN,
+                maxsize=settings.DB_ASYNC_POOL_SIZE,
+                autocommit=False,
+                pool_recycle=settings.DB_POOL_RECYCLE,
+            )
+            logger.info(f"异步数据库连接池初始化成功，最大连接数: {settings.DB_ASYNC_POOL_SIZE}")
+    return _async_pool
+
+
+async def _acquire(timeout: Optional[float] = None):
+    pool = await _init_async_pool()
+    timeout = settings.DB_POOL_TIMEOUT if timeout is None else timeout
+    _async_stats["checkouts"] += 1
+    if pool.freesize == 0 and pool.size >= pool.maxsize:
+        _async_stats["waits"] += 1
+    start = time.monotonic()
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), timeout)
+    except asyncio.TimeoutError:
+        _async_stats["timeouts"] += 1
+        raise PoolTimeoutError(f"等待异步数据库连接超时（{timeout:.1f}s）")
+    waited = time.monotonic() - start
+    _async_stats["wait_time_total"] += waited
+    _async_stats["wait_time_max"] = max(_async_stats["wait_time_max"], waited)
+    return conn
+
+
+class AsyncUnitOfWork:
+    """
+    异步请求级工作单元：接口与 UnitOfWork 一致，方法均为协程。
+
+        cursor = await db.cursor(dictionary=True)
+        try:
+            await cursor.execute(sql, params)
+            rows = await cursor.fetchall()
+        finally:
+            await cursor.close()
+
+    也可以脱离请求单独使用：async with AsyncUnitOfWork() as db: ...
+    """
+
+    def __init__(self):
+        self._conn = None
+
+    async def connection(self):
+        if self._conn is None:
+            self._conn = await _acquire()
+        return self._conn
+
+    async def cursor(self, dictionary: bool = False):
+        conn = await self.connection()
+        if dictionary:
+            aiomysql = _import_aiomysql()
+            return await conn.cursor(aiomysql.DictCursor)
+        return await conn.cursor()
+
+    async def start_transaction(self):
+        """BEGIN 会隐式提交依赖阶段的只读事务，无需像同步版那样先 commit"""
+        conn = await self.connection()
+        await conn.begin()
+
+    async def commit(self):
+        if self._conn is not None:
+            await self._conn.commit()
+
+    async def rollback(self):
+        if self._conn is not None:
+            await self._conn.rollback()
+
+    async def release(self):
+        """归还连接；aiomysql 归还事务中的连接会直接关闭，所以先回滚"""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            if not conn.closed and conn.get_transaction_status():
+                await conn.rollback()
+        except Exception as e:
+            logger.warning(f"归还异步连接前回滚失败: {e}")
+            conn.close()
+        pool = _async_pool
+        if pool is not None and _async_pool_loop is asyncio.get_running_loop():
+            await pool.release(conn)
+        else:
+            conn.close()
+
+    async def __aenter__(self) -> "AsyncUnitOfWork":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+
+async def get_async_uow() -> AsyncIterator[AsyncUnitOfWork]:
+    """
+    FastAPI 依赖：异步请求级工作单元，用于 async def 路由。
+
+    用法：
+        @router.get("")
+        async def list_xxx(db: AsyncUnitOfWork = Depends(get_async_uow)):
+            cursor = await db.cursor(dictionary=True)
+            ...
+    """
+    uow = AsyncUnitOfWork()
+    try:
+        yield uow
+    finally:
+        await uow.release()
+
+
+def get_async_pool_stats() -> Dict[str, Any]:
+    """返回异步连接池统计信息；尚未初始化时只返回借用计数"""
+    stats = dict(_async_stats)
+    checkouts = stats["checkouts"]
+    stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+    pool = _async_pool
+    if pool is not None:
+        stats.update(
+            size=pool.maxsize,
+            total=pool.size,
+            idle=pool.freesize,
+            in_use=pool.size - pool.freesize,
+        )
+    return stats
+
+
+async def close_async_pool():
+    """关闭异步连接池（应用关闭时调用）"""
+    global _async_pool
+    pool, _async_pool = _async_pool, None
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+        logger.info("异步数据库连接池已关闭")
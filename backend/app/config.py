@@ -18,7 +18,53 @@ class Settings(BaseSettings):
     # 数据库连接池配置
     DB_POOL_SIZE: int = 10
     DB_POOL_NAME: str = "gym_pool"
+    DB_POOL_MAX_OVERFLOW: int = 10       # 池满时最多额外创建的连接数
+    DB_POOL_TIMEOUT: float = 10.0        # 借连接最长等待秒数，超时返回错误
+    DB_POOL_RECYCLE: int = 3600          # 连接最长存活秒数（需小于 MySQL wait_timeout），<= 0 不回收
+    DB_POOL_PRE_PING: bool = True        # 借出前 ping 空闲较久的连接
+    DB_POOL_PING_INTERVAL: float = 30.0  # 空闲超过该秒数才 ping
+    DB_ASYNC_POOL_SIZE: int = 20         # 异步连接池（aiomysql）最大连接数
+    DB_ASYNC_POOL_MIN: int = 1           # 异步连接池最少保持的连接数
+
+    # 跨进程缓存失效：轮询 cache_versions 表的间隔（秒），<= 0 关闭后台轮询
+    CACHE_BUS_POLL_INTERVAL: float = 0.5
     
+    # 认证主体缓存（token -> 当前用户/会员）
+    PRINCIPAL_CACHE_SIZE: int = 4096     # 最多缓存的 token 数，<= 0 关闭缓存
+    PRINCIPAL_CACHE_TTL: float = 60.0    # 单条缓存有效期（秒），状态变更会经 cache_bus 提前失效
+
+    # 场地预约区间索引（进程内），覆盖今天起的天数与兜底刷新间隔（秒）
+    RESERVATION_INDEX_DAYS: int = 14
+    RESERVATION_INDEX_TTL: float = 300.0
+
+    # 统一计价引擎：场地/商品价格表的兜底刷新间隔（秒），保存接口会经 cache_bus 提前失效
+    PRICING_CACHE_TTL: float = 300.0
+    # 批量计价接口单次最多的明细条数
+    PRICING_QUOTE_MAX_LINES: int = 500
+
+    # 会员端时段预留：有效期（秒）与每个会员同时持有的上限
+    SLOT_HOLD_TTL_SECONDS: int = 300
+    SLOT_HOLD_MAX_PER_MEMBER: int = 3
+    # 满场候补：每个会员同时等待中的候补上限
+    WAITLIST_MAX_PER_MEMBER: int = 5
+
+    # 预约状态后台推进：轮询间隔（秒，<= 0 关闭）与每批推进的最大条数
+    RESERVATION_LIFECYCLE_INTERVAL: float = 60.0
+    RESERVATION_LIFECYCLE_BATCH_SIZE: int = 500
+
+    # 订单号：本进程的 worker id（0-999；< 0 表示启动时在 order_no_workers 表中租用）与租期（秒）
+    ORDER_NO_WORKER_ID: int = -1
+    ORDER_NO_LEASE_TTL: float = 120.0
+
+    # 场地停用批量取消：每个事务处理的预约条数
+    COURT_CLOSURE_CHUNK_SIZE: int = 100
+
+    # 密码哈希
+    PASSWORD_HASH_SCHEME: str = "pbkdf2_sha256"  # 新密码使用的算法（passlib 名称）
+    PASSWORD_LEGACY_SCHEMES: str = ""            # 仍可验证的旧算法，逗号分隔；登录成功后自动升级
+    PASSWORD_HASH_ROUNDS: int = 29000            # 迭代次数；低于该值的旧哈希会在登录时重算
+    PASSWORD_HASH_WORKERS: int = 4               # 专用哈希线程数，即同时进行的哈希/验证上限
+
     # AI Agent 配置
     DEEPSEEK_API_KEY: str = ""  # DeepSeek API Key
 
@@ -1,7 +1,34 @@
 # backend/app/database.py
+"""
+数据库连接池
+
+mysql-connector 自带的 MySQLConnectionPool 在连接耗尽时会立刻抛出
+"pool exhausted"，而 FastAPI 的同步路由运行在约 40 个线程的线程池里，
+高峰期请求数一旦超过池大小就直接 500。这里实现一个会等待的连接池：
+
+1. 借出连接时按 FIFO 顺序排队等待，超过 DB_POOL_TIMEOUT 秒才报错
+2. 池满时允许临时创建 DB_POOL_MAX_OVERFLOW 个溢出连接，归还时若无人等待即关闭
+3. 空闲超过 DB_POOL_PING_INTERVAL 秒的连接借出前先 ping，失效则重建
+4. 存活超过 DB_POOL_RECYCLE 秒的连接在借出时回收重建，避免被服务端 wait_timeout 断开
+5. close_pool() 会真正关闭空闲连接，并等待借出中的连接归还后关闭
+6. get_pool_stats() 返回等待耗时、使用中/溢出连接数、超时次数，便于按数据调整池大小
+
+调用方式不变：db = get_db() 取连接，db.close() 归还到池中。
+
+路由里优先使用请求级工作单元 get_uow：一个请求（含认证依赖、路由、service）
+共用一条连接，业务写入在一次 commit 中原子提交。
+"""
 import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
 import mysql.connector
-from mysql.connector import Error, pooling
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
 from .config import settings
 
 logger = logging.getLogger(__name__)
@@ -15,25 +42,343 @@ dbconfig = {
     "charset": "utf8mb4",
 }
 
+
+class PoolTimeoutError(PoolError):
+    """在 timeout 秒内没有等到可用连接"""
+
+
+class _Waiter:
+    """排队等待连接的线程，归还连接时直接交到队首等待者手里（FIFO）"""
+
+    __slots__ = ("event", "entry")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry: Optional["_PoolEntry"] = None
+
+
+class _PoolEntry:
+    """池内一条物理连接及其元数据"""
+
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw: Any):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+class PooledConnection:
+    """
+    借出给调用方的连接代理。
+
+    除 close() 外的属性都透传给底层 mysql-connector 连接；
+    close() 不会断开物理连接，而是把它归还到连接池（可重复调用）。
+    """
+
+    def __init__(self, pool: "ConnectionPool", entry: _PoolEntry):
+        self._pool = pool
+        self._entry: Optional[_PoolEntry] = entry
+
+    def __getattr__(self, name: str) -> Any:
+        entry = self.__dict__.get("_entry")
+        if entry is None:
+            raise PoolError("连接已归还到连接池，不能继续使用")
+        return getattr(entry.raw, name)
+
+    def close(self) -> None:
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """
+    线程安全的阻塞式连接池。
+
+    Args:
+        creator: 创建物理连接的函数
+        size: 常驻连接数
+        max_overflow: 池满时最多额外创建的连接数
+        timeout: 借出连接的最长等待秒数
+        recycle: 连接最长存活秒数，<= 0 表示不回收
+        pre_ping: 借出前是否 ping 空闲较久的连接
+        ping_interval: 空闲超过多少秒才 ping，0 表示每次借出都 ping
+    """
+
+    def __init__(
+        self,
+        creator: Callable[[], Any],
+        *,
+        size: int = 10,
+        max_overflow: int = 0,
+        timeout: float = 30.0,
+        recycle: int = -1,
+        pre_ping: bool = True,
+        ping_interval: float = 30.0,
+    ):
+        if size < 1:
+            raise ValueError("连接池大小至少为 1")
+        self._creator = creator
+        self.size = size
+        self.max_overflow = max(0, max_overflow)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._idle: Deque[_PoolEntry] = deque()
+        self._waiters: Deque[_Waiter] = deque()
+        self._total = 0  # 已创建且未关闭的物理连接数（空闲 + 借出）
+        self._closed = False
+
+        # 统计数据
+        self._checkouts = 0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._overflow_peak = 0
+
+    # ---------- 借出 ----------
+
+    def get_connection(self, timeout: Optional[float] = None) -> PooledConnection:
+        """借出一个连接，池满时排队等待，超时抛出 PoolTimeoutError"""
+        timeout = self.timeout if timeout is None else timeout
+        waiter: Optional[_Waiter] = None
+        entry: Optional[_PoolEntry] = None
+        need_create = False
+
+        with self._lock:
+            if self._closed:
+                raise PoolError("连接池已关闭")
+            if self._idle and not self._waiters:
+                entry = self._idle.pop()
+            elif self._total < self.size + self.max_overflow and not self._waiters:
+                self._total += 1
+                self._overflow_peak = max(self._overflow_peak, self._total - self.size)
+                need_create = True
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        if need_create:
+            entry = self._create_entry()
+        else:
+            if waiter is not None:
+                entry = self._wait_for(waiter, timeout)
+            entry = self._validate(entry)
+        entry.last_used = time.monotonic()
+        with self._lock:
+            self._checkouts += 1
+        return PooledConnection(self, entry)
+
+    def _wait_for(self, waiter: _Waiter, timeout: float) -> _PoolEntry:
+        started = time.monotonic()
+        waiter.event.wait(timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            self._wait_count += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            if waiter.entry is None:
+                # 超时或连接池关闭：把自己移出队列
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if self._closed:
+                    raise PoolError("连接池已关闭")
+                self._timeouts += 1
+                raise PoolTimeoutError(
+                    f"等待数据库连接超时（{timeout:.1f}s），"
+                    f"使用中 {self._total - len(self._idle)}，排队 {len(self._waiters)}"
+                )
+            return waiter.entry
+
+    def _create_entry(self) -> _PoolEntry:
+        """创建物理连接（调用前已在 _total 中占位）"""
+        try:
+            raw = self._creator()
+        except Exception:
+            with self._lock:
+                self._total -= 1
+                self._wake_creator_slot()
+            raise
+        with self._lock:
+            self._created += 1
+        return _PoolEntry(raw)
+
+    def _wake_creator_slot(self) -> None:
+        """释放了一个连接名额：若有人排队，让队首的人去新建（需在锁内调用）"""
+        if self._waiters and self._total < self.size + self.max_overflow and not self._closed:
+            # 用一个占位 entry 唤醒等待者，由其在锁外创建真实连接
+            self._total += 1
+            waiter = self._waiters.popleft()
+            waiter.entry = _PoolEntry(None)
+            waiter.event.set()
+
+    def _validate(self, entry: _PoolEntry) -> _PoolEntry:
+        """回收过期连接、ping 空闲较久的连接；失败则原地重建"""
+        if entry.raw is None:
+            return self._replace(entry, reason=None)
+
+        now = time.monotonic()
+        if self.recycle > 0 and now - entry.created_at > self.recycle:
+            return self._replace(entry, reason="recycle")
+
+        if self.pre_ping and now - entry.last_used >= self.ping_interval:
+            try:
+                entry.raw.ping(reconnect=False)
+            except Exception:
+                return self._replace(entry, reason="ping")
+        return entry
+
+    def _replace(self, entry: _PoolEntry, reason: Optional[str]) -> _PoolEntry:
+        if entry.raw is not None:
+            self._close_raw(entry.raw)
+        with self._lock:
+            if reason == "recycle":
+                self._recycled += 1
+            elif reason == "ping":
+                self._ping_failures += 1
+        return self._create_entry()
+
+    # ---------- 归还 ----------
+
+    def _release(self, entry: _PoolEntry) -> None:
+        raw = entry.raw
+        healthy = True
+        try:
+            # 未提交的事务一律回滚，避免脏数据/行锁跟着连接回到池里
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            healthy = False
+        entry.last_used = time.monotonic()
+
+        discard = False
+        with self._lock:
+            if self._closed or not healthy:
+                discard = True
+            elif self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.entry = entry
+                waiter.event.set()
+                return
+            elif self._total > self.size:
+                # 溢出连接：无人等待时直接关闭
+                discard = True
+            else:
+                self._idle.append(entry)
+                return
+
+            self._total -= 1
+            self._wake_creator_slot()
+            self._drained.notify_all()
+
+        if discard:
+            self._close_raw(raw)
+
+    @staticmethod
+    def _close_raw(raw: Any) -> None:
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # ---------- 关闭与统计 ----------
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        排空连接池：关闭空闲连接，唤醒排队线程，并等待借出中的连接归还后关闭。
+        超过 timeout 秒仍未归还的连接交给 GC 处理。
+        """
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            while self._waiters:
+                self._waiters.popleft().event.set()
+        for entry in idle:
+            self._close_raw(entry.raw)
+
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._total > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"关闭连接池时仍有 {self._total} 个连接未归还")
+                    break
+                self._drained.wait(remaining)
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池运行指标（用于监控和调整池大小）"""
+        with self._lock:
+            in_use = self._total - len(self._idle)
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "total": self._total,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "overflow": max(0, self._total - self.size),
+                "overflow_peak": self._overflow_peak,
+                "waiting": len(self._waiters),
+                "checkouts": self._checkouts,
+                "waits": self._wait_count,
+                "wait_time_total": round(self._wait_total, 6),
+                "wait_time_avg": round(self._wait_total / self._wait_count, 6) if self._wait_count else 0.0,
+                "wait_time_max": round(self._wait_max, 6),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "ping_failures": self._ping_failures,
+                "closed": self._closed,
+            }
+
+
 # 数据库连接池（单例）
-_db_pool = None
+_db_pool: Optional[ConnectionPool] = None
+_db_pool_lock = threading.Lock()
 
 
-def _init_pool():
+def _connect():
+    return mysql.connector.connect(**dbconfig)
+
+
+def _init_pool() -> ConnectionPool:
     """初始化数据库连接池（懒加载单例）"""
     global _db_pool
     if _db_pool is None:
-        try:
-            _db_pool = pooling.MySQLConnectionPool(
-                pool_name=settings.DB_POOL_NAME,
-                pool_size=settings.DB_POOL_SIZE,
-                pool_reset_session=True,
-                **dbconfig
-            )
-            logger.info(f"数据库连接池初始化成功，池大小: {settings.DB_POOL_SIZE}")
-        except Error as e:
-            logger.error(f"数据库连接池初始化失败: {e}")
-            raise
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    _connect,
+                    size=settings.DB_POOL_SIZE,
+                    max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+                    timeout=settings.DB_POOL_TIMEOUT,
+                    recycle=settings.DB_POOL_RECYCLE,
+                    pre_ping=settings.DB_POOL_PRE_PING,
+                    ping_interval=settings.DB_POOL_PING_INTERVAL,
+                )
+                logger.info(
+                    f"数据库连接池 {settings.DB_POOL_NAME} 初始化成功，"
+                    f"池大小: {settings.DB_POOL_SIZE}，最大溢出: {settings.DB_POOL_MAX_OVERFLOW}"
+                )
     return _db_pool
 
 
@@ -51,11 +396,114 @@ def get_db():
         raise
 
 
-def close_pool():
-    """关闭连接池（用于应用关闭时清理资源）"""
+def get_pool_stats() -> Dict[str, Any]:
+    """返回连接池统计信息；连接池尚未初始化时返回空字典"""
+    pool = _db_pool
+    return pool.stats() if pool is not None else {}
+
+
+def close_pool(timeout: float = 10.0):
+    """关闭连接池（用于应用关闭时清理资源），会等待借出中的连接归还"""
     global _db_pool
-    if _db_pool is not None:
-        # MySQL Connector 的连接池没有显式 close 方法，
-        # 但我们可以将引用置为 None，让 GC 处理
-        _db_pool = None
+    with _db_pool_lock:
+        pool, _db_pool = _db_pool, None
+    if pool is not None:
+        pool.close(timeout=timeout)
         logger.info("数据库连接池已关闭")
+
+
+class UnitOfWork:
+    """
+    请求级工作单元：一个请求内的认证依赖、路由和 service 共用同一条连接。
+
+    - 第一次用到时才从连接池借连接，不访问数据库的请求不占用连接
+    - 接口与连接保持一致（cursor / start_transaction / commit / rollback），
+      路由代码无需改写
+    - 请求结束时由 get_uow 归还连接，未提交的事务会被回滚
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._explicit = False  # 是否处在 start_transaction 开启、尚未提交/回滚的事务中
+
+    @property
+    def connection(self):
+        if self._conn is None:
+            self._conn = get_db()
+        return self._conn
+
+    def cursor(self, *args, **kwargs):
+        return self.connection.cursor(*args, **kwargs)
+
+    def start_transaction(self, **kwargs):
+        """
+        开启显式事务。
+        - 已处在显式事务中（嵌套调用）时抛出 RuntimeError：不能替外层提交它做了一半的修改，由外层统一 commit
+        - 认证依赖中的查询已隐式开启了只读事务，这里回滚掉（只结束读快照，不提交任何东西），
+          保证写事务从最新快照开始（否则 mysql-connector 会报 Transaction already in progress）；
+          因此在显式事务之外的写入必须自己先 commit
+        """
+        if self._explicit:
+            raise RuntimeError("事务已在进行中，不能嵌套开启；请由最外层统一 commit / rollback")
+        conn = self.connection
+        if conn.in_transaction:
+            conn.rollback()
+        conn.start_transaction(**kwargs)
+        self._explicit = True
+
+    def commit(self):
+        if self._conn is not None:
+            self._conn.commit()
+        self._explicit = False
+
+    def rollback(self):
+        if self._conn is not None:
+            self._conn.rollback()
+        self._explicit = False
+
+    def release(self):
+        """归还连接（连接池会回滚未提交的事务）"""
+        conn, self._conn = self._conn, None
+        self._explicit = False
+        if conn is not None:
+            conn.close()
+
+
+def get_uow() -> Iterator[UnitOfWork]:
+    """
+    FastAPI 依赖：请求级工作单元。
+    FastAPI 在同一请求内缓存依赖结果，get_current_user 与路由拿到的是同一个实例。
+
+    用法：
+        @router.post("")
+        def create_xxx(data: XxxIn, db: UnitOfWork = Depends(get_uow)):
+            cursor = db.cursor(dictionary=True)
+            ...
+            db.commit()
+    """
+    uow = UnitOfWork()
+    try:
+        yield uow
+    finally:
+        uow.release()
+
+
+@contextmanager
+def cursor_scope(cursor=None, *, dictionary: bool = False):
+    """
+    service 层取游标的统一入口：
+    - 传入外部 cursor 时直接复用，由调用方负责 commit（与请求共用一个事务）
+    - 未传入时临时借一条连接，正常结束自动 commit 并归还
+    """
+    if cursor is not None:
+        yield cursor
+        return
+
+    db = get_db()
+    own = db.cursor(dictionary=dictionary)
+    try:
+        yield own
+        db.commit()
+    finally:
+        own.close()
+        db.close()
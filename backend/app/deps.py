@@ -4,8 +4,8 @@
 提供用户认证、权限控制等依赖注入函数，用于 FastAPI 路由的权限验证。
 
 核心功能：
-1. 管理端用户认证（get_current_user）
-2. 会员端用户认证（get_current_member）  
+1. 管理端用户认证（get_current_user，异步路由用 get_current_user_async）
+2. 会员端用户认证（get_current_member，异步路由用 get_current_member_async）
 3. 基于角色的访问控制（RBAC）
 4. 操作权限验证（require_action）
 
@@ -13,10 +13,12 @@
 - 角色配置存储在 system_settings 表中
 - 支持菜单权限（menus）和操作权限（actions）
 - 通配符 "*" 表示拥有所有权限
-- 使用缓存机制减少数据库查询
+- 角色配置编译为权限索引缓存在进程内，配置变更经 cache_bus 跨进程失效
 """
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, FrozenSet, List
 import json
 import time
 
@@ -24,23 +26,29 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
 from .config import settings
-from .database import get_db
-from .security import decode_access_token
+from .async_database import AsyncUnitOfWork, get_async_uow
+from .database import UnitOfWork, get_uow
+from .principals import resolve_member, resolve_member_async, resolve_user, resolve_user_async
+from .services.cache_bus import subscribe
 
 # ========== 管理端（后台）认证 ==========
 # OAuth2 密码模式的 Bearer Token 认证
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
     """
     获取当前登录的管理端用户信息
     
-    从 JWT Token 中解析用户 ID，然后从数据库查询用户详细信息。
+    从 JWT Token 中解析用户 ID，然后查询用户详细信息（经 principals 缓存，命中时不查库）。
     这是管理端所有需要认证的接口的依赖函数。
     
     Args:
         token: JWT Token 字符串（由 FastAPI 自动从 Authorization header 提取）
+        db: 请求级工作单元，与路由共用同一条连接（命中缓存时不借连接）
         
     Returns:
         dict: 用户信息，包含 id, username, role, is_active
@@ -48,25 +56,15 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
     Raises:
         HTTPException(401): Token 无效或用户不存在/被禁用
     """
-    payload = decode_access_token(token)
-    user_id = payload.get("sub")
-    if user_id is None:
-        raise HTTPException(status_code=401, detail="无效 token")
+    return resolve_user(token, db)
 
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute(
-            "SELECT id, username, role, is_active FROM users WHERE id = %s",
-            (user_id,),
-        )
-        user = cursor.fetchone()
-        if not user or not user.get("is_active"):
-            raise HTTPException(status_code=401, detail="用户不存在或已被禁用")
-        return user
-    finally:
-        cursor.close()
-        db.close()
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncUnitOfWork = Depends(get_async_uow),
+) -> Dict[str, Any]:
+    """get_current_user 的异步版本，供 async def 路由使用（与路由共用异步连接）"""
+    return await resolve_user_async(token, db)
 
 
 def require_super_admin(current_user=Depends(get_current_user)):
@@ -96,73 +94,176 @@ def require_super_admin(current_user=Depends(get_current_user)):
 member_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/member/auth/login")
 
 
-def get_current_member(token: str = Depends(member_oauth2_scheme)) -> Dict[str, Any]:
+def get_current_member(
+    token: str = Depends(member_oauth2_scheme),
+    db: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
     """
     获取当前登录的会员信息
     
-    从 JWT Token 中解析会员 ID，查询数据库获取会员详细信息。
+    从 JWT Token 中解析会员 ID，获取会员身份信息（经 principals 缓存，命中时不查库）。
     验证会员身份和状态，确保会员可以正常使用系统。
     
     Args:
         token: JWT Token 字符串（从 Authorization header 提取）
+        db: 请求级工作单元，与路由共用同一条连接
         
     Returns:
-        dict: 会员信息，包含 id, name, phone, status, balance
+        dict: 会员信息，包含 id, name, phone, mobile, level, status（余额等请在路由中实时查询）
         
     Raises:
         HTTPException(401): Token 无效或会员不存在
-        HTTPException(400): 会员状态异常，无法使用服务
+        HTTPException(403): 会员状态异常，无法使用服务
     """
-    payload = decode_access_token(token)
-    scope = payload.get("scope")
-    if scope != "member":
-        raise HTTPException(status_code=401, detail="无效的会员 token")
+    return resolve_member(token, db)
+
+
+async def get_current_member_async(
+    token: str = Depends(member_oauth2_scheme),
+    db: AsyncUnitOfWork = Depends(get_async_uow),
+) -> Dict[str, Any]:
+    """get_current_member 的异步版本，供 async def 路由使用"""
+    return await resolve_member_async(token, db)
+
 
-    member_id = payload.get("sub")
-    if not member_id:
-        raise HTTPException(status_code=401, detail="无效 token")
+# ========== 基于角色的访问控制（RBAC）==========
+# 角色配置编译为 PermissionIndex 缓存在进程内：鉴权只是一次 dict 查找 + frozenset 判断。
+# 保存角色配置时直接编译新配置整体替换；其他 worker 经 cache_bus 的 "roles" 频道失效，TTL 只作兜底。
+from threading import Lock
+ROLES_CACHE_TTL = 3600
+_DEFAULT_ROLES: List[Dict[str, Any]] = [
+    {"code": "admin", "name": "管理员", "menus": ["*"], "actions": ["*"], "data_scope": "all"},
+    {"code": "staff", "name": "员工", "menus": ["dashboard"], "actions": ["view"], "data_scope": "own"},
+]
+# data: 原始角色列表；index: 编译结果；expires_at: 过期时间；gen: 失效代数
+_roles_cache: Dict[str, Any] = {"data": None, "index": None, "expires_at": 0.0, "gen": 0}
+_roles_cache_lock = Lock()
+
+
+@dataclass(frozen=True)
+class RolePermissions:
+    """单个角色编译后的权限"""
+    actions: FrozenSet[str]
+    all_actions: bool
+    menus: FrozenSet[str]
+    all_menus: bool
+    data_scope: str
+
+
+class PermissionIndex:
+    """
+    role -> RolePermissions 的只读索引
+    未配置的角色、actions 为空或格式不对时视为拥有全部操作权限（与原有判断规则一致）
+    """
 
-    db = get_db()
+    def __init__(self, roles: List[Dict[str, Any]]):
+        index: Dict[str, RolePermissions] = {}
+        for r in roles:
+            if not isinstance(r, dict):
+                continue
+            code = r.get("code")
+            if code in index:
+                continue  # 重复 code 以靠前的为准
+            actions = r.get("actions")
+            if not isinstance(actions, list) or not actions:
+                actions = ["*"]
+            actions = frozenset(str(a) for a in actions)
+            menus = r.get("menus")
+            menus = frozenset(str(m) for m in menus) if isinstance(menus, list) else frozenset()
+            index[code] = RolePermissions(
+                actions=actions,
+                all_actions="*" in actions,
+                menus=menus,
+                all_menus="*" in menus,
+                data_scope=str(r.get("data_scope") or ""),
+            )
+        self._roles = index
+
+    def get(self, role: str) -> RolePermissions | None:
+        return self._roles.get(role)
+
+    def allows(self, role: str, action_code: str) -> bool:
+        perms = self._roles.get(role)
+        if perms is None or perms.all_actions:
+            return True
+        return action_code in perms.actions
+
+    def has_menu(self, role: str, menu: str) -> bool:
+        perms = self._roles.get(role)
+        if perms is None:
+            return True
+        return perms.all_menus or menu in perms.menus
+
+
+def _install_roles(roles: List[Dict[str, Any]], gen: int | None = None) -> PermissionIndex:
+    """编译并整体替换缓存；gen 与当前代数不一致（加载期间已被失效）时只返回结果不写入"""
+    index = PermissionIndex(roles)
+    with _roles_cache_lock:
+        if gen is None:
+            # 主动替换：让此前开始的加载作废
+            _roles_cache["gen"] += 1
+        if gen is None or _roles_cache["gen"] == gen:
+            # 一次性替换 data/index/过期时间，读取方不会看到半新半旧的状态
+            _roles_cache.update(data=roles, index=index, expires_at=time.time() + ROLES_CACHE_TTL)
+    return index
+
+
+def install_roles_config(roles: List[Dict[str, Any]]) -> PermissionIndex:
+    """保存角色配置（已 commit）后调用：直接用新配置编译索引并替换，无需再读库"""
+    return _install_roles(roles or _DEFAULT_ROLES)
+
+
+def _invalidate_roles_cache() -> None:
+    with _roles_cache_lock:
+        _roles_cache.update(data=None, index=None, expires_at=0.0)
+        _roles_cache["gen"] += 1
+
+
+subscribe("roles", _invalidate_roles_cache)
+
+
+def _read_roles(db: UnitOfWork | None) -> List[Dict[str, Any]]:
+    own_db = db is None
+    if own_db:
+        db = UnitOfWork()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
             """
-            SELECT id, name, phone, status, balance
-            FROM members
-            WHERE id = %s
-            """,
-            (member_id,),
+            SELECT setting_value
+            FROM system_settings
+            WHERE group_key = 'permission' AND setting_key = 'roles_json'
+            """
         )
-        member = cursor.fetchone()
-        if not member:
-            raise HTTPException(status_code=401, detail="会员不存在")
-
-        if member.get("status") not in ("正常", "active", 1, "1"):
-            raise HTTPException(status_code=400, detail="会员状态异常")
-
-        # 统一一下字段类型
-        member["balance"] = float(member.get("balance") or 0.0)
-        return member
+        row = cursor.fetchone()
+        if row and row.get("setting_value"):
+            try:
+                roles = json.loads(row["setting_value"])
+            except Exception:
+                roles = []
+        else:
+            roles = []
+        return roles if isinstance(roles, list) and roles else _DEFAULT_ROLES
     finally:
         cursor.close()
-        db.close()
+        if own_db:
+            db.release()
 
 
-# ========== 基于角色的访问控制（RBAC）==========
-# 角色配置缓存，避免频繁查询数据库
-# 缓存有效期 60 秒，60 秒后自动重新加载最新配置
-from threading import Lock
-_roles_cache: Dict[str, Any] = {"data": None, "ts": 0}
-_roles_cache_lock = Lock()
+def _get_permission_index(db: UnitOfWork | None = None) -> PermissionIndex:
+    """返回当前权限索引；命中时无锁、无查询"""
+    index = _roles_cache["index"]
+    if index is not None and time.time() < _roles_cache["expires_at"]:
+        return index
+    gen = _roles_cache["gen"]
+    return _install_roles(_read_roles(db), gen)
 
 
-def _load_roles_config() -> List[Dict[str, Any]]:
+def _load_roles_config(db: UnitOfWork | None = None) -> List[Dict[str, Any]]:
     """
     加载角色权限配置
     
-    从数据库 system_settings 表读取角色配置（JSON 格式）。
-    使用 60 秒缓存减少数据库查询，提高性能。
-    添加线程锁保护，确保多线程安全。
+    从数据库 system_settings 表读取角色配置（JSON 格式），与权限索引一起缓存在进程内。
     
     角色配置示例：
     [
@@ -182,79 +283,44 @@ def _load_roles_config() -> List[Dict[str, Any]]:
         }
     ]
     
+    Args:
+        db: 请求级工作单元；缓存未命中时复用它的连接，未传入则临时借一个
+    
     Returns:
         list: 角色配置列表，如果配置不存在则返回默认配置
     """
-    with _roles_cache_lock:
-        now = time.time()
-        if _roles_cache["data"] and now - _roles_cache["ts"] < 60:
-            return _roles_cache["data"]
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute(
-            """
-            SELECT setting_value
-            FROM system_settings
-            WHERE group_key = 'permission' AND setting_key = 'roles_json'
-            """
-        )
-        row = cursor.fetchone()
-        if row and row.get("setting_value"):
-            try:
-                roles = json.loads(row["setting_value"])
-            except Exception:
-                roles = []
-        else:
-            roles = []
-        if not roles:
-            roles = [
-                {"code": "admin", "name": "管理员", "menus": ["*"], "actions": ["*"], "data_scope": "all"},
-                {"code": "staff", "name": "员工", "menus": ["dashboard"], "actions": ["view"], "data_scope": "own"},
-            ]
-        _roles_cache["data"] = roles
-        _roles_cache["ts"] = now
-        return roles
-    finally:
-        cursor.close()
-        db.close()
+    _get_permission_index(db)
+    return _roles_cache["data"] or _DEFAULT_ROLES
 
 
-def _user_has_action(user: Dict[str, Any], action_code: str) -> bool:
+def _user_has_action(user: Dict[str, Any], action_code: str, db: UnitOfWork | None = None) -> bool:
     """
     检查用户是否拥有指定操作权限
     
-    根据用户角色查找对应的权限配置，判断是否拥有指定的操作权限。
     权限判断规则：
-    1. 如果 actions 包含 "*"，表示拥有所有权限
+    1. 如果角色的 actions 包含 "*"，表示拥有所有权限
     2. 如果 actions 包含指定的 action_code，表示拥有该权限
     3. 否则无权限
     
     Args:
         user: 用户信息，包含 role 字段
         action_code: 操作权限码，如 "member.create"、"reservation.delete" 等
+        db: 请求级工作单元（可选，仅缓存未命中时使用）
         
     Returns:
         bool: 有权限返回 True，否则返回 False
     """
-    role = user.get("role") or ""
-    roles = _load_roles_config()
-    # 查找用户角色对应的权限配置
-    role_conf = next((r for r in roles if r.get("code") == role), None)
-    actions = role_conf.get("actions") if role_conf else ["*"]
-    if not isinstance(actions, list) or not actions:
-        actions = ["*"]
-    actions = [str(a) for a in actions]
-    # 检查是否拥有全部权限或指定权限
-    return "*" in actions or action_code in actions
+    return _get_permission_index(db).allows(user.get("role") or "", action_code)
 
 
+@lru_cache(maxsize=None)
 def require_action(action_code: str):
     """
     创建操作权限检查依赖
     
     这是一个依赖工厂函数，返回一个权限检查依赖。
     使用方式：在路由装饰器中添加 Depends(require_action("member.create"))
+    同一个 action_code 返回同一个依赖函数，FastAPI 在同一请求内只执行一次。
     
     示例：
         @router.post("/members", dependencies=[Depends(require_action("member.create"))])
@@ -270,8 +336,8 @@ def require_action(action_code: str):
     Raises:
         HTTPException(403): 用户没有指定操作权限时抛出
     """
-    def dependency(current_user=Depends(get_current_user)):
-        if not _user_has_action(current_user, action_code):
+    def dependency(current_user=Depends(get_current_user), db: UnitOfWork = Depends(get_uow)):
+        if not _get_permission_index(db).allows(current_user.get("role") or "", action_code):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无操作权限")
         return current_user
 
@@ -27,9 +27,22 @@
 - JWT：用户认证
 - RBAC：基于角色的访问控制
 """
-from fastapi import FastAPI
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from .async_database import close_async_pool, get_async_pool_stats
+from .database import close_pool, get_pool_stats
+from .deps import require_action
+from .services.cache_bus import start_cache_bus, stop_cache_bus
+from .services.schema import schema_registry
+from .services.court_slots import ensure_table as ensure_court_slots_table
+from .services.slot_holds import ensure_table as ensure_slot_holds_table
+from .services.reservation_index import reservation_index
+from .services.order_numbers import start_order_no_worker, stop_order_no_worker
+from .services.reservation_lifecycle import start_lifecycle_worker, stop_lifecycle_worker
 from .routers import (
     auth,
     courts,
@@ -38,6 +51,7 @@ from .routers import (
     members,
     member_transactions,
     product_sales,
+    pricing,
     reports,
     system_settings,
     employees,
@@ -58,9 +72,48 @@ from .routers import (
     agent_chat,
 )
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    应用生命周期：
+    - 启动时加载表结构注册表、预约区间索引（失败不阻止启动，首次使用时再加载）
+    - 启动跨进程缓存失效轮询线程、预约状态推进线程
+    - 关闭时停止后台线程，排空数据库连接池（同步 + 异步）
+    """
+    try:
+        schema_registry.reload()
+    except Exception as e:
+        logger.warning(f"启动时加载表结构失败，将在首次使用时重试: {e}")
+    try:
+        ensure_court_slots_table()
+        ensure_slot_holds_table()
+    except Exception as e:
+        logger.warning(f"启动时创建 court_day_slots / court_closure_jobs / court_slot_holds 表失败，将在首次下单时重试: {e}")
+    try:
+        reservation_index.load()
+    except Exception as e:
+        logger.warning(f"启动时加载预约区间索引失败，将在首次使用时重试: {e}")
+    try:
+        start_order_no_worker()
+    except Exception as e:
+        logger.warning(f"启动时确定订单号 worker id 失败，将在首次生成订单号时重试: {e}")
+    start_cache_bus()
+    start_lifecycle_worker()
+    yield
+    stop_lifecycle_worker()
+    stop_order_no_worker()
+    stop_cache_bus()
+    await close_async_pool()
+    close_pool()
+
+
 app = FastAPI(
     title="Gym Management System V2",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # 配置 CORS 中间件，允许前端跨域访问
@@ -96,6 +149,7 @@ app.include_router(court_reservations.router, prefix="/api")
 app.include_router(member_transactions.router, prefix="/api")
 app.include_router(products.router, prefix="/api")
 app.include_router(product_sales.router, prefix="/api")
+app.include_router(pricing.router, prefix="/api")
 app.include_router(reports.router, prefix="/api")
 
 # 系统配置、员工
@@ -136,3 +190,14 @@ def ping():
 def health_check():
     """给监控用的健康检查接口。"""
     return {"status": "ok"}
+
+
+@app.get("/health/db-pool", dependencies=[Depends(require_action("system.monitor"))])
+def db_pool_stats():
+    """
+    数据库连接池指标：等待耗时、使用中/溢出连接数、超时次数；async 为异步连接池指标。
+    暴露连接池内部状态，需登录且拥有 system.monitor 权限（默认仅全权限角色）。
+    """
+    stats = get_pool_stats()
+    stats["async"] = get_async_pool_stats()
+    return stats
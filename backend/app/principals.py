@@ -0,0 +1,257 @@
+"""
+认证主体解析与缓存
+
+管理端每个请求都要按 token 查一次 users，会员端每个请求查一次 members，
+而列表页又在不停轮询。这里把 "token -> 当前用户/会员" 的解析统一到一处，并加一层 LRU + TTL 缓存：
+
+1. 缓存键为 (类型, sub, iat)：同一个 token 在 TTL 内只查一次库，重新登录拿到的新 token 不复用旧结果
+2. 只缓存身份与状态（id、账号、角色、启用状态、会员等级），余额等会变化的数据不放进来
+3. 员工被禁用/删除、会员状态变化时经 cache_bus 的 users / members 频道清空对应缓存（包括其他 worker）
+4. UnitOfWork 是懒借连接的，命中缓存时整个认证过程不占用数据库连接
+
+会员 token 历史上有三种写法（role="member"、scope="member"、user_type="member"），这里统一兼容。
+
+登录签发的 token 带有声明（cv = CLAIMS_VERSION）：管理端带 username/role，会员带 name/phone/level/status。
+带声明的 token 认证时完全不查库，只查进程内的撤销表（services.token_revocation）：
+- 主体在签发之后被标记为 stale（角色/状态/资料变化）时，回退到查库认证
+- 被强制下线（改密码、管理员下线）时直接 401
+不带声明的旧 token 仍走查库 + 缓存的路径，同样受强制下线约束。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from .async_database import AsyncUnitOfWork
+from .config import settings
+from .database import UnitOfWork
+from .security import decode_access_token
+from .services.cache_bus import subscribe
+from .services.token_revocation import TOKEN_OK, TOKEN_REVOKED, token_state
+
+# token 声明格式版本：声明字段变化时递增，旧版本 token 回退到查库认证
+CLAIMS_VERSION = 1
+
+
+class PrincipalCache:
+    """线程安全的 LRU + TTL 缓存；失效时递增代数，避免并发加载写回旧数据"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._generation: Dict[str, int] = {}
+
+    def generation(self, kind: str) -> int:
+        return self._generation.get(kind, 0)
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: Dict[str, Any], generation: int) -> None:
+        """generation 为加载前读到的代数；加载期间发生过失效则丢弃本次结果"""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        kind = key[0]
+        with self._lock:
+            if self._generation.get(kind, 0) != generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, kind: str, subject: Any = None) -> None:
+        """清空某类主体的缓存；传 subject 时只清该主体"""
+        with self._lock:
+            self._generation[kind] = self._generation.get(kind, 0) + 1
+            for key in [k for k in self._data if k[0] == kind and (subject is None or k[1] == str(subject))]:
+                del self._data[key]
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+
+subscribe("users", lambda: principal_cache.invalidate("user"))
+subscribe("members", lambda: principal_cache.invalidate("member"))
+
+
+def _trusted_claims(kind: str, subject: str, payload: Dict[str, Any]) -> bool:
+    """检查撤销表：已强制下线则 401；返回 token 中的声明是否可以直接使用"""
+    state = token_state(kind, subject, payload.get("iat"))
+    if state == TOKEN_REVOKED:
+        raise HTTPException(status_code=401, detail="登录已失效，请重新登录")
+    return state == TOKEN_OK and payload.get("cv") == CLAIMS_VERSION
+
+
+# ========== 管理端用户 ==========
+
+_USER_SQL = "SELECT id, username, role, is_active FROM users WHERE id = %s"
+
+
+def user_claims(user: Dict[str, Any]) -> Dict[str, Any]:
+    """管理端登录 token 的声明"""
+    return {
+        "sub": str(user["id"]),
+        "role": user["role"],
+        "username": user["username"],
+        "cv": CLAIMS_VERSION,
+    }
+
+
+def _parse_user_token(token: str) -> Tuple[Tuple[str, str, Any], Optional[Dict[str, Any]]]:
+    """返回 (缓存键, 可信声明得到的用户)；声明不可用时后者为 None，需要查库"""
+    payload = decode_access_token(token)
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="无效 token")
+    key = ("user", str(user_id), payload.get("iat"))
+    if not _trusted_claims("user", key[1], payload):
+        return key, None
+    return key, {
+        "id": int(user_id) if str(user_id).isdigit() else user_id,
+        "username": payload.get("username"),
+        "role": payload.get("role"),
+        "is_active": 1,
+    }
+
+
+def _check_user(user: Dict[str, Any] | None) -> Dict[str, Any]:
+    if not user or not user.get("is_active"):
+        raise HTTPException(status_code=401, detail="用户不存在或已被禁用")
+    return user
+
+
+def resolve_user(token: str, db: UnitOfWork) -> Dict[str, Any]:
+    """解析管理端 token 得到当前用户（id, username, role, is_active），声明可信时不查库，否则未命中缓存才查库"""
+    key, claimed = _parse_user_token(token)
+    if claimed is not None:
+        return claimed
+    user = principal_cache.get(key)
+    if user is None:
+        generation = principal_cache.generation("user")
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(_USER_SQL, (key[1],))
+            user = _check_user(cursor.fetchone())
+        finally:
+            cursor.close()
+        principal_cache.put(key, user, generation)
+    return dict(user)
+
+
+async def resolve_user_async(token: str, db: AsyncUnitOfWork) -> Dict[str, Any]:
+    """resolve_user 的异步版本"""
+    key, claimed = _parse_user_token(token)
+    if claimed is not None:
+        return claimed
+    user = principal_cache.get(key)
+    if user is None:
+        generation = principal_cache.generation("user")
+        cursor = await db.cursor(dictionary=True)
+        try:
+            await cursor.execute(_USER_SQL, (key[1],))
+            user = _check_user(await cursor.fetchone())
+        finally:
+            await cursor.close()
+        principal_cache.put(key, user, generation)
+    return dict(user)
+
+
+# ========== 会员 ==========
+
+_MEMBER_SQL = "SELECT id, name, phone, level, status FROM members WHERE id = %s"
+
+
+def member_claims(member: Dict[str, Any]) -> Dict[str, Any]:
+    """会员登录 token 的声明"""
+    return {
+        "sub": str(member["id"]),
+        "member_id": member["id"],
+        "role": "member",
+        "name": member.get("name"),
+        "phone": member.get("phone"),
+        "level": member.get("level"),
+        "status": member.get("status"),
+        "cv": CLAIMS_VERSION,
+    }
+
+
+def _parse_member_token(token: str) -> Tuple[Tuple[str, str, Any], Optional[Dict[str, Any]]]:
+    """返回 (缓存键, 可信声明得到的会员)；声明不可用时后者为 None，需要查库"""
+    payload = decode_access_token(token)
+    if "member" not in (payload.get("role"), payload.get("scope"), payload.get("user_type")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="无效的会员 token")
+
+    member_id = payload.get("member_id") or payload.get("sub")
+    if not member_id:
+        raise HTTPException(status_code=401, detail="Token 中缺少会员信息")
+    key = ("member", str(member_id), payload.get("iat"))
+    if not _trusted_claims("member", key[1], payload):
+        return key, None
+    return key, _check_member({
+        "id": int(member_id) if str(member_id).isdigit() else member_id,
+        "name": payload.get("name"),
+        "phone": payload.get("phone"),
+        "level": payload.get("level"),
+        "status": payload.get("status"),
+    })
+
+
+def _check_member(member: Dict[str, Any] | None) -> Dict[str, Any]:
+    if not member:
+        raise HTTPException(status_code=401, detail="会员不存在")
+
+    if member.get("status") not in ("正常", "active", 1, "1"):
+        raise HTTPException(status_code=403, detail="会员状态异常")
+
+    # 与会员资料接口的字段保持一致
+    member["mobile"] = member.get("phone")
+    return member
+
+
+def resolve_member(token: str, db: UnitOfWork) -> Dict[str, Any]:
+    """解析会员 token 得到当前会员（id, name, phone, level, status），声明可信时不查库，否则未命中缓存才查库"""
+    key, claimed = _parse_member_token(token)
+    if claimed is not None:
+        return claimed
+    member = principal_cache.get(key)
+    if member is None:
+        generation = principal_cache.generation("member")
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(_MEMBER_SQL, (key[1],))
+            member = _check_member(cursor.fetchone())
+        finally:
+            cursor.close()
+        principal_cache.put(key, member, generation)
+    return dict(member)
+
+
+async def resolve_member_async(token: str, db: AsyncUnitOfWork) -> Dict[str, Any]:
+    """resolve_member 的异步版本"""
+    key, claimed = _parse_member_token(token)
+    if claimed is not None:
+        return claimed
+    member = principal_cache.get(key)
+    if member is None:
+        generation = principal_cache.generation("member")
+        cursor = await db.cursor(dictionary=True)
+        try:
+            await cursor.execute(_MEMBER_SQL, (key[1],))
+            member = _check_member(await cursor.fetchone())
+        finally:
+            await cursor.close()
+        principal_cache.put(key, member, generation)
+    return dict(member)
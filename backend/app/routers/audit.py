@@ -2,7 +2,7 @@
 from fastapi import APIRouter, Depends, Query, Request
 from typing import List, Dict, Any, Optional
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_super_admin
 
 router = APIRouter(prefix="/audit", tags=["Audit"])
@@ -15,11 +15,11 @@ def list_login_logs(
     username: Optional[str] = Query(None),
     success: Optional[int] = Query(None, description="1 成功, 0 失败"),
     current_user=Depends(require_super_admin),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     登录日志列表
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         where = " WHERE 1=1 "
@@ -47,7 +47,6 @@ def list_login_logs(
         return {"total": total, "items": items}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/operation-logs")
@@ -60,11 +59,11 @@ def list_operation_logs(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     current_user=Depends(require_super_admin),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     操作日志列表
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         where = " WHERE 1=1 "
@@ -104,4 +103,3 @@ def list_operation_logs(
         return {"total": total, "items": items}
     finally:
         cursor.close()
-        db.close()
@@ -6,21 +6,68 @@
 """
 from datetime import timedelta
 
+from typing import Any, Dict, Optional
+
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 
-from ..database import get_db
-from ..security import verify_password, create_access_token
+from ..database import UnitOfWork, get_uow
+from ..principals import user_claims
+from ..security import verify_and_update_password_async, create_access_token
 from ..config import settings
 from ..services.audit import write_login_log
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 
+def _load_user(db: UnitOfWork, username: str) -> Optional[Dict[str, Any]]:
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            "SELECT id, username, password_hash, role, is_active FROM users WHERE username = %s",
+            (username,),
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _finish_login(
+    db: UnitOfWork,
+    *,
+    user_id: int,
+    username: str,
+    success: bool,
+    ip: Optional[str],
+    user_agent: Optional[str],
+    message: str,
+    new_hash: Optional[str] = None,
+) -> None:
+    """记录登录日志；new_hash 不为空时顺带把旧哈希升级为当前算法/迭代次数，一起提交"""
+    cursor = db.cursor(dictionary=True)
+    try:
+        if new_hash:
+            cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user_id))
+        write_login_log(
+            user_id=user_id,
+            username=username,
+            success=success,
+            ip=ip,
+            user_agent=user_agent,
+            message=message,
+            cursor=cursor,
+        )
+        db.commit()
+    finally:
+        cursor.close()
+
+
 @router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     管理端用户登录接口
@@ -37,10 +84,13 @@ def login_for_access_token(
     业务流程：
     1. 查询用户信息
     2. 验证账号状态（是否存在、是否禁用）
-    3. 验证密码
+    3. 验证密码（在专用哈希线程池中执行，旧哈希登录成功后自动升级）
     4. 生成 JWT Token（包含用户 ID 和角色）
     5. 记录登录日志
     6. 返回 Token 和用户基本信息
+
+    路由本身是 async 的：查库/写日志放到线程池，密码验证放到专用哈希线程池，
+    登录高峰时不会占满处理其他请求的线程。
     
     Args:
         request: 请求对象，用于获取客户端 IP
@@ -56,82 +106,80 @@ def login_for_access_token(
     Raises:
         HTTPException(400): 用户名或密码错误、账号被禁用
     """
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    try:
-        sql = "SELECT id, username, password_hash, role, is_active FROM users WHERE username = %s"
-        cursor.execute(sql, (form_data.username,))
-        user = cursor.fetchone()
-
-        # 获取客户端 IP 和 User-Agent
-        client_ip = request.client.host if request.client else None
-        user_agent = request.headers.get("User-Agent")
-
-        # 用户不存在
-        if not user:
-            write_login_log(
-                user_id=0,
-                username=form_data.username,
-                success=False,
-                ip=client_ip,
-                user_agent=user_agent,
-                message="用户不存在",
-            )
-            # 对外仍然保持模糊提示，避免暴露用户信息
-            raise HTTPException(status_code=400, detail="用户名或密码错误")
-
-        # 账号被禁用
-        if not user["is_active"]:
-            write_login_log(
-                user_id=user["id"],
-                username=user["username"],
-                success=False,
-                ip=client_ip,
-                user_agent=user_agent,
-                message="账号已被禁用",
-            )
-            raise HTTPException(status_code=400, detail="用户不存在或已被禁用")
-
-        # 密码错误
-        if not verify_password(form_data.password, user["password_hash"]):
-            write_login_log(
-                user_id=user["id"],
-                username=user["username"],
-                success=False,
-                ip=client_ip,
-                user_agent=user_agent,
-                message="密码错误",
-            )
-            raise HTTPException(status_code=400, detail="用户名或密码错误")
-
-        # 登录成功：生成 token
-        access_token_expires = timedelta(
-            minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
+    user = await run_in_threadpool(_load_user, db, form_data.username)
+
+    # 获取客户端 IP 和 User-Agent
+    client_ip = request.client.host if request.client else None
+    user_agent = request.headers.get("User-Agent")
+
+    # 用户不存在
+    if not user:
+        await run_in_threadpool(
+            _finish_login, db,
+            user_id=0,
+            username=form_data.username,
+            success=False,
+            ip=client_ip,
+            user_agent=user_agent,
+            message="用户不存在",
         )
-        access_token = create_access_token(
-            data={"sub": str(user["id"]), "role": user["role"]},
-            expires_delta=access_token_expires,
+        # 对外仍然保持模糊提示，避免暴露用户信息
+        raise HTTPException(status_code=400, detail="用户名或密码错误")
+
+    # 账号被禁用
+    if not user["is_active"]:
+        await run_in_threadpool(
+            _finish_login, db,
+            user_id=user["id"],
+            username=user["username"],
+            success=False,
+            ip=client_ip,
+            user_agent=user_agent,
+            message="账号已被禁用",
         )
+        raise HTTPException(status_code=400, detail="用户不存在或已被禁用")
 
-        # 记录成功登录日志
-        write_login_log(
+    # 密码错误
+    ok, new_hash = await verify_and_update_password_async(form_data.password, user["password_hash"])
+    if not ok:
+        await run_in_threadpool(
+            _finish_login, db,
             user_id=user["id"],
             username=user["username"],
-            success=True,
+            success=False,
             ip=client_ip,
             user_agent=user_agent,
-            message="登录成功",
+            message="密码错误",
         )
+        raise HTTPException(status_code=400, detail="用户名或密码错误")
 
-        return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "user": {
-                "id": user["id"],
-                "username": user["username"],
-                "role": user["role"],
-            },
-        }
-    finally:
-        cursor.close()
-        db.close()
+    # 登录成功：生成 token（带角色等声明，后续请求认证不查库）
+    access_token_expires = timedelta(
+        minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
+    )
+    access_token = create_access_token(
+        data=user_claims(user),
+        expires_delta=access_token_expires,
+    )
+
+    # 记录成功登录日志（需要时一并升级密码哈希）
+    await run_in_threadpool(
+        _finish_login, db,
+        user_id=user["id"],
+        username=user["username"],
+        success=True,
+        ip=client_ip,
+        user_agent=user_agent,
+        message="登录成功",
+        new_hash=new_hash,
+    )
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user": {
+            "id": user["id"],
+            "username": user["username"],
+            "role": user["role"],
+        },
+    }
@@ -1,7 +1,7 @@
 # backend/app/routers/coaches.py
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Dict, Any, Optional
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
 
 router = APIRouter(prefix="/training/coaches", tags=["Coaches"])
@@ -15,6 +15,7 @@ def list_coaches(
     status: Optional[str] = None,
     specialty: Optional[str] = None,
     current_user=Depends(require_action("coach.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取教练列表
@@ -22,7 +23,6 @@ def list_coaches(
     - 支持按状态筛选
     - 支持按擅长项目筛选
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         conditions = []
@@ -62,16 +62,15 @@ def list_coaches(
         return {"total": total, "items": items, "page": page, "page_size": page_size}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/{coach_id}")
 def get_coach(
     coach_id: int,
     current_user=Depends(require_action("coach.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """获取教练详情"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT * FROM coaches WHERE id = %s", (coach_id,))
@@ -81,13 +80,13 @@ def get_coach(
         return coach
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
 def create_coach(
     data: Dict[str, Any],
     current_user=Depends(require_action("coach.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """创建教练"""
     required = ["name"]
@@ -95,7 +94,6 @@ def create_coach(
         if field not in data or not data[field]:
             raise HTTPException(status_code=400, detail=f"缺少必填字段: {field}")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -123,7 +121,6 @@ def create_coach(
         return {"id": coach_id, "message": "教练创建成功"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{coach_id}")
@@ -131,9 +128,9 @@ def update_coach(
     coach_id: int,
     data: Dict[str, Any],
     current_user=Depends(require_action("coach.edit")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """更新教练信息"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id FROM coaches WHERE id = %s", (coach_id,))
@@ -170,20 +167,19 @@ def update_coach(
         return {"message": "教练信息已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{coach_id}")
 def delete_coach(
     coach_id: int,
     current_user=Depends(require_action("coach.delete")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     删除教练
     - 检查是否有关联的课程或排期
     - 如果有在读的课程，禁止删除
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id, name FROM coaches WHERE id = %s", (coach_id,))
@@ -227,13 +223,11 @@ def delete_coach(
         return {"message": f"教练【{coach['name']}】已删除"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/specialties/list")
-def get_specialties(current_user=Depends(require_action("coach.view"))):
+def get_specialties(current_user=Depends(require_action("coach.view")), db: UnitOfWork = Depends(get_uow)):
     """获取所有已使用过的擅长项目（用于前端筛选下拉）"""
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute(
@@ -252,7 +246,6 @@ def get_specialties(current_user=Depends(require_action("coach.view"))):
         return sorted(list(specialties))
     finally:
         cursor.close()
-        db.close()
 
 
 
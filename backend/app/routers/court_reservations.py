@@ -1,13 +1,44 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import Optional, List, Any, Dict
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 
-from ..database import get_db
+from ..async_database import AsyncUnitOfWork, get_async_uow
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
-from ..services.orders import create_court_order, create_refund_order
-from ..services.cards import get_best_card, consume_card_times
-from ..services.discounts import get_member_discount
+from ..services.orders import create_court_order, create_court_orders, create_refund_order
+from ..services.cards import consume_card_times
+from ..services.pricing import CourtNotFound, PricingError, court_amount, quote
+from ..services.schema import SCHEMA_CACHE_TTL
+from ..services.court_slots import SlotConflict, claim_court_slots, claim_many, release_court_slots
+from ..services.slot_holds import has_held_conflict, held_rows
+from ..services.waitlist import schedule_promotion
+from ..services.wallet import (
+    InsufficientBalance,
+    MemberNotFound,
+    WalletError,
+    credit,
+    debit,
+    debit_many,
+    ensure_member,
+)
+from ..services.reservation_index import (
+    note_reservation_booked,
+    note_reservation_released,
+    note_reservations_booked,
+    reservation_index,
+)
+from ..services.availability import (
+    MAX_GRID_DAYS,
+    availability_settings,
+    build_grid,
+    busy_range_query,
+    courts_query,
+    merge_busy,
+    next_available,
+    parse_hhmm,
+)
 
 router = APIRouter(prefix="/court-reservations", tags=["Court Reservations"])
 
@@ -31,115 +62,43 @@ def _parse_dt(val: str, field_name: str) -> datetime:
         )
 
 
-# 场地表结构缓存（避免频繁执行 SHOW COLUMNS）
-_courts_columns_cache: set = None
-_courts_columns_cache_ts: float = 0
-COLUMNS_CACHE_TTL = 300  # 缓存时间 5 分钟
-
-
-def _get_courts_columns(cursor) -> set:
-    """获取 courts 表的列名（带缓存）"""
-    global _courts_columns_cache, _courts_columns_cache_ts
-    import time
-    now = time.time()
-    
-    if _courts_columns_cache is not None and now - _courts_columns_cache_ts < COLUMNS_CACHE_TTL:
-        return _courts_columns_cache
-    
-    cursor.execute("SHOW COLUMNS FROM courts")
-    rows = cursor.fetchall()
-    if rows and isinstance(rows[0], dict):
-        _courts_columns_cache = {r["Field"] for r in rows}
-    else:
-        _courts_columns_cache = {r[0] for r in rows}
-    _courts_columns_cache_ts = now
-    return _courts_columns_cache
-
-
-def _get_court_price(cursor, court_id: int) -> float:
-    """获取场地价格，优先 price_per_hour，否则 price（使用缓存优化）"""
-    cols = _get_courts_columns(cursor)
-    has_price_per_hour = "price_per_hour" in cols
-    has_price = "price" in cols
-    
-    if has_price_per_hour and has_price:
-        cursor.execute("SELECT price_per_hour, price FROM courts WHERE id = %s", (court_id,))
-    elif has_price_per_hour:
-        cursor.execute("SELECT price_per_hour FROM courts WHERE id = %s", (court_id,))
-    elif has_price:
-        cursor.execute("SELECT price FROM courts WHERE id = %s", (court_id,))
-    else:
-        raise HTTPException(
-            status_code=500,
-            detail="courts 未找到价格字段，price_per_hour / price 至少需存在一个",
-        )
-
-    row = cursor.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="场地不存在")
-
-    if isinstance(row, dict):
-        raw_price = row.get("price_per_hour")
-        if raw_price is None:
-            raw_price = row.get("price")
-    else:
-        raw_price = row[0] if len(row) > 0 else 0
-
-    try:
-        return float(raw_price or 0)
-    except (TypeError, ValueError):
-        return 0.0
-
+def _wallet_http_error(e: WalletError) -> HTTPException:
+    """余额变更失败转为接口错误（会员不存在 404，其余 400）"""
+    if isinstance(e, MemberNotFound):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, InsufficientBalance):
+        return HTTPException(status_code=400, detail=f"会员{e}")
+    return HTTPException(status_code=400, detail=str(e))
 
-def _calc_amount(cursor, court_id: int, start_dt: datetime, end_dt: datetime, current_amount: float) -> float:
-    """金额未传时，按价格 * 时长自动计算"""
-    if current_amount and current_amount > 0:
-        return float(current_amount)
 
-    duration_hours = (end_dt - start_dt).total_seconds() / 3600.0
-    if duration_hours <= 0:
-        raise HTTPException(status_code=400, detail="预约时长必须大于 0")
+# 表结构由 services.schema 统一注册，这里保留旧名供引用
+COLUMNS_CACHE_TTL = SCHEMA_CACHE_TTL
 
-    price_per_hour = _get_court_price(cursor, court_id)
-    if price_per_hour <= 0:
-        raise HTTPException(status_code=400, detail="场地价格未配置，请先设置 price_per_hour 或 price")
 
-    amount = round(price_per_hour * duration_hours, 2)
-    if amount <= 0:
-        raise HTTPException(status_code=400, detail="计算金额为 0，请检查场地价格或预约时长")
-    return amount
-
-
-def _apply_member_pricing(cursor, amount: float, member_id: int | None) -> float:
-    """应用会员折扣：会员卡折扣或等级折扣"""
-    if not member_id or amount <= 0:
-        return amount
+def _quote_courts(cursor, items: List[tuple], member_id: int | None, base_amount: float = 0) -> List[Dict[str, Any]]:
+    """按统一计价引擎为 [(court_id, start, end), ...] 计价（base_amount > 0 时为手工指定的单次原价），返回明细行"""
     try:
-        # 优先使用会员卡折扣
-        card, _ = get_best_card(cursor, member_id)
-        if card and card.get("discount") is not None:
-            try:
-                card_discount = float(card.get("discount") or 100)
-            except Exception:
-                card_discount = 100.0
-            if card_discount < 100:
-                amount = round(amount * card_discount / 100.0, 2)
-        else:
-            # 没有会员卡折扣，使用会员等级折扣
-            discount = get_member_discount(cursor, member_id)
-            if discount < 100:
-                amount = round(amount * discount / 100.0, 2)
-    except Exception:
-        pass
-    return amount
+        return quote(
+            [{"court_id": c, "start": s, "end": e, "base_amount": base_amount} for c, s, e in items],
+            member_id,
+            cursor=cursor,
+        )["lines"]
+    except CourtNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("")
-def list_reservations(court_id: Optional[int] = None, member_id: Optional[int] = None):
-    """预约列表"""
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor_orders = db.cursor(dictionary=True)
+async def list_reservations(
+    court_id: Optional[int] = None,
+    member_id: Optional[int] = None,
+    status: Optional[str] = None,
+    db: AsyncUnitOfWork = Depends(get_async_uow),
+):
+    """预约列表；status 由后台线程按时间推进，可直接按状态筛选（走 (status, end_time) 索引）"""
+    cursor = await db.cursor(dictionary=True)
+    cursor_orders = await db.cursor(dictionary=True)
     try:
         sql = """
         SELECT
@@ -167,16 +126,19 @@ def list_reservations(court_id: Optional[int] = None, member_id: Optional[int] =
         if member_id is not None:
             sql += " AND r.member_id = %s"
             params.append(member_id)
+        if status:
+            sql += " AND r.status = %s"
+            params.append(status)
         sql += " ORDER BY r.id DESC"
 
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
+        await cursor.execute(sql, params)
+        rows = await cursor.fetchall()
 
         reservation_ids = [r.get("id") for r in rows if r.get("id") is not None]
         order_map: Dict[int, Dict[str, Any]] = {}
         if reservation_ids:
             placeholders = ", ".join(["%s"] * len(reservation_ids))
-            cursor_orders.execute(
+            await cursor_orders.execute(
                 f"""
                 SELECT *
                 FROM orders
@@ -186,7 +148,7 @@ def list_reservations(court_id: Optional[int] = None, member_id: Optional[int] =
                 """,
                 reservation_ids,
             )
-            order_rows = cursor_orders.fetchall()
+            order_rows = await cursor_orders.fetchall()
             for order in order_rows:
                 rid = order.get("related_id")
                 if rid is None or rid in order_map:
@@ -206,15 +168,128 @@ def list_reservations(court_id: Optional[int] = None, member_id: Optional[int] =
                 r["order_pay_method"] = order.get("pay_method")
         return rows
     finally:
-        cursor_orders.close()
-        cursor.close()
-        db.close()
+        await cursor_orders.close()
+        await cursor.close()
+
+
+@router.get("/availability")
+async def get_availability(
+    date_str: str = Query(..., alias="date", description="起始日期 YYYY-MM-DD"),
+    days: int = Query(1, ge=1, le=MAX_GRID_DAYS, description="连续天数"),
+    court_type: Optional[str] = Query(None, alias="type", description="场地类型"),
+    slot_minutes: Optional[int] = Query(None, ge=5, le=24 * 60, description="时段长度（分钟），默认取预约规则"),
+    with_price: bool = Query(False, description="是否附带每个时段的价格"),
+    db: AsyncUnitOfWork = Depends(get_async_uow),
+):
+    """
+    场地可用性网格：场地 × 时段 的空闲矩阵（可跨多天）
+    占用区间优先取进程内区间索引，超出索引覆盖范围时一次范围查询；会员未过期的预留也算占用；在内存中合并计算，
+    with_price 时每个时段附带分时段价格表中的原价；返回的 cache_key 可用于判断内容是否变化
+    """
+    try:
+        first_day = date.fromisoformat(date_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date 格式不正确，需为 YYYY-MM-DD")
+
+    day_list = [first_day + timedelta(days=i) for i in range(days)]
+
+    def _settings_and_index():
+        # 营业时段来自设置快照，占用区间优先取进程内索引；二者都可能需要加载，放到线程池执行
+        rules = availability_settings()
+        start = datetime.combine(day_list[0], rules["open_time"])
+        end = datetime.combine(day_list[-1], rules["close_time"])
+        return rules, start, end, reservation_index.busy_rows(start, end), held_rows(start, end)
+
+    rules, range_start, range_end, busy_rows, held = await run_in_threadpool(_settings_and_index)
+    slot = slot_minutes or rules["slot_minutes"]
+
+    cursor = await db.cursor(dictionary=True)
+    try:
+        sql, params = courts_query(court_type)
+        await cursor.execute(sql, params)
+        courts = await cursor.fetchall()
+
+        if busy_rows is None:
+            # 超出索引覆盖范围（或索引不可用）时一次范围查询
+            sql, params = busy_range_query(range_start, range_end, court_type)
+            await cursor.execute(sql, params)
+            busy_rows = await cursor.fetchall()
+        # 会员端未过期的预留同样视为占用
+        busy = merge_busy(list(busy_rows) + held)
+    finally:
+        await cursor.close()
+
+    if not with_price:
+        return build_grid(courts, busy, day_list, rules["open_time"], rules["close_time"], slot)
+    # 价格表与系统设置可能需要加载，放到线程池执行
+    return await run_in_threadpool(
+        build_grid, courts, busy, day_list, rules["open_time"], rules["close_time"], slot, court_amount
+    )
+
+
+@router.get("/next-available")
+async def get_next_available(
+    court_type: Optional[str] = Query(None, alias="type", description="场地类型"),
+    duration: int = Query(60, ge=5, le=24 * 60, description="时长（分钟）"),
+    from_date: Optional[str] = Query(None, alias="from", description="起始日期 YYYY-MM-DD，默认今天"),
+    days: int = Query(7, ge=1, le=MAX_GRID_DAYS, description="向后查找的天数"),
+    earliest: Optional[str] = Query(None, description="每天最早开始时间 HH:MM，默认营业开始"),
+    latest: Optional[str] = Query(None, description="每天最晚结束时间 HH:MM，默认营业结束"),
+    limit: int = Query(5, ge=1, le=50, description="返回条数"),
+    db: AsyncUnitOfWork = Depends(get_async_uow),
+):
+    """
+    最近的空闲时段：在日期范围内找最早能放下 duration 分钟的场地时段，返回前 limit 个（附价格）
+    占用区间与可用性网格同源（区间索引或一次范围查询，会员预留也算占用），空档在内存中查找
+    """
+    try:
+        first_day = date.fromisoformat(from_date) if from_date else date.today()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from 格式不正确，需为 YYYY-MM-DD")
+
+    day_list = [first_day + timedelta(days=i) for i in range(days)]
+
+    def _settings_and_index():
+        rules = availability_settings()
+        day_from = parse_hhmm(earliest, rules["open_time"].strftime("%H:%M"))
+        day_to = parse_hhmm(latest, rules["close_time"].strftime("%H:%M"))
+        start = datetime.combine(day_list[0], day_from)
+        end = datetime.combine(day_list[-1], day_to)
+        return day_from, day_to, start, end, reservation_index.busy_rows(start, end), held_rows(start, end)
+
+    day_from, day_to, range_start, range_end, busy_rows, held = await run_in_threadpool(_settings_and_index)
+    if day_to <= day_from:
+        raise HTTPException(status_code=400, detail="latest 必须晚于 earliest")
+
+    cursor = await db.cursor(dictionary=True)
+    try:
+        sql, params = courts_query(court_type, with_price=True)
+        await cursor.execute(sql, params)
+        courts = await cursor.fetchall()
+
+        if busy_rows is None:
+            sql, params = busy_range_query(range_start, range_end, court_type)
+            await cursor.execute(sql, params)
+            busy_rows = await cursor.fetchall()
+        busy = merge_busy(list(busy_rows) + held)
+    finally:
+        await cursor.close()
+
+    # 价格按分时段价格表计算，价格表可能需要加载，放到线程池执行
+    items = await run_in_threadpool(
+        lambda: next_available(
+            courts, busy, day_list, day_from, day_to, duration,
+            not_before=datetime.now(), limit=limit, price_of=court_amount,
+        )
+    )
+    return {"duration": duration, "items": items}
 
 
 @router.post("")
 def create_reservation(
     data: Dict[str, Any],
     _current_user=Depends(require_action("reservation.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     后台创建场地预约：校验时间段自动计价，创建预约并生成已支付的订单(order_type=court，source=后台)
@@ -249,12 +324,17 @@ def create_reservation(
     except (TypeError, ValueError):
         amount_val = 0.0
 
-    db = get_db()
+    # 预检：进程内区间索引 / 预留映射已能确定冲突时，不开事务直接返回
+    if reservation_index.has_conflict(court_id, start_dt, end_dt):
+        raise HTTPException(status_code=400, detail="当前时间段已被预约，请选择其它时间")
+    if has_held_conflict(court_id, start_dt, end_dt):
+        raise HTTPException(status_code=400, detail="当前时间段已被会员预留，请选择其它时间")
+
     cursor = db.cursor(dictionary=True)
     try:
         db.start_transaction()
-        amount_val = _calc_amount(cursor, court_id, start_dt, end_dt, amount_val)
-        amount_val = _apply_member_pricing(cursor, amount_val, member_id)
+        priced = _quote_courts(cursor, [(court_id, start_dt, end_dt)], member_id, amount_val)[0]
+        amount_val = priced["amount"]
 
         # 【核心算法】时间段冲突检测
         # 检测逻辑：两个时间段冲突的条件是"不满足完全不重叠"
@@ -272,16 +352,12 @@ def create_reservation(
         # - 冲突：9:00-13:00（完全包含新预约）
         #
         # 注意：只检查非"已取消"状态的预约，已取消的预约不占用时间段
-        check_sql = """
-          SELECT COUNT(*) AS cnt
-          FROM court_reservations
-          WHERE court_id = %s
-            AND status <> '已取消'
-            AND NOT (end_time <= %s OR start_time >= %s)
-        """
-        cursor.execute(check_sql, (court_id, start_dt, end_dt))
-        row = cursor.fetchone() or {"cnt": 0}
-        if (row.get("cnt") or 0) > 0:
+        #
+        # 区间索引只做预检；事务内锁定 court_day_slots 中该场地当天的位图行，
+        # 检查并置位（位图相交时再按上面的精确条件查一次），只有竞争同一场地同一天的下单会互相等待
+        try:
+            claim_court_slots(court_id, start_dt, end_dt, cursor=cursor)
+        except SlotConflict:
             raise HTTPException(status_code=400, detail="当前时间段已被预约，请选择其它时间")
 
         cursor.execute(
@@ -310,46 +386,24 @@ def create_reservation(
             if mrow:
                 member_name = mrow.get("name") if isinstance(mrow, dict) else mrow[0]
 
-        # 获取场地名称用于通知
-        cursor.execute("SELECT name FROM courts WHERE id = %s", (court_id,))
-        court_row = cursor.fetchone()
-        court_name = court_row.get("name") if court_row else "场地"
+        # 场地名称用于通知
+        court_name = priced["name"]
 
-        # 扣除会员余额（只要有会员就扣款）
-        pay_method = data.get("pay_method", "会员余额")  # 默认会员余额
+        # 扣除会员余额（只要有会员就扣款）：一条条件更新完成判断与扣减，并写入流水
         if member_id:
-            cursor.execute(
-                "SELECT balance, status FROM members WHERE id = %s FOR UPDATE",
-                (member_id,)
-            )
-            member_row = cursor.fetchone()
-            if not member_row:
-                raise HTTPException(status_code=404, detail="会员不存在")
-            
-            member_status = member_row.get("status") if isinstance(member_row, dict) else member_row[1]
-            if str(member_status or "正常") != "正常":
-                raise HTTPException(status_code=400, detail="会员状态异常，无法使用余额支付")
-            
-            balance = float(member_row.get("balance") if isinstance(member_row, dict) else member_row[0] or 0)
-            
-            if amount_val > 0:
-                if balance < amount_val:
-                    raise HTTPException(status_code=400, detail=f"会员余额不足，当前余额：{balance:.2f}元，需要：{amount_val:.2f}元")
-                
-                new_balance = round(balance - amount_val, 2)
-                cursor.execute(
-                    "UPDATE members SET balance = %s WHERE id = %s",
-                    (new_balance, member_id)
-                )
-                
-                # 记录流水
-                cursor.execute(
-                    """
-                    INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
-                    VALUES (%s, '消费', %s, %s, %s)
-                    """,
-                    (member_id, -amount_val, new_balance, f"场地预约：{court_name} {start_dt.strftime('%Y-%m-%d %H:%M')}")
-                )
+            try:
+                if amount_val > 0:
+                    debit(
+                        cursor,
+                        member_id,
+                        amount_val,
+                        f"场地预约：{court_name} {start_dt.strftime('%Y-%m-%d %H:%M')}",
+                        require_active=True,
+                    )
+                else:
+                    ensure_member(cursor, member_id)
+            except WalletError as e:
+                raise _wallet_http_error(e)
 
         order_info = create_court_order(
             cursor=cursor,
@@ -363,24 +417,246 @@ def create_reservation(
             source=data.get("source", "后台"),
         )
 
+        # 发送通知给会员（如果是会员预约），与预约同一事务提交
+        if member_id:
+            try:
+                from ..services.notifications import create_notification
+
+                time_range = f"{start_dt.strftime('%Y-%m-%d %H:%M')} ~ {end_dt.strftime('%H:%M')}"
+                content = f"{court_name} {time_range} 预约成功（后台创建），金额 ¥{amount_val:.2f}"
+                create_notification(
+                    member_id=member_id, title="预约成功", content=content, level="info", cursor=cursor
+                )
+            except Exception:
+                pass
+
         db.commit()
-        result = {"id": reservation_id, "order": order_info}
+        note_reservation_booked(reservation_id, court_id, start_dt, end_dt)
+        return {"id": reservation_id, "order": order_info}
     finally:
         cursor.close()
-        db.close()
 
-    # 发送通知给会员（如果是会员预约）
-    if member_id:
+
+# 一次批量/周期预约最多展开的次数
+MAX_BATCH_RESERVATIONS = 52
+
+
+def _expand_batch(data: Dict[str, Any]) -> List[tuple]:
+    """
+    展开批量预约请求，返回按开始时间排序的 [(court_id, start_dt, end_dt), ...]
+    - slots: [{court_id?, start_time, end_time}, ...]，court_id 缺省取外层
+    - recurrence: {start_date, start_time(HH:MM), end_time(HH:MM), count, interval_days=7}
+    """
+    default_court = data.get("court_id")
+    items: List[tuple] = []
+
+    recurrence = data.get("recurrence")
+    if recurrence:
+        if default_court in (None, ""):
+            raise HTTPException(status_code=400, detail="缺少字段: court_id")
         try:
-            from ..services.notifications import create_notification
+            first_day = date.fromisoformat(str(recurrence["start_date"]))
+            start_t = datetime.strptime(str(recurrence["start_time"]), "%H:%M").time()
+            end_t = datetime.strptime(str(recurrence["end_time"]), "%H:%M").time()
+            count = int(recurrence.get("count") or 0)
+            interval = int(recurrence.get("interval_days") or 7)
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(
+                status_code=400,
+                detail="recurrence 需包含 start_date(YYYY-MM-DD)、start_time/end_time(HH:MM)、count",
+            )
+        if count <= 0 or interval <= 0:
+            raise HTTPException(status_code=400, detail="count 与 interval_days 必须大于 0")
+        if count > MAX_BATCH_RESERVATIONS:
+            raise HTTPException(status_code=400, detail=f"单次最多批量预约 {MAX_BATCH_RESERVATIONS} 次")
+        for i in range(count):
+            day = first_day + timedelta(days=i * interval)
+            start_dt = datetime.combine(day, start_t)
+            end_dt = datetime.combine(day, end_t)
+            if end_dt <= start_dt:
+                # 跨零点的时段（如 23:00-01:00）
+                end_dt += timedelta(days=1)
+            items.append((int(default_court), start_dt, end_dt))
+    else:
+        slots = data.get("slots") or []
+        if not slots:
+            raise HTTPException(status_code=400, detail="缺少字段: slots 或 recurrence")
+        if len(slots) > MAX_BATCH_RESERVATIONS:
+            raise HTTPException(status_code=400, detail=f"单次最多批量预约 {MAX_BATCH_RESERVATIONS} 次")
+        for slot in slots:
+            court_id = slot.get("court_id", default_court)
+            if court_id in (None, ""):
+                raise HTTPException(status_code=400, detail="缺少字段: court_id")
+            start_dt = _parse_dt(str(slot.get("start_time") or ""), "开始时间").replace(microsecond=0)
+            end_dt = _parse_dt(str(slot.get("end_time") or ""), "结束时间").replace(microsecond=0)
+            if end_dt <= start_dt:
+                raise HTTPException(status_code=400, detail="结束时间必须晚于开始时间")
+            items.append((int(court_id), start_dt, end_dt))
+
+    now = datetime.now()
+    for _, start_dt, end_dt in items:
+        if end_dt <= now:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{start_dt.strftime('%Y-%m-%d %H:%M')} 的时段已经结束，请调整批量预约的起始日期",
+            )
+
+    # 批量内部同一场地的时段不能互相重叠
+    by_court = sorted(items)
+    for (c1, _, e1), (c2, s2, _) in zip(by_court, by_court[1:]):
+        if c1 == c2 and s2 < e1:
+            raise HTTPException(status_code=400, detail=f"{s2.strftime('%Y-%m-%d %H:%M')} 的时段与批量中的其他时段重叠")
+
+    return sorted(items, key=lambda x: (x[1], x[0]))
 
-            time_range = f"{start_dt.strftime('%Y-%m-%d %H:%M')} ~ {end_dt.strftime('%H:%M')}"
-            content = f"{court_name} {time_range} 预约成功（后台创建），金额 ¥{amount_val:.2f}"
-            create_notification(member_id=member_id, title="预约成功", content=content, level="info")
+
+@router.post("/batch")
+def create_reservations_batch(
+    data: Dict[str, Any],
+    _current_user=Depends(require_action("reservation.create")),
+    db: UnitOfWork = Depends(get_uow),
+):
+    """
+    后台批量/周期预约（如"每周二 19:00-21:00，共 12 周"）：全部成功或全部失败
+    计价、冲突检测、会员扣款各做一次，预约/流水/订单用 executemany 批量写入，只发一条汇总通知
+
+    请求体：
+    - court_id: 场地ID（slots 中未指定时使用）
+    - slots: [{court_id?, start_time, end_time}, ...] 或 recurrence: {start_date, start_time, end_time, count, interval_days}
+    - member_id / member_name / pay_method / remark / source / amount（每次的金额，缺省按价格自动计算）
+    """
+    items = _expand_batch(data)
+
+    raw_member = data.get("member_id")
+    if raw_member in (None, "", 0, "0"):
+        member_id = None
+    else:
+        try:
+            member_id = int(raw_member)
         except Exception:
-            pass
+            raise HTTPException(status_code=400, detail="会员ID格式不正确")
+
+    amount_val = data.get("total_amount", data.get("amount", 0))
+    try:
+        amount_val = float(amount_val or 0)
+    except (TypeError, ValueError):
+        amount_val = 0.0
+
+    # 预检：进程内区间索引 / 预留映射已能确定冲突时，不开事务直接返回
+    for court_id, start_dt, end_dt in items:
+        if reservation_index.has_conflict(court_id, start_dt, end_dt) or has_held_conflict(court_id, start_dt, end_dt):
+            raise HTTPException(status_code=400, detail=f"{start_dt.strftime('%Y-%m-%d %H:%M')} 的时间段已被占用，请调整后重试")
+
+    remark = data.get("remark")
+    source = data.get("source", "后台")
+    court_ids = sorted({court_id for court_id, _, _ in items})
+
+    cursor = db.cursor(dictionary=True)
+    try:
+        db.start_transaction()
+
+        # 1. 计价：价格取自缓存的价格表，会员折扣只解析一次
+        lines = _quote_courts(cursor, items, member_id, amount_val)
+        amounts: List[float] = [line["amount"] for line in lines]
+        court_names = {line["id"]: line["name"] for line in lines}
+        total = round(sum(amounts), 2)
+
+        # 2. 冲突检测：一次锁定全部 (场地, 日期) 位图行，一次范围查询复查
+        try:
+            claim_many(items, cursor=cursor)
+        except SlotConflict as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # 3. 会员先校验（不加锁），扣款放在写入之后、提交之前
+        member_name = data.get("member_name")
+        if member_id:
+            try:
+                member_name = member_name or ensure_member(cursor, member_id)["name"]
+            except WalletError as e:
+                raise _wallet_http_error(e)
+
+        # 4. 批量写入预约，再一次查回 id（持有位图行锁，(场地, 开始时间) 在未取消预约中唯一）
+        cursor.executemany(
+            """
+            INSERT INTO court_reservations
+                (court_id, member_id, start_time, end_time, total_amount, status, remark, source)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            [
+                (court_id, member_id, start_dt, end_dt, amount, "已预约", remark, source)
+                for (court_id, start_dt, end_dt), amount in zip(items, amounts)
+            ],
+        )
+        first_id = cursor.lastrowid or 0
+        cond = " OR ".join(["(court_id = %s AND start_time = %s)"] * len(items))
+        cursor.execute(
+            f"""
+            SELECT id, court_id, start_time
+            FROM court_reservations
+            WHERE id >= %s AND status = '已预约' AND ({cond})
+            """,
+            (first_id, *[v for court_id, start_dt, _ in items for v in (court_id, start_dt)]),
+        )
+        ids = {(int(r["court_id"]), r["start_time"]): int(r["id"]) for r in cursor.fetchall() or []}
+        reservation_ids = [ids[(court_id, start_dt)] for court_id, start_dt, _ in items]
+
+        # 5. 一条条件更新扣除合计，流水逐次记录（余额递减）；订单每次预约一张，均为一次多行插入
+        if member_id and total > 0:
+            try:
+                debit_many(
+                    cursor,
+                    member_id,
+                    [
+                        (amount, f"场地预约：{court_names[court_id]} {start_dt.strftime('%Y-%m-%d %H:%M')}")
+                        for (court_id, start_dt, _), amount in zip(items, amounts)
+                        if amount > 0
+                    ],
+                    require_active=True,
+                )
+            except WalletError as e:
+                raise _wallet_http_error(e)
+
+        orders = create_court_orders(
+            cursor=cursor,
+            items=list(zip(reservation_ids, amounts)),
+            member_id=member_id,
+            member_name=member_name,
+            pay_method=data.get("pay_method"),
+            status="paid",
+            remark=remark,
+            source=source,
+        )
 
-    return result
+        # 6. 一条汇总通知
+        if member_id:
+            try:
+                from ..services.notifications import create_notification
+
+                first, last = items[0], items[-1]
+                names = "、".join(court_names[c] for c in court_ids)
+                content = (
+                    f"{names} 共 {len(items)} 次预约成功（后台批量创建），"
+                    f"{first[1].strftime('%Y-%m-%d %H:%M')} 起至 {last[1].strftime('%Y-%m-%d %H:%M')}，"
+                    f"合计 ¥{total:.2f}"
+                )
+                create_notification(
+                    member_id=member_id, title="预约成功", content=content, level="info", cursor=cursor
+                )
+            except Exception:
+                pass
+
+        db.commit()
+        note_reservations_booked(
+            (rid, court_id, start_dt, end_dt) for rid, (court_id, start_dt, end_dt) in zip(reservation_ids, items)
+        )
+        return {
+            "ids": reservation_ids,
+            "count": len(reservation_ids),
+            "total_amount": total,
+            "orders": orders,
+        }
+    finally:
+        cursor.close()
 
 
 @router.put("/{reservation_id}/status")
@@ -388,6 +664,7 @@ def update_reservation_status(
     reservation_id: int,
     data: dict,
     _current_user=Depends(require_action("reservation.edit")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """更新预约状态：已预约 / 已取消 / 进行中 / 已完成"""
     new_status = data.get("status")
@@ -395,7 +672,6 @@ def update_reservation_status(
     if new_status not in allowed:
         raise HTTPException(status_code=400, detail="不合法的预约状态")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -406,7 +682,7 @@ def update_reservation_status(
         # - 后续事务会等待第一个事务提交或回滚
         # - 避免"丢失更新"问题（Lost Update）
         cursor.execute(
-            "SELECT status, member_id, remark FROM court_reservations WHERE id = %s FOR UPDATE",
+            "SELECT status, member_id, remark, court_id, start_time, end_time FROM court_reservations WHERE id = %s FOR UPDATE",
             (reservation_id,),
         )
         row = cursor.fetchone()
@@ -416,10 +692,19 @@ def update_reservation_status(
         if row["status"] == new_status:
             raise HTTPException(status_code=400, detail=f"当前已是{new_status}状态")
 
+        if row["status"] == "已取消":
+            # 从已取消恢复：先重新占用时间段（此时本预约仍是已取消，不会与自己冲突）
+            try:
+                claim_court_slots(row["court_id"], row["start_time"], row["end_time"], cursor=cursor)
+            except SlotConflict:
+                raise HTTPException(status_code=400, detail="该时间段已被其他预约占用，无法恢复")
+
         cursor.execute(
             "UPDATE court_reservations SET status = %s WHERE id = %s",
             (new_status, reservation_id),
         )
+        if new_status == "已取消":
+            release_court_slots(row["court_id"], row["start_time"], row["end_time"], cursor=cursor)
 
         if new_status == "已取消":
             _process_reservation_refund(
@@ -432,30 +717,43 @@ def update_reservation_status(
             )
 
         db.commit()
+        if new_status == "已取消":
+            note_reservation_released(reservation_id)
+            schedule_promotion(row["court_id"], row["start_time"], row["end_time"])
+        elif row["status"] == "已取消":
+            # 从已取消恢复，重新占用时间段
+            note_reservation_booked(reservation_id, row["court_id"], row["start_time"], row["end_time"])
         return {"code": 200, "msg": "状态更新成功", "data": {"id": reservation_id, "status": new_status}}
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
 
 
 @router.delete("/{reservation_id}")
 def delete_reservation(
     reservation_id: int,
     _current_user=Depends(require_action("reservation.delete")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """删除预约"""
-    db = get_db()
-    cursor = db.cursor()
+    cursor = db.cursor(dictionary=True)
     try:
+        db.start_transaction()
+        cursor.execute(
+            "SELECT court_id, start_time, end_time, status FROM court_reservations WHERE id = %s FOR UPDATE",
+            (reservation_id,),
+        )
+        row = cursor.fetchone()
         cursor.execute("DELETE FROM court_reservations WHERE id = %s", (reservation_id,))
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="预约记录不存在")
+        if row and row["status"] != "已取消":
+            release_court_slots(row["court_id"], row["start_time"], row["end_time"], cursor=cursor)
         db.commit()
+        note_reservation_released(reservation_id)
         return {"message": "deleted"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("/{reservation_id}/refund")
@@ -463,9 +761,9 @@ def refund_reservation(
     reservation_id: int,
     data: Dict[str, Any],
     _current_user=Depends(require_action("reservation.refund")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """取消预约并发起退款"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -494,43 +792,49 @@ def refund_reservation(
         )
 
         cursor.execute("UPDATE court_reservations SET status = %s WHERE id = %s", ("已取消", reservation_id))
+        if reservation.get("status") != "已取消":
+            release_court_slots(
+                reservation["court_id"], reservation["start_time"], reservation["end_time"], cursor=cursor
+            )
+
+        # 发送通知给会员（如果是会员预约），与退款同一事务提交
+        try:
+            member_id = reservation.get("member_id")
+            if member_id:
+                from ..services.notifications import create_notification
+                from datetime import datetime
+
+                start_time = reservation.get("start_time")
+                if isinstance(start_time, datetime):
+                    start_dt = start_time
+                elif isinstance(start_time, str):
+                    try:
+                        start_dt = datetime.fromisoformat(start_time.replace(" ", "T"))
+                    except Exception:
+                        start_dt = None
+                else:
+                    start_dt = None
+
+                content_time = start_dt.strftime("%Y-%m-%d %H:%M") if start_dt else ""
+                court_name = reservation.get("court_name") or "场地"
+                content = f"{court_name} {content_time} 预约已取消（后台操作），费用已退回"
+                create_notification(
+                    member_id=member_id, title="预约取消通知", content=content, level="warning", cursor=cursor
+                )
+        except Exception:
+            pass
 
         db.commit()
-        result = {"message": "预约已取消并退款", "refund_order": refund_info}
+        note_reservation_released(reservation_id)
+        if reservation.get("status") != "已取消":
+            schedule_promotion(reservation["court_id"], reservation["start_time"], reservation["end_time"])
+        return {"message": "预约已取消并退款", "refund_order": refund_info}
     except HTTPException:
         db.rollback()
         raise
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
-
-    # 发送通知给会员（如果是会员预约）
-    try:
-        member_id = reservation.get("member_id")
-        if member_id:
-            from ..services.notifications import create_notification
-            from datetime import datetime
-
-            start_time = reservation.get("start_time")
-            if isinstance(start_time, datetime):
-                start_dt = start_time
-            elif isinstance(start_time, str):
-                try:
-                    start_dt = datetime.fromisoformat(start_time.replace(" ", "T"))
-                except Exception:
-                    start_dt = None
-            else:
-                start_dt = None
-
-            content_time = start_dt.strftime("%Y-%m-%d %H:%M") if start_dt else ""
-            court_name = reservation.get("court_name") or "场地"
-            content = f"{court_name} {content_time} 预约已取消（后台操作），费用已退回"
-            create_notification(member_id=member_id, title="预约取消通知", content=content, level="warning")
-    except Exception:
-        pass
-
-    return result
 
 
 def _find_latest_court_order(cursor, reservation_id: int):
@@ -602,21 +906,7 @@ def _process_reservation_refund(
         params.append(order["id"])
         cursor.execute(sql, tuple(params))
 
-    if member_id:
-        cursor.execute("SELECT balance FROM members WHERE id = %s FOR UPDATE", (member_id,))
-        mrow = cursor.fetchone()
-        if mrow:
-            balance = float(mrow["balance"] if isinstance(mrow, dict) else mrow[0] or 0)
-            new_balance = balance + refund_amount
-            cursor2.execute(
-                "UPDATE members SET balance = %s WHERE id = %s",
-                (new_balance, member_id),
-            )
-            mt_sql = """
-            INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
-            VALUES (%s, '退款', %s, %s, %s)
-            """
-            mt_remark = remark or f"取消预约退款：{reservation_id}"
-            cursor2.execute(mt_sql, (member_id, refund_amount, new_balance, mt_remark))
+    if member_id and refund_amount > 0:
+        credit(cursor2, member_id, refund_amount, remark or f"取消预约退款：{reservation_id}")
 
     return refund_info
@@ -1,19 +1,24 @@
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
 from typing import Dict, Any
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
+from ..deps import require_action
+from ..services.cache_bus import publish
+from ..services.court_closures import ClosureError, ClosureNotFound, create_job, get_job, lift_job, start_job
+from ..services.court_slots import reset_courts
+from ..services.reservation_index import note_reservations_changed
 
 router = APIRouter(prefix="/courts", tags=["Courts"])
 
 
 # 1. 场地列表
 @router.get("")
-def list_courts():
+def list_courts(db: UnitOfWork = Depends(get_uow)):
     """
     场地列表，给管理端“场地管理”页面用。
     返回直接是数组，保持和原前端兼容。
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -31,18 +36,16 @@ def list_courts():
         return rows
     finally:
         cursor.close()
-        db.close()
 
 
 # 2. 新增场地
 @router.post("")
-def add_court(data: Dict[str, Any]):
+def add_court(data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     required_fields = ["name", "type", "price_per_hour"]
     for field in required_fields:
         if field not in data:
             raise HTTPException(status_code=400, detail=f"缺少字段: {field}")
 
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -61,20 +64,20 @@ def add_court(data: Dict[str, Any]):
             ),
         )
         db.commit()
+        # 排期按 courts.name = schedules.venue 对应到场地：同名排期从此占用新场地
+        publish("prices", "reservations")
         return {"id": cursor.lastrowid}
     finally:
         cursor.close()
-        db.close()
 
 
 # 3. 更新场地状态（可用 / 维护 / 停用）
 @router.put("/{court_id}/status")
-def update_court_status(court_id: int, data: Dict[str, Any]):
+def update_court_status(court_id: int, data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     new_status = data.get("status")
     if new_status not in ("可用", "维护", "停用"):
         raise HTTPException(status_code=400, detail="非法的状态值")
 
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute("SELECT id FROM courts WHERE id=%s", (court_id,))
@@ -87,26 +90,31 @@ def update_court_status(court_id: int, data: Dict[str, Any]):
             (new_status, court_id),
         )
         db.commit()
+        publish("prices")
         return {"message": "状态已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 # 4. 编辑场地（名称 / 类型 / 单价 / 位置 / 备注）
 @router.put("/{court_id}")
-def update_court(court_id: int, data: Dict[str, Any]):
+def update_court(court_id: int, data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """
     简单做法：前端编辑时把完整表单发过来，这里整行更新。
     """
-    db = get_db()
     cursor = db.cursor()
     try:
         # 先确认是否存在
-        cursor.execute("SELECT id FROM courts WHERE id=%s", (court_id,))
+        cursor.execute("SELECT id, name FROM courts WHERE id=%s", (court_id,))
         row = cursor.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="场地不存在")
+        renamed = data.get("name") != row[1]
+        if renamed:
+            # 排期按 courts.name = schedules.venue 对应到场地：改名后该场地与新旧同名场地的位图行都已过时，
+            # 删除后按新的对应关系重建（在更新 courts 之前删除，与下单"先位图行、后场地行"的加锁顺序一致）
+            cursor.execute("SELECT id FROM courts WHERE name IN (%s, %s)", (row[1], data.get("name")))
+            reset_courts({court_id, *(r[0] for r in cursor.fetchall() or [])}, cursor=cursor)
 
         sql = """
             UPDATE courts
@@ -129,30 +137,32 @@ def update_court(court_id: int, data: Dict[str, Any]):
             ),
         )
         db.commit()
+        if renamed:
+            # 排期按 courts.name = schedules.venue 对应到场地，改名后各 worker 的预约区间索引要重新加载
+            publish("prices", "reservations")
+        else:
+            publish("prices")
         return {"message": "场地信息已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 # 5. 删除场地（带预约约束）
 @router.delete("/{court_id}")
-def delete_court(court_id: int):
+def delete_court(court_id: int, db: UnitOfWork = Depends(get_uow)):
     """
     删除场地前检查是否存在未完成的预约：
     只要有不是 已完成/已取消 的预约，就不允许删除。
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 1. 先检查是否有未完成的预约
-        # 这里假设 court_reservations.status 使用英文编码：
-        #  FINISHED / CANCELLED / RESERVED 等
+        # 已结束的预约由后台线程推进为 已完成，这里只按状态过滤
         sql_check = """
             SELECT COUNT(*) AS cnt
             FROM court_reservations
             WHERE court_id = %s
-              AND status NOT IN ('FINISHED', 'CANCELLED')
+              AND status NOT IN ('已完成', '已取消')
         """
         cursor.execute(sql_check, (court_id,))
         row = cursor.fetchone() or {"cnt": 0}
@@ -167,7 +177,91 @@ def delete_court(court_id: int):
         # 2. 没有未完成预约，执行删除
         cursor.execute("DELETE FROM courts WHERE id = %s", (court_id,))
         db.commit()
+        publish("prices")
         return {"message": "删除成功"}
     finally:
         cursor.close()
-        db.close()
+
+
+# 6. 场地停用：批量取消时间段内的预约并退款（后台任务）
+@router.post("/{court_id}/closures")
+def create_court_closure(
+    court_id: int,
+    data: Dict[str, Any],
+    _current_user=Depends(require_action("reservation.refund")),
+    db: UnitOfWork = Depends(get_uow),
+):
+    """
+    登记停用时间段 [start_time, end_time)：此后该时段不能再预约/预留，已有的预留删除、候补过期，
+    后台按块取消其中的预约并退款。
+    返回 job_id，可用 GET /courts/{court_id}/closures/{job_id} 查询进度。
+    """
+    try:
+        start = datetime.fromisoformat(str(data.get("start_time") or "").replace(" ", "T"))
+        end = datetime.fromisoformat(str(data.get("end_time") or "").replace(" ", "T"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="时间格式不正确，需为 YYYY-MM-DD HH:MM:SS")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="结束时间必须晚于开始时间")
+
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id FROM courts WHERE id=%s", (court_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="场地不存在")
+
+        job = create_job(court_id, start, end, data.get("reason"), cursor=cursor)
+        db.commit()
+        # 停用时段进入各 worker 的区间索引；删除的预留从各 worker 的映射中移除
+        publish("holds")
+        note_reservations_changed()
+        start_job(job["job_id"])
+        return job
+    finally:
+        cursor.close()
+
+
+@router.post("/{court_id}/closures/{job_id}/lift")
+def lift_court_closure(
+    court_id: int,
+    job_id: int,
+    _current_user=Depends(require_action("reservation.refund")),
+    db: UnitOfWork = Depends(get_uow),
+):
+    """
+    解除停用（登记错了时间段时使用）：该时段重新开放预约；尚未处理的预约不再取消，
+    已取消/退款的预约、已删除的预留与已过期的候补不会恢复
+    """
+    cursor = db.cursor(dictionary=True)
+    try:
+        try:
+            lift_job(court_id, job_id, cursor=cursor)
+        except ClosureNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ClosureError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        db.commit()
+        # 停用时段从各 worker 的区间索引中移除
+        note_reservations_changed()
+        return {"message": "停用已解除"}
+    finally:
+        cursor.close()
+
+
+@router.get("/{court_id}/closures/{job_id}")
+def get_court_closure(
+    court_id: int,
+    job_id: int,
+    _current_user=Depends(require_action("reservation.refund")),
+    db: UnitOfWork = Depends(get_uow),
+):
+    """停用任务进度：status 为 running / done / failed / lifted（已解除），processed / total 为已处理 / 受影响的预约数"""
+    cursor = db.cursor(dictionary=True)
+    try:
+        job = get_job(job_id, cursor=cursor)
+        if not job or int(job["court_id"]) != court_id:
+            raise HTTPException(status_code=404, detail="停用任务不存在")
+        job["refunded_amount"] = float(job["refunded_amount"] or 0)
+        return job
+    finally:
+        cursor.close()
@@ -2,9 +2,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from typing import Dict, Any, List
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_super_admin
 from ..services.audit import write_operation_log
+from ..services.cache_bus import publish
+from ..services.token_revocation import revoke_tokens
 from ..services.notifications import create_admin_notifications
 
 router = APIRouter(prefix="/employees", tags=["Employees"])
@@ -28,8 +30,7 @@ def _get_current_user_id_name(current_user):
 
 
 @router.get("", response_model=List[Dict[str, Any]])
-def list_employees(current_user=Depends(require_super_admin)):
-    db = get_db()
+def list_employees(current_user=Depends(require_super_admin), db: UnitOfWork = Depends(get_uow)):
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -51,11 +52,10 @@ def list_employees(current_user=Depends(require_super_admin)):
         return cursor.fetchall()
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
-def create_employee(data: Dict[str, Any], current_user=Depends(require_super_admin)):
+def create_employee(data: Dict[str, Any], current_user=Depends(require_super_admin), db: UnitOfWork = Depends(get_uow)):
     """
     创建员工：同时写 users + employees
     """
@@ -66,7 +66,6 @@ def create_employee(data: Dict[str, Any], current_user=Depends(require_super_adm
 
     from ..security import get_password_hash  # 避免循环引用，局部导入
 
-    db = get_db()
     cursor = db.cursor()
     try:
         # 1) 创建用户账号
@@ -102,8 +101,6 @@ def create_employee(data: Dict[str, Any], current_user=Depends(require_super_adm
         )
         emp_id = cursor.lastrowid
 
-        db.commit()
-
         # 记录操作日志
         uid, uname = _get_current_user_id_name(current_user)
         if uid and uname:
@@ -115,30 +112,31 @@ def create_employee(data: Dict[str, Any], current_user=Depends(require_super_adm
                 target_id=emp_id,
                 target_desc=data["name"],
                 detail={"data": data},
+                cursor=cursor,
             )
             try:
                 create_admin_notifications(
                     title="新增员工",
                     content=f"管理员 {uname} 新增员工：{data['name']}（账号：{data['username']}）",
                     level="info",
+                    cursor=cursor,
                 )
             except Exception:
                 pass
 
+        db.commit()
         return {"id": emp_id}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{emp_id}")
-def update_employee(emp_id: int, data: Dict[str, Any], current_user=Depends(require_super_admin)):
+def update_employee(emp_id: int, data: Dict[str, Any], current_user=Depends(require_super_admin), db: UnitOfWork = Depends(get_uow)):
     """
     更新员工信息 / 启用禁用 / 重置密码
     - 前端传 { is_active: true/false } 时，只切换启用状态
     - 传完整信息时，更新员工 + 用户角色/电话/密码
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 查出原始数据
@@ -200,7 +198,14 @@ def update_employee(emp_id: int, data: Dict[str, Any], current_user=Depends(requ
                         (get_password_hash(reset_password), emp["user_id"]),
                     )
 
-        db.commit()
+        # token 中的角色/启用状态已过期；重置密码则强制下线
+        reset = bool(not only_toggle_active and user and data.get("reset_password"))
+        revoke_tokens(
+            "user", emp["user_id"],
+            force_logout=reset,
+            reason="password_reset" if reset else "account_changed",
+            cursor=cursor,
+        )
 
         # 日志
         uid, uname = _get_current_user_id_name(current_user)
@@ -213,28 +218,31 @@ def update_employee(emp_id: int, data: Dict[str, Any], current_user=Depends(requ
                 target_id=emp_id,
                 target_desc=data.get("name") or emp["name"],
                 detail={"data": data},
+                cursor=cursor,
             )
             try:
                 create_admin_notifications(
                     title="员工信息变更",
                     content=f"管理员 {uname} 更新员工：{data.get('name') or emp['name']}",
                     level="info",
+                    cursor=cursor,
                 )
             except Exception:
                 pass
 
+        db.commit()
+        # 账号角色/启用状态变化，通知各 worker 丢弃该用户相关缓存
+        publish("users", "revocations")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{emp_id}")
-def delete_employee(emp_id: int, current_user=Depends(require_super_admin)):
+def delete_employee(emp_id: int, current_user=Depends(require_super_admin), db: UnitOfWork = Depends(get_uow)):
     """
     删除员工档案 + 对应用户账号，并记录操作日志
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT * FROM employees WHERE id = %s", (emp_id,))
@@ -248,8 +256,7 @@ def delete_employee(emp_id: int, current_user=Depends(require_super_admin)):
         cursor.execute("DELETE FROM employees WHERE id = %s", (emp_id,))
         if user:
             cursor.execute("DELETE FROM users WHERE id = %s", (emp["user_id"],))
-
-        db.commit()
+            revoke_tokens("user", emp["user_id"], force_logout=True, reason="account_deleted", cursor=cursor)
 
         # 日志
         uid, uname = _get_current_user_id_name(current_user)
@@ -262,17 +269,55 @@ def delete_employee(emp_id: int, current_user=Depends(require_super_admin)):
                 target_id=emp_id,
                 target_desc=emp.get("name"),
                 detail=None,
+                cursor=cursor,
             )
             try:
                 create_admin_notifications(
                     title="删除员工",
                     content=f"管理员 {uname} 删除员工：{emp.get('name')}",
                     level="warning",
+                    cursor=cursor,
                 )
             except Exception:
                 pass
 
+        db.commit()
+        # 账号角色/启用状态变化，通知各 worker 丢弃该用户相关缓存
+        publish("users", "revocations")
+        return {"success": True}
+    finally:
+        cursor.close()
+
+
+@router.post("/{emp_id}/force-logout")
+def force_logout_employee(emp_id: int, current_user=Depends(require_super_admin), db: UnitOfWork = Depends(get_uow)):
+    """
+    强制员工下线：此前签发的所有 token 立即失效，需要重新登录
+    """
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id, user_id, name FROM employees WHERE id = %s", (emp_id,))
+        emp = cursor.fetchone()
+        if not emp:
+            raise HTTPException(status_code=404, detail="员工不存在")
+
+        revoke_tokens("user", emp["user_id"], force_logout=True, reason="force_logout", cursor=cursor)
+
+        uid, uname = _get_current_user_id_name(current_user)
+        if uid and uname:
+            write_operation_log(
+                user_id=uid,
+                username=uname,
+                action="FORCE_LOGOUT_EMPLOYEE",
+                module="employee",
+                target_id=emp_id,
+                target_desc=emp.get("name"),
+                detail=None,
+                cursor=cursor,
+            )
+
+        db.commit()
+        publish("revocations")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
@@ -1,11 +1,14 @@
 # backend/app/routers/member_auth.py
 from fastapi import APIRouter, HTTPException, Header, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import Any, Dict
 
-from ..database import get_db
-from ..security import verify_password, create_access_token, decode_access_token
+from ..async_database import AsyncUnitOfWork, get_async_uow
+from ..database import UnitOfWork, get_uow
+from ..principals import member_claims, resolve_member, resolve_member_async
+from ..security import verify_and_update_password_async, create_access_token
 from .members import normalize_member
 
 router = APIRouter(prefix="/member-auth", tags=["MemberAuth"])
@@ -24,14 +27,7 @@ class TokenWithMember(BaseModel):
 
 
 # --------- 内部公共登录逻辑 ---------
-def _login_core(phone: str, password: str) -> Dict[str, Any]:
-    phone = (phone or "").strip()
-    password = (password or "").strip()
-
-    if not phone or not password:
-        raise HTTPException(status_code=400, detail="手机号和密码不能为空")
-
-    db = get_db()
+def _load_member(db: UnitOfWork, phone: str) -> Dict[str, Any] | None:
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -46,95 +42,121 @@ def _login_core(phone: str, password: str) -> Dict[str, Any]:
             """,
             (phone,),
         )
-        member = cursor.fetchone()
-
-        if not member:
-            # 不区分是手机号不存在还是密码错
-            raise HTTPException(status_code=401, detail="手机号或密码错误")
-
-        if member.get("status") != "正常":
-            raise HTTPException(status_code=403, detail="会员状态异常，无法登录")
-
-        if not member.get("login_password_hash"):
-            raise HTTPException(status_code=401, detail="该会员尚未设置登录密码，请联系前台")
-
-        if not verify_password(password, member["login_password_hash"]):
-            raise HTTPException(status_code=401, detail="手机号或密码错误")
-
-        payload = {
-            "sub": str(member["id"]),
-            "member_id": member["id"],
-            "role": "member",
-        }
-        token = create_access_token(payload)
-
-        member_data = normalize_member(member)
-        return {
-            "access_token": token,
-            "token_type": "bearer",
-            "member": member_data,
-        }
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _upgrade_password_hash(db: UnitOfWork, member_id: int, new_hash: str) -> None:
+    """登录成功后把旧哈希升级为当前算法/迭代次数"""
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            "UPDATE members SET login_password_hash = %s WHERE id = %s",
+            (new_hash, member_id),
+        )
+        db.commit()
     finally:
         cursor.close()
-        db.close()
+
+
+async def _login_core(db: UnitOfWork, phone: str, password: str) -> Dict[str, Any]:
+    """查库在线程池、密码验证在专用哈希线程池，登录高峰不占满路由线程"""
+    phone = (phone or "").strip()
+    password = (password or "").strip()
+
+    if not phone or not password:
+        raise HTTPException(status_code=400, detail="手机号和密码不能为空")
+
+    member = await run_in_threadpool(_load_member, db, phone)
+
+    if not member:
+        # 不区分是手机号不存在还是密码错
+        raise HTTPException(status_code=401, detail="手机号或密码错误")
+
+    if member.get("status") != "正常":
+        raise HTTPException(status_code=403, detail="会员状态异常，无法登录")
+
+    if not member.get("login_password_hash"):
+        raise HTTPException(status_code=401, detail="该会员尚未设置登录密码，请联系前台")
+
+    ok, new_hash = await verify_and_update_password_async(password, member["login_password_hash"])
+    if not ok:
+        raise HTTPException(status_code=401, detail="手机号或密码错误")
+
+    if new_hash:
+        await run_in_threadpool(_upgrade_password_hash, db, member["id"], new_hash)
+
+    # 带状态/等级等声明，会员端后续请求认证不查库
+    token = create_access_token(member_claims(member))
+
+    member_data = normalize_member(member)
+    return {
+        "access_token": token,
+        "token_type": "bearer",
+        "member": member_data,
+    }
 
 
 # --------- 1. JSON 方式登录（备用） ---------
 @router.post("/login", response_model=TokenWithMember)
-def member_login(data: MemberLoginRequest):
-    return _login_core(data.phone, data.password)
+async def member_login(data: MemberLoginRequest, db: UnitOfWork = Depends(get_uow)):
+    return await _login_core(db, data.phone, data.password)
 
 
 # --------- 2. /token 表单登录（前端现在用的这个） ---------
 @router.post("/token", response_model=TokenWithMember)
-def member_login_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def member_login_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: UnitOfWork = Depends(get_uow),
+):
     """
     兼容 axios 以 form-data 方式提交：
     username = 手机号, password = 密码
     """
-    return _login_core(form_data.username, form_data.password)
+    return await _login_core(db, form_data.username, form_data.password)
 
 
 # --------- 3. 从 token 获取当前会员 ---------
-def get_current_member(authorization: str = Header(...)):
+def _token_from_header(authorization: str) -> str:
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="认证信息无效")
+    return authorization.split(" ", 1)[1].strip()
+
+
+def get_current_member(authorization: str = Header(...), db: UnitOfWork = Depends(get_uow)):
+    """当前会员身份（id, name, phone, mobile, level, status），经 principals 缓存"""
+    return resolve_member(_token_from_header(authorization), db)
 
-    token = authorization.split(" ", 1)[1].strip()
-    payload = decode_access_token(token)
 
-    if payload.get("role") != "member":
-        raise HTTPException(status_code=403, detail="无权访问")
+async def get_current_member_async(
+    authorization: str = Header(...),
+    db: AsyncUnitOfWork = Depends(get_async_uow),
+):
+    """get_current_member 的异步版本，供会员端 async def 路由使用"""
+    return await resolve_member_async(_token_from_header(authorization), db)
 
-    member_id = payload.get("member_id") or payload.get("sub")
-    if not member_id:
-        raise HTTPException(status_code=401, detail="Token 中缺少会员信息")
 
-    db = get_db()
+# --------- 4. 会员端「我的资料」 ---------
+_PROFILE_SQL = """
+    SELECT id, name, phone, gender, birthday,
+           level, status, remark,
+           balance, total_spent,
+           created_at
+    FROM members
+    WHERE id = %s
+"""
+
+
+@router.get("/me")
+def get_me(current_member=Depends(get_current_member), db: UnitOfWork = Depends(get_uow)):
+    """完整资料（含余额）实时查询，不走认证缓存"""
     cursor = db.cursor(dictionary=True)
     try:
-        cursor.execute(
-            """
-            SELECT id, name, phone, gender, birthday,
-                   level, status, remark,
-                   balance, total_spent,
-                   created_at
-            FROM members
-            WHERE id = %s
-            """,
-            (member_id,),
-        )
+        cursor.execute(_PROFILE_SQL, (current_member["id"],))
         row = cursor.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="会员不存在")
-
         return normalize_member(row)
     finally:
         cursor.close()
-        db.close()
-
-
-# --------- 4. 会员端「我的资料」 ---------
-@router.get("/me")
-def get_me(current_member=Depends(get_current_member)):
-    return current_member
@@ -1,9 +1,9 @@
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 
 router = APIRouter(prefix="/member-cards", tags=["Member Cards"])
 
@@ -35,9 +35,8 @@ def _normalize(row: Dict[str, Any]) -> Dict[str, Any]:
 
 
 @router.get("")
-def list_cards(member_id: Optional[int] = None):
+def list_cards(member_id: Optional[int] = None, db: UnitOfWork = Depends(get_uow)):
     """会员卡列表，支持按 member_id 过滤"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -56,7 +55,6 @@ def list_cards(member_id: Optional[int] = None):
         return [_normalize(r) for r in rows]
     finally:
         cursor.close()
-        db.close()
 
 
 def _validate_dates(start_date: str | None, end_date: str | None):
@@ -73,7 +71,7 @@ def _validate_dates(start_date: str | None, end_date: str | None):
 
 
 @router.post("", status_code=201)
-def create_card(data: Dict[str, Any]):
+def create_card(data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     required = ["member_id", "card_name", "card_type", "start_date", "end_date"]
     for f in required:
         if f not in data:
@@ -113,7 +111,6 @@ def create_card(data: Dict[str, Any]):
     else:
         discount = None
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id, name FROM members WHERE id = %s", (member_id,))
@@ -155,13 +152,11 @@ def create_card(data: Dict[str, Any]):
         return _normalize(row) if row else {"id": card_id}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{card_id}")
-def update_card(card_id: int, data: Dict[str, Any]):
+def update_card(card_id: int, data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """支持更新剩余次数、有效期、折扣、备注等"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT * FROM member_cards WHERE id = %s", (card_id,))
@@ -230,12 +225,10 @@ def update_card(card_id: int, data: Dict[str, Any]):
         return {"message": "updated"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{card_id}")
-def delete_card(card_id: int):
-    db = get_db()
+def delete_card(card_id: int, db: UnitOfWork = Depends(get_uow)):
     cursor = db.cursor()
     try:
         cursor.execute("DELETE FROM member_cards WHERE id = %s", (card_id,))
@@ -245,4 +238,3 @@ def delete_card(card_id: int):
         return {"message": "deleted"}
     finally:
         cursor.close()
-        db.close()
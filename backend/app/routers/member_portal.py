@@ -4,10 +4,41 @@ from pydantic import BaseModel
 from typing import Any, Dict, List, Optional
 from datetime import datetime, date
 
-from .member_auth import get_current_member
-from ..database import get_db
+from .member_auth import get_current_member, get_current_member_async
+from .pricing import run_quote
+from ..async_database import AsyncUnitOfWork, get_async_uow
+from ..database import UnitOfWork, get_uow
 from ..services.member_config import load_member_config, get_level_display
 from ..security import verify_password, get_password_hash
+from ..services.cache_bus import publish
+from ..services.token_revocation import revoke_tokens
+from ..services.court_slots import SlotConflict, claim_court_slots, release_court_slots
+from ..services.pricing import CourtNotFound, PricingError, quote_member_court
+from ..services.slot_holds import (
+    HoldError,
+    create_hold,
+    delete_hold,
+    get_hold,
+    has_held_conflict,
+    lock_hold,
+    note_hold_added,
+    note_hold_removed,
+)
+from ..services.reservation_index import (
+    note_reservation_booked,
+    note_reservation_released,
+    reservation_index,
+)
+from ..services.wallet import MemberInactive, MemberNotFound, WalletError, credit, debit, ensure_member
+from ..services.waitlist import (
+    WaitlistError,
+    cancel_waitlist,
+    join_waitlist,
+    list_member_waitlist,
+    mark_hold_booked,
+    release_offer,
+    schedule_promotion,
+)
 
 router = APIRouter(prefix="/member", tags=["Member Portal"])
 
@@ -67,11 +98,11 @@ def _status_to_label(raw_status: Any) -> str:
 @router.get("/profile")
 def get_member_profile(
     current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     会员个人资料（会员端首页顶部、账号设置用）
     """
-    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     try:
         member_id = current_member["id"]
@@ -113,14 +144,14 @@ def get_member_profile(
         }
     finally:
         cursor.close()
-        conn.close()
 
 
 # ------- 会员首页概览（卡片统计） -------
 
 @router.get("/overview")
-def member_overview(
-    current_member: Dict[str, Any] = Depends(get_current_member),
+async def member_overview(
+    current_member: Dict[str, Any] = Depends(get_current_member_async),
+    conn: AsyncUnitOfWork = Depends(get_async_uow),
 ) -> Dict[str, Any]:
     """
     会员首页概览卡片：
@@ -128,8 +159,7 @@ def member_overview(
     - 已报名课次数（目前培训模块停用，统一返回 0）
     - 本月预约次数
     """
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+    cursor = await conn.cursor(dictionary=True)
     member_id = current_member["id"]
 
     data = {
@@ -141,11 +171,11 @@ def member_overview(
     try:
         # 历史订单总数
         try:
-            cursor.execute(
+            await cursor.execute(
                 "SELECT COUNT(*) AS cnt FROM orders WHERE member_id = %s",
                 (member_id,),
             )
-            row = cursor.fetchone()
+            row = await cursor.fetchone()
             if row and row.get("cnt") is not None:
                 data["total_orders"] = int(row["cnt"])
         except Exception:
@@ -153,7 +183,7 @@ def member_overview(
 
         # 本月预约次数（自然月）
         try:
-            cursor.execute(
+            await cursor.execute(
                 """
                 SELECT COUNT(*) AS cnt
                 FROM court_reservations
@@ -162,7 +192,7 @@ def member_overview(
                 """,
                 (member_id,),
             )
-            row = cursor.fetchone()
+            row = await cursor.fetchone()
             if row and row.get("cnt") is not None:
                 data["month_reservations"] = int(row["cnt"])
         except Exception:
@@ -173,23 +203,22 @@ def member_overview(
 
         return data
     finally:
-        cursor.close()
-        conn.close()
+        await cursor.close()
 
 
 # ------- 会员“我的订单”列表（首页 & 我的订单页会用） -------
 
 @router.get("/orders")
-def member_orders(
-    current_member: Dict[str, Any] = Depends(get_current_member),
+async def member_orders(
+    current_member: Dict[str, Any] = Depends(get_current_member_async),
     limit: Optional[int] = Query(
         None,
         ge=1,
         description="限制返回前几条，空则返回全部",
     ),
+    conn: AsyncUnitOfWork = Depends(get_async_uow),
 ) -> List[Dict[str, Any]]:
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+    cursor = await conn.cursor(dictionary=True)
     member_id = current_member["id"]
 
     try:
@@ -204,8 +233,8 @@ def member_orders(
             sql += " LIMIT %s"
             params.append(limit)
 
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
+        await cursor.execute(sql, params)
+        rows = await cursor.fetchall()
 
         result: List[Dict[str, Any]] = []
         for r in rows:
@@ -256,15 +285,15 @@ def member_orders(
             )
         return result
     finally:
-        cursor.close()
-        conn.close()
+        await cursor.close()
 
 
 # ------- 会员“我的预约”列表 -------
 
 @router.get("/reservations")
-def member_reservations(
-    current_member: Dict[str, Any] = Depends(get_current_member),
+async def member_reservations(
+    current_member: Dict[str, Any] = Depends(get_current_member_async),
+    conn: AsyncUnitOfWork = Depends(get_async_uow),
 ) -> List[Dict[str, Any]]:
     """
     我的场地预约列表（会员端）
@@ -273,8 +302,7 @@ def member_reservations(
     - 这里 **不再声明任何查询参数**，避免空字符串/非法值触发 422。
     - 如需筛选，在前端本地做过滤（你现在的 Reservations.vue 就是这样的）。
     """
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+    cursor = await conn.cursor(dictionary=True)
     member_id = current_member["id"]
 
     try:
@@ -285,8 +313,8 @@ def member_reservations(
             WHERE r.member_id = %s
             ORDER BY r.id DESC
         """
-        cursor.execute(sql, (member_id,))
-        rows = cursor.fetchall()
+        await cursor.execute(sql, (member_id,))
+        rows = await cursor.fetchall()
 
         result: List[Dict[str, Any]] = []
         for r in rows:
@@ -328,33 +356,13 @@ def member_reservations(
 
         return result
     finally:
-        cursor.close()
-        conn.close()
+        await cursor.close()
 
 
 # ------- 会员端创建预约 -------
 
-@router.post("/reservations")
-def create_member_reservation(
-    data: Dict[str, Any],
-    current_member: Dict[str, Any] = Depends(get_current_member),
-) -> Dict[str, Any]:
-    """
-    会员端创建场地预约
-    
-    请求体：
-    - court_id: 场地ID
-    - date: 预约日期 (YYYY-MM-DD)
-    - start_time: 开始时间 (HH:MM)
-    - end_time: 结束时间 (HH:MM)
-    - remark: 备注（可选）
-    """
-    from ..services.orders import create_court_order
-    from ..services.discounts import get_member_discount
-    from ..services.cards import get_best_card
-    from datetime import datetime
-    
-    # 验证必填字段
+def _parse_member_slot(data: Dict[str, Any]):
+    """校验请求体中的场地与时段，返回 (court_id, start_dt, end_dt)"""
     required = ["court_id", "date", "start_time", "end_time"]
     for field in required:
         if field not in data:
@@ -378,159 +386,289 @@ def create_member_reservation(
     if end_dt <= datetime.now():
         raise HTTPException(status_code=400, detail="不能预约已经结束的时间段")
     
+    # 预检：进程内区间索引 / 预留映射已能确定冲突时，不开事务直接返回
+    if reservation_index.has_conflict(court_id, start_dt, end_dt):
+        raise HTTPException(status_code=400, detail="该时间段已被预约，请选择其他时间")
+    if has_held_conflict(court_id, start_dt, end_dt):
+        raise HTTPException(status_code=400, detail="该时间段已被其他会员预留，请选择其他时间")
+    
+    return court_id, start_dt, end_dt
+
+
+def _quote_member_reservation(cursor, member_id: int, court_id: int, start_dt: datetime, end_dt: datetime):
+    """按场地价格与会员卡/等级折扣计算金额，返回 (场地名称, 金额)"""
+    try:
+        return quote_member_court(cursor, member_id, court_id, start_dt, end_dt)
+    except CourtNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _settle_member_reservation(
+    cursor,
+    cursor2,
+    *,
+    member_id: int,
+    member_name: str,
+    court_id: int,
+    court_name: str,
+    start_dt: datetime,
+    end_dt: datetime,
+    total_amount: float,
+    remark: Optional[str],
+):
+    """
+    扣款并写入预约、流水、订单与通知（时段已由调用方占用，需外部 commit）
+    返回 (reservation_id, order_info)
+    """
+    from ..services.orders import create_court_order
+    
+    # 1. 创建预约记录
+    cursor2.execute(
+        """
+        INSERT INTO court_reservations
+            (court_id, member_id, start_time, end_time, total_amount, status, remark, source)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        (
+            court_id,
+            member_id,
+            start_dt,
+            end_dt,
+            total_amount,
+            "已预约",
+            remark,
+            "会员端",
+        )
+    )
+    reservation_id = cursor2.lastrowid
+    
+    # 2. 扣除余额并记录流水：一条条件更新完成余额判断与扣减（失败时由调用方回滚预约）
+    try:
+        if total_amount > 0:
+            debit(
+                cursor2,
+                member_id,
+                total_amount,
+                f"场地预约：{court_name} {start_dt.strftime('%Y-%m-%d %H:%M')}",
+                require_active=True,
+            )
+        else:
+            ensure_member(cursor2, member_id)
+    except MemberNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except MemberInactive:
+        raise HTTPException(status_code=400, detail="会员状态异常，无法预约")
+    except WalletError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 3. 生成订单
+    order_info = create_court_order(
+        cursor=cursor,
+        related_id=reservation_id,
+        member_id=member_id,
+        member_name=member_name,
+        total_amount=total_amount,
+        pay_method="会员余额",
+        status="paid",
+        remark=remark,
+        source="会员端",
+    )
+    
+    # 4. 发送通知
+    try:
+        from ..services.notifications import create_notification
+        time_range = f"{start_dt.strftime('%Y-%m-%d %H:%M')} ~ {end_dt.strftime('%H:%M')}"
+        content = f"{court_name} {time_range} 预约成功，金额 ¥{total_amount:.2f}"
+        create_notification(
+            member_id=member_id,
+            title="预约成功",
+            content=content,
+            level="info",
+            cursor=cursor,
+        )
+    except Exception:
+        pass
+    
+    return reservation_id, order_info
+
+
+@router.post("/reservations")
+def create_member_reservation(
+    data: Dict[str, Any],
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """
+    会员端创建场地预约（一步完成：计价、占用时段、扣款）
+    
+    请求体：
+    - court_id: 场地ID
+    - date: 预约日期 (YYYY-MM-DD)
+    - start_time: 开始时间 (HH:MM)
+    - end_time: 结束时间 (HH:MM)
+    - remark: 备注（可选）
+    """
+    court_id, start_dt, end_dt = _parse_member_slot(data)
     member_id = current_member["id"]
-    member_name = current_member.get("name") or ""
     
-    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     cursor2 = conn.cursor()
     
     try:
         conn.start_transaction()
         
-        # 1. 获取场地价格
-        cursor.execute(
-            "SELECT id, name, price_per_hour FROM courts WHERE id = %s",
-            (court_id,)
-        )
-        court = cursor.fetchone()
-        if not court:
-            raise HTTPException(status_code=404, detail="场地不存在")
-        
-        price_per_hour = float(court.get("price_per_hour") or 0)
-        if price_per_hour <= 0:
-            raise HTTPException(status_code=400, detail="场地价格未配置")
-        
-        court_name = court.get("name") or "场地"
+        court_name, total_amount = _quote_member_reservation(cursor, member_id, court_id, start_dt, end_dt)
         
-        # 2. 计算时长和金额
-        duration_hours = (end_dt - start_dt).total_seconds() / 3600.0
-        if duration_hours <= 0:
-            raise HTTPException(status_code=400, detail="预约时长必须大于0")
-        
-        total_amount = round(price_per_hour * duration_hours, 2)
-        
-        # 3. 应用会员折扣
-        card, _ = get_best_card(cursor, member_id)
-        if card and card.get("discount") is not None:
-            card_discount = float(card.get("discount") or 100)
-            if card_discount < 100:
-                total_amount = round(total_amount * card_discount / 100.0, 2)
-        else:
-            discount = get_member_discount(cursor, member_id)
-            if discount < 100:
-                total_amount = round(total_amount * discount / 100.0, 2)
-        
-        # 4. 检查时间段冲突
-        cursor.execute(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM court_reservations
-            WHERE court_id = %s
-              AND status <> '已取消'
-              AND NOT (end_time <= %s OR start_time >= %s)
-            """,
-            (court_id, start_dt, end_dt)
-        )
-        row = cursor.fetchone()
-        if (row.get("cnt") or 0) > 0:
-            raise HTTPException(status_code=400, detail="该时间段已被预约，请选择其他时间")
+        # 锁定该场地当天的位图行并置位（区间索引只做预检，这里以数据库为准）
+        try:
+            claim_court_slots(court_id, start_dt, end_dt, cursor=cursor)
+        except SlotConflict as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 5. 检查会员余额
-        cursor.execute(
-            "SELECT balance, status FROM members WHERE id = %s FOR UPDATE",
-            (member_id,)
+        reservation_id, order_info = _settle_member_reservation(
+            cursor,
+            cursor2,
+            member_id=member_id,
+            member_name=current_member.get("name") or "",
+            court_id=court_id,
+            court_name=court_name,
+            start_dt=start_dt,
+            end_dt=end_dt,
+            total_amount=total_amount,
+            remark=data.get("remark"),
         )
-        member = cursor.fetchone()
-        if not member:
-            raise HTTPException(status_code=404, detail="会员不存在")
         
-        if str(member.get("status") or "正常") != "正常":
-            raise HTTPException(status_code=400, detail="会员状态异常，无法预约")
+        conn.commit()
+        note_reservation_booked(reservation_id, court_id, start_dt, end_dt)
+        return {
+            "id": reservation_id,
+            "order": order_info,
+            "message": "预约成功"
+        }
         
-        balance = float(member.get("balance") or 0)
-        if balance < total_amount:
-            raise HTTPException(
-                status_code=400,
-                detail=f"余额不足，当前余额：{balance:.2f}元，需要：{total_amount:.2f}元"
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"预约失败：{str(e)}")
+    finally:
+        cursor.close()
+        cursor2.close()
+
+
+# ------- 会员端时段预留（先预留、再确认扣款） -------
+
+@router.post("/reservations/holds")
+def create_member_hold(
+    data: Dict[str, Any],
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """
+    预留场地时段：计价并在短事务中占住时段（不锁会员余额），有效期内调用 confirm 完成扣款
+    
+    请求体同创建预约：court_id / date / start_time / end_time / remark
+    """
+    court_id, start_dt, end_dt = _parse_member_slot(data)
+    member_id = current_member["id"]
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        conn.start_transaction()
+        court_name, total_amount = _quote_member_reservation(cursor, member_id, court_id, start_dt, end_dt)
+        try:
+            token, hold = create_hold(
+                member_id=member_id,
+                court_id=court_id,
+                start=start_dt,
+                end=end_dt,
+                total_amount=total_amount,
+                remark=data.get("remark"),
+                cursor=cursor,
             )
+        except (SlotConflict, HoldError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        conn.commit()
+        note_hold_added(token, hold)
+        return {
+            "hold_token": token,
+            "court_id": court_id,
+            "court_name": court_name,
+            "start_time": _to_datetime_str(start_dt),
+            "end_time": _to_datetime_str(end_dt),
+            "amount": total_amount,
+            "expires_at": _to_datetime_str(hold.expires_at),
+        }
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"预留失败：{str(e)}")
+    finally:
+        cursor.close()
+
+
+@router.post("/reservations/holds/{hold_token}/confirm")
+def confirm_member_hold(
+    hold_token: str,
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """确认预留：按预留时的金额扣款并生成预约与订单，成功后删除预留"""
+    member_id = current_member["id"]
+    
+    cursor = conn.cursor(dictionary=True)
+    cursor2 = conn.cursor()
+    
+    try:
+        conn.start_transaction()
+        # 先不加锁读出预留，锁位图行之后再锁预留并复核：与下单、创建预留的加锁顺序一致，避免死锁
+        try:
+            hold = get_hold(hold_token, member_id, cursor=cursor)
+        except HoldError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 6. 创建预约记录
-        cursor2.execute(
-            """
-            INSERT INTO court_reservations
-                (court_id, member_id, start_time, end_time, total_amount, status, remark, source)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                court_id,
-                member_id,
-                start_dt,
-                end_dt,
-                total_amount,
-                "已预约",
-                data.get("remark"),
-                "会员端",
-            )
-        )
-        reservation_id = cursor2.lastrowid
+        court_id = int(hold["court_id"])
+        start_dt, end_dt = hold["start_time"], hold["end_time"]
         
-        # 7. 扣除余额
-        new_balance = round(balance - total_amount, 2)
-        cursor2.execute(
-            "UPDATE members SET balance = %s WHERE id = %s",
-            (new_balance, member_id)
-        )
+        # 时段已由预留占住，这里置位时跳过自己的预留
+        try:
+            claim_court_slots(court_id, start_dt, end_dt, cursor=cursor, hold_token=hold_token)
+            hold = lock_hold(hold_token, member_id, cursor=cursor)
+        except (SlotConflict, HoldError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 8. 记录流水
-        cursor2.execute(
-            """
-            INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
-            VALUES (%s, '消费', %s, %s, %s)
-            """,
-            (
-                member_id,
-                -total_amount,
-                new_balance,
-                f"场地预约：{court_name} {start_dt.strftime('%Y-%m-%d %H:%M')}"
-            )
-        )
+        cursor.execute("SELECT name FROM courts WHERE id = %s", (court_id,))
+        court = cursor.fetchone() or {}
         
-        # 9. 生成订单
-        order_info = create_court_order(
-            cursor=cursor,
-            related_id=reservation_id,
+        reservation_id, order_info = _settle_member_reservation(
+            cursor,
+            cursor2,
             member_id=member_id,
-            member_name=member_name,
-            total_amount=total_amount,
-            pay_method="会员余额",
-            status="paid",
-            remark=data.get("remark"),
-            source="会员端",
+            member_name=current_member.get("name") or "",
+            court_id=court_id,
+            court_name=court.get("name") or "场地",
+            start_dt=start_dt,
+            end_dt=end_dt,
+            total_amount=_to_float(hold["total_amount"]),
+            remark=hold.get("remark"),
         )
+        delete_hold(hold_token, cursor=cursor2)
+        mark_hold_booked(hold_token, cursor=cursor2)
         
         conn.commit()
-        
-        # 10. 发送通知
-        try:
-            from ..services.notifications import create_notification
-            time_range = f"{start_dt.strftime('%Y-%m-%d %H:%M')} ~ {end_dt.strftime('%H:%M')}"
-            content = f"{court_name} {time_range} 预约成功，金额 ¥{total_amount:.2f}"
-            create_notification(
-                member_id=member_id,
-                title="预约成功",
-                content=content,
-                level="info"
-            )
-        except Exception:
-            pass
-        
+        note_hold_removed(hold_token)
+        note_reservation_booked(reservation_id, court_id, start_dt, end_dt)
         return {
             "id": reservation_id,
             "order": order_info,
             "message": "预约成功"
         }
-        
     except HTTPException:
         conn.rollback()
         raise
@@ -540,7 +678,136 @@ def create_member_reservation(
     finally:
         cursor.close()
         cursor2.close()
-        conn.close()
+
+
+@router.delete("/reservations/holds/{hold_token}")
+def release_member_hold(
+    hold_token: str,
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """会员主动释放预留"""
+    cursor = conn.cursor()
+    try:
+        deleted = delete_hold(hold_token, cursor=cursor, member_id=current_member["id"])
+        conn.commit()
+    finally:
+        cursor.close()
+    if not deleted:
+        raise HTTPException(status_code=404, detail="预留不存在或已失效")
+    note_hold_removed(hold_token)
+    # 候补转成的预留被放弃时，轮到下一位候补
+    release_offer(hold_token)
+    return {"message": "预留已释放"}
+
+
+# ------- 会员端批量计价（周视图一次刷新全部时段价格） -------
+
+@router.post("/pricing/quote")
+def member_quote_prices(
+    data: Dict[str, Any],
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """
+    按本人的会员卡/等级折扣批量计价（只计价，不占用时段）
+
+    请求体：{"lines": [{"court_id", "start_time", "end_time"} | {"product_id", "quantity"}, ...]}，
+    返回结构同 POST /pricing/quote
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        return run_quote(cursor, data.get("lines"), current_member["id"])
+    finally:
+        cursor.close()
+
+
+# ------- 会员端满场候补（有人取消时自动转为预留） -------
+
+@router.post("/waitlist")
+def join_member_waitlist(
+    data: Dict[str, Any],
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """
+    登记候补：时段被释放时按登记顺序自动预留并通知，无需反复刷新
+    
+    请求体：court_id 或 court_type（任一同类型场地均可）、date、start_time、end_time（HH:MM）、remark
+    """
+    for field in ("date", "start_time", "end_time"):
+        if field not in data:
+            raise HTTPException(status_code=400, detail=f"缺少字段: {field}")
+    try:
+        start_dt = datetime.strptime(f"{data['date']} {data['start_time']}", "%Y-%m-%d %H:%M")
+        end_dt = datetime.strptime(f"{data['date']} {data['end_time']}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日期时间格式不正确")
+    if end_dt <= start_dt:
+        raise HTTPException(status_code=400, detail="结束时间必须晚于开始时间")
+    if start_dt <= datetime.now():
+        raise HTTPException(status_code=400, detail="只能候补尚未开始的时段")
+    
+    court_id = int(data["court_id"]) if data.get("court_id") not in (None, "") else None
+    if court_id is not None and reservation_index.has_conflict(court_id, start_dt, end_dt) is False \
+            and not has_held_conflict(court_id, start_dt, end_dt):
+        raise HTTPException(status_code=400, detail="该时段当前可预约，请直接预约")
+    
+    cursor = conn.cursor(dictionary=True)
+    try:
+        try:
+            entry_id = join_waitlist(
+                member_id=current_member["id"],
+                court_id=court_id,
+                court_type=data.get("court_type"),
+                start=start_dt,
+                end=end_dt,
+                remark=data.get("remark"),
+                cursor=cursor,
+            )
+        except WaitlistError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        conn.commit()
+        return {"id": entry_id, "message": "已登记候补，时段释放后将自动为您预留"}
+    finally:
+        cursor.close()
+
+
+@router.get("/waitlist")
+def member_waitlist(
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> List[Dict[str, Any]]:
+    """我的候补：status 为 waiting / offered（已预留，待确认）/ booked / expired / cancelled"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        rows = list_member_waitlist(current_member["id"], cursor=cursor)
+    finally:
+        cursor.close()
+    for r in rows:
+        for key in ("start_time", "end_time", "created_at", "offered_at"):
+            if r.get(key) is not None:
+                r[key] = _to_datetime_str(r[key])
+    return rows
+
+
+@router.delete("/waitlist/{entry_id}")
+def cancel_member_waitlist(
+    entry_id: int,
+    current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
+) -> Dict[str, Any]:
+    """取消等待中的候补"""
+    cursor = conn.cursor()
+    try:
+        try:
+            cancel_waitlist(entry_id, current_member["id"], cursor=cursor)
+        except WaitlistError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        conn.commit()
+    finally:
+        cursor.close()
+    return {"message": "候补已取消"}
 
 
 @router.post("/reservations/{reservation_id}/cancel")
@@ -548,6 +815,7 @@ def cancel_member_reservation(
     reservation_id: int,
     data: Dict[str, Any],
     current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     会员端取消预约并退款
@@ -559,7 +827,6 @@ def cancel_member_reservation(
     
     member_id = current_member["id"]
     
-    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     cursor2 = conn.cursor()
     
@@ -630,38 +897,14 @@ def cancel_member_reservation(
             "UPDATE court_reservations SET status = %s WHERE id = %s",
             ("已取消", reservation_id)
         )
-        
-        # 7. 退回余额
-        cursor.execute(
-            "SELECT balance FROM members WHERE id = %s FOR UPDATE",
-            (member_id,)
+        release_court_slots(
+            reservation["court_id"], reservation["start_time"], reservation["end_time"], cursor=cursor2
         )
-        member = cursor.fetchone()
-        if member:
-            balance = float(member.get("balance") or 0)
-            new_balance = balance + refund_amount
-            cursor2.execute(
-                "UPDATE members SET balance = %s WHERE id = %s",
-                (new_balance, member_id)
-            )
-            
-            # 8. 记录流水
-            cursor2.execute(
-                """
-                INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
-                VALUES (%s, '退款', %s, %s, %s)
-                """,
-                (
-                    member_id,
-                    refund_amount,
-                    new_balance,
-                    data.get("remark") or f"取消预约退款：{reservation_id}"
-                )
-            )
         
-        conn.commit()
+        # 7. 退回余额并记录流水
+        credit(cursor2, member_id, refund_amount, data.get("remark") or f"取消预约退款：{reservation_id}")
         
-        # 9. 发送通知
+        # 8. 发送通知
         try:
             from ..services.notifications import create_notification
             court_name = reservation.get("court_name") or "场地"
@@ -676,11 +919,15 @@ def cancel_member_reservation(
                 member_id=member_id,
                 title="预约取消通知",
                 content=content,
-                level="warning"
+                level="warning",
+                cursor=cursor,
             )
         except Exception:
             pass
         
+        conn.commit()
+        note_reservation_released(reservation_id)
+        schedule_promotion(reservation["court_id"], reservation["start_time"], reservation["end_time"])
         return {
             "message": "预约已取消并退款",
             "refund_order": refund_info
@@ -695,7 +942,6 @@ def cancel_member_reservation(
     finally:
         cursor.close()
         cursor2.close()
-        conn.close()
 
 
 # ------- 会员端消息通知列表 -------
@@ -707,12 +953,12 @@ def member_notifications(
         None,
         description="0=未读, 1=已读, 其他/空=全部",
     ),
+    conn: UnitOfWork = Depends(get_uow),
 ) -> List[Dict[str, Any]]:
     """
     会员端消息通知列表：
     GET /api/member/notifications?is_read=0/1
     """
-    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     member_id = current_member["id"]
 
@@ -748,19 +994,18 @@ def member_notifications(
         return result
     finally:
         cursor.close()
-        conn.close()
 
 
 @router.put("/notifications/{notif_id}/read")
 def member_set_notification_read(
     notif_id: int,
     current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     会员端：将一条通知标记为已读
     PUT /api/member/notifications/{id}/read
     """
-    conn = get_db()
     cursor = conn.cursor()
     member_id = current_member["id"]
 
@@ -779,7 +1024,6 @@ def member_set_notification_read(
         return {"success": True}
     finally:
         cursor.close()
-        conn.close()
 
 
 # ------- 会员更新个人资料 -------
@@ -787,6 +1031,7 @@ def member_set_notification_read(
 def update_member_profile(
     data: Dict[str, Any],
     current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     会员更新个人资料
@@ -806,7 +1051,6 @@ def update_member_profile(
     if not phone:
         raise HTTPException(status_code=400, detail="手机号不能为空")
     
-    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -831,15 +1075,17 @@ def update_member_profile(
             """,
             (name, phone, phone, member_id)
         )
-        conn.commit()
-        
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="会员不存在")
+        # token 中的姓名/手机号已过期，回退查库认证
+        revoke_tokens("member", member_id, reason="profile_changed", cursor=cursor)
+        conn.commit()
+        # 丢弃各 worker 缓存的会员身份
+        publish("members", "revocations")
         
         return {"success": True, "message": "资料更新成功"}
     finally:
         cursor.close()
-        conn.close()
 
 
 # ------- 会员修改密码 -------
@@ -847,6 +1093,7 @@ def update_member_profile(
 def change_password(
     data: ChangePasswordRequest,
     current_member: Dict[str, Any] = Depends(get_current_member),
+    conn: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     会员修改登录密码
@@ -865,7 +1112,6 @@ def change_password(
         raise HTTPException(status_code=400, detail="新密码长度至少6位")
     
     member_id = current_member["id"]
-    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     try:
@@ -906,9 +1152,11 @@ def change_password(
             """,
             (new_password_hash, member_id),
         )
+        # 5. 已签发的 token 全部失效，需要用新密码重新登录
+        revoke_tokens("member", member_id, force_logout=True, reason="password_changed", cursor=cursor)
         conn.commit()
+        publish("revocations")
         
         return {"success": True, "message": "密码修改成功"}
     finally:
         cursor.close()
-        conn.close()
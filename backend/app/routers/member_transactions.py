@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Optional, List
 from datetime import datetime
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
+from ..services.wallet import InsufficientBalance, MemberNotFound, credit, debit
 
 router = APIRouter(prefix="/member-transactions", tags=["Member Transactions"])
 
@@ -20,12 +21,12 @@ def list_transactions(
     type: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取会员收支记录列表
     GET /api/member-transactions?member_id=1&type=充值&start_date=2025-01-01&end_date=2025-01-31
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -71,11 +72,10 @@ def list_transactions(
         return rows
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("", status_code=201)
-def create_transaction(data: dict):
+def create_transaction(data: dict, db: UnitOfWork = Depends(get_uow)):
     """
     新增一条会员收支记录（充值 / 扣费 / 消费）
     POST /api/member-transactions
@@ -109,54 +109,29 @@ def create_transaction(data: dict):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="金额必须大于 0")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
-    cursor2 = db.cursor()
     try:
-        # 1) 查询当前余额
-        cursor.execute("SELECT balance FROM members WHERE id = %s", (member_id,))
-        row = cursor.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="会员不存在")
-
-        old_balance = float(row["balance"] or 0)
-
-        # 2) 计算新余额
-        if tx_type == "充值":
-            new_balance = old_balance + amount
-        else:  # 扣费 / 消费
-            if old_balance < amount:
-                raise HTTPException(status_code=400, detail="余额不足，无法扣费/消费")
-            new_balance = old_balance - amount
-
-        # 3) 更新会员余额
-        cursor2.execute(
-            "UPDATE members SET balance = %s WHERE id = %s",
-            (new_balance, member_id),
-        )
-
-        # 4) 写入收支记录
-        insert_sql = """
-        INSERT INTO member_transactions
-            (member_id, type, amount, balance_after, remark)
-        VALUES
-            (%s,        %s,   %s,     %s,            %s)
-        """
-        cursor2.execute(
-            insert_sql,
-            (member_id, tx_type, amount, new_balance, remark),
-        )
+        # 余额判断与变更是一条条件更新，流水随后写入；手工扣费/消费的流水金额沿用正数记录
+        try:
+            if tx_type == "充值":
+                result = credit(cursor, member_id, amount, remark, tx_type=tx_type)
+                if result is None:
+                    raise MemberNotFound()
+            else:  # 扣费 / 消费
+                result = debit(cursor, member_id, amount, remark, tx_type=tx_type, negative_amount=False)
+        except MemberNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except InsufficientBalance:
+            raise HTTPException(status_code=400, detail="余额不足，无法扣费/消费")
 
         db.commit()
 
         return {
-            "id": cursor2.lastrowid,
+            "id": result.transaction_id,
             "member_id": member_id,
             "type": tx_type,
             "amount": amount,
-            "balance_after": new_balance,
+            "balance_after": result.balance,
         }
     finally:
         cursor.close()
-        cursor2.close()
-        db.close()
@@ -3,9 +3,13 @@ from typing import List, Dict, Any
 
 from fastapi import APIRouter, Depends, HTTPException
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_super_admin, require_action
 from ..security import get_password_hash
+from ..services.cache_bus import publish
+from ..services.token_revocation import revoke_tokens
+from ..services.court_slots import release_many
+from ..services.reservation_index import note_reservations_changed
 from ..services.member_config import (
     load_member_config,
     normalize_level,
@@ -62,6 +66,7 @@ def list_members(
     page_size: int = 20,
     keyword: str = None,
     status: str = None,
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取会员列表（分页）
@@ -85,7 +90,6 @@ def list_members(
     
     offset = (page - 1) * page_size
     
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 构建 WHERE 条件
@@ -127,11 +131,10 @@ def list_members(
         return {"total": total, "items": items}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("", status_code=201)
-def create_member(data: Dict[str, Any]):
+def create_member(data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """
     新增会员：
     - 姓名、手机号必填
@@ -164,7 +167,6 @@ def create_member(data: Dict[str, Any]):
     if status_val not in ("正常", "禁用", "注销"):
         raise HTTPException(status_code=400, detail="状态只能是 正常 / 禁用 / 注销")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         config = load_member_config(cursor)
@@ -267,13 +269,11 @@ def create_member(data: Dict[str, Any]):
         return normalize_member(row, config)
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{member_id}")
-def update_member(member_id: int, data: Dict[str, Any]):
+def update_member(member_id: int, data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """编辑会员信息（不强制会员等级）。"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         config = load_member_config(cursor)
@@ -319,7 +319,11 @@ def update_member(member_id: int, data: Dict[str, Any]):
             """,
             (name, new_phone, gender, birthday, level, status_val, remark, member_id),
         )
+        # token 中的资料/状态/等级已过期，回退查库认证
+        revoke_tokens("member", member_id, reason="profile_changed", cursor=cursor)
         db.commit()
+        # 状态/等级可能变化，丢弃各 worker 缓存的会员身份
+        publish("members", "revocations")
 
         cursor.execute(
             """
@@ -343,16 +347,14 @@ def update_member(member_id: int, data: Dict[str, Any]):
         return normalize_member(row, config)
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{member_id}/status")
-def update_member_status(member_id: int, data: Dict[str, Any]):
+def update_member_status(member_id: int, data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     new_status = data.get("status")
     if new_status not in ("正常", "禁用", "注销"):
         raise HTTPException(status_code=400, detail="状态只能是 正常 / 禁用 / 注销")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id FROM members WHERE id=%s", (member_id,))
@@ -364,15 +366,16 @@ def update_member_status(member_id: int, data: Dict[str, Any]):
             "UPDATE members SET status=%s WHERE id=%s",
             (new_status, member_id),
         )
+        revoke_tokens("member", member_id, reason="status_changed", cursor=cursor)
         db.commit()
+        publish("members", "revocations")
         return {"message": "状态已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{member_id}")
-def delete_member(member_id: int, current_user=Depends(require_action("member.delete"))):
+def delete_member(member_id: int, current_user=Depends(require_action("member.delete")), db: UnitOfWork = Depends(get_uow)):
     """
     删除会员及其所有关联数据
     
@@ -415,7 +418,6 @@ def delete_member(member_id: int, current_user=Depends(require_action("member.de
         此操作不可逆！删除后无法恢复会员的任何数据。
         建议在生产环境使用软删除（修改状态为"注销"）而不是物理删除。
     """
-    db = get_db()
     cursor = db.cursor()
     try:
         db.start_transaction()
@@ -435,13 +437,23 @@ def delete_member(member_id: int, current_user=Depends(require_action("member.de
         cursor.execute("DELETE FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE member_id=%s)", (member_id,))
         cursor.execute("DELETE FROM orders WHERE member_id=%s", (member_id,))
         
+        # 记下未结束且仍占用时段的预约，删除后重建对应场地日期的占用位图
+        cursor.execute(
+            "SELECT court_id, start_time, end_time FROM court_reservations WHERE member_id=%s AND status <> '已取消' AND end_time > NOW()",
+            (member_id,),
+        )
+        occupied = cursor.fetchall() or []
         cursor.execute("DELETE FROM court_reservations WHERE member_id=%s", (member_id,))
+        release_many(occupied, cursor=cursor)
         cursor.execute("DELETE FROM notifications WHERE member_id=%s", (member_id,))
         
         # 最后删除会员本身
         cursor.execute("DELETE FROM members WHERE id=%s", (member_id,))
+        revoke_tokens("member", member_id, force_logout=True, reason="account_deleted", cursor=cursor)
         
         db.commit()
+        publish("members", "revocations")
+        note_reservations_changed()
         return {"message": "会员及其关联数据已删除"}
     except HTTPException:
         db.rollback()
@@ -454,7 +466,6 @@ def delete_member(member_id: int, current_user=Depends(require_action("member.de
         raise HTTPException(status_code=500, detail="删除失败，请联系管理员")
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{member_id}/login-password")
@@ -462,6 +473,7 @@ def set_member_login_password(
     member_id: int,
     data: dict,
     current_user=Depends(require_super_admin),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     设置会员登录密码。
@@ -473,7 +485,6 @@ def set_member_login_password(
 
     pwd_hash = get_password_hash(password)
 
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute(
@@ -482,16 +493,19 @@ def set_member_login_password(
         )
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="会员不存在")
+        # 密码变更：强制该会员已登录的设备下线
+        revoke_tokens("member", member_id, force_logout=True, reason="password_set", cursor=cursor)
         db.commit()
+        publish("revocations")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("/{member_id}/reset-password")
 def admin_reset_member_password(
     member_id: int,
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     管理员重置会员登录密码：
@@ -501,7 +515,6 @@ def admin_reset_member_password(
     # 安全：密码列白名单，防止 SQL 注入
     ALLOWED_PASSWORD_COLUMNS = {"login_password_hash", "password"}
     
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 1. 确认会员存在
@@ -533,7 +546,9 @@ def admin_reset_member_password(
         # 使用安全的参数化查询（列名已经通过白名单验证）
         sql = f"UPDATE members SET {password_column} = %s WHERE id = %s"
         cursor.execute(sql, (new_hash, member_id))
+        revoke_tokens("member", member_id, force_logout=True, reason="password_reset", cursor=cursor)
         db.commit()
+        publish("revocations")
 
         return {
             "message": "密码已重置为默认值",
@@ -542,3 +557,25 @@ def admin_reset_member_password(
     finally:
         cursor.close()
         db.close()  # 确保连接正确关闭/归还到连接池
+
+
+@router.post("/{member_id}/force-logout")
+def force_logout_member(
+    member_id: int,
+    current_user=Depends(require_super_admin),
+    db: UnitOfWork = Depends(get_uow),
+):
+    """
+    强制会员下线：此前签发的所有会员端 token 立即失效
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT id FROM members WHERE id = %s", (member_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="会员不存在")
+        revoke_tokens("member", member_id, force_logout=True, reason="force_logout", cursor=cursor)
+        db.commit()
+        publish("revocations")
+        return {"success": True}
+    finally:
+        cursor.close()
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from typing import Optional
 
+from ..database import UnitOfWork, get_uow
 from ..deps import get_current_user
 from ..services.notifications import (
     list_notifications,
@@ -20,26 +21,33 @@ def get_my_notifications(
     level: Optional[str] = None,
     keyword: Optional[str] = None,
     current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取当前登录用户的通知列表
     GET /api/notifications
     """
     uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
-    return list_notifications(
-        user_id=uid,
-        is_read=is_read if is_read in (0, 1) else None,
-        level=level,
-        keyword=keyword,
-        page=page,
-        page_size=page_size,
-    )
+    cursor = db.cursor(dictionary=True)
+    try:
+        return list_notifications(
+            user_id=uid,
+            is_read=is_read if is_read in (0, 1) else None,
+            level=level,
+            keyword=keyword,
+            page=page,
+            page_size=page_size,
+            cursor=cursor,
+        )
+    finally:
+        cursor.close()
 
 
 @router.post("")
 def create_manual_notification(
     data: dict,
     current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     手工创建一条通知（只允许 admin 用于测试）
@@ -57,37 +65,55 @@ def create_manual_notification(
     if not target_user_id or not title or not content:
         raise HTTPException(status_code=400, detail="user_id / title / content 不能为空")
 
-    nid = create_notification(
-        user_id=int(target_user_id),
-        title=title,
-        content=content,
-        level=level,
-    )
-    return {"id": nid}
+    cursor = db.cursor(dictionary=True)
+    try:
+        nid = create_notification(
+            user_id=int(target_user_id),
+            title=title,
+            content=content,
+            level=level,
+            cursor=cursor,
+        )
+        db.commit()
+        return {"id": nid}
+    finally:
+        cursor.close()
 
 
 @router.put("/{notif_id}/read")
 def set_notification_read(
     notif_id: int,
     current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     将一条通知标记为已读
     """
     uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
-    ok = mark_notification_read(user_id=uid, notif_id=notif_id)
-    if not ok:
-        raise HTTPException(status_code=404, detail="通知不存在")
-    return {"success": True}
+    cursor = db.cursor()
+    try:
+        ok = mark_notification_read(user_id=uid, notif_id=notif_id, cursor=cursor)
+        if not ok:
+            raise HTTPException(status_code=404, detail="通知不存在")
+        db.commit()
+        return {"success": True}
+    finally:
+        cursor.close()
 
 
 @router.put("/read-all")
 def set_all_notification_read(
     current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     将当前用户所有通知标记为已读
     """
     uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
-    count = mark_all_notifications_read(user_id=uid)
-    return {"success": True, "count": count}
+    cursor = db.cursor()
+    try:
+        count = mark_all_notifications_read(user_id=uid, cursor=cursor)
+        db.commit()
+        return {"success": True, "count": count}
+    finally:
+        cursor.close()
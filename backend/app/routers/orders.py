@@ -3,7 +3,7 @@ from typing import Dict, Any, List
 
 from fastapi import APIRouter, Depends, Query, HTTPException
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
 from ..services.orders import create_refund_order
 from ..services.audit import write_operation_log
@@ -24,12 +24,12 @@ def list_orders(
     date_from: str | None = None,  # 'YYYY-MM-DD'
     date_to: str | None = None,    # 'YYYY-MM-DD'
     _current_user=Depends(require_action("order.view")),
+    db: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     订单列表，支持按类型 / 状态 / 会员名 / 日期过滤 + 分页
     返回 { total, items }
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         where: List[str] = []
@@ -119,7 +119,6 @@ def list_orders(
         return {"total": total, "items": normalized}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("/{order_id}/refund")
@@ -128,13 +127,13 @@ def refund_order(
     amount: float | None = None,
     remark: str | None = None,
     current_user=Depends(require_action("order.refund")),
+    db: UnitOfWork = Depends(get_uow),
 ) -> Dict[str, Any]:
     """
     后台指定订单手动退款（生成负向退款订单，原订单标记 refunded）
     - amount 缺省时默认取 pay_amount/total_amount
     - 仅支持未退款的订单
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT * FROM orders WHERE id = %s", (order_id,))
@@ -195,12 +194,14 @@ def refund_order(
                 target_desc=order.get("order_no"),
                 detail={"refund_amount": refund_amount, "remark": remark},
                 ip=None,
+                cursor=cursor,
             )
             try:
                 create_admin_notifications(
                     title="订单退款",
                     content=f"订单 {order.get('order_no')} 已手工退款 ¥{refund_amount}",
                     level="warning",
+                    cursor=cursor,
                 )
             except Exception:
                 pass
@@ -211,4 +212,3 @@ def refund_order(
         return {"code": 200, "msg": "退款成功", "data": refund_info}
     finally:
         cursor.close()
-        db.close()
@@ -0,0 +1,121 @@
+# app/routers/pricing.py
+"""
+批量计价接口
+
+会员端周视图、后台下单弹窗以前逐个时段请求金额，每次都走一遍完整的计价路径。
+这里一次接收多行 (场地, 开始, 结束) 或 (商品, 数量)，在统一计价引擎中用缓存的价格表
+与一次会员折扣解析算出全部金额，返回逐行金额与合计。
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..config import settings
+from ..database import UnitOfWork, get_uow
+from ..deps import get_current_user
+from ..services.pricing import CourtNotFound, PricingError, ProductNotFound, quote
+
+router = APIRouter(prefix="/pricing", tags=["Pricing"])
+
+
+def _parse_dt(val: Any, field_name: str, index: int) -> datetime:
+    """解析 '2025-11-15 09:00:00' 或 ISO 形式"""
+    if not val:
+        raise HTTPException(status_code=400, detail=f"第 {index + 1} 行缺少字段: {field_name}")
+    try:
+        return datetime.fromisoformat(str(val).replace(" ", "T"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"第 {index + 1} 行 {field_name} 格式不正确，需为 YYYY-MM-DD HH:MM:SS")
+
+
+def parse_quote_lines(lines: Any) -> List[Dict[str, Any]]:
+    """
+    校验并转换请求中的明细：
+    场地 {"court_id", "start_time", "end_time"}，商品 {"product_id", "quantity"}
+    """
+    if not isinstance(lines, list) or not lines:
+        raise HTTPException(status_code=400, detail="lines 不能为空")
+    if len(lines) > settings.PRICING_QUOTE_MAX_LINES:
+        raise HTTPException(status_code=400, detail=f"单次最多计价 {settings.PRICING_QUOTE_MAX_LINES} 行")
+
+    items: List[Dict[str, Any]] = []
+    for i, line in enumerate(lines):
+        if not isinstance(line, dict):
+            raise HTTPException(status_code=400, detail=f"第 {i + 1} 行格式不正确")
+        try:
+            if line.get("court_id") not in (None, ""):
+                items.append({
+                    "court_id": int(line["court_id"]),
+                    "start": _parse_dt(line.get("start_time"), "start_time", i),
+                    "end": _parse_dt(line.get("end_time"), "end_time", i),
+                })
+            elif line.get("product_id") not in (None, ""):
+                items.append({"product_id": int(line["product_id"]), "quantity": line.get("quantity", 1)})
+            else:
+                raise HTTPException(status_code=400, detail=f"第 {i + 1} 行需包含 court_id 或 product_id")
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"第 {i + 1} 行 id 格式不正确")
+    return items
+
+
+def run_quote(cursor, lines: Any, member_id: Optional[int]) -> Dict[str, Any]:
+    """计价并整理为接口返回结构（传入的 cursor 需为 dictionary 游标）"""
+    items = parse_quote_lines(lines)
+    try:
+        result = quote(items, member_id, cursor=cursor)
+    except (CourtNotFound, ProductNotFound) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    out_lines = []
+    for line in result["lines"]:
+        item = {
+            "kind": line["kind"],
+            "id": line["id"],
+            "name": line["name"],
+            "unit_price": line["unit_price"],
+            "quantity": line["quantity"],
+            "base_amount": line["base_amount"],
+            "amount": line["amount"],
+        }
+        if line["kind"] == "court":
+            item["start_time"] = line["start"].strftime("%Y-%m-%d %H:%M:%S")
+            item["end_time"] = line["end"].strftime("%Y-%m-%d %H:%M:%S")
+        out_lines.append(item)
+
+    card = result["card"]
+    return {
+        "member_id": result["member_id"],
+        "discount": result["discount"],
+        "card_id": card.get("id") if card else None,
+        "lines": out_lines,
+        "base_total": round(sum(line["base_amount"] for line in result["lines"]), 2),
+        "total_amount": result["total_amount"],
+    }
+
+
+@router.post("/quote")
+def quote_prices(
+    data: Dict[str, Any],
+    _current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
+):
+    """
+    后台批量计价（只计价，不占用时段、不下单）
+
+    请求体：{"member_id": 可选, "lines": [{"court_id", "start_time", "end_time"} | {"product_id", "quantity"}, ...]}
+    返回逐行的原价 base_amount 与折后金额 amount，以及合计 total_amount；会员折扣只解析一次
+    """
+    member_id = data.get("member_id")
+    try:
+        member_id = int(member_id) if member_id not in (None, "") else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="member_id 格式不正确")
+
+    cursor = db.cursor(dictionary=True)
+    try:
+        return run_quote(cursor, data.get("lines"), member_id)
+    finally:
+        cursor.close()
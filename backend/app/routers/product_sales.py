@@ -4,13 +4,14 @@ from typing import List, Dict, Any
 
 from fastapi import APIRouter, HTTPException, Depends, Request
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import get_current_user
 from ..services.orders import create_product_order, create_refund_order
 from ..services.audit import write_operation_log
 from ..services.notifications import create_notification, create_admin_notifications
-from ..services.discounts import get_member_discount
-from ..services.cards import get_best_card, consume_card_times
+from ..services.cards import consume_card_times
+from ..services.pricing import PricingError, quote
+from ..services.wallet import InsufficientBalance, MemberNotFound, WalletError, credit, debit, ensure_member
 
 router = APIRouter(prefix="/product-sales", tags=["Product Sales"])
 
@@ -22,9 +23,8 @@ def _to_str(dt):
 
 
 @router.get("")
-def list_sales():
+def list_sales(db: UnitOfWork = Depends(get_uow)):
     """获取商品售卖记录列表"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -53,11 +53,10 @@ def list_sales():
         return rows
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("", status_code=201)
-def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get_current_user)):
+def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get_current_user), db: UnitOfWork = Depends(get_uow)):
     """
     新增商品售卖：扣库存、会员余额/流水、创建订单、操作日志、通知
     body: { product_id, quantity, member_id?, pay_method(现金/会员余额), remark? }
@@ -83,7 +82,6 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
     if pay_method not in ("现金", "会员余额"):
         raise HTTPException(status_code=400, detail="非法的支付方式")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -101,62 +99,30 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
         if stock < quantity:
             raise HTTPException(status_code=400, detail="库存不足")
 
-        unit_price = float(product["price"])
-        total_price = round(unit_price * quantity, 2)
-
-        # 应用会员折扣（会员卡折扣或等级折扣）
+        # 计价（会员卡折扣或等级折扣）：价格表与等级折扣取自统一计价引擎的缓存
         try:
-            if member_id:
-                # 优先使用会员卡折扣
-                card, _ = get_best_card(cursor, member_id)
-                if card and card.get("discount") is not None:
-                    try:
-                        card_discount = float(card.get("discount") or 100)
-                    except Exception:
-                        card_discount = 100.0
-                    if card_discount < 100:
-                        total_price = round(total_price * card_discount / 100.0, 2)
-                else:
-                    # 没有会员卡折扣，使用会员等级折扣
-                    discount = get_member_discount(cursor, member_id)
-                    if discount < 100:
-                        total_price = round(total_price * discount / 100.0, 2)
-        except Exception:
-            pass
+            line = quote(
+                [{"product_id": product_id, "quantity": quantity}],
+                int(member_id) if member_id else None,
+                cursor=cursor,
+            )["lines"][0]
+        except PricingError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        unit_price = line["unit_price"]
+        total_price = line["amount"]
 
         member_name = None
         if member_id is not None:
             member_id = int(member_id)
-            cursor.execute(
-                "SELECT id, name, balance, status FROM members WHERE id = %s FOR UPDATE",
-                (member_id,),
-            )
-            member = cursor.fetchone()
-            if not member:
-                raise HTTPException(status_code=404, detail="会员不存在")
-            member_name = member.get("name")
-
-            if str(member.get("status") or "正常") != "正常":
-                raise HTTPException(status_code=400, detail="会员状态异常，无法使用余额支付")
-
-            if pay_method == "会员余额":
-                balance = float(member.get("balance") or 0.0)
-                if balance < total_price:
-                    raise HTTPException(status_code=400, detail="会员余额不足")
-                new_balance = round(balance - total_price, 2)
-                cursor2.execute(
-                    "UPDATE members SET balance = %s WHERE id = %s",
-                    (new_balance, member_id),
-                )
-                mt_sql = """
-                INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
-                VALUES (%s, '消费', %s, %s, %s)
-                """
-                mt_remark = remark or f"商品消费：{product['name']} x {quantity}"
-                cursor2.execute(mt_sql, (member_id, -total_price, new_balance, mt_remark))
-        else:
-            if pay_method == "会员余额":
-                raise HTTPException(status_code=400, detail="使用会员余额支付时必须选择会员")
+            # 只校验会员（不加锁），余额在写入销售记录之后用一条条件更新扣除
+            try:
+                member_name = ensure_member(cursor, member_id)["name"]
+            except MemberNotFound as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            except WalletError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        elif pay_method == "会员余额":
+            raise HTTPException(status_code=400, detail="使用会员余额支付时必须选择会员")
 
         new_stock = stock - quantity
         cursor2.execute("UPDATE products SET stock = %s WHERE id = %s", (new_stock, product_id))
@@ -173,6 +139,14 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
         )
         sale_id = cursor2.lastrowid
 
+        if member_id is not None and pay_method == "会员余额" and total_price > 0:
+            try:
+                debit(cursor2, member_id, total_price, remark or f"商品消费：{product['name']} x {quantity}")
+            except InsufficientBalance:
+                raise HTTPException(status_code=400, detail="会员余额不足")
+            except WalletError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
         pay_method_code = "cash" if pay_method == "现金" else "member_balance"
         order_items = [
             {
@@ -184,6 +158,7 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
             }
         ]
         order_result = create_product_order(
+            cursor=cursor,
             member_id=member_id,
             member_name=member_name,
             items=order_items,
@@ -214,6 +189,7 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
                     "order_no": order_result.get("order_no"),
                 },
                 ip=request.client.host if request.client else None,
+                cursor=cursor,
             )
         except Exception:
             pass
@@ -224,11 +200,13 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
                     member_id=member_id,
                     title="商品购买成功",
                     content=f"已购买 {product['name']} x {quantity}，金额：¥{total_price}",
+                    cursor=cursor,
                 )
             create_admin_notifications(
                 title="商品售卖",
                 content=f"{member_name or '散客'} 购买 {product['name']} x {quantity}，金额 ¥{total_price}",
                 level="info",
+                cursor=cursor,
             )
         except Exception:
             pass
@@ -244,13 +222,11 @@ def create_sale(data: Dict[str, Any], request: Request, current_user=Depends(get
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
 
 
 @router.post("/{sale_id}/refund")
-def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_current_user)):
+def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_current_user), db: UnitOfWork = Depends(get_uow)):
     """商品售卖退款：生成退款订单，返还会员余额（如有），记录操作日志与通知"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -264,11 +240,10 @@ def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_cur
         member_id = sale.get("member_id")
         member_name = None
         if member_id:
-            cursor.execute("SELECT id, name, balance FROM members WHERE id = %s FOR UPDATE", (member_id,))
-            mrow = cursor.fetchone()
-            if not mrow:
-                raise HTTPException(status_code=404, detail="会员不存在")
-            member_name = mrow.get("name") if isinstance(mrow, dict) else None
+            try:
+                member_name = ensure_member(cursor, member_id, require_active=False)["name"]
+            except MemberNotFound as e:
+                raise HTTPException(status_code=404, detail=str(e))
 
         cursor.execute(
             "SELECT * FROM orders WHERE related_id = %s AND order_type = 'goods' ORDER BY id DESC LIMIT 1",
@@ -314,19 +289,8 @@ def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_cur
             params.append(order["id"])
             cursor.execute(sql, tuple(params))
 
-        if member_id:
-            balance = float(mrow["balance"] if isinstance(mrow, dict) else mrow[0] or 0)
-            new_balance = balance + refund_amount
-            cursor2.execute(
-                "UPDATE members SET balance = %s WHERE id = %s",
-                (new_balance, member_id),
-            )
-            mt_sql = """
-            INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
-            VALUES (%s, '退款', %s, %s, %s)
-            """
-            mt_remark = data.get("remark") or f"商品售卖退款：{sale.get('product_id')}"
-            cursor2.execute(mt_sql, (member_id, refund_amount, new_balance, mt_remark))
+        if member_id and refund_amount > 0:
+            credit(cursor2, member_id, refund_amount, data.get("remark") or f"商品售卖退款：{sale.get('product_id')}")
 
         try:
             uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
@@ -340,6 +304,7 @@ def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_cur
                 target_desc=sale.get("product_id"),
                 detail={"refund_amount": refund_amount, "order_id": order["id"], "order_no": order.get("order_no")},
                 ip=None,
+                cursor=cursor,
             )
             try:
                 # 给会员发通知
@@ -352,6 +317,7 @@ def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_cur
                         title="商品退款成功",
                         content=f"{product_name} 已退款 ¥{refund_amount:.2f}，金额已退回账户余额",
                         level="info",
+                        cursor=cursor,
                     )
                 
                 # 给管理员发通知
@@ -359,6 +325,7 @@ def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_cur
                     title="商品售卖退款",
                     content=f"订单 {order.get('order_no')} 已退款 ¥{refund_amount}",
                     level="warning",
+                    cursor=cursor,
                 )
             except Exception:
                 pass
@@ -373,4 +340,3 @@ def refund_sale(sale_id: int, data: Dict[str, Any], current_user=Depends(get_cur
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from typing import Optional, List
 from datetime import datetime
 
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
+from ..services.cache_bus import publish
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
@@ -17,12 +18,12 @@ def _to_str(dt):
 def list_products(
     keyword: Optional[str] = None,
     status: Optional[str] = None,
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取商品列表
     GET /api/products?keyword=水&status=上架
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -52,11 +53,10 @@ def list_products(
         return rows
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("", status_code=201)
-def create_product(data: dict):
+def create_product(data: dict, db: UnitOfWork = Depends(get_uow)):
     """
     新增商品
     body: { name, category?, price, stock, remark? }
@@ -87,7 +87,6 @@ def create_product(data: dict):
     if stock < 0:
         raise HTTPException(status_code=400, detail="库存不能为负数")
 
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -96,14 +95,14 @@ def create_product(data: dict):
         """
         cursor.execute(sql, (name, category, price, stock, remark))
         db.commit()
+        publish("prices")
         return {"id": cursor.lastrowid}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{product_id}")
-def update_product(product_id: int, data: dict):
+def update_product(product_id: int, data: dict, db: UnitOfWork = Depends(get_uow)):
     """
     编辑商品信息
     body: { name, category?, price, stock, remark? }
@@ -134,7 +133,6 @@ def update_product(product_id: int, data: dict):
     if stock < 0:
         raise HTTPException(status_code=400, detail="库存不能为负数")
 
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -147,14 +145,14 @@ def update_product(product_id: int, data: dict):
             raise HTTPException(status_code=404, detail="商品不存在")
 
         db.commit()
+        publish("prices")
         return {"message": "ok"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{product_id}/status")
-def update_product_status(product_id: int, data: dict):
+def update_product_status(product_id: int, data: dict, db: UnitOfWork = Depends(get_uow)):
     """
     上下架
     body: { status }  status: '上架' | '下架'
@@ -163,7 +161,6 @@ def update_product_status(product_id: int, data: dict):
     if status not in ("上架", "下架"):
         raise HTTPException(status_code=400, detail="非法状态")
 
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute(
@@ -177,22 +174,20 @@ def update_product_status(product_id: int, data: dict):
         return {"message": "ok"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{product_id}")
-def delete_product(product_id: int):
+def delete_product(product_id: int, db: UnitOfWork = Depends(get_uow)):
     """
     删除商品（注意：如果已经有销售记录，真实项目里一般不允许直接删，这里先简单处理）
     """
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="商品不存在")
         db.commit()
+        publish("prices")
         return {"message": "deleted"}
     finally:
         cursor.close()
-        db.close()
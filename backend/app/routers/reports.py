@@ -1,9 +1,10 @@
 from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from ..database import get_db
+from ..async_database import AsyncUnitOfWork, get_async_uow
+from ..database import UnitOfWork, get_uow
 
 router = APIRouter(prefix="/reports", tags=["Reports"])
 
@@ -23,16 +24,15 @@ def _safe_int(val: Any) -> int:
 
 
 @router.get("/overview")
-def get_overview():
+async def get_overview(db: AsyncUnitOfWork = Depends(get_async_uow)):
     """
     数据总览：今日/本月预约数、收入（含退款扣减）、会员数与余额总额。查询异常时返回 0，避免 500。
     """
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
     try:
         # 场地预约数
         try:
-            cursor.execute(
+            await cursor.execute(
                 """
                 SELECT
                   IFNULL(SUM(CASE WHEN DATE(start_time) = CURDATE() THEN 1 ELSE 0 END), 0) AS today_cnt,
@@ -40,7 +40,7 @@ def get_overview():
                 FROM court_reservations
                 """
             )
-            row = cursor.fetchone() or {}
+            row = await cursor.fetchone() or {}
             today_reservations = _safe_int(row.get("today_cnt"))
             month_reservations = _safe_int(row.get("month_cnt"))
         except Exception:
@@ -49,8 +49,8 @@ def get_overview():
 
         # 会员数量 & 余额总额
         try:
-            cursor.execute("SELECT COUNT(*) AS member_count, IFNULL(SUM(balance), 0) AS balance_total FROM members")
-            mrow = cursor.fetchone() or {}
+            await cursor.execute("SELECT COUNT(*) AS member_count, IFNULL(SUM(balance), 0) AS balance_total FROM members")
+            mrow = await cursor.fetchone() or {}
             member_count = _safe_int(mrow.get("member_count"))
             member_balance = _safe_float(mrow.get("balance_total"))
         except Exception:
@@ -59,7 +59,7 @@ def get_overview():
 
         # 收入（court/goods/course/refund），退款记为负数
         try:
-            cursor.execute(
+            await cursor.execute(
                 """
                 SELECT
                   IFNULL(SUM(CASE WHEN DATE(created_at) = CURDATE() THEN amount ELSE 0 END), 0) AS today_income,
@@ -75,7 +75,7 @@ def get_overview():
                 ) t
                 """
             )
-            irow = cursor.fetchone() or {}
+            irow = await cursor.fetchone() or {}
             today_income = _safe_float(irow.get("today_income"))
             month_income = _safe_float(irow.get("month_income"))
         except Exception:
@@ -91,12 +91,11 @@ def get_overview():
             "member_balance": round(member_balance, 2),
         }
     finally:
-        cursor.close()
-        db.close()
+        await cursor.close()
 
 
 @router.get("/revenue-daily")
-def revenue_daily(days: int = 7):
+def revenue_daily(days: int = 7, db: UnitOfWork = Depends(get_uow)):
     """
     近 N 天收入（场地预约 + 商品售卖 + 培训报名），退款记为负数。
     来源：orders.order_type in (court, goods, course, refund)
@@ -109,7 +108,6 @@ def revenue_daily(days: int = 7):
     end_date = date.today()
     start_date = end_date - timedelta(days=days - 1)
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -170,15 +168,13 @@ def revenue_daily(days: int = 7):
         return result
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/training-income-summary")
-def training_income_summary():
+def training_income_summary(db: UnitOfWork = Depends(get_uow)):
     """
     培训收入汇总：今日/本月/累计收入及报名数
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -210,18 +206,16 @@ def training_income_summary():
         }
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/training-income-daily")
-def training_income_daily(days: int = 30):
+def training_income_daily(days: int = 30, db: UnitOfWork = Depends(get_uow)):
     """
     培训收入按日统计，默认 30 天，退款退课不计入
     """
     if days <= 0 or days > 365:
         days = 30
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -257,7 +251,6 @@ def training_income_daily(days: int = 30):
         return {"days": day_list, "income": income_list}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/coach-workload")
@@ -265,11 +258,11 @@ def coach_workload(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     coach: Optional[str] = None,
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     教练工作量：课程数、报名学员数、考勤次数、出勤次数
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -315,4 +308,3 @@ def coach_workload(
         return result
     finally:
         cursor.close()
-        db.close()
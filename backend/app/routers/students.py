@@ -1,7 +1,7 @@
 # backend/app/routers/students.py
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Dict, Any, Optional
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
 
 router = APIRouter(prefix="/training/students", tags=["Students"])
@@ -14,13 +14,13 @@ def list_students(
     keyword: Optional[str] = None,
     status: Optional[str] = None,
     current_user=Depends(require_action("student.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取学员列表
     - 支持关键字搜索（姓名、电话、监护人）
     - 支持按状态筛选
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         conditions = []
@@ -60,16 +60,15 @@ def list_students(
         return {"total": total, "items": items, "page": page, "page_size": page_size}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/{student_id}")
 def get_student(
     student_id: int,
     current_user=Depends(require_action("student.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """获取学员详情（包含报名记录）"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT * FROM students WHERE id = %s", (student_id,))
@@ -94,13 +93,13 @@ def get_student(
         return student
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
 def create_student(
     data: Dict[str, Any],
     current_user=Depends(require_action("student.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """创建学员"""
     required = ["name"]
@@ -108,7 +107,6 @@ def create_student(
         if field not in data or not data[field]:
             raise HTTPException(status_code=400, detail=f"缺少必填字段: {field}")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -135,7 +133,6 @@ def create_student(
         return {"id": student_id, "message": "学员创建成功"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{student_id}")
@@ -143,9 +140,9 @@ def update_student(
     student_id: int,
     data: Dict[str, Any],
     current_user=Depends(require_action("student.edit")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """更新学员信息"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id FROM students WHERE id = %s", (student_id,))
@@ -181,19 +178,18 @@ def update_student(
         return {"message": "学员信息已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{student_id}")
 def delete_student(
     student_id: int,
     current_user=Depends(require_action("student.delete")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     删除学员
     - 只有没有"在读"状态的报名记录时才可以删除
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id, name FROM students WHERE id = %s", (student_id,))
@@ -222,4 +218,3 @@ def delete_student(
         return {"message": f"学员【{student['name']}】已删除"}
     finally:
         cursor.close()
-        db.close()
@@ -1,10 +1,14 @@
+from threading import Lock
 from typing import Dict, Any, List, Tuple
 
 from fastapi import APIRouter, HTTPException, Depends
 
-from ..database import get_db
-from ..deps import get_current_user
+from ..database import UnitOfWork, get_uow
+from ..deps import get_current_user, install_roles_config
 from ..services.audit import write_operation_log
+from ..services.cache_bus import publish
+from ..services.settings_cache import bump_settings_version, get_settings_snapshot
+from ..services.token_revocation import ALL_PRINCIPALS, revoke_tokens
 from ..security import verify_password
 
 router = APIRouter(prefix="/system-settings", tags=["SystemSettings"])
@@ -33,6 +37,10 @@ DEFAULT_SETTINGS: List[Tuple[str, str, str, str, str | None]] = [
     ("business", "reservation_cancel_limit_hours", "2", "int", "开场前多少小时内禁止取消"),
     ("business", "auto_cancel_minutes", "30", "int", "未支付自动取消时间（分钟）"),
 
+    # 分时段价格（规则格式见 services/pricing.py）
+    ("pricing", "court_price_rules_json", "[]", "json", "场地分时段价格规则列表（JSON）"),
+    ("pricing", "holidays_json", "[]", "json", "按节假日计价的日期列表（JSON）"),
+
     # 培训设置
     ("training", "default_course_lessons", "12", "int", "默认总课时"),
     ("training", "default_course_price", "2000", "float", "默认总课时价格"),
@@ -103,49 +111,44 @@ DEFAULT_SETTINGS: List[Tuple[str, str, str, str, str | None]] = [
 ]
 
 
-def _ensure_default_settings():
+# 默认配置每个进程只需补齐一次（system_settings 不会被数据清理删除）
+_defaults_ensured = False
+_defaults_lock = Lock()
+
+
+def _ensure_default_settings(db: UnitOfWork):
     """确保 system_settings 表里至少有 DEFAULT_SETTINGS 这几条，不覆盖已有值。"""
-    db = get_db()
-    cursor = db.cursor()
-    try:
-        sql = """
-        INSERT INTO system_settings (group_key, setting_key, setting_value, value_type, description)
-        VALUES (%s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-          setting_value = setting_value
-        """
-        for item in DEFAULT_SETTINGS:
-            cursor.execute(sql, item)
-        db.commit()
-    finally:
-        cursor.close()
-        db.close()
+    global _defaults_ensured
+    if _defaults_ensured:
+        return
+    with _defaults_lock:
+        if _defaults_ensured:
+            return
+        cursor = db.cursor()
+        try:
+            sql = """
+            INSERT INTO system_settings (group_key, setting_key, setting_value, value_type, description)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+              setting_value = setting_value
+            """
+            cursor.executemany(sql, DEFAULT_SETTINGS)
+            db.commit()
+        finally:
+            cursor.close()
+        bump_settings_version()
+        _defaults_ensured = True
 
 
-def _load_settings_dict() -> Dict[str, Dict[str, Any]]:
-    _ensure_default_settings()
-    db = get_db()
+def _load_settings_dict(db: UnitOfWork) -> Dict[str, Dict[str, Any]]:
+    """按 group_key 分组返回全部设置，读取进程内设置缓存"""
+    _ensure_default_settings(db)
     cursor = db.cursor(dictionary=True)
     try:
-        cursor.execute(
-            """
-            SELECT group_key, setting_key, setting_value
-            FROM system_settings
-            ORDER BY group_key, setting_key
-            """
-        )
-        rows = cursor.fetchall()
-
-        grouped: Dict[str, Dict[str, Any]] = {}
-        for row in rows:
-            g = row["group_key"]
-            k = row["setting_key"]
-            v = row["setting_value"]
-            grouped.setdefault(g, {})[k] = v
-        return grouped
+        snapshot = get_settings_snapshot(cursor)
     finally:
         cursor.close()
-        db.close()
+    return {g: dict(sorted(values.items())) for g, values in sorted(snapshot.items())}
 
 
 def _parse_json_list(raw: str | None, fallback: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -162,15 +165,16 @@ def _parse_json_list(raw: str | None, fallback: List[Dict[str, Any]]) -> List[Di
 
 
 @router.get("/grouped")
-def get_grouped_settings():
+def get_grouped_settings(db: UnitOfWork = Depends(get_uow)):
     """按 group_key 分组返回设置"""
-    return _load_settings_dict()
+    return _load_settings_dict(db)
 
 
 @router.post("/grouped")
 def save_grouped_settings(
     data: Dict[str, Dict[str, Any]],
-    current_user=Depends(get_current_user)
+    current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     前端提交的结构：
@@ -184,7 +188,6 @@ def save_grouped_settings(
     if not isinstance(data, dict):
         raise HTTPException(status_code=400, detail="数据格式不正确")
 
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -205,8 +208,6 @@ def save_grouped_settings(
                 value_str = str(value) if value is not None else ""
                 cursor.execute(sql, (group_key, setting_key, value_str, "string", None))
 
-        db.commit()
-        
         # 写入操作日志
         try:
             write_operation_log(
@@ -214,19 +215,21 @@ def save_grouped_settings(
                 username=current_user.get("username"),
                 action="批量更新",
                 module="系统设置",
-                target_desc=f"更新了系统配置：{', '.join(changed_groups)}"
+                target_desc=f"更新了系统配置：{', '.join(changed_groups)}",
+                cursor=cursor,
             )
         except Exception as e:
             print(f"写入操作日志失败: {e}")
         
+        db.commit()
+        publish("settings", "roles")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/member-config")
-def get_member_config():
+def get_member_config(db: UnitOfWork = Depends(get_uow)):
     """
     返回会员等级与卡种配置，解析 JSON。
     {
@@ -235,7 +238,7 @@ def get_member_config():
       "card_packages": [...]
     }
     """
-    settings = _load_settings_dict().get("member", {})
+    settings = _load_settings_dict(db).get("member", {})
     default_level = settings.get("default_level") or "normal"
     member_levels = _parse_json_list(
         settings.get("member_levels_json"),
@@ -262,11 +265,11 @@ def get_member_config():
 
 
 @router.get("/roles-config")
-def get_roles_config():
+def get_roles_config(db: UnitOfWork = Depends(get_uow)):
     """
     返回角色权限配置列表
     """
-    settings = _load_settings_dict().get("permission", {})
+    settings = _load_settings_dict(db).get("permission", {})
     roles = _parse_json_list(
         settings.get("roles_json"),
         [
@@ -278,7 +281,7 @@ def get_roles_config():
 
 
 @router.post("/roles-config")
-def save_roles_config(payload: Dict[str, Any]):
+def save_roles_config(payload: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """
     保存角色配置（JSON），同时落库 system_settings.permission.roles_json
     payload 示例：
@@ -294,7 +297,6 @@ def save_roles_config(payload: Dict[str, Any]):
 
     roles_json = json.dumps(roles, ensure_ascii=False)
 
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute(
@@ -306,14 +308,16 @@ def save_roles_config(payload: Dict[str, Any]):
             ("permission", "roles_json", roles_json, "json", "角色与权限配置（JSON）"),
         )
         db.commit()
+        publish("settings", "roles")
+        # 本进程直接用新配置编译权限索引，下一个请求即生效
+        install_roles_config(roles)
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/reservation-rules")
-def get_reservation_rules():
+def get_reservation_rules(db: UnitOfWork = Depends(get_uow)):
     """
     获取预约相关规则，字段含：
     - reservation_slot_minutes: 每次预约时长（分钟）
@@ -322,7 +326,7 @@ def get_reservation_rules():
     - auto_cancel_minutes: 未支付自动取消时间
     - business_open_time / business_close_time: 营业时段
     """
-    settings = _load_settings_dict()
+    settings = _load_settings_dict(db)
     biz = settings.get("business", {})
     time_cfg = settings.get("time", {})
     return {
@@ -336,11 +340,10 @@ def get_reservation_rules():
 
 
 @router.post("/reservation-rules")
-def save_reservation_rules(data: Dict[str, Any]):
+def save_reservation_rules(data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """
     保存预约规则 + 营业时间
     """
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -365,15 +368,15 @@ def save_reservation_rules(data: Dict[str, Any]):
             g, s, vt, desc = meta
             cursor.execute(sql, (g, s, str(data.get(k) or ""), vt, desc))
         db.commit()
+        publish("settings")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/module-switches")
-def get_module_switches():
-    settings = _load_settings_dict().get("modules", {})
+def get_module_switches(db: UnitOfWork = Depends(get_uow)):
+    settings = _load_settings_dict(db).get("modules", {})
     return {
         "enable_reservation": settings.get("enable_reservation") == "1",
         "enable_member": settings.get("enable_member") == "1",
@@ -385,8 +388,7 @@ def get_module_switches():
 
 
 @router.post("/module-switches")
-def save_module_switches(data: Dict[str, Any]):
-    db = get_db()
+def save_module_switches(data: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     cursor = db.cursor()
     try:
         sql = """
@@ -407,16 +409,17 @@ def save_module_switches(data: Dict[str, Any]):
                 ("modules", key, "1" if data.get(key) else "0", "bool", "模块开关"),
             )
         db.commit()
+        publish("settings")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("/batch")
 def save_batch_settings(
     data: Dict[str, Any],
-    current_user=Depends(get_current_user)
+    current_user=Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     批量保存所有系统设置
@@ -437,7 +440,6 @@ def save_batch_settings(
     if not isinstance(data, dict):
         raise HTTPException(status_code=400, detail="数据格式不正确")
     
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -496,8 +498,6 @@ def save_batch_settings(
                     ),
                 )
         
-        db.commit()
-        
         # 写入操作日志
         try:
             write_operation_log(
@@ -505,19 +505,21 @@ def save_batch_settings(
                 username=current_user.get("username"),
                 action="批量更新",
                 module="系统设置",
-                target_desc=f"更新了系统配置：{', '.join(changed_groups)}"
+                target_desc=f"更新了系统配置：{', '.join(changed_groups)}",
+                cursor=cursor,
             )
         except Exception as e:
             print(f"写入操作日志失败: {e}")
         
+        db.commit()
+        publish("settings", "roles")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("/member-config")
-def save_member_config(payload: Dict[str, Any]):
+def save_member_config(payload: Dict[str, Any], db: UnitOfWork = Depends(get_uow)):
     """
     保存会员等级与卡种配置
     """
@@ -527,7 +529,6 @@ def save_member_config(payload: Dict[str, Any]):
     member_levels = payload.get("member_levels") or []
     card_packages = payload.get("card_packages") or []
 
-    db = get_db()
     cursor = db.cursor()
     try:
         sql = """
@@ -557,21 +558,40 @@ def save_member_config(payload: Dict[str, Any]):
             ),
         )
         db.commit()
+        publish("settings")
         return {"success": True}
     finally:
         cursor.close()
-        db.close()
+
+
+# 预约相关的运行时表（场地位图、时段预留、候补、区间变化、场地停用时段），由各 service 按需建表，可能不存在；
+# 停用时段计入场地占用，不清空的话"重置"后旧的停用窗口仍会拒绝新预约
+_RESERVATION_RUNTIME_TABLES = (
+    "court_day_slots",
+    "court_slot_holds",
+    "court_waitlist",
+    "reservation_index_changes",
+    "court_closure_jobs",
+)
+
+
+def _clear_reservation_runtime_tables(cursor) -> None:
+    """预约清空后同步清空这些表，否则旧的位图/预留/停用时段仍会拒绝新预约；表不存在时跳过"""
+    for t in _RESERVATION_RUNTIME_TABLES:
+        try:
+            cursor.execute(f"DELETE FROM {t}")
+        except Exception:
+            pass
 
 
 @router.post("/data-clean")
-def data_clean(password: str, current_user=Depends(get_current_user)):
+def data_clean(password: str, current_user=Depends(get_current_user), db: UnitOfWork = Depends(get_uow)):
     """
     数据清理/演示重置：清空业务流水但保留基础配置。
     需要管理员密码验证。
     清理表：attendances, enrollments, schedules, order_items, orders, court_reservations, member_transactions, product_sales, notifications, operation_logs
     """
     # 验证密码
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 获取当前用户的密码哈希（从 users 表）
@@ -609,12 +629,11 @@ def data_clean(password: str, current_user=Depends(get_current_user)):
             except Exception as e:
                 # 如果 TRUNCATE 失败，使用 DELETE（更慢但更安全）
                 cursor.execute(f"DELETE FROM {t}")
+        _clear_reservation_runtime_tables(cursor)
         
         # 重新启用外键检查
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
         
-        db.commit()
-        
         # 记录操作日志
         try:
             username = current_user.get("username") if isinstance(current_user, dict) else current_user.username
@@ -627,10 +646,14 @@ def data_clean(password: str, current_user=Depends(get_current_user)):
                 target_desc="数据格式化",
                 detail={"cleaned_tables": tables},
                 ip=None,
+                cursor=cursor,
             )
         except Exception:
             pass
         
+        db.commit()
+        # 各 worker 的预约区间索引、时段预留与价格缓存都已过期
+        publish("reservations", "holds", "prices")
         return {"success": True, "message": "业务数据已清理（保留基础配置：会员、场地、商品、教练、学员、课程）"}
     except HTTPException:
         raise
@@ -639,18 +662,16 @@ def data_clean(password: str, current_user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"数据清理失败：{str(e)}")
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("/data-clean-all")
-def data_clean_all(password: str, current_user=Depends(get_current_user)):
+def data_clean_all(password: str, current_user=Depends(get_current_user), db: UnitOfWork = Depends(get_uow)):
     """
     完全格式化：清空所有数据，包括基础配置（会员、场地、商品、教练、学员、课程等）。
     需要管理员密码验证。
     ⚠️ 极度危险操作，仅保留系统设置和管理员账号！
     """
     # 验证密码
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 获取当前用户的密码哈希（从 users 表）
@@ -697,11 +718,13 @@ def data_clean_all(password: str, current_user=Depends(get_current_user)):
             except Exception:
                 # 如果 TRUNCATE 失败，使用 DELETE（更慢但更安全）
                 cursor.execute(f"DELETE FROM {t}")
+        _clear_reservation_runtime_tables(cursor)
         
         # 重新启用外键检查
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
-        
-        db.commit()
+
+        # 会员表已清空（自增 id 会被新会员重用），此前签发的会员 token 全部下线
+        revoke_tokens("member", ALL_PRINCIPALS, force_logout=True, reason="data_clean_all", cursor=cursor)
         
         # 记录操作日志（如果日志表没被清空）
         try:
@@ -715,10 +738,13 @@ def data_clean_all(password: str, current_user=Depends(get_current_user)):
                 target_desc="完全格式化",
                 detail={"cleaned_tables": tables, "warning": "所有基础配置已清空"},
                 ip=None,
+                cursor=cursor,
             )
         except Exception:
             pass
         
+        db.commit()
+        publish("members", "revocations", "reservations", "holds", "prices")
         return {"success": True, "message": "所有数据已清空（仅保留系统设置和管理员账号）"}
     except HTTPException:
         raise
@@ -727,4 +753,3 @@ def data_clean_all(password: str, current_user=Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"完全格式化失败：{str(e)}")
     finally:
         cursor.close()
-        db.close()
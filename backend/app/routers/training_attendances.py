@@ -14,7 +14,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from typing import Dict, Any, Optional
 from datetime import datetime
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
 from ..services.audit import write_operation_log
 from ..services.notifications import create_admin_notifications
@@ -32,6 +32,7 @@ def list_attendances(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     current_user=Depends(require_action("attendance.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     查询签到记录列表
@@ -48,7 +49,6 @@ def list_attendances(
     - 课程名称和类型
     - 签到后的剩余课时
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         conditions = []
@@ -114,13 +114,13 @@ def list_attendances(
         return {"total": total, "items": items, "page": page, "page_size": page_size}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/{attendance_id}")
 def get_attendance(
     attendance_id: int,
     current_user=Depends(require_action("attendance.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取签到记录详情
@@ -131,7 +131,6 @@ def get_attendance(
     - 课程和排期信息
     - 当前剩余课时
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -162,7 +161,6 @@ def get_attendance(
         return attendance
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
@@ -170,6 +168,7 @@ def create_attendance(
     data: Dict[str, Any],
     request: Request,
     current_user=Depends(require_action("attendance.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     创建签到记录（学员签到）
@@ -215,7 +214,6 @@ def create_attendance(
         if field not in data or data[field] is None:
             raise HTTPException(status_code=400, detail=f"缺少必填字段: {field}")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -304,8 +302,6 @@ def create_attendance(
                 ("已结课", enrollment_id),
             )
 
-        db.commit()
-
         # 记录操作日志
         try:
             uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
@@ -323,6 +319,7 @@ def create_attendance(
                     "status": "已结课" if new_remaining == 0 else "在读",
                 },
                 ip=request.client.host if request.client else None,
+                cursor=cursor,
             )
             
             # 发送管理员通知
@@ -330,10 +327,12 @@ def create_attendance(
                 title="学员签到",
                 content=f"{enrollment['student_name']} 签到成功，剩余 {new_remaining} 节课",
                 level="info",
+                cursor=cursor,
             )
         except Exception:
             pass
 
+        db.commit()
         return {
             "id": attendance_id,
             "remaining_lessons": new_remaining,
@@ -349,7 +348,6 @@ def create_attendance(
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
 
 
 @router.delete("/{attendance_id}")
@@ -357,6 +355,7 @@ def delete_attendance(
     attendance_id: int,
     request: Request,
     current_user=Depends(require_action("attendance.delete")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     删除签到记录（撤销签到）
@@ -393,7 +392,6 @@ def delete_attendance(
         删除签到记录是敏感操作，建议只在特殊情况下使用。
         所有删除操作都会记录到操作日志中，便于追溯。
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -443,8 +441,6 @@ def delete_attendance(
         # 删除签到记录
         cursor2.execute("DELETE FROM attendances WHERE id = %s", (attendance_id,))
 
-        db.commit()
-
         # 记录操作日志
         try:
             uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
@@ -461,16 +457,19 @@ def delete_attendance(
                     "status": "在读" if enrollment["status"] == "已结课" else enrollment["status"],
                 },
                 ip=request.client.host if request.client else None,
+                cursor=cursor,
             )
             
             create_admin_notifications(
                 title="撤销签到",
                 content=f"{attendance['student_name']} 签到已撤销，课时已恢复至 {new_remaining} 节",
                 level="warning",
+                cursor=cursor,
             )
         except Exception:
             pass
 
+        db.commit()
         return {"message": "签到记录已删除，课时已恢复"}
     except HTTPException:
         db.rollback()
@@ -481,7 +480,6 @@ def delete_attendance(
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
 
 
 @router.put("/{attendance_id}")
@@ -490,6 +488,7 @@ def update_attendance(
     data: Dict[str, Any],
     request: Request,
     current_user=Depends(require_action("attendance.edit")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     更新签到记录备注
@@ -507,7 +506,6 @@ def update_attendance(
     Returns:
         dict: {"message": "更新成功"}
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -535,7 +533,6 @@ def update_attendance(
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
 
 
 
@@ -1,7 +1,7 @@
 # backend/app/routers/training_courses.py
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Dict, Any, Optional
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
 
 router = APIRouter(prefix="/training/courses", tags=["Training Courses"])
@@ -16,13 +16,13 @@ def list_courses(
     status: Optional[str] = None,
     coach_id: Optional[int] = None,
     current_user=Depends(require_action("course.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取课程列表
     - 支持关键字搜索（课程名称）
     - 支持按类型、状态、教练筛选
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         conditions = []
@@ -70,16 +70,15 @@ def list_courses(
         return {"total": total, "items": items, "page": page, "page_size": page_size}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/{course_id}")
 def get_course(
     course_id: int,
     current_user=Depends(require_action("course.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """获取课程详情（包含报名学员、排期列表、收入统计）"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         # 课程基本信息
@@ -145,13 +144,13 @@ def get_course(
         return course
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
 def create_course(
     data: Dict[str, Any],
     current_user=Depends(require_action("course.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """创建课程"""
     required = ["name"]
@@ -159,7 +158,6 @@ def create_course(
         if field not in data or not data[field]:
             raise HTTPException(status_code=400, detail=f"缺少必填字段: {field}")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         sql = """
@@ -187,7 +185,6 @@ def create_course(
         return {"id": course_id, "message": "课程创建成功"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{course_id}")
@@ -195,9 +192,9 @@ def update_course(
     course_id: int,
     data: Dict[str, Any],
     current_user=Depends(require_action("course.edit")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """更新课程信息"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id FROM courses WHERE id = %s", (course_id,))
@@ -234,20 +231,19 @@ def update_course(
         return {"message": "课程信息已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{course_id}")
 def delete_course(
     course_id: int,
     current_user=Depends(require_action("course.delete")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     删除课程
     - 只要没有"在读"状态的报名记录，课程就可以删除
     - 会级联删除关联的排期和考勤记录
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute("SELECT id, name FROM courses WHERE id = %s", (course_id,))
@@ -277,13 +273,11 @@ def delete_course(
         return {"message": f"课程【{course['name']}】已删除"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/types/list")
-def get_course_types(current_user=Depends(require_action("course.view"))):
+def get_course_types(current_user=Depends(require_action("course.view")), db: UnitOfWork = Depends(get_uow)):
     """获取所有已使用过的课程类型（用于前端下拉）"""
-    db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute(
@@ -297,4 +291,3 @@ def get_course_types(current_user=Depends(require_action("course.view"))):
         return [item[0] for item in items]
     finally:
         cursor.close()
-        db.close()
@@ -3,7 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from typing import Dict, Any, Optional
 from decimal import Decimal
 from datetime import datetime
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action, get_current_user
 from ..services.audit import write_operation_log
 from ..services.orders import generate_order_no
@@ -20,13 +20,13 @@ def list_enrollments(
     status: Optional[str] = None,
     keyword: Optional[str] = None,
     current_user=Depends(require_action("enrollment.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取报名列表
     - 支持按课程、学员、状态筛选
     - 支持关键字搜索（学员姓名、课程名称）
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         conditions = []
@@ -84,16 +84,15 @@ def list_enrollments(
         return {"total": total, "items": items, "page": page, "page_size": page_size}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/{enrollment_id}")
 def get_enrollment(
     enrollment_id: int,
     current_user=Depends(require_action("enrollment.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """获取报名详情（包含签到记录）"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -131,7 +130,6 @@ def get_enrollment(
         return enrollment
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
@@ -139,6 +137,7 @@ def create_enrollment(
     data: Dict[str, Any],
     request: Request,
     current_user=Depends(require_action("enrollment.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     创建教培课程报名
@@ -188,7 +187,6 @@ def create_enrollment(
         if field not in data or data[field] is None:
             raise HTTPException(status_code=400, detail=f"缺少必填字段: {field}")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -280,8 +278,6 @@ def create_enrollment(
         order_id = order_info["order_id"]
         order_no = order_info["order_no"]
 
-        db.commit()
-
         # 记录操作日志
         try:
             uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
@@ -299,10 +295,12 @@ def create_enrollment(
                     "order_no": order_no,
                 },
                 ip=request.client.host if request.client else None,
+                cursor=cursor,
             )
         except Exception:
             pass
 
+        db.commit()
         return {
             "id": enrollment_id,
             "order_id": order_id,
@@ -318,7 +316,6 @@ def create_enrollment(
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
 
 
 @router.post("/{enrollment_id}/refund")
@@ -327,6 +324,7 @@ def refund_enrollment(
     data: Dict[str, Any],
     request: Request,
     current_user=Depends(require_action("enrollment.refund")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     教培课程退费
@@ -382,7 +380,6 @@ def refund_enrollment(
         退费后报名状态变为"退费"，学员无法继续签到上课。
         退款需要线下完成，系统只记录退款金额和原因。
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     cursor2 = db.cursor()
     try:
@@ -434,7 +431,7 @@ def refund_enrollment(
         original_order = cursor.fetchone()
 
         # 生成退款订单
-        refund_order_no = generate_order_no("REFUND")
+        refund_order_no = generate_order_no("REFUND", cursor)
         refund_order_sql = """
             INSERT INTO orders (
                 order_no, order_type, related_id, member_id, member_name,
@@ -469,8 +466,6 @@ def refund_enrollment(
                 ("refunded", original_order["id"]),
             )
 
-        db.commit()
-
         # 记录操作日志
         try:
             uid = current_user["id"] if isinstance(current_user, dict) else current_user.id
@@ -488,10 +483,12 @@ def refund_enrollment(
                     "refund_order_no": refund_order_no,
                 },
                 ip=request.client.host if request.client else None,
+                cursor=cursor,
             )
         except Exception:
             pass
 
+        db.commit()
         return {
             "message": "退费成功",
             "refund_amount": refund_amount,
@@ -507,4 +504,3 @@ def refund_enrollment(
     finally:
         cursor.close()
         cursor2.close()
-        db.close()
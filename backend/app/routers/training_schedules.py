@@ -2,12 +2,40 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Dict, Any, Optional
 from datetime import datetime, date, time as dt_time
-from ..database import get_db
+from ..database import UnitOfWork, get_uow
 from ..deps import require_action
+from ..services.court_slots import SlotConflict, claim_court_slots, release_court_slots
+from ..services.reservation_index import note_reservations_changed
+from ..services.resource_calendar import KIND_SCHEDULE, resolve_schedule_court, schedule_interval
 
 router = APIRouter(prefix="/training/schedules", tags=["Training Schedules"])
 
 
+def _resolve_venue(cursor, data: Dict[str, Any], venue: Optional[str]):
+    """
+    确定排期占用的场地：请求体带 court_id 时以场地名称作为 venue；
+    否则 venue 与场地名称相同时映射到该场地。返回 (venue, court_id 或 None)
+    """
+    court_id = data.get("court_id")
+    if court_id:
+        cursor.execute("SELECT name FROM courts WHERE id = %s", (court_id,))
+        row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="场地不存在")
+        return row["name"], int(court_id)
+    return venue, resolve_schedule_court(cursor, venue)
+
+
+def _schedule_interval(day, start_time, end_time):
+    try:
+        start_dt, end_dt = schedule_interval(day, start_time, end_time)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="日期或时间格式不正确")
+    if end_dt <= start_dt:
+        raise HTTPException(status_code=400, detail="结束时间必须晚于开始时间")
+    return start_dt, end_dt
+
+
 @router.get("")
 def list_schedules(
     page: int = Query(1, ge=1),
@@ -18,12 +46,12 @@ def list_schedules(
     date_to: Optional[str] = None,
     status: Optional[str] = None,
     current_user=Depends(require_action("schedule.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     获取排期列表
     - 支持按课程、教练、日期范围、状态筛选
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         conditions = []
@@ -77,16 +105,15 @@ def list_schedules(
         return {"total": total, "items": items, "page": page, "page_size": page_size}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.get("/{schedule_id}")
 def get_schedule(
     schedule_id: int,
     current_user=Depends(require_action("schedule.view")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """获取排期详情（包含签到情况）"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         cursor.execute(
@@ -124,25 +151,25 @@ def get_schedule(
         return schedule
     finally:
         cursor.close()
-        db.close()
 
 
 @router.post("")
 def create_schedule(
     data: Dict[str, Any],
     current_user=Depends(require_action("schedule.create")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     创建排期
     - 检查教练时间冲突
-    - 检查场地时间冲突（如果提供了 venue）
+    - 检查场地时间冲突：venue 为场地名称（或传 court_id）时与场地预约、其他排期统一检测，
+      其他地点只与同地点的排期比对
     """
     required = ["course_id", "date", "start_time", "end_time"]
     for field in required:
         if field not in data or not data[field]:
             raise HTTPException(status_code=400, detail=f"缺少必填字段: {field}")
 
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
         course_id = data["course_id"]
@@ -150,7 +177,11 @@ def create_schedule(
         schedule_date = data["date"]
         start_time = data["start_time"]
         end_time = data["end_time"]
-        venue = data.get("venue")
+        status = data.get("status", "正常")
+        start_dt, end_dt = _schedule_interval(schedule_date, start_time, end_time)
+
+        db.start_transaction()
+        venue, court_id = _resolve_venue(cursor, data, data.get("venue"))
 
         # 验证课程存在
         cursor.execute("SELECT id, coach_id FROM courses WHERE id = %s", (course_id,))
@@ -175,8 +206,14 @@ def create_schedule(
             if cursor.fetchone()["cnt"] > 0:
                 raise HTTPException(status_code=400, detail="该教练在此时间段已有排期")
 
-        # 检查场地冲突（如果提供了场地）
-        if venue:
+        # 检查场地冲突：排在场地上的课与场地预约走同一把位图行锁，互相可见；
+        # 其他上课地点（如教室）仍只与同地点的排期比对
+        if court_id and status == "正常":
+            try:
+                claim_court_slots(court_id, start_dt, end_dt, cursor=cursor)
+            except SlotConflict:
+                raise HTTPException(status_code=400, detail="该场地在此时间段已被占用（预约或其他排期）")
+        elif venue:
             cursor.execute(
                 """
                 SELECT COUNT(*) as cnt FROM schedules
@@ -204,16 +241,17 @@ def create_schedule(
                 start_time,
                 end_time,
                 venue,
-                data.get("status", "正常"),
+                status,
                 data.get("remark"),
             ),
         )
-        db.commit()
         schedule_id = cursor.lastrowid
+        db.commit()
+        if court_id:
+            note_reservations_changed()
         return {"id": schedule_id, "message": "排期创建成功"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.put("/{schedule_id}")
@@ -221,12 +259,13 @@ def update_schedule(
     schedule_id: int,
     data: Dict[str, Any],
     current_user=Depends(require_action("schedule.edit")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """更新排期信息"""
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT * FROM schedules WHERE id = %s", (schedule_id,))
+        db.start_transaction()
+        cursor.execute("SELECT * FROM schedules WHERE id = %s FOR UPDATE", (schedule_id,))
         old_schedule = cursor.fetchone()
         if not old_schedule:
             raise HTTPException(status_code=404, detail="排期不存在")
@@ -255,6 +294,9 @@ def update_schedule(
             "status",
             "remark",
         ]
+        data = dict(data)
+        if data.get("court_id") or "venue" in data:
+            data["venue"], _ = _resolve_venue(cursor, data, data.get("venue"))
         for field in fields:
             if field in data:
                 updates.append(f"{field} = %s")
@@ -263,31 +305,63 @@ def update_schedule(
         if not updates:
             raise HTTPException(status_code=400, detail="没有可更新的字段")
 
+        # 场地占用：旧的（正常状态且在场地上）先记下，新的在更新前占用，更新后按剩余占用重建旧日期的位图
+        old_court = (
+            resolve_schedule_court(cursor, old_schedule.get("venue"))
+            if old_schedule.get("status") == "正常" else None
+        )
+        new_status = data.get("status", old_schedule.get("status"))
+        new_court = resolve_schedule_court(cursor, data.get("venue", old_schedule.get("venue"))) if new_status == "正常" else None
+
+        if new_court:
+            new_start, new_end = _schedule_interval(
+                data.get("date", old_schedule.get("date")),
+                data.get("start_time", old_schedule.get("start_time")),
+                data.get("end_time", old_schedule.get("end_time")),
+            )
+            try:
+                claim_court_slots(
+                    new_court, new_start, new_end, cursor=cursor, exclude=(KIND_SCHEDULE, schedule_id)
+                )
+            except SlotConflict:
+                raise HTTPException(status_code=400, detail="该场地在此时间段已被占用（预约或其他排期）")
+
         params.append(schedule_id)
         sql = f"UPDATE schedules SET {', '.join(updates)} WHERE id = %s"
         cursor.execute(sql, tuple(params))
+        if old_court:
+            old_start, old_end = schedule_interval(
+                old_schedule["date"], old_schedule["start_time"], old_schedule["end_time"]
+            )
+            release_court_slots(old_court, old_start, old_end, cursor=cursor)
         db.commit()
+        if old_court or new_court:
+            note_reservations_changed()
 
         return {"message": "排期已更新"}
     finally:
         cursor.close()
-        db.close()
 
 
 @router.delete("/{schedule_id}")
 def delete_schedule(
     schedule_id: int,
     current_user=Depends(require_action("schedule.delete")),
+    db: UnitOfWork = Depends(get_uow),
 ):
     """
     删除排期
     - 如果已有签到记录，不允许删除，只能修改状态为"已取消"
     """
-    db = get_db()
     cursor = db.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT id FROM schedules WHERE id = %s", (schedule_id,))
-        if not cursor.fetchone():
+        db.start_transaction()
+        cursor.execute(
+            "SELECT id, date, start_time, end_time, venue, status FROM schedules WHERE id = %s FOR UPDATE",
+            (schedule_id,),
+        )
+        schedule = cursor.fetchone()
+        if not schedule:
             raise HTTPException(status_code=404, detail="排期不存在")
 
         # 检查是否有签到记录
@@ -300,13 +374,18 @@ def delete_schedule(
                 status_code=400, detail="该排期已有签到记录，不能删除，请修改状态为'已取消'"
             )
 
+        court_id = resolve_schedule_court(cursor, schedule.get("venue")) if schedule.get("status") == "正常" else None
         cursor.execute("DELETE FROM schedules WHERE id = %s", (schedule_id,))
+        if court_id:
+            start_dt, end_dt = schedule_interval(schedule["date"], schedule["start_time"], schedule["end_time"])
+            release_court_slots(court_id, start_dt, end_dt, cursor=cursor)
         db.commit()
+        if court_id:
+            note_reservations_changed()
 
         return {"message": "排期已删除"}
     finally:
         cursor.close()
-        db.close()
 
 
 
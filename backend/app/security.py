@@ -3,9 +3,17 @@
 
 提供密码哈希、JWT Token 生成和验证等安全相关功能。
 使用 PBKDF2-SHA256 算法进行密码哈希，使用 JWT 进行用户身份认证。
+
+密码哈希是刻意放慢的 CPU 运算。登录高峰时如果直接在同步路由里验证，
+会占满 FastAPI 的线程池，连带其他只查库的请求一起排队。登录接口因此改用
+verify_and_update_password_async：哈希在容量为 PASSWORD_HASH_WORKERS 的专用线程池里执行
+（hashlib 的 pbkdf2 计算期间释放 GIL，多线程可以并行），超出的请求在该池内排队，不占用路由线程。
 """
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
 
 from fastapi import HTTPException
 from jose import JWTError, jwt
@@ -13,9 +21,35 @@ from passlib.context import CryptContext
 
 from .config import settings
 
-# 密码哈希上下文，使用 PBKDF2-SHA256 算法
+
+
+def _build_pwd_context() -> CryptContext:
+    """
+    按配置构建密码哈希上下文
+
+    默认算法用于生成新哈希；PASSWORD_LEGACY_SCHEMES 中的旧算法只用于验证（标记为 deprecated），
+    迭代次数低于 PASSWORD_HASH_ROUNDS 的哈希同样视为需要升级。
+    """
+    scheme = settings.PASSWORD_HASH_SCHEME
+    legacy = [s.strip() for s in settings.PASSWORD_LEGACY_SCHEMES.split(",") if s.strip() and s.strip() != scheme]
+    rounds = settings.PASSWORD_HASH_ROUNDS
+    return CryptContext(
+        schemes=[scheme, *legacy],
+        default=scheme,
+        deprecated="auto",
+        **{f"{scheme}__rounds": rounds, f"{scheme}__min_rounds": rounds},
+    )
+
+
+# 密码哈希上下文，默认使用 PBKDF2-SHA256 算法
 # 该算法是 Python 标准库推荐的密码哈希算法，安全性高且性能良好
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+pwd_context = _build_pwd_context()
+
+# 专用哈希线程池：同时进行的哈希/验证不超过 PASSWORD_HASH_WORKERS 个
+_hash_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.PASSWORD_HASH_WORKERS),
+    thread_name_prefix="pwd-hash",
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -50,6 +84,28 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    验证密码，并在哈希使用旧算法或迭代次数不足时给出升级后的新哈希
+
+    Returns:
+        (是否匹配, 新哈希)：新哈希为 None 表示无需升级；调用方应在同一事务内写回数据库
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """verify_and_update_password 的异步版本，在专用哈希线程池中执行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_and_update_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash 的异步版本，在专用哈希线程池中执行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     创建 JWT 访问令牌
@@ -70,10 +126,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     """
     to_encode = data.copy()
     # 设置 Token 过期时间（使用时区感知的 UTC 时间）
-    expire = datetime.now(timezone.utc) + (
+    now = datetime.now(timezone.utc)
+    expire = now + (
         expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    to_encode.update({"exp": expire})
+    # iat 用作认证缓存键的一部分，重新登录后不会命中旧缓存；
+    # 保留毫秒（向下取整），与撤销表比较时同一秒内先撤销、后登录的 token 不会被误判
+    iat = math.floor(now.timestamp() * 1000) / 1000
+    to_encode.update({"exp": expire, "iat": iat})
     # 使用密钥签名生成 Token
     encoded_jwt = jwt.encode(
         to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
@@ -1,37 +1,24 @@
 # app/services/audit.py
 from typing import Optional, Dict, Any
 
-from ..database import get_db
+from ..database import cursor_scope
+from .settings_cache import get_setting_value
 
 
-def get_setting(group_key: str, setting_key: str, default: Optional[str] = None) -> Optional[str]:
+def get_setting(group_key: str, setting_key: str, default: Optional[str] = None, cursor=None) -> Optional[str]:
     """
-    从 system_settings 表中读取配置项。
+    从 system_settings 读取配置项（走进程内设置缓存）。
+    传入 cursor 时缓存失效后复用调用方的连接加载。
     """
-    db = get_db()
-    cursor = db.cursor()
-    try:
-        cursor.execute(
-            """
-            SELECT setting_value
-            FROM system_settings
-            WHERE group_key = %s AND setting_key = %s
-            """,
-            (group_key, setting_key),
-        )
-        row = cursor.fetchone()
-        return row[0] if row else default
-    finally:
-        cursor.close()
-        db.close()
+    return get_setting_value(group_key, setting_key, default, cursor=cursor)
 
 
-def is_login_log_enabled() -> bool:
-    return (get_setting("audit", "enable_login_log", "1") or "1") == "1"
+def is_login_log_enabled(cursor=None) -> bool:
+    return (get_setting("audit", "enable_login_log", "1", cursor=cursor) or "1") == "1"
 
 
-def is_operation_log_enabled() -> bool:
-    return (get_setting("audit", "enable_operation_log", "1") or "1") == "1"
+def is_operation_log_enabled(cursor=None) -> bool:
+    return (get_setting("audit", "enable_operation_log", "1", cursor=cursor) or "1") == "1"
 
 
 def write_login_log(
@@ -41,21 +28,21 @@ def write_login_log(
     ip: Optional[str] = None,
     user_agent: Optional[str] = None,
     message: Optional[str] = None,
+    cursor=None,
 ) -> None:
     """
     写登录日志。
+    传入 cursor 时与调用方同一事务（需外部 commit），否则单独借连接并提交。
     """
-    if not is_login_log_enabled():
+    if not is_login_log_enabled(cursor):
         return
 
-    db = get_db()
-    cursor = db.cursor()
-    try:
+    with cursor_scope(cursor) as cur:
         sql = """
         INSERT INTO login_logs (user_id, username, ip, user_agent, success, message)
         VALUES (%s, %s, %s, %s, %s, %s)
         """
-        cursor.execute(
+        cur.execute(
             sql,
             (
                 user_id,
@@ -66,10 +53,6 @@ def write_login_log(
                 message,
             ),
         )
-        db.commit()
-    finally:
-        cursor.close()
-        db.close()
 
 
 def write_operation_log(
@@ -81,26 +64,26 @@ def write_operation_log(
     target_desc: Optional[str] = None,
     detail: Optional[Dict[str, Any]] = None,
     ip: Optional[str] = None,
+    cursor=None,
 ) -> None:
     """
     写操作日志。
+    传入 cursor 时与业务写入同一事务（需外部 commit），否则单独借连接并提交。
     """
-    if not is_operation_log_enabled():
+    if not is_operation_log_enabled(cursor):
         return
 
     import json
 
     detail_json = json.dumps(detail, ensure_ascii=False) if detail is not None else None
 
-    db = get_db()
-    cursor = db.cursor()
-    try:
+    with cursor_scope(cursor) as cur:
         sql = """
         INSERT INTO operation_logs
         (user_id, username, action, module, target_id, target_desc, detail, ip)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         """
-        cursor.execute(
+        cur.execute(
             sql,
             (
                 user_id,
@@ -113,7 +96,3 @@ def write_operation_log(
                 ip,
             ),
         )
-        db.commit()
-    finally:
-        cursor.close()
-        db.close()
@@ -0,0 +1,288 @@
+# app/services/availability.py
+"""
+场地可用性网格
+
+以前查空闲场地是"先查占用的 court_id，再 NOT IN 查 courts"，每个时间窗口查一次；
+后台日历则反复拉取完整预约列表。这里改为：
+
+1. 一次范围查询取出查询区间内所有占用：未取消的预约与排在场地上的培训课（按 court_id, start_time 排序）
+2. 在内存中按场地合并重叠区间，再与时段序列做一次双指针扫描，得到 场地 × 时段 的空闲矩阵
+3. 网格附带 cache_key（由日期、参数和占用区间计算），内容不变时前端可以直接复用上次结果
+4. "最近的空闲时段"：在同一份合并后的占用区间上逐场地找空档，多场地按开始时间归并，取前 k 个即停
+5. 需要价格时由调用方传入 price_of(court_id, start, end)（pricing.court_amount，分时段价格表在内存中），
+   网格的每个时段与空闲时段的价格都不再查库
+
+本模块只负责 SQL 与纯计算，同步/异步连接由调用方决定。
+"""
+import hashlib
+import heapq
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .resource_calendar import occupancy_query
+from .settings_cache import get_settings_snapshot
+
+Interval = Tuple[datetime, datetime]
+PriceOf = Callable[[int, datetime, datetime], float]
+
+DEFAULT_OPEN_TIME = "06:00"
+DEFAULT_CLOSE_TIME = "23:00"
+DEFAULT_SLOT_MINUTES = 60
+MAX_GRID_DAYS = 31
+# 空闲时段的开始时间按该粒度向上取整（分钟）
+NEXT_AVAILABLE_ALIGN_MINUTES = 15
+
+
+def parse_hhmm(value: Optional[str], default: str) -> time:
+    """解析 HH:MM，格式不对时解析 default"""
+    for raw in (value, default):
+        try:
+            hour, minute = str(raw).strip().split(":")[:2]
+            return time(int(hour), int(minute))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return time(0, 0)
+
+
+def availability_settings(cursor=None) -> Dict[str, Any]:
+    """营业时段与默认时段长度（取自 system_settings 快照）"""
+    snapshot = get_settings_snapshot(cursor)
+    time_cfg = snapshot.get("time", {})
+    biz = snapshot.get("business", {})
+    try:
+        slot_minutes = int(biz.get("reservation_slot_minutes") or DEFAULT_SLOT_MINUTES)
+    except (TypeError, ValueError):
+        slot_minutes = DEFAULT_SLOT_MINUTES
+    return {
+        "open_time": parse_hhmm(time_cfg.get("business_open_time"), DEFAULT_OPEN_TIME),
+        "close_time": parse_hhmm(time_cfg.get("business_close_time"), DEFAULT_CLOSE_TIME),
+        "slot_minutes": slot_minutes if slot_minutes > 0 else DEFAULT_SLOT_MINUTES,
+    }
+
+
+# ========== SQL ==========
+
+def courts_query(court_type: Optional[str] = None, with_price: bool = False) -> Tuple[str, List[Any]]:
+    sql = "SELECT id, name, type, status, price_per_hour FROM courts" if with_price else "SELECT id, name, type, status FROM courts"
+    params: List[Any] = []
+    if court_type:
+        sql += " WHERE type = %s"
+        params.append(court_type)
+    return sql + " ORDER BY id ASC", params
+
+
+def busy_range_query(start: datetime, end: datetime, court_type: Optional[str] = None) -> Tuple[str, List[Any]]:
+    """[start, end) 区间内的全部占用（未取消的预约 + 映射到场地的培训排期）的一次范围查询"""
+    return occupancy_query(start, end, court_type=court_type)
+
+
+# ========== 纯计算 ==========
+
+def merge_busy(rows: Iterable[Any]) -> Dict[int, List[Interval]]:
+    """按场地合并重叠/相接的占用区间，返回 {court_id: [(start, end), ...]}（有序且互不相交）"""
+    per_court: Dict[int, List[Interval]] = {}
+    for row in rows:
+        if isinstance(row, dict):
+            court_id, start, end = row["court_id"], row["start_time"], row["end_time"]
+        else:
+            court_id, start, end = row[0], row[1], row[2]
+        per_court.setdefault(int(court_id), []).append((start, end))
+
+    merged: Dict[int, List[Interval]] = {}
+    for court_id, intervals in per_court.items():
+        intervals.sort()
+        out: List[Interval] = []
+        for start, end in intervals:
+            if out and start <= out[-1][1]:
+                if end > out[-1][1]:
+                    out[-1] = (out[-1][0], end)
+            else:
+                out.append((start, end))
+        merged[court_id] = out
+    return merged
+
+
+def day_slots(day: date, open_time: time, close_time: time, slot_minutes: int) -> List[Interval]:
+    """某天营业时段内的时段序列（最后一个不足 slot_minutes 的时段舍去）"""
+    start = datetime.combine(day, open_time)
+    close = datetime.combine(day, close_time)
+    step = timedelta(minutes=slot_minutes)
+    slots: List[Interval] = []
+    while start + step <= close:
+        slots.append((start, start + step))
+        start += step
+    return slots
+
+
+def sweep_free(slots: Sequence[Interval], busy: Sequence[Interval]) -> List[bool]:
+    """时段与有序不相交的占用区间做双指针扫描，返回每个时段是否空闲"""
+    free: List[bool] = []
+    i = 0
+    for start, end in slots:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        free.append(not (i < len(busy) and busy[i][0] < end))
+    return free
+
+
+def build_grid(
+    courts: Sequence[Dict[str, Any]],
+    busy: Dict[int, List[Interval]],
+    days: Sequence[date],
+    open_time: time,
+    close_time: time,
+    slot_minutes: int,
+    price_of: Optional[PriceOf] = None,
+) -> Dict[str, Any]:
+    """
+    组装 场地 × 时段 网格。status 不是"可用"的场地所有时段都视为不可预约。
+    传入 price_of 时每个场地附带 prices（与 slots 一一对应的时段原价）。
+    返回的 cache_key 只取决于输入内容，占用与价格没有变化时保持不变。
+    """
+    digest = hashlib.sha1(f"{slot_minutes}|{open_time}|{close_time}".encode())
+    out_days = []
+    for day in days:
+        slots = day_slots(day, open_time, close_time, slot_minutes)
+        out_courts = []
+        for court in courts:
+            court_id = int(court["id"])
+            if court.get("status") == "可用":
+                free = sweep_free(slots, busy.get(court_id, ()))
+            else:
+                free = [False] * len(slots)
+            item = {
+                "court_id": court_id,
+                "court_name": court.get("name"),
+                "type": court.get("type"),
+                "court_status": court.get("status"),
+                "free": free,
+            }
+            digest.update(f"{day}|{court_id}|{court.get('status')}|".encode())
+            digest.update(bytes(free))
+            if price_of is not None:
+                item["prices"] = [price_of(court_id, s, e) for s, e in slots]
+                digest.update(repr(item["prices"]).encode())
+            out_courts.append(item)
+        out_days.append({
+            "date": day.isoformat(),
+            "slots": [s.strftime("%H:%M") for s, _ in slots],
+            "courts": out_courts,
+        })
+
+    return {
+        "slot_minutes": slot_minutes,
+        "open_time": open_time.strftime("%H:%M"),
+        "close_time": close_time.strftime("%H:%M"),
+        "days": out_days,
+        "cache_key": digest.hexdigest(),
+    }
+
+
+def free_court_ids(
+    courts: Sequence[Dict[str, Any]],
+    busy: Dict[int, List[Interval]],
+    start: datetime,
+    end: datetime,
+) -> List[int]:
+    """[start, end) 整段空闲且状态为"可用"的场地 id"""
+    window = [(start, end)]
+    return [
+        int(c["id"])
+        for c in courts
+        if c.get("status") == "可用" and sweep_free(window, busy.get(int(c["id"]), ()))[0]
+    ]
+
+
+def _align_up(value: datetime, minutes: int) -> datetime:
+    """向上取整到当天 minutes 分钟的刻度"""
+    day_start = datetime.combine(value.date(), time(0))
+    step = timedelta(minutes=minutes)
+    return day_start - ((day_start - value) // step) * step
+
+
+def _court_gaps(
+    busy: Sequence[Interval],
+    windows: Sequence[Interval],
+    duration: timedelta,
+    align_minutes: int,
+) -> Iterator[datetime]:
+    """按时间顺序产出该场地每个空档中最早能放下 duration 的开始时间（busy 有序且互不相交）"""
+    i = 0
+    for win_start, win_end in windows:
+        t = _align_up(win_start, align_minutes)
+        while i < len(busy) and busy[i][1] <= t:
+            i += 1
+        j = i
+        while t + duration <= win_end:
+            if j < len(busy) and busy[j][0] < t + duration:
+                # 与占用区间相交：跳到其结束之后
+                t = _align_up(max(t, busy[j][1]), align_minutes)
+                j += 1
+                continue
+            yield t
+            # 同一空档只给一个候选，下一个候选从下一段占用结束之后找
+            if j >= len(busy) or busy[j][0] >= win_end:
+                break
+            t = _align_up(busy[j][1], align_minutes)
+            j += 1
+
+
+def _tagged(court: Dict[str, Any], starts: Iterator[datetime]) -> Iterator[Tuple[datetime, int, Dict[str, Any]]]:
+    court_id = int(court["id"])
+    for start in starts:
+        yield start, court_id, court
+
+
+def next_available(
+    courts: Sequence[Dict[str, Any]],
+    busy: Dict[int, List[Interval]],
+    days: Sequence[date],
+    earliest: time,
+    latest: time,
+    duration_minutes: int,
+    *,
+    not_before: Optional[datetime] = None,
+    limit: int = 5,
+    align_minutes: int = NEXT_AVAILABLE_ALIGN_MINUTES,
+    price_of: Optional[PriceOf] = None,
+) -> List[Dict[str, Any]]:
+    """
+    在 days 的每天 [earliest, latest] 内找最早能放下 duration_minutes 的空闲时段，返回最早的 limit 个
+    （每个空档只返回最早的开始时间；只考虑状态为"可用"的场地；
+    传入 price_of 时按分时段价格附上价格，否则 courts 带 price_per_hour 时按标准价附上）
+    """
+    duration = timedelta(minutes=duration_minutes)
+    windows: List[Interval] = []
+    for day in days:
+        win_start = datetime.combine(day, earliest)
+        win_end = datetime.combine(day, latest)
+        if not_before is not None:
+            win_start = max(win_start, not_before)
+        if win_start + duration <= win_end:
+            windows.append((win_start, win_end))
+
+    streams = []
+    for court in courts:
+        if court.get("status") != "可用":
+            continue
+        streams.append(_tagged(court, _court_gaps(busy.get(int(court["id"]), ()), windows, duration, align_minutes)))
+
+    result: List[Dict[str, Any]] = []
+    # 各场地的候选已按时间有序，归并后取前 limit 个即可，不用算完全部空档
+    for start, court_id, court in heapq.merge(*streams, key=lambda x: (x[0], x[1])):
+        item = {
+            "court_id": court_id,
+            "court_name": court.get("name"),
+            "type": court.get("type"),
+            "start_time": start.strftime("%Y-%m-%d %H:%M"),
+            "end_time": (start + duration).strftime("%Y-%m-%d %H:%M"),
+        }
+        if price_of is not None:
+            item["price"] = price_of(court_id, start, start + duration)
+        elif "price_per_hour" in court:
+            price = float(court.get("price_per_hour") or 0)
+            item["price"] = round(price * duration_minutes / 60.0, 2)
+        result.append(item)
+        if len(result) >= limit:
+            break
+    return result
@@ -0,0 +1,180 @@
+# app/services/cache_bus.py
+"""
+跨进程缓存失效通道
+
+多个 uvicorn worker 各有一份进程内缓存（角色配置、系统设置、表结构……），
+某个 worker 保存配置后，其他 worker 只能等 TTL 过期才能看到新值。这里用一张
+cache_versions 表做轻量的失效通道：
+
+1. 保存配置的接口在 commit 之后调用 publish("settings", ...)：
+   本进程立即失效，同时把 cache_versions 中对应频道的版本号 +1
+2. 每个 worker 启动一个后台线程，每 CACHE_BUS_POLL_INTERVAL 秒读一次 cache_versions（主键小表，开销极低），
+   发现版本号变化就调用该频道上注册的失效回调
+3. 各缓存模块通过 subscribe(channel, callback) 注册自己的失效回调，
+   因此可以使用很长的 TTL，仍能在保存后很快丢弃旧数据
+
+频道：
+- settings：system_settings 快照（services.settings_cache）
+- roles：角色权限配置（deps）
+- schema：表结构注册表（services.schema），迁移后 publish("schema")
+- users：员工账号的角色/启用状态（principals 认证缓存）
+- members：会员状态/等级（principals 认证缓存）
+- revocations：token 撤销表有新记录（services.token_revocation 增量拉取）
+- reservations：场地预约批量变化/培训排期变化（services.reservation_index 重新加载）；
+  单条预约的创建/取消不走频道，而是由轮询线程经 on_poll 钩子同步变化的区间（见 reservation_index）
+- holds：会员时段预留有变化（services.slot_holds 重新加载）
+- prices：场地/商品价格有变化（services.pricing 重新加载价格表）
+"""
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from ..config import settings
+from ..database import cursor_scope
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+)
+"""
+
+_lock = threading.Lock()
+_handlers: Dict[str, List[Callable[[], None]]] = {}
+_poll_hooks: List[Callable[[], None]] = []
+_seen_versions: Dict[str, int] = {}
+_baseline_ready = False
+_table_ready = False
+
+_poller: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+
+
+def subscribe(channel: str, callback: Callable[[], None]) -> None:
+    """注册频道的失效回调（本进程 publish 或其他 worker publish 时调用）"""
+    with _lock:
+        _handlers.setdefault(channel, []).append(callback)
+
+
+def on_poll(callback: Callable[[], None]) -> None:
+    """注册每轮轮询后在轮询线程里执行的钩子（如同步预约区间变化）；轮询线程未启动时不会执行"""
+    with _lock:
+        _poll_hooks.append(callback)
+
+
+def is_running() -> bool:
+    """本进程的轮询线程是否在运行"""
+    return _poller is not None and _poller.is_alive()
+
+
+def _fire(channel: str) -> None:
+    for callback in list(_handlers.get(channel, ())):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"缓存失效回调执行失败 [{channel}]: {e}")
+
+
+def _ensure_table(cursor) -> None:
+    global _table_ready
+    if not _table_ready:
+        cursor.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def publish(*channels: str, local: bool = True) -> None:
+    """
+    广播频道失效：本进程立即失效，并递增 cache_versions 中的版本号通知其他 worker。
+    必须在业务数据 commit 之后调用，否则其他进程可能在提交前重新加载到旧数据。
+    单独借连接并提交；写库失败只记日志，本进程仍会失效。
+    local=False：本进程已自行更新缓存（如预约区间索引），只通知其他 worker。
+    """
+    try:
+        with cursor_scope() as cur:
+            _ensure_table(cur)
+            for channel in channels:
+                cur.execute(
+                    """
+                    INSERT INTO cache_versions (name, version) VALUES (%s, 1)
+                    ON DUPLICATE KEY UPDATE version = version + 1
+                    """,
+                    (channel,),
+                )
+                cur.execute("SELECT version FROM cache_versions WHERE name = %s", (channel,))
+                row = cur.fetchone()
+                if row:
+                    # 记下自己发布的版本，轮询时不再重复失效；
+                    # 只有恰好比上次看到的版本大 1 时才记：否则中间还有其他 worker 的递增，要留给轮询触发
+                    version = int(row[0])
+                    with _lock:
+                        if _seen_versions.get(channel, 0) + 1 == version:
+                            _seen_versions[channel] = version
+    except Exception as e:
+        logger.warning(f"发布缓存失效失败 {channels}: {e}")
+
+    if local:
+        for channel in channels:
+            _fire(channel)
+
+
+def poll_once() -> List[str]:
+    """读取一次 cache_versions，对版本号变化的频道触发失效，返回触发的频道"""
+    with cursor_scope() as cur:
+        _ensure_table(cur)
+        cur.execute("SELECT name, version FROM cache_versions")
+        rows = cur.fetchall() or []
+
+    global _baseline_ready
+    changed: List[str] = []
+    with _lock:
+        for name, version in rows:
+            version = int(version)
+            last = _seen_versions.get(name)
+            _seen_versions[name] = version
+            # 第一次轮询只记录基线：进程启动时缓存本来就是空的
+            if _baseline_ready and last != version:
+                changed.append(name)
+        _baseline_ready = True
+    for channel in changed:
+        _fire(channel)
+    return changed
+
+
+def _poll_loop(interval: float) -> None:
+    while not _stop_event.wait(interval):
+        try:
+            poll_once()
+        except Exception as e:
+            logger.warning(f"轮询缓存版本失败: {e}")
+        for hook in list(_poll_hooks):
+            try:
+                hook()
+            except Exception as e:
+                logger.warning(f"缓存轮询钩子执行失败: {e}")
+
+
+def start_cache_bus() -> None:
+    """启动后台轮询线程（应用启动时调用；间隔 <= 0 时不启动）"""
+    global _poller
+    interval = settings.CACHE_BUS_POLL_INTERVAL
+    if interval <= 0 or (_poller is not None and _poller.is_alive()):
+        return
+    try:
+        poll_once()  # 记录启动时的版本基线
+    except Exception as e:
+        logger.warning(f"初始化缓存版本失败，后台线程将继续重试: {e}")
+    _stop_event.clear()
+    _poller = threading.Thread(target=_poll_loop, args=(interval,), name="cache-bus", daemon=True)
+    _poller.start()
+
+
+def stop_cache_bus() -> None:
+    """停止后台轮询线程（应用关闭时调用）"""
+    global _poller
+    _stop_event.set()
+    if _poller is not None:
+        _poller.join(timeout=5)
+        _poller = None
@@ -31,6 +31,11 @@ def get_best_card(cursor, member_id: int) -> Tuple[Optional[Dict[str, Any]], Opt
     except Exception:
         return None, None
 
+    return pick_best_card(cards)
+
+
+def pick_best_card(cards) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """从会员当前有效的卡中选卡：有剩余次数的次卡优先，否则取折扣最低的卡；返回 (card_row, card_type)"""
     best_times_card = None
     best_discount_card = None
     best_discount_value = None
@@ -0,0 +1,337 @@
+# app/services/court_closures.py
+"""
+场地停用批量取消（带退款）
+
+以前场地停用维护时，员工要对每条未来预约调用 POST /court-reservations/{id}/refund，
+每次都单独查订单、生成退款单（读设置 + 表结构）、锁会员行、写通知。
+现在 POST /courts/{id}/closures 指定时间段后登记一个任务，由后台线程按块处理。
+
+登记本身就是停用：court_closure_jobs 的这一行是 resource_calendar 占用的一部分（kind = closure），
+登记事务里按停用时段重建位图行，此后新的预约、预留（claim_court_slots / create_hold）与可用性网格都把它当作占用；
+同一事务里删除该时段内的预留、把指定该场地的候补标记为过期，避免之后被确认或转成预留。
+后台任务取消预约后重建位图时停用时段仍在占用中，不会被释放出来。
+
+只有 running / done 的任务计入占用。任务失败（failed）或管理员解除停用（lifted，POST .../lift）时，
+先按日期锁定窗口内的位图行、再改任务状态、最后按剩余占用重建位图，加锁顺序与下单一致；
+正在执行的任务在下一块提交前发现已解除即回滚该块并停止。已取消的预约、已删除的预留与已过期的候补不会恢复。
+
+
+- 每块一个短事务：加锁取出最多 COURT_CLOSURE_CHUNK_SIZE 条受影响的预约，
+  一次查回它们的场地订单，退款单 / 原订单状态 / 预约状态 / 会员流水 / 通知各一条批量语句写入
+- 同一会员的退款合并成一次余额变更（按 id 顺序加锁），流水仍按预约逐条记录
+- 任务进度写在 court_closure_jobs 表里，任意 worker 都能按 job id 查询
+
+任务只选取仍未取消/未完成的预约，中断后对同一时间段重新提交即可继续；
+已取消但订单未退款的预约不在处理范围内（与单条取消接口一致，需单独退款）。
+"""
+import logging
+import threading
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+from ..database import cursor_scope
+from .court_slots import lock_court_days, release_many
+from .notifications import create_member_notifications
+from .orders import create_refund_orders
+from .reservation_index import note_reservations_changed, note_reservations_released
+from .slot_holds import delete_holds_in_range
+from .waitlist import expire_in_range
+from .wallet import credit_many
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS court_closure_jobs (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    court_id INT NOT NULL,
+    start_time DATETIME NOT NULL,
+    end_time DATETIME NOT NULL,
+    reason VARCHAR(255) NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    total INT NOT NULL DEFAULT 0,
+    processed INT NOT NULL DEFAULT 0,
+    refunded_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    error VARCHAR(255) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at DATETIME NULL,
+    KEY idx_court_closure_jobs_court (court_id, created_at),
+    KEY idx_court_closure_jobs_window (court_id, start_time, end_time)
+)
+"""
+
+# 受影响的预约：该场地上与停用时段重叠、尚未取消/完成的
+_AFFECTED_WHERE = """
+    r.court_id = %s
+    AND r.status NOT IN ('已取消', '已完成')
+    AND r.start_time < %s
+    AND r.end_time > %s
+"""
+
+_REFUNDED_STATUSES = {"refunded", "partial_refund", "cancelled", "canceled"}
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_LIFTED = "lifted"
+# 计入场地占用的任务状态（与 resource_calendar.occupancy_query 一致）
+ACTIVE_STATUSES = (STATUS_RUNNING, STATUS_DONE)
+
+_table_ready = False
+
+
+class ClosureError(ValueError):
+    """停用任务已不在生效中（已解除或已失败）"""
+
+
+class ClosureNotFound(ClosureError):
+    """停用任务不存在或不属于该场地"""
+
+
+class _JobStopped(Exception):
+    """任务在执行中被解除，停止处理"""
+
+
+def ensure_table() -> None:
+    """建表（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _table_ready
+    if not _table_ready:
+        with cursor_scope() as cur:
+            cur.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def create_job(court_id: int, start: datetime, end: datetime, reason: Optional[str] = None, *, cursor) -> Dict[str, Any]:
+    """
+    登记停用时段并统计受影响的预约数（需外部 commit）
+    commit 后调用 publish("holds")、note_reservations_changed() 与 start_job；
+    返回 {"job_id", "total", "holds_removed", "waitlist_expired"}
+    """
+    ensure_table()
+    cursor.execute(
+        f"SELECT COUNT(*) AS cnt FROM court_reservations r WHERE {_AFFECTED_WHERE}",
+        (court_id, end, start),
+    )
+    row = cursor.fetchone()
+    total = int((row["cnt"] if isinstance(row, dict) else row[0]) or 0) if row else 0
+    cursor.execute(
+        """
+        INSERT INTO court_closure_jobs (court_id, start_time, end_time, reason, total)
+        VALUES (%s, %s, %s, %s, %s)
+        """,
+        (court_id, start, end, reason, total),
+    )
+    job_id = cursor.lastrowid
+    # 停用时段已计入占用：按 (场地, 日期) 加锁重建位图，并发下单在行锁上等待，提交后即看到停用
+    release_many([{"court_id": court_id, "start_time": start, "end_time": end}], cursor=cursor)
+    holds_removed = delete_holds_in_range(court_id, start, end, cursor=cursor)
+    waitlist_expired = expire_in_range(court_id, start, end, cursor=cursor)
+    return {"job_id": job_id, "total": total, "holds_removed": holds_removed, "waitlist_expired": waitlist_expired}
+
+
+def get_job(job_id: int, *, cursor) -> Optional[Dict[str, Any]]:
+    """查询任务进度，不存在时返回 None（传入的 cursor 需为 dictionary 游标）"""
+    ensure_table()
+    cursor.execute(
+        """
+        SELECT id, court_id, start_time, end_time, reason, status, total, processed,
+               refunded_amount, error, created_at, finished_at
+        FROM court_closure_jobs
+        WHERE id = %s
+        """,
+        (job_id,),
+    )
+    return cursor.fetchone()
+
+
+def _latest_court_orders(cursor, reservation_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """一次查回每条预约最新的场地订单"""
+    cursor.execute(
+        f"""
+        SELECT *
+        FROM orders
+        WHERE related_id IN ({', '.join(['%s'] * len(reservation_ids))})
+          AND LOWER(order_type) = 'court'
+        ORDER BY id DESC
+        """,
+        tuple(reservation_ids),
+    )
+    latest: Dict[int, Dict[str, Any]] = {}
+    for order in cursor.fetchall() or []:
+        latest.setdefault(int(order["related_id"]), order)
+    return latest
+
+
+def _process_chunk(cursor, job: Dict[str, Any], limit: int) -> Dict[str, Any]:
+    """取消一块受影响的预约并退款（需外部 commit），返回 {"ids", "refunded"}"""
+    cursor.execute(
+        f"""
+        SELECT r.id, r.member_id, r.court_id, r.start_time, r.end_time,
+               m.name AS member_name, c.name AS court_name
+        FROM court_reservations r
+        LEFT JOIN members m ON r.member_id = m.id
+        LEFT JOIN courts c ON r.court_id = c.id
+        WHERE {_AFFECTED_WHERE}
+        ORDER BY r.id
+        LIMIT %s
+        FOR UPDATE
+        """,
+        (job["court_id"], job["end_time"], job["start_time"], limit),
+    )
+    reservations = cursor.fetchall() or []
+    if not reservations:
+        return {"ids": [], "refunded": Decimal("0")}
+
+    ids = [int(r["id"]) for r in reservations]
+    orders = _latest_court_orders(cursor, ids)
+    reason = job.get("reason") or "场地停用"
+
+    refunds: List[Dict[str, Any]] = []
+    credits: List[Dict[str, Any]] = []
+    refunded_order_ids: List[int] = []
+    notices: List[Dict[str, Any]] = []
+    total = Decimal("0")
+    for r in reservations:
+        order = orders.get(int(r["id"]))
+        status_raw = (order.get("status") or order.get("order_status") or "").lower() if order else ""
+        amount = (order.get("pay_amount") or order.get("total_amount")) if order else None
+        refunded = order is not None and status_raw not in _REFUNDED_STATUSES and amount is not None
+        if refunded:
+            amount = Decimal(str(amount))
+            total += amount
+            refunded_order_ids.append(int(order["id"]))
+            refunds.append({
+                "original_order_id": order["id"],
+                "original_order_no": order.get("order_no"),
+                "member_id": r["member_id"],
+                "member_name": r["member_name"],
+                "amount": amount,
+            })
+            if r["member_id"]:
+                credits.append({"member_id": int(r["member_id"]), "amount": amount, "remark": f"{reason}退款：{r['id']}"})
+        if r["member_id"]:
+            when = r["start_time"].strftime("%Y-%m-%d %H:%M") if isinstance(r["start_time"], datetime) else str(r["start_time"])
+            notices.append({
+                "member_id": r["member_id"],
+                "title": "预约取消通知",
+                "content": f"{r['court_name'] or '场地'} {when} 预约因{reason}已取消" + ("，费用已退回" if refunded else ""),
+            })
+
+    marks = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"UPDATE court_reservations SET status = '已取消' WHERE id IN ({marks})", tuple(ids))
+    release_many(reservations, cursor=cursor)
+
+    create_refund_orders(cursor=cursor, items=refunds, order_type="court", remark=f"{reason}批量退款")
+    if refunded_order_ids:
+        order_cols = [k for k in ("status", "order_status") if k in next(iter(orders.values()))]
+        if order_cols:
+            cursor.execute(
+                f"""
+                UPDATE orders SET {', '.join(f'{k} = %s' for k in order_cols)}
+                WHERE id IN ({', '.join(['%s'] * len(refunded_order_ids))})
+                """,
+                (*(["refunded"] * len(order_cols)), *refunded_order_ids),
+            )
+    credit_many(cursor, credits)
+
+    try:
+        create_member_notifications(notices, level="warning", cursor=cursor)
+    except Exception as e:
+        # 通知失败不影响取消与退款
+        logger.warning(f"场地停用通知写入失败: {e}")
+
+    cursor.execute(
+        """
+        UPDATE court_closure_jobs
+        SET processed = processed + %s, refunded_amount = refunded_amount + %s
+        WHERE id = %s AND status = %s
+        """,
+        (len(ids), str(total), job["id"], STATUS_RUNNING),
+    )
+    if cursor.rowcount == 0:
+        # 停用已被解除：回滚这一块（预约不取消、不退款）
+        raise _JobStopped()
+    return {"ids": ids, "refunded": total}
+
+
+def _deactivate(cursor, job: Dict[str, Any], status: str, error: Optional[str] = None) -> bool:
+    """
+    让停用时段不再占用（需外部 commit，commit 后调用 note_reservations_changed）；任务已不在生效中时返回 False
+    先锁窗口内的位图行再改任务状态，与下单（位图行 → 占用查询的共享锁）的加锁顺序一致
+    """
+    court_id, start, end = int(job["court_id"]), job["start_time"], job["end_time"]
+    lock_court_days(court_id, start, end, cursor=cursor)
+    cursor.execute(
+        f"""
+        UPDATE court_closure_jobs
+        SET status = %s, error = %s, finished_at = NOW()
+        WHERE id = %s AND status IN ({', '.join(['%s'] * len(ACTIVE_STATUSES))})
+        """,
+        (status, error[:255] if error else None, job["id"], *ACTIVE_STATUSES),
+    )
+    if cursor.rowcount == 0:
+        return False
+    release_many([{"court_id": court_id, "start_time": start, "end_time": end}], cursor=cursor)
+    return True
+
+
+def lift_job(court_id: int, job_id: int, *, cursor) -> Dict[str, Any]:
+    """
+    解除停用（需外部 commit，commit 后调用 note_reservations_changed）：窗口不再占用，位图按剩余占用重建
+    任务不存在或不属于该场地时抛出 ClosureNotFound，已不在生效中时抛出 ClosureError；传入的 cursor 需为 dictionary 游标
+    """
+    job = get_job(job_id, cursor=cursor)
+    if not job or int(job["court_id"]) != int(court_id):
+        raise ClosureNotFound("停用任务不存在")
+    if job["status"] not in ACTIVE_STATUSES or not _deactivate(cursor, job, STATUS_LIFTED):
+        raise ClosureError("停用已解除或任务已失败")
+    return job
+
+
+def _finish(job_id: int) -> None:
+    with cursor_scope() as cur:
+        cur.execute(
+            "UPDATE court_closure_jobs SET status = %s, finished_at = NOW() WHERE id = %s AND status = %s",
+            (STATUS_DONE, job_id, STATUS_RUNNING),
+        )
+
+
+def _fail(job: Dict[str, Any], error: str) -> None:
+    """任务失败：记录错误，停用时段不再占用"""
+    with cursor_scope(dictionary=True) as cur:
+        deactivated = _deactivate(cur, job, STATUS_FAILED, error)
+    if deactivated:
+        note_reservations_changed()
+
+
+def run_job(job_id: int, chunk_size: Optional[int] = None) -> None:
+    """按块处理一个停用任务直到没有受影响的预约；每块单独提交，失败时记录错误并停止"""
+    limit = chunk_size or settings.COURT_CLOSURE_CHUNK_SIZE
+    job = None
+    try:
+        with cursor_scope(dictionary=True) as cur:
+            job = get_job(job_id, cursor=cur)
+        if not job or job["status"] != STATUS_RUNNING:
+            return
+        while True:
+            with cursor_scope(dictionary=True) as cur:
+                result = _process_chunk(cur, job, limit)
+            if not result["ids"]:
+                break
+            note_reservations_released(result["ids"])
+        _finish(job_id)
+    except _JobStopped:
+        logger.info(f"场地停用任务 {job_id} 已解除，停止处理")
+    except Exception as e:
+        logger.exception(f"场地停用任务 {job_id} 失败")
+        if job:
+            try:
+                _fail(job, str(e))
+            except Exception:
+                logger.exception(f"记录场地停用任务 {job_id} 失败状态时出错")
+
+
+def start_job(job_id: int) -> None:
+    """在后台线程中执行停用任务（commit 之后调用）"""
+    threading.Thread(target=run_job, args=(job_id,), name=f"court-closure-{job_id}", daemon=True).start()
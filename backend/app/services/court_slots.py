@@ -0,0 +1,309 @@
+# app/services/court_slots.py
+"""
+场地日占用位图（court_day_slots）
+
+以前下单时用不加锁的 COUNT(*) 检查时间段冲突再插入：并发下单同一时段可能重复预约；
+改成加锁查询又会在 court_reservations 上产生大范围的间隙锁，把不相干的预约也串行化。
+这里为每个场地每天维护一行位图（96 个 15 分钟时段，BINARY(12)）：
+
+1. 下单时对涉及的 (场地, 日期) 行 INSERT ... ON DUPLICATE KEY UPDATE 建行并加排他锁，
+   只有真正竞争同一场地同一天的请求才会互相等待
+2. 在 Python 中检查位图与新预约的掩码是否相交，不相交直接置位并在同一事务中写回（O(1)）
+3. 掩码按 15 分钟向外取整，是实际占用的超集：不相交一定无冲突；相交时（可能只是相邻的非整刻预约）
+   在已持有行锁的情况下再按精确条件查一次占用（预约与排期）
+4. 某天的位图行首次创建时根据已有预约重建；取消/删除预约后也按剩余预约重建，避免误清相邻预约的位；
+   场地改名（排期按名称对应的场地变化）时删除相关场地的位图行（reset_courts），之后按需重建
+5. 批量占用（周期预约）用 claim_many：一次性锁定全部位图行，冲突复查/重建共用一次范围查询，
+   写回用一条多行 INSERT ... ON DUPLICATE KEY UPDATE，往返次数与预约条数无关
+6. "占用"包括未取消的预约、映射到该场地的培训排期与场地停用时段（resource_calendar），互相可见
+7. 会员端的时段预留（slot_holds）不置位，持有行锁时再查一次未过期的预留；预留本身也走这里加锁检查
+
+行锁之外不需要其他加锁，写入与预约在同一事务内（需外部 commit）。
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..database import cursor_scope
+from .resource_calendar import occupancy_rows
+from .slot_holds import hold_conflict_exists, holds_in_range
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BITMAP_BYTES = SLOTS_PER_DAY // 8
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS court_day_slots (
+    court_id INT NOT NULL,
+    slot_date DATE NOT NULL,
+    bitmap BINARY(12) NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (court_id, slot_date)
+)
+"""
+
+# 建行或锁定已有行（都加排他锁）
+_LOCK_ROW_SQL = """
+INSERT INTO court_day_slots (court_id, slot_date, bitmap) VALUES (%s, %s, %s)
+ON DUPLICATE KEY UPDATE bitmap = bitmap
+"""
+
+_table_ready = False
+
+
+class SlotConflict(ValueError):
+    """时间段已被占用"""
+
+
+def ensure_table() -> None:
+    """建表（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _table_ready
+    if not _table_ready:
+        # 占用查询包含场地停用时段，停用表也要先存在（court_closures 依赖本模块，在这里按需导入）
+        from .court_closures import ensure_table as ensure_closures_table
+
+        ensure_closures_table()
+        with cursor_scope() as cur:
+            cur.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+# ========== 位运算 ==========
+
+def day_masks(start: datetime, end: datetime) -> Dict[date, int]:
+    """[start, end) 按天拆分后的时段掩码（开始向下、结束向上取整到 15 分钟）"""
+    masks: Dict[date, int] = {}
+    step = timedelta(minutes=SLOT_MINUTES)
+    day = start.date()
+    while datetime.combine(day, time(0)) < end:
+        day_start = datetime.combine(day, time(0))
+        lo = max(start, day_start) - day_start
+        hi = min(end, day_start + timedelta(days=1)) - day_start
+        first = int(lo // step)
+        last = -int(-hi // step)  # 向上取整
+        if last > first:
+            masks[day] = ((1 << (last - first)) - 1) << first
+        day += timedelta(days=1)
+    return masks
+
+
+def decode_bitmap(raw) -> int:
+    if raw is None:
+        return 0
+    return int.from_bytes(bytes(raw), "big")
+
+
+def encode_bitmap(bits: int) -> bytes:
+    return bits.to_bytes(BITMAP_BYTES, "big")
+
+
+def split_days(start: datetime, end: datetime) -> List[date]:
+    return sorted(day_masks(start, end))
+
+
+# ========== 数据库操作（需外部 commit） ==========
+
+def _row(row, key, index):
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+def _rebuild_bits(cursor, court_id: int, day: date) -> int:
+    """按该场地当天未取消的预约与正常的排期重建位图（加锁读，读到最新已提交数据与本事务的修改）"""
+    day_start = datetime.combine(day, time(0))
+    bits = 0
+    for c, start, end, _, _ in occupancy_rows(cursor, day_start, day_start + timedelta(days=1), court_ids=[court_id], lock=True):
+        if c == court_id:
+            bits |= day_masks(start, end).get(day, 0)
+    return bits
+
+
+def _lock_day(cursor, court_id: int, day: date) -> Tuple[int, bool]:
+    """
+    锁定 (场地, 日期) 位图行，不存在时创建；返回 (位图, 是否新建)
+    建行与加锁在同一条语句里完成，且直接加排他锁：INSERT IGNORE 遇到已有行只加共享锁，
+    两个请求同时首次预约同一场地同一天时都持有共享锁再升级，会互相死锁
+    """
+    cursor.execute(
+        _LOCK_ROW_SQL,
+        (court_id, day, encode_bitmap(0)),
+    )
+    # 未设置 CLIENT_FOUND_ROWS：新插入为 1，已有行且值不变为 0
+    created = cursor.rowcount == 1
+    cursor.execute(
+        "SELECT bitmap FROM court_day_slots WHERE court_id = %s AND slot_date = %s FOR UPDATE",
+        (court_id, day),
+    )
+    row = cursor.fetchone()
+    return decode_bitmap(_row(row, "bitmap", 0) if row else None), created
+
+
+def _write_day(cursor, court_id: int, day: date, bits: int) -> None:
+    cursor.execute(
+        "UPDATE court_day_slots SET bitmap = %s WHERE court_id = %s AND slot_date = %s",
+        (encode_bitmap(bits), court_id, day),
+    )
+
+
+def _has_exact_conflict(cursor, court_id: int, start: datetime, end: datetime, exclude=None) -> bool:
+    rows = occupancy_rows(cursor, start, end, court_ids=[court_id], exclude=exclude, lock=True)
+    return _overlaps(((c, s, e) for c, s, e, _, _ in rows), court_id, start, end)
+
+
+def _overlaps(rows: Iterable[Tuple[int, datetime, datetime]], court_id: int, start: datetime, end: datetime) -> bool:
+    return any(c == court_id and s < end and e > start for c, s, e in rows)
+
+
+def claim_court_slots(
+    court_id: int,
+    start: datetime,
+    end: datetime,
+    *,
+    cursor,
+    hold_token: Optional[str] = None,
+    mark: bool = True,
+    exclude: Optional[Tuple[str, int]] = None,
+) -> None:
+    """
+    占用场地时段：锁定涉及的位图行，检查冲突并置位（需外部 commit）
+    冲突时抛出 SlotConflict，调用方应回滚事务
+    按日期顺序加锁，跨天预约之间不会死锁
+    hold_token: 确认预留时传入，跳过自己的预留；mark=False 时只检查不置位（创建预留）
+    exclude: (kind, id)，精确复查时排除这一条（修改排期时排除自己）
+    """
+    ensure_table()
+    masks = day_masks(start, end)
+    new_bits: Dict[date, int] = {}
+    for day in sorted(masks):
+        bits, created = _lock_day(cursor, court_id, day)
+        if created:
+            bits = _rebuild_bits(cursor, court_id, day)
+            _write_day(cursor, court_id, day, bits)
+        if bits & masks[day]:
+            # 位图相交不一定真冲突（相邻的非整刻预约），持有行锁后按精确条件再查一次
+            if _has_exact_conflict(cursor, court_id, start, end, exclude):
+                raise SlotConflict("该时间段已被预约，请选择其他时间")
+        new_bits[day] = bits | masks[day]
+    if hold_conflict_exists(cursor, court_id, start, end, hold_token):
+        raise SlotConflict("该时间段已被其他会员预留，请选择其他时间")
+    if mark:
+        for day, bits in new_bits.items():
+            _write_day(cursor, court_id, day, bits)
+
+
+def claim_many(items: Sequence[Tuple[int, datetime, datetime]], *, cursor) -> None:
+    """
+    批量占用 [(court_id, start, end), ...]（需外部 commit），与逐条 claim_court_slots 语义相同
+    调用方需先保证 items 之间互不重叠；任一时段冲突时抛出 SlotConflict（消息指明哪一次），调用方应回滚
+    """
+    if not items:
+        return
+    ensure_table()
+    masks: Dict[Tuple[int, date], int] = {}
+    for court_id, start, end in items:
+        for day, mask in day_masks(start, end).items():
+            key = (int(court_id), day)
+            masks[key] = masks.get(key, 0) | mask
+    keys = sorted(masks)
+    cond = " OR ".join(["(court_id = %s AND slot_date = %s)"] * len(keys))
+    key_params = tuple(v for key in keys for v in key)
+
+    # 不加锁地找出缺失的行；并发下被别人抢先建好的行也按"新建"处理，重建结果同样正确
+    cursor.execute(f"SELECT court_id, slot_date FROM court_day_slots WHERE {cond}", key_params)
+    existing = {(int(_row(r, "court_id", 0)), _row(r, "slot_date", 1)) for r in cursor.fetchall() or []}
+    missing = [key for key in keys if key not in existing]
+
+    # 按主键顺序一次性建行并加排他锁（同 _lock_day，不经过共享锁），再读出位图
+    cursor.executemany(
+        _LOCK_ROW_SQL,
+        [(court_id, day, encode_bitmap(0)) for court_id, day in keys],
+    )
+    cursor.execute(
+        f"SELECT court_id, slot_date, bitmap FROM court_day_slots WHERE {cond} ORDER BY court_id, slot_date FOR UPDATE",
+        key_params,
+    )
+    bits = {
+        (int(_row(r, "court_id", 0)), _row(r, "slot_date", 1)): decode_bitmap(_row(r, "bitmap", 2))
+        for r in cursor.fetchall() or []
+    }
+
+    court_ids = sorted({court_id for court_id, _ in keys})
+    span_start = datetime.combine(min(day for _, day in keys), time(0))
+    span_end = datetime.combine(max(day for _, day in keys), time(0)) + timedelta(days=1)
+    booked: Optional[List[Tuple[int, datetime, datetime]]] = None
+
+    def _booked() -> List[Tuple[int, datetime, datetime]]:
+        # 重建与精确复查共用一次范围查询
+        nonlocal booked
+        if booked is None:
+            rows = occupancy_rows(cursor, span_start, span_end, court_ids=court_ids, lock=True)
+            booked = [(c, s, e) for c, s, e, _, _ in rows]
+        return booked
+
+    for court_id, day in missing:
+        day_bits = 0
+        for c, s, e in _booked():
+            if c == court_id:
+                day_bits |= day_masks(s, e).get(day, 0)
+        bits[(court_id, day)] = day_bits
+
+    if any(bits.get(key, 0) & masks[key] for key in keys):
+        for court_id, start, end in items:
+            if _overlaps(_booked(), int(court_id), start, end):
+                raise SlotConflict(f"{start.strftime('%Y-%m-%d %H:%M')} 的时间段已被预约")
+
+    held = holds_in_range(cursor, court_ids, span_start, span_end)
+    for court_id, start, end in items:
+        if _overlaps(held, int(court_id), start, end):
+            raise SlotConflict(f"{start.strftime('%Y-%m-%d %H:%M')} 的时间段已被会员预留")
+
+    cursor.executemany(
+        """
+        INSERT INTO court_day_slots (court_id, slot_date, bitmap) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE bitmap = VALUES(bitmap)
+        """,
+        [(court_id, day, encode_bitmap(bits.get((court_id, day), 0) | masks[(court_id, day)])) for court_id, day in keys],
+    )
+
+
+def lock_court_days(court_id: int, start: datetime, end: datetime, *, cursor) -> None:
+    """按日期顺序锁定（必要时创建）该场地 [start, end) 涉及的位图行（需外部 commit），之后再改动占用来源并重建"""
+    ensure_table()
+    for day in split_days(start, end):
+        _lock_day(cursor, court_id, day)
+
+
+def release_court_slots(court_id: int, start: datetime, end: datetime, *, cursor) -> None:
+    """
+    释放场地时间段：在预约已取消/删除（同一事务内）之后调用，按剩余预约重建涉及日期的位图（需外部 commit）
+    """
+    ensure_table()
+    for day in split_days(start, end):
+        _lock_day(cursor, court_id, day)
+        _write_day(cursor, court_id, day, _rebuild_bits(cursor, court_id, day))
+
+
+def release_many(reservations: Iterable, *, cursor) -> None:
+    """批量释放（如删除会员的全部预约），reservations 为含 court_id/start_time/end_time 的行；按 (场地, 日期) 去重后逐行重建"""
+    ensure_table()
+    keys = sorted({
+        (int(_row(r, "court_id", 0)), day)
+        for r in reservations
+        for day in split_days(_row(r, "start_time", 1), _row(r, "end_time", 2))
+    })
+    for court_id, day in keys:
+        _lock_day(cursor, court_id, day)
+        _write_day(cursor, court_id, day, _rebuild_bits(cursor, court_id, day))
+
+
+def reset_courts(court_ids: Iterable[int], *, cursor) -> None:
+    """
+    删除这些场地的全部位图行（需外部 commit），之后首次加锁时按当时的占用重建
+    排期与场地的对应关系变化（场地改名）时调用：旧的位图既漏了新对应上的排期，又留着已不属于该场地的排期
+    """
+    court_ids = sorted({int(c) for c in court_ids})
+    if not court_ids:
+        return
+    ensure_table()
+    cursor.execute(
+        f"DELETE FROM court_day_slots WHERE court_id IN ({', '.join(['%s'] * len(court_ids))})",
+        tuple(court_ids),
+    )
@@ -5,7 +5,38 @@
 折扣配置存储在系统设置中，支持动态配置。
 """
 import json
-from typing import Any
+from typing import Any, Dict
+
+from .settings_cache import get_parsed
+
+
+def _parse_discount_map(levels_json: str | None) -> Dict[str, float]:
+    """
+    把 member_levels_json 解析为 {等级 code/name: 折扣}，只包含 enabled 的等级。
+    同一个 code/name 以配置中靠前的等级为准；折扣非正数或无法解析时按 100 处理。
+    """
+    discount_map: Dict[str, float] = {}
+    if not levels_json:
+        return discount_map
+    try:
+        levels = json.loads(levels_json)
+    except Exception:
+        return discount_map
+    if not isinstance(levels, list):
+        return discount_map
+
+    for lv in levels:
+        if not isinstance(lv, dict) or not lv.get("enabled", True):
+            continue
+        try:
+            d = float(lv.get("discount", 100))
+        except Exception:
+            d = 100.0
+        if d <= 0:
+            d = 100.0
+        discount_map.setdefault(str(lv.get("code")), d)
+        discount_map.setdefault(str(lv.get("name")), d)
+    return discount_map
 
 
 def get_member_discount(cursor, member_id: int) -> float:
@@ -14,7 +45,7 @@ def get_member_discount(cursor, member_id: int) -> float:
     
     折扣计算规则：
     1. 从 members 表获取会员的 level 字段
-    2. 从 system_settings 表读取会员等级配置（JSON 格式）
+    2. 从系统设置缓存读取会员等级配置（JSON 只在设置变更后解析一次）
     3. 匹配会员等级（按 code 或 name 匹配）
     4. 返回对应的折扣比例
     
@@ -53,36 +84,16 @@ def get_member_discount(cursor, member_id: int) -> float:
             return discount
         level = str(level_raw)
 
-        cursor.execute(
-            """
-            SELECT setting_value FROM system_settings
-            WHERE group_key = 'member' AND setting_key = 'member_levels_json'
-            """
-        )
-        srow = cursor.fetchone()
-        levels_json = srow.get("setting_value") if isinstance(srow, dict) else (srow[0] if srow else None)
-        if not levels_json:
-            return discount
-
-        levels = json.loads(levels_json)
-        if not isinstance(levels, list):
-            return discount
-
-        for lv in levels:
-            code = str(lv.get("code"))
-            name = str(lv.get("name"))
-            enabled = lv.get("enabled", True)
-            if not enabled:
-                continue
-            if level == code or level == name:
-                try:
-                    d = float(lv.get("discount", 100))
-                    if d > 0:
-                        discount = d
-                except Exception:
-                    pass
-                break
+        discount = level_discount(level, cursor=cursor)
     except Exception:
         return 100.0
 
     return discount
+
+
+def level_discount(level: Any, cursor=None) -> float:
+    """会员等级（code 或 name）对应的折扣，未配置时返回 100；等级映射按系统设置版本缓存"""
+    if not level:
+        return 100.0
+    discount_map = get_parsed("member", "member_levels_json", _parse_discount_map, cursor=cursor)
+    return discount_map.get(str(level), 100.0)
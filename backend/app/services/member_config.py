@@ -1,44 +1,13 @@
 import json
 from typing import Any, Dict, List, Tuple
 
+from .settings_cache import get_parsed, get_setting_value
+
 DEFAULT_LEVEL_NAME = "普通会员"
 
 
-def load_member_config(cursor) -> Dict[str, Any]:
-    """
-    读取会员等级/卡种配置：
-    {
-        "default_level": "normal",
-        "levels": [
-            {"name": "普通会员", "code": "normal", "discount": 100, "enabled": True},
-            ...
-        ]
-    }
-    """
-    config: Dict[str, Any] = {"default_level": DEFAULT_LEVEL_NAME, "levels": []}
-
-    cursor.execute(
-        """
-        SELECT setting_value
-        FROM system_settings
-        WHERE group_key = 'member' AND setting_key = 'default_level'
-        """
-    )
-    row = cursor.fetchone()
-    if row:
-        value = row.get("setting_value") if isinstance(row, dict) else row[0]
-        if value:
-            config["default_level"] = str(value)
-
-    cursor.execute(
-        """
-        SELECT setting_value
-        FROM system_settings
-        WHERE group_key = 'member' AND setting_key = 'member_levels_json'
-        """
-    )
-    row = cursor.fetchone()
-    levels_json = row.get("setting_value") if isinstance(row, dict) else (row[0] if row else None)
+def _parse_levels(levels_json: str | None) -> Tuple[Dict[str, Any], ...]:
+    """解析 member_levels_json（结果由设置缓存按版本缓存，视为只读）"""
     levels: List[Dict[str, Any]] = []
     if levels_json:
         try:
@@ -61,9 +30,27 @@ def load_member_config(cursor) -> Dict[str, Any]:
                     )
         except json.JSONDecodeError:
             levels = []
+    return tuple(levels)
+
 
-    config["levels"] = levels
-    return config
+def load_member_config(cursor) -> Dict[str, Any]:
+    """
+    读取会员等级/卡种配置：
+    {
+        "default_level": "normal",
+        "levels": [
+            {"name": "普通会员", "code": "normal", "discount": 100, "enabled": True},
+            ...
+        ]
+    }
+    配置取自进程内设置缓存，JSON 只在设置变更后解析一次；返回的是副本，可自由修改。
+    """
+    default_level = get_setting_value("member", "default_level", cursor=cursor)
+    levels = get_parsed("member", "member_levels_json", _parse_levels, cursor=cursor)
+    return {
+        "default_level": str(default_level) if default_level else DEFAULT_LEVEL_NAME,
+        "levels": [dict(lv) for lv in levels],
+    }
 
 
 def normalize_level(value: str | None, config: Dict[str, Any]) -> Tuple[str, Dict[str, Any] | None]:
@@ -1,18 +1,18 @@
 # app/services/notifications.py
 from typing import Optional, List, Dict, Any
-from ..database import get_db
+from ..database import cursor_scope
+from .schema import schema_registry
 
 
-def _detect_columns(cursor) -> set[str]:
-    cursor.execute("SHOW COLUMNS FROM notifications")
-    rows = cursor.fetchall() or []
-    cols = set()
-    for r in rows:
-        if isinstance(r, dict):
-            cols.add(r.get("Field"))
-        else:
-            cols.add(r[0])
-    return {c for c in cols if c}
+def _first_admin_id(cursor) -> int | None:
+    """返回首个启用中的管理员 id，users 表不存在时返回 None"""
+    if not schema_registry.has_table("users", cursor):
+        return None
+    cursor.execute("SELECT id FROM users WHERE role = 'admin' AND is_active = 1 ORDER BY id ASC LIMIT 1")
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return row.get("id") if isinstance(row, dict) else row[0]
 
 
 def create_notification(
@@ -22,26 +22,21 @@ def create_notification(
     title: str,
     content: str,
     level: str = "info",
+    cursor=None,
 ) -> int:
     """
     创建一条通知，支持 user_id（员工/管理员）或 member_id（会员）。
     - 若表结构要求 user_id 非空且未传，则回退为首个管理员用户 id；如无管理员则抛错。
-    - 自动探测列存在性，兼容 member_id 可选场景。
+    - 按表结构注册表判断列存在性，兼容 member_id 可选场景。
+    - 传入 cursor 时与业务写入同一事务（需外部 commit），否则单独借连接并提交。
     """
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    try:
-        cols = _detect_columns(cursor)
+    with cursor_scope(cursor, dictionary=True) as cur:
+        cols = schema_registry.columns("notifications", cur)
 
         final_user_id = user_id
         if final_user_id is None:
             # 回退首个 admin 用户
-            cursor.execute("SHOW TABLES LIKE 'users'")
-            if cursor.fetchone():
-                cursor.execute("SELECT id FROM users WHERE role = 'admin' AND is_active = 1 ORDER BY id ASC LIMIT 1")
-                row = cursor.fetchone()
-                if row:
-                    final_user_id = row.get("id")
+            final_user_id = _first_admin_id(cur)
             if final_user_id is None:
                 raise ValueError("no admin user found for notification and user_id is required")
 
@@ -62,38 +57,59 @@ def create_notification(
         placeholders.extend(["%s", "%s", "%s"])
         params.extend([title, content, level])
 
-        sql = f"INSERT INTO notifications ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
-        cursor.execute(sql, tuple(params))
-        db.commit()
-        return cursor.lastrowid
-    finally:
-        cursor.close()
-        db.close()
+        sql = schema_registry.insert_sql("notifications", columns, placeholders)
+        cur.execute(sql, tuple(params))
+        return cur.lastrowid
+
+
+def create_member_notifications(items: List[Dict[str, Any]], level: str = "info", cursor=None) -> int:
+    """
+    批量给会员发通知：items 为 {"member_id", "title", "content"}，一条 executemany 写入，返回写入条数。
+    - user_id 非空时统一回退为首个管理员；notifications 表没有 member_id 列时不写入
+    - 传入 cursor 时与业务写入同一事务（需外部 commit）
+    """
+    if not items:
+        return 0
+    with cursor_scope(cursor, dictionary=True) as cur:
+        cols = schema_registry.columns("notifications", cur)
+        if "member_id" not in cols:
+            return 0
+
+        columns = ["member_id", "title", "content", "level"]
+        prefix: List[Any] = []
+        if "user_id" in cols:
+            admin_id = _first_admin_id(cur)
+            if admin_id is None:
+                raise ValueError("no admin user found for notification and user_id is required")
+            columns.insert(0, "user_id")
+            prefix.append(admin_id)
+
+        sql = schema_registry.insert_sql("notifications", columns, ["%s"] * len(columns))
+        cur.executemany(
+            sql,
+            [(*prefix, it["member_id"], it["title"], it["content"], level) for it in items],
+        )
+        return len(items)
 
 
-def create_admin_notifications(title: str, content: str, level: str = "info") -> None:
+def create_admin_notifications(title: str, content: str, level: str = "info", cursor=None) -> None:
     """
     发送给所有 admin 用户的通知（按 users.role='admin' 且 is_active=1）
+    所有管理员的通知复用同一条连接写入；传入 cursor 时需外部 commit。
     """
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SHOW TABLES LIKE 'users'")
-        if not cursor.fetchone():
+    with cursor_scope(cursor, dictionary=True) as cur:
+        if not schema_registry.has_table("users", cur):
             return
-        cursor.execute("SELECT id FROM users WHERE role = 'admin' AND is_active = 1")
-        admins = cursor.fetchall() or []
+        cur.execute("SELECT id FROM users WHERE role = 'admin' AND is_active = 1")
+        admins = cur.fetchall() or []
         for a in admins:
-            uid = a.get("id")
+            uid = a.get("id") if isinstance(a, dict) else a[0]
             if uid:
                 try:
-                    create_notification(user_id=uid, title=title, content=content, level=level)
+                    create_notification(user_id=uid, title=title, content=content, level=level, cursor=cur)
                 except Exception:
                     # 单个失败不影响整体
                     continue
-    finally:
-        cursor.close()
-        db.close()
 
 
 def list_notifications(
@@ -105,14 +121,14 @@ def list_notifications(
     keyword: Optional[str] = None,
     page: int = 1,
     page_size: int = 20,
+    cursor=None,
 ) -> Dict[str, Any]:
     """
     列出通知，优先按 member_id 过滤，其次 user_id；支持已读状态筛选 + 分页。
+    传入的 cursor 需为 dictionary 游标。
     """
     offset = (page - 1) * page_size
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    try:
+    with cursor_scope(cursor, dictionary=True) as cursor:
         where_sql = "WHERE 1=1"
         params: List[Any] = []
 
@@ -152,18 +168,16 @@ def list_notifications(
         items = cursor.fetchall()
 
         return {"total": total, "items": items}
-    finally:
-        cursor.close()
-        db.close()
 
 
-def mark_notification_read(*, user_id: int | None = None, member_id: int | None = None, notif_id: int) -> bool:
+def mark_notification_read(
+    *, user_id: int | None = None, member_id: int | None = None, notif_id: int, cursor=None
+) -> bool:
     """
     将通知标记为已读，优先 member_id，再 user_id。
+    传入 cursor 时需外部 commit。
     """
-    db = get_db()
-    cursor = db.cursor()
-    try:
+    with cursor_scope(cursor) as cursor:
         where_sql = "id = %s"
         params: List[Any] = [notif_id]
 
@@ -180,22 +194,17 @@ def mark_notification_read(*, user_id: int | None = None, member_id: int | None
         WHERE {where_sql}
         """
         cursor.execute(sql, tuple(params))
-        db.commit()
         return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        db.close()
 
 
-def mark_all_notifications_read(*, user_id: int | None = None, member_id: int | None = None) -> int:
+def mark_all_notifications_read(*, user_id: int | None = None, member_id: int | None = None, cursor=None) -> int:
     """
     将当前用户或会员的全部通知标记为已读
+    传入 cursor 时需外部 commit。
     """
     if user_id is None and member_id is None:
         return 0
-    db = get_db()
-    cursor = db.cursor()
-    try:
+    with cursor_scope(cursor) as cursor:
         where_sql = []
         params: List[Any] = []
         if member_id is not None:
@@ -212,8 +221,4 @@ def mark_all_notifications_read(*, user_id: int | None = None, member_id: int |
         WHERE {' AND '.join(where_sql)} AND is_read = 0
         """
         cursor.execute(sql, tuple(params))
-        db.commit()
         return cursor.rowcount
-    finally:
-        cursor.close()
-        db.close()
@@ -0,0 +1,293 @@
+# app/services/order_numbers.py
+"""
+订单号生成（不查库、不冲突）
+
+以前订单号是 前缀 + 微秒时间戳 + 4 位随机数：多个 worker 同一微秒下单时仍可能重复，只能靠唯一键报错重试。
+现在的订单号为：
+
+    {前缀}-{类型首字母}-{YYYYMMDDHHMMSS}{worker id 3 位}{序号 5 位}
+
+1. 前缀按系统设置版本缓存在进程内（设置保存后经 cache_bus 失效），生成订单号本身不查库
+2. worker id 每个进程一个：优先取环境变量 ORDER_NO_WORKER_ID；未配置时启动时在 order_no_workers 表
+   租用一行（过期的行可被重用），后台线程定期续租；同一时刻两个进程不会持有同一个 worker id。
+   进程内按单调时钟记下租约的截止时间（从发出租用/续租语句之前算起，并留出余量）：续租一直失败
+   （如数据库长时间不可用）超过截止时间后不再使用该 id，生成订单号时先重新租用，租不到就抛出
+   WorkerIdUnavailable，而不是冒着与接管该 id 的进程重复的风险继续生成
+3. 序号在进程内单调递增，每秒从 0 开始；一秒内超过 10 万个时借用下一秒，时钟回拨时沿用上次的秒，
+   因此同一进程产出的订单号严格递增，不同进程因 worker id 不同而不会重复；整体按秒有序
+"""
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from typing import Optional, Tuple
+
+from ..config import settings
+from ..database import cursor_scope
+from .settings_cache import get_setting_value, settings_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFIX = "GYM"
+WORKER_ID_LIMIT = 1000          # worker id 取值 0-999
+SEQ_LIMIT = 100000              # 每个 worker 每秒最多 10 万个
+_RETRY_INTERVAL = 30.0          # 加载前缀失败后的重试间隔（秒）
+_ACQUIRE_ATTEMPTS = 5
+_LEASE_MARGIN = 5.0             # 本地截止时间相对租期提前的秒数（至多租期的 1/10）
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS order_no_workers (
+    worker_id SMALLINT NOT NULL PRIMARY KEY,
+    owner VARCHAR(128) NOT NULL,
+    expires_at DATETIME NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+)
+"""
+
+_lock = threading.Lock()
+_acquire_lock = threading.Lock()
+_last_second = 0
+_seq = -1
+
+_worker_id: Optional[int] = None
+_worker_leased = False           # worker id 是否来自租约（需要续租）
+_lease_deadline = 0.0            # 租约在本地的截止时间（time.monotonic），过后不能再使用该 id
+_owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"[:128]
+
+_prefix = DEFAULT_PREFIX
+_prefix_version = -1
+_prefix_retry_at = 0.0
+
+_table_ready = False
+_renewer: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+
+
+# ========== 前缀 ==========
+
+def order_no_prefix(cursor=None) -> str:
+    """订单号前缀（按系统设置版本缓存；读取失败时用默认前缀，稍后重试）"""
+    global _prefix, _prefix_version, _prefix_retry_at
+    version = settings_version()
+    if _prefix_version == version or time.monotonic() < _prefix_retry_at:
+        return _prefix
+    try:
+        value = get_setting_value("order", "order_no_prefix", cursor=cursor) or DEFAULT_PREFIX
+    except Exception as e:
+        logger.warning(f"读取订单号前缀失败，暂用默认前缀 {DEFAULT_PREFIX}: {e}")
+        _prefix_retry_at = time.monotonic() + _RETRY_INTERVAL
+        return _prefix
+    with _lock:
+        _prefix, _prefix_version = str(value), version
+    return _prefix
+
+
+# ========== worker id ==========
+
+class WorkerIdUnavailable(RuntimeError):
+    """没有可用的 worker id（未配置 ORDER_NO_WORKER_ID 且租约已失效、重新租用失败），不能保证订单号不重复"""
+
+
+def ensure_table() -> None:
+    """建表（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _table_ready
+    if not _table_ready:
+        with cursor_scope() as cur:
+            cur.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def _lease_until(started: float) -> float:
+    """从发出租用/续租语句之前的时刻算起的本地截止时间"""
+    ttl = float(settings.ORDER_NO_LEASE_TTL)
+    return started + ttl - min(_LEASE_MARGIN, ttl / 10.0)
+
+
+def set_worker_id(worker_id: int, *, lease_deadline: Optional[float] = None) -> None:
+    """
+    指定本进程的 worker id；租来的 id 传入本地截止时间（time.monotonic）
+    只有 worker id 变化时才重置序号：重新租到同一个 id 时沿用原来的秒与序号，同一秒内不会再发出已用过的序号
+    """
+    global _worker_id, _worker_leased, _lease_deadline, _last_second, _seq
+    if not 0 <= int(worker_id) < WORKER_ID_LIMIT:
+        raise ValueError(f"worker id 需在 0-{WORKER_ID_LIMIT - 1} 之间")
+    with _lock:
+        if _worker_id != int(worker_id):
+            _last_second, _seq = 0, -1
+        _worker_id = int(worker_id)
+        _worker_leased = lease_deadline is not None
+        _lease_deadline = lease_deadline or 0.0
+
+
+def _lease_worker_id() -> int:
+    """在 order_no_workers 中租用一个 worker id：优先重用已过期的行，否则新增一行"""
+    ensure_table()
+    ttl = int(settings.ORDER_NO_LEASE_TTL)
+    for _ in range(_ACQUIRE_ATTEMPTS):
+        with cursor_scope() as cur:
+            cur.execute(
+                "SELECT worker_id FROM order_no_workers WHERE expires_at < NOW() ORDER BY worker_id LIMIT 1"
+            )
+            row = cur.fetchone()
+            if row:
+                # 条件更新抢占：并发抢同一行时只有一个能更新成功
+                cur.execute(
+                    """
+                    UPDATE order_no_workers
+                    SET owner = %s, expires_at = NOW() + INTERVAL %s SECOND
+                    WHERE worker_id = %s AND expires_at < NOW()
+                    """,
+                    (_owner, ttl, row[0]),
+                )
+                if cur.rowcount == 1:
+                    return int(row[0])
+                continue
+
+            cur.execute("SELECT COALESCE(MAX(worker_id) + 1, 0) FROM order_no_workers")
+            candidate = int(cur.fetchone()[0])
+            if candidate >= WORKER_ID_LIMIT:
+                raise RuntimeError("order_no_workers 已无可用的 worker id")
+            try:
+                cur.execute(
+                    "INSERT INTO order_no_workers (worker_id, owner, expires_at) VALUES (%s, %s, NOW() + INTERVAL %s SECOND)",
+                    (candidate, _owner, ttl),
+                )
+                return candidate
+            except Exception as e:
+                # 主键冲突：被其他进程抢先，重新选择
+                logger.debug(f"worker id {candidate} 已被占用: {e}")
+    raise RuntimeError("租用 worker id 失败，请稍后重试")
+
+
+def acquire_worker_id() -> int:
+    """确定本进程的 worker id：环境变量 ORDER_NO_WORKER_ID 优先，否则租用；租用失败时抛出 WorkerIdUnavailable"""
+    if settings.ORDER_NO_WORKER_ID >= 0:
+        set_worker_id(settings.ORDER_NO_WORKER_ID)
+        return settings.ORDER_NO_WORKER_ID
+    started = time.monotonic()
+    try:
+        worker_id = _lease_worker_id()
+    except Exception as e:
+        raise WorkerIdUnavailable(f"租用订单号 worker id 失败: {e}") from e
+    set_worker_id(worker_id, lease_deadline=_lease_until(started))
+    return worker_id
+
+
+def _lease_expired() -> bool:
+    return _worker_leased and time.monotonic() >= _lease_deadline
+
+
+def _renew_lease() -> None:
+    """续租并顺延本地截止时间；租约已被他人接管时重新租用（新的 worker id 从下一个订单号开始生效）"""
+    global _lease_deadline
+    started = time.monotonic()
+    with cursor_scope() as cur:
+        cur.execute(
+            """
+            UPDATE order_no_workers
+            SET expires_at = NOW() + INTERVAL %s SECOND
+            WHERE worker_id = %s AND owner = %s
+            """,
+            (int(settings.ORDER_NO_LEASE_TTL), _worker_id, _owner),
+        )
+        renewed = cur.rowcount == 1
+        if not renewed:
+            # 同一秒内重复续租时值未变，affected rows 为 0；再确认一次归属
+            cur.execute("SELECT owner FROM order_no_workers WHERE worker_id = %s", (_worker_id,))
+            row = cur.fetchone()
+            renewed = row is not None and row[0] == _owner
+    if renewed:
+        with _lock:
+            _lease_deadline = _lease_until(started)
+        return
+    logger.warning(f"订单号 worker id {_worker_id} 的租约已失效，重新租用")
+    with _lock:
+        # 已被其他进程接管：立即停用旧 id，重新租用失败时生成订单号会再尝试
+        _lease_deadline = 0.0
+    with _acquire_lock:
+        acquire_worker_id()
+
+
+def _release_lease() -> None:
+    with cursor_scope() as cur:
+        cur.execute(
+            "UPDATE order_no_workers SET expires_at = NOW() WHERE worker_id = %s AND owner = %s",
+            (_worker_id, _owner),
+        )
+
+
+def _run_loop(interval: float) -> None:
+    while not _stop_event.wait(interval):
+        try:
+            if _worker_leased and not _lease_expired():
+                _renew_lease()
+            else:
+                # 启动时没租到，或续租一直失败到租约过期：重新租用
+                with _acquire_lock:
+                    acquire_worker_id()
+        except Exception as e:
+            logger.warning(f"订单号 worker id 续租失败: {e}")
+
+
+def start_order_no_worker() -> None:
+    """应用启动时确定 worker id；使用租约时启动续租线程（间隔为租期的 1/3，启动时没租到也由它重试）"""
+    global _renewer
+    if settings.ORDER_NO_WORKER_ID >= 0:
+        acquire_worker_id()
+        return
+    if _renewer is not None and _renewer.is_alive():
+        return
+    try:
+        with _acquire_lock:
+            acquire_worker_id()
+    finally:
+        _stop_event.clear()
+        interval = max(settings.ORDER_NO_LEASE_TTL / 3.0, 1.0)
+        _renewer = threading.Thread(target=_run_loop, args=(interval,), name="order-no-lease", daemon=True)
+        _renewer.start()
+
+
+def stop_order_no_worker() -> None:
+    """停止续租线程并让出租约（应用关闭时调用）"""
+    global _renewer
+    _stop_event.set()
+    if _renewer is not None:
+        _renewer.join(timeout=5)
+        _renewer = None
+    if _worker_leased:
+        try:
+            _release_lease()
+        except Exception as e:
+            logger.warning(f"释放订单号 worker id 失败: {e}")
+
+
+# ========== 生成 ==========
+
+def _next_stamp() -> Tuple[int, int, int]:
+    """返回 (秒, worker id, 序号)，同一进程内严格递增；没有可用的 worker id 时抛出 WorkerIdUnavailable"""
+    global _last_second, _seq
+    if _worker_id is None or _lease_expired():
+        # 未经应用启动流程（脚本、测试）时在首次生成时确定；租约已过期时不能继续使用旧 id
+        with _acquire_lock:
+            if _worker_id is None or _lease_expired():
+                acquire_worker_id()
+    now = int(time.time())
+    with _lock:
+        if now > _last_second:
+            _last_second, _seq = now, 0
+        else:
+            # 同一秒或时钟回拨：沿用上次的秒，序号递增；用尽时借用下一秒
+            _seq += 1
+            if _seq >= SEQ_LIMIT:
+                _last_second, _seq = _last_second + 1, 0
+        return _last_second, _worker_id, _seq
+
+
+def next_order_no(order_type: str, prefix: Optional[str] = None, cursor=None) -> str:
+    """生成订单号；prefix 为空时取缓存的系统设置前缀"""
+    second, worker, seq = _next_stamp()
+    ts = time.strftime("%Y%m%d%H%M%S", time.localtime(second))
+    type_code = order_type[:1].upper()
+    return f"{prefix or order_no_prefix(cursor)}-{type_code}-{ts}{worker:03d}{seq:05d}"
@@ -1,90 +1,45 @@
-from datetime import datetime
 from decimal import Decimal
 from typing import List, Dict, Any, Tuple
-import random
 
-from ..database import get_db
+from .order_numbers import next_order_no
+from .schema import schema_registry
+from .settings_cache import get_settings_snapshot
 
 
-def _detect_order_columns(cursor) -> set[str]:
-    """探测 orders 表已有的列，避免 Unknown column 错误"""
-    cursor.execute("SHOW COLUMNS FROM orders")
-    rows = cursor.fetchall() or []
-    cols = set()
-    for r in rows:
-        if isinstance(r, dict):
-            cols.add(r.get("Field"))
-        else:
-            cols.add(r[0])
-    return {c for c in cols if c}
-
-
-def _get_order_prefix_and_currency() -> Tuple[str, str]:
-    """从 system_settings 读取订单号前缀和默认货币，未配置则用 GYM/CNY"""
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    prefix = "GYM"
-    currency = "CNY"
-    try:
-        cursor.execute(
-            """
-            SELECT setting_key, setting_value
-            FROM system_settings
-            WHERE group_key = 'order'
-              AND setting_key IN ('order_no_prefix', 'default_currency')
-            """
-        )
-        for row in cursor.fetchall():
-            if row["setting_key"] == "order_no_prefix":
-                prefix = row["setting_value"] or prefix
-            elif row["setting_key"] == "default_currency":
-                currency = row["setting_value"] or currency
-    finally:
-        cursor.close()
-        db.close()
-
+def _get_order_prefix_and_currency(cursor=None) -> Tuple[str, str]:
+    """从 system_settings 读取订单号前缀和默认货币，未配置则用 GYM/CNY
+    读取进程内设置缓存，缓存失效时复用传入的 cursor 重新加载
+    """
+    order_cfg = get_settings_snapshot(cursor).get("order", {})
+    prefix = order_cfg.get("order_no_prefix") or "GYM"
+    currency = order_cfg.get("default_currency") or "CNY"
     return prefix, currency
 
 
-def generate_order_no(order_type: str) -> str:
-    """生成订单号：前缀 + 类型首字母 + 时间戳 + 随机数
-    
-    使用完整微秒时间戳 + 4位随机数，确保高并发下的唯一性
+def generate_order_no(order_type: str, cursor=None) -> str:
+    """生成订单号：前缀 + 类型首字母 + 秒级时间戳 + worker id + 进程内序号
+
+    前缀按设置版本缓存，worker id 每个进程唯一，序号单调递增：不查库、不会重复（见 order_numbers）
     """
-    prefix, _ = _get_order_prefix_and_currency()
-    now = datetime.now()
-    ts = now.strftime("%Y%m%d%H%M%S%f")  # 完整微秒精度
-    type_code = order_type[:1].upper()
-    rand = random.randint(1000, 9999)  # 4位随机数，进一步降低冲突
-    return f"{prefix}-{type_code}-{ts}{rand}"
+    return next_order_no(order_type, cursor=cursor)
 
 
-def create_court_order(
+def _court_order_row(
+    cols,
     *,
-    cursor,
+    order_no: str,
+    currency: str,
     related_id: int,
     member_id: int | None,
     member_name: str | None,
     total_amount: Decimal | float | str,
     pay_method: str | None,
-    status: str = "paid",
-    remark: str | None = None,
-    source: str | None = None,
-) -> Dict[str, Any]:
-    """
-    为场地预约生成订单（需外部 commit）
-    - order_type 固定 court
-    - status=paid 时 pay_amount=total_amount，paid_at 写 NOW()
-    - 自动探测 orders 有哪些字段再写入
-    """
-    order_no = generate_order_no("court")
-    _, currency = _get_order_prefix_and_currency()
-    cols = _detect_order_columns(cursor)
-
-    total_str = str(total_amount)
+    status: str,
+    remark: str | None,
+    source: str | None,
+) -> Tuple[List[str], List[str], List[Any]]:
+    """按 orders 已有的字段组装一行场地订单，返回 (columns, placeholders, params)"""
     pay_amount = total_amount if status == "paid" else 0
-    pay_str = str(pay_amount)
-    discount_str = "0"
 
     columns: List[str] = ["order_no"]
     placeholders: List[str] = ["%s"]
@@ -115,11 +70,11 @@ def create_court_order(
         add_col("member_name", member_name)
 
     if "total_amount" in cols:
-        add_col("total_amount", total_str)
+        add_col("total_amount", str(total_amount))
     if "pay_amount" in cols:
-        add_col("pay_amount", pay_str)
+        add_col("pay_amount", str(pay_amount))
     if "discount_amount" in cols:
-        add_col("discount_amount", discount_str)
+        add_col("discount_amount", "0")
 
     if "currency" in cols:
         add_col("currency", currency)
@@ -139,10 +94,49 @@ def create_court_order(
     if "remark" in cols and remark is not None:
         add_col("remark", remark)
 
-    sql = f"INSERT INTO orders ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
+    return columns, placeholders, params
+
+
+def create_court_order(
+    *,
+    cursor,
+    related_id: int,
+    member_id: int | None,
+    member_name: str | None,
+    total_amount: Decimal | float | str,
+    pay_method: str | None,
+    status: str = "paid",
+    remark: str | None = None,
+    source: str | None = None,
+) -> Dict[str, Any]:
+    """
+    为场地预约生成订单（需外部 commit）
+    - order_type 固定 court
+    - status=paid 时 pay_amount=total_amount，paid_at 写 NOW()
+    - 按表结构注册表中 orders 已有的字段写入
+    """
+    order_no = generate_order_no("court", cursor)
+    _, currency = _get_order_prefix_and_currency(cursor)
+    cols = schema_registry.columns("orders", cursor)
+
+    columns, placeholders, params = _court_order_row(
+        cols,
+        order_no=order_no,
+        currency=currency,
+        related_id=related_id,
+        member_id=member_id,
+        member_name=member_name,
+        total_amount=total_amount,
+        pay_method=pay_method,
+        status=status,
+        remark=remark,
+        source=source,
+    )
+    sql = schema_registry.insert_sql("orders", columns, placeholders)
     cursor.execute(sql, tuple(params))
     order_id = cursor.lastrowid
 
+    pay_amount = total_amount if status == "paid" else 0
     return {
         "order_id": order_id,
         "order_no": order_no,
@@ -152,8 +146,72 @@ def create_court_order(
     }
 
 
+def create_court_orders(
+    *,
+    cursor,
+    items: List[Tuple[int, Decimal | float | str]],
+    member_id: int | None,
+    member_name: str | None,
+    pay_method: str | None,
+    status: str = "paid",
+    remark: str | None = None,
+    source: str | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    批量为场地预约生成订单（需外部 commit），items 为 [(related_id, total_amount), ...]
+    一条 executemany 多行插入，再按订单号一次查回 id；返回值与 create_court_order 一一对应
+    """
+    if not items:
+        return []
+    _, currency = _get_order_prefix_and_currency(cursor)
+    cols = schema_registry.columns("orders", cursor)
+
+    rows: List[Tuple[Any, ...]] = []
+    order_nos: List[str] = []
+    columns = placeholders = None
+    for related_id, total_amount in items:
+        order_no = generate_order_no("court", cursor)
+        columns, placeholders, params = _court_order_row(
+            cols,
+            order_no=order_no,
+            currency=currency,
+            related_id=related_id,
+            member_id=member_id,
+            member_name=member_name,
+            total_amount=total_amount,
+            pay_method=pay_method,
+            status=status,
+            remark=remark,
+            source=source,
+        )
+        order_nos.append(order_no)
+        rows.append(tuple(params))
+
+    cursor.executemany(schema_registry.insert_sql("orders", columns, placeholders), rows)
+    cursor.execute(
+        f"SELECT id, order_no FROM orders WHERE order_no IN ({', '.join(['%s'] * len(order_nos))})",
+        tuple(order_nos),
+    )
+    ids = {
+        (r["order_no"] if isinstance(r, dict) else r[1]): (r["id"] if isinstance(r, dict) else r[0])
+        for r in cursor.fetchall() or []
+    }
+
+    return [
+        {
+            "order_id": ids.get(order_no),
+            "order_no": order_no,
+            "status": status,
+            "pay_amount": float(total_amount if status == "paid" else 0),
+            "total_amount": float(total_amount),
+        }
+        for order_no, (_, total_amount) in zip(order_nos, items)
+    ]
+
+
 def create_product_order(
     *,
+    cursor,
     member_id: int | None,
     member_name: str | None,
     items: List[Dict[str, Any]],
@@ -162,79 +220,72 @@ def create_product_order(
     remark: str | None = None,
     related_id: int | None = None,
 ) -> Dict[str, Any]:
-    """为商品售卖生成 orders + order_items。"""
+    """为商品售卖生成 orders + order_items（需外部 commit，与销售记录同一事务）。"""
     if not items:
         raise ValueError("items 不能为空")
 
-    _, currency = _get_order_prefix_and_currency()
-    order_no = generate_order_no("goods")
+    _, currency = _get_order_prefix_and_currency(cursor)
+    order_no = generate_order_no("goods", cursor)
 
-    db = get_db()
-    cursor = db.cursor()
-    try:
-        sql_order = """
-        INSERT INTO orders (
-            order_no, order_type, related_id,
-            member_id, member_name,
-            total_amount, pay_amount, discount_amount,
-            currency, pay_method, status,
-            created_at, paid_at, remark
-        )
-        VALUES (%s, 'goods', %s,
-                %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                NOW(), NOW(), %s)
-        """
-        total_str = str(total_amount)
+    sql_order = """
+    INSERT INTO orders (
+        order_no, order_type, related_id,
+        member_id, member_name,
+        total_amount, pay_amount, discount_amount,
+        currency, pay_method, status,
+        created_at, paid_at, remark
+    )
+    VALUES (%s, 'goods', %s,
+            %s, %s,
+            %s, %s, %s,
+            %s, %s, %s,
+            NOW(), NOW(), %s)
+    """
+    total_str = str(total_amount)
+    cursor.execute(
+        sql_order,
+        (
+            order_no,
+            related_id,
+            member_id,
+            member_name,
+            total_str,
+            total_str,
+            "0",
+            currency,
+            pay_method,
+            "paid",
+            remark,
+        ),
+    )
+    order_id = cursor.lastrowid
+
+    sql_item = """
+    INSERT INTO order_items (
+        order_id, item_type, item_id,
+        item_name, unit_price, quantity, amount
+    )
+    VALUES (%s, 'product', %s, %s, %s, %s, %s)
+    """
+    for it in items:
+        product_id = it.get("product_id")
+        name = it.get("name") or ""
+        unit_price = Decimal(str(it.get("unit_price", "0")))
+        qty = int(it.get("quantity", 0))
+        amount = Decimal(str(it.get("amount", unit_price * qty)))
         cursor.execute(
-            sql_order,
+            sql_item,
             (
-                order_no,
-                related_id,
-                member_id,
-                member_name,
-                total_str,
-                total_str,
-                "0",
-                currency,
-                pay_method,
-                "paid",
-                remark,
+                order_id,
+                product_id,
+                name,
+                str(unit_price),
+                qty,
+                str(amount),
             ),
         )
-        order_id = cursor.lastrowid
 
-        sql_item = """
-        INSERT INTO order_items (
-            order_id, item_type, item_id,
-            item_name, unit_price, quantity, amount
-        )
-        VALUES (%s, 'product', %s, %s, %s, %s, %s)
-        """
-        for it in items:
-            product_id = it.get("product_id")
-            name = it.get("name") or ""
-            unit_price = Decimal(str(it.get("unit_price", "0")))
-            qty = int(it.get("quantity", 0))
-            amount = Decimal(str(it.get("amount", unit_price * qty)))
-            cursor.execute(
-                sql_item,
-                (
-                    order_id,
-                    product_id,
-                    name,
-                    str(unit_price),
-                    qty,
-                    str(amount),
-                ),
-            )
-
-        db.commit()
-        return {"order_id": order_id, "order_no": order_no}
-    finally:
-        cursor.close()
-        db.close()
+    return {"order_id": order_id, "order_no": order_no}
 
 
 def create_course_order(
@@ -253,8 +304,8 @@ def create_course_order(
     order_type 固定 training；status=paid 时 paid_at 写 NOW()。
     """
     total_str = str(total_amount)
-    order_no = generate_order_no("training")
-    _, currency = _get_order_prefix_and_currency()
+    order_no = generate_order_no("training", cursor)
+    _, currency = _get_order_prefix_and_currency(cursor)
 
     cursor.execute(
         """
@@ -296,27 +347,20 @@ def create_course_order(
     }
 
 
-def create_refund_order(
+def _refund_order_row(
+    cols,
     *,
-    cursor,
+    order_no: str,
+    currency: str,
     original_order_id: int,
     original_order_no: str | None,
     member_id: int | None,
     member_name: str | None,
     amount: Decimal | float | str,
     order_type: str,
-    remark: str | None = None,
-) -> Dict[str, Any]:
-    """
-    生成一条退款订单（金额为负），需外部 commit。
-    - status 固定 refunded
-    - pay_amount/total_amount 记录为负值
-    - related_id 指向原订单 id
-    """
-    order_no = generate_order_no(f"{order_type}-refund")
-    _, currency = _get_order_prefix_and_currency()
-    cols = _detect_order_columns(cursor)
-
+    remark: str | None,
+) -> Tuple[List[str], List[str], List[Any]]:
+    """按 orders 已有的字段组装一行退款订单（金额为负），返回 (columns, placeholders, params)"""
     amount_val = Decimal(str(amount)) if not isinstance(amount, Decimal) else amount
     neg_amount = str(-abs(amount_val))
 
@@ -374,7 +418,43 @@ def create_refund_order(
         refund_remark = remark or f"退款来源订单 {original_order_no or original_order_id}"
         add_col("remark", refund_remark)
 
-    sql = f"INSERT INTO orders ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
+    return columns, placeholders, params
+
+
+def create_refund_order(
+    *,
+    cursor,
+    original_order_id: int,
+    original_order_no: str | None,
+    member_id: int | None,
+    member_name: str | None,
+    amount: Decimal | float | str,
+    order_type: str,
+    remark: str | None = None,
+) -> Dict[str, Any]:
+    """
+    生成一条退款订单（金额为负），需外部 commit。
+    - status 固定 refunded
+    - pay_amount/total_amount 记录为负值
+    - related_id 指向原订单 id
+    """
+    order_no = generate_order_no(f"{order_type}-refund", cursor)
+    _, currency = _get_order_prefix_and_currency(cursor)
+    cols = schema_registry.columns("orders", cursor)
+
+    columns, placeholders, params = _refund_order_row(
+        cols,
+        order_no=order_no,
+        currency=currency,
+        original_order_id=original_order_id,
+        original_order_no=original_order_no,
+        member_id=member_id,
+        member_name=member_name,
+        amount=amount,
+        order_type=order_type,
+        remark=remark,
+    )
+    sql = schema_registry.insert_sql("orders", columns, placeholders)
     cursor.execute(sql, tuple(params))
     refund_id = cursor.lastrowid
 
@@ -382,6 +462,54 @@ def create_refund_order(
         "order_id": refund_id,
         "order_no": order_no,
         "status": "refunded",
-        "amount": float(-abs(amount_val)),
+        "amount": float(-abs(Decimal(str(amount)))),
         "related_order_id": original_order_id,
     }
+
+
+def create_refund_orders(
+    *,
+    cursor,
+    items: List[Dict[str, Any]],
+    order_type: str,
+    remark: str | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    批量生成退款订单（需外部 commit），items 为 create_refund_order 的关键字参数
+    （original_order_id / original_order_no / member_id / member_name / amount，可带各自的 remark）。
+    设置与表结构各读一次，一条 executemany 写入；返回值不含 order_id（按 order_no 追溯）
+    """
+    if not items:
+        return []
+    _, currency = _get_order_prefix_and_currency(cursor)
+    cols = schema_registry.columns("orders", cursor)
+
+    rows: List[Tuple[Any, ...]] = []
+    out: List[Dict[str, Any]] = []
+    columns = placeholders = None
+    for it in items:
+        order_no = generate_order_no(f"{order_type}-refund", cursor)
+        columns, placeholders, params = _refund_order_row(
+            cols,
+            order_no=order_no,
+            currency=currency,
+            original_order_id=it["original_order_id"],
+            original_order_no=it.get("original_order_no"),
+            member_id=it.get("member_id"),
+            member_name=it.get("member_name"),
+            amount=it["amount"],
+            order_type=order_type,
+            remark=it.get("remark", remark),
+        )
+        rows.append(tuple(params))
+        out.append(
+            {
+                "order_no": order_no,
+                "status": "refunded",
+                "amount": float(-abs(Decimal(str(it["amount"])))),
+                "related_order_id": it["original_order_id"],
+            }
+        )
+
+    cursor.executemany(schema_registry.insert_sql("orders", columns, placeholders), rows)
+    return out
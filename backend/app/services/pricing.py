@@ -0,0 +1,484 @@
+# app/services/pricing.py
+"""
+统一计价引擎
+
+以前场地/商品计价在后台预约、会员端预约、商品售卖、AI 助手下单四处各写一遍，
+每次都重新查 courts / products 价格、member_cards（SELECT * 全部卡）和 members.level + 等级配置。
+这里统一为：
+
+1. 场地与商品价格表缓存在进程内（一次查询全量加载）：courts / products 的保存接口在 commit 之后
+   publish("prices")，本进程与其他 worker（经 cache_bus）下次读取时重新加载；另按 PRICING_CACHE_TTL 兜底刷新，
+   缓存中找不到的 id 会立即重新加载一次
+2. 等级 → 折扣映射复用 discounts.level_discount（按系统设置版本缓存）
+3. resolve_member 用一条查询同时取会员等级与当前有效的卡，quote 对一批明细只解析一次会员折扣，
+   因此一次计价最多一条与会员相关的查询
+4. 分时段价格（高峰/平峰、周末、节假日）：系统设置 pricing.court_price_rules_json 中的规则按场地编译成
+   "日类型 → 96 个 15 分钟时段的价格前缀和"缓存在内存里，任意时长的场地金额是一次前缀和相减（与时长无关），
+   可用性网格也能直接给出每个时段的价格；价格表或系统设置变化后下次读取时重新编译
+
+折扣规则不变：有折扣卡（选中的卡 discount 不为空）时按卡折扣，否则按等级折扣；每行单独四舍五入到分。
+"""
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from ..config import settings
+from ..database import cursor_scope
+from .cache_bus import subscribe
+from .cards import pick_best_card
+from .court_slots import SLOT_MINUTES, SLOTS_PER_DAY
+from .discounts import level_discount
+from .schema import schema_registry
+from .settings_cache import get_parsed, settings_version
+
+logger = logging.getLogger(__name__)
+
+
+class PricingError(ValueError):
+    """无法计价：场地/商品不存在、价格未配置或时长/数量非法"""
+
+
+class CourtNotFound(PricingError):
+    """场地不存在"""
+
+
+class ProductNotFound(PricingError):
+    """商品不存在"""
+
+
+class CourtPrice(NamedTuple):
+    id: int
+    name: str
+    type: Optional[str]
+    status: Optional[str]
+    price_per_hour: float
+
+
+class ProductPrice(NamedTuple):
+    id: int
+    name: str
+    status: Optional[str]
+    price: float
+
+
+class MemberPricing(NamedTuple):
+    member_id: Optional[int]
+    discount: float                  # 百分比，100 为不打折
+    card: Optional[Dict[str, Any]]   # 选中的会员卡（次卡扣次也用它）
+    card_type: Optional[str]
+
+
+NO_MEMBER = MemberPricing(None, 100.0, None, None)
+
+
+# ========== 价格表缓存 ==========
+
+_lock = threading.Lock()
+_courts: Dict[int, CourtPrice] = {}
+_products: Dict[int, ProductPrice] = {}
+_notified = 1      # 每收到一次 prices 通知 +1
+_loaded = 0        # 最近一次加载开始时的 _notified，二者不等说明需要重新加载
+_loaded_at = 0.0
+_generation = 0    # 每次重新加载 +1，分时段价格表据此失效
+
+
+def _mark_dirty() -> None:
+    global _notified
+    with _lock:
+        _notified += 1
+
+
+def _court_price_expr(cursor) -> str:
+    """courts 的价格列：优先 price_per_hour，否则 price（列信息取自表结构注册表）"""
+    cols = schema_registry.columns("courts", cursor)
+    if "price_per_hour" in cols and "price" in cols:
+        return "COALESCE(price_per_hour, price)"
+    if "price_per_hour" in cols:
+        return "price_per_hour"
+    if "price" in cols:
+        return "price"
+    return "NULL"
+
+
+def _num(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def reload_prices(cursor=None) -> None:
+    """重新加载场地与商品价格表（传入 cursor 时复用调用方连接）"""
+    global _courts, _products, _loaded, _loaded_at, _generation
+    notified = _notified
+    with cursor_scope(cursor, dictionary=True) as cur:
+        cur.execute(f"SELECT id, name, type, status, {_court_price_expr(cur)} AS price FROM courts")
+        court_rows = cur.fetchall() or []
+        cur.execute("SELECT id, name, status, price FROM products")
+        product_rows = cur.fetchall() or []
+
+    def val(row, key, index):
+        return row[key] if isinstance(row, dict) else row[index]
+
+    courts = {
+        int(val(r, "id", 0)): CourtPrice(
+            int(val(r, "id", 0)), val(r, "name", 1) or "场地", val(r, "type", 2), val(r, "status", 3), _num(val(r, "price", 4))
+        )
+        for r in court_rows
+    }
+    products = {
+        int(val(r, "id", 0)): ProductPrice(
+            int(val(r, "id", 0)), val(r, "name", 1) or "", val(r, "status", 2), _num(val(r, "price", 3))
+        )
+        for r in product_rows
+    }
+    with _lock:
+        _courts, _products = courts, products
+        # 加载期间又收到通知时保持"需要加载"
+        _loaded = notified
+        _loaded_at = time.monotonic()
+        _generation += 1
+
+
+def _tables(cursor=None) -> Tuple[Dict[int, CourtPrice], Dict[int, ProductPrice]]:
+    if _loaded != _notified or time.monotonic() - _loaded_at > settings.PRICING_CACHE_TTL:
+        reload_prices(cursor)
+    return _courts, _products
+
+
+def court_price(court_id: int, cursor=None) -> CourtPrice:
+    """场地价格（缓存）；不在缓存中时重新加载一次，仍找不到抛出 CourtNotFound"""
+    court = _tables(cursor)[0].get(int(court_id))
+    if court is None:
+        reload_prices(cursor)
+        court = _courts.get(int(court_id))
+    if court is None:
+        raise CourtNotFound("场地不存在")
+    return court
+
+
+def product_price(product_id: int, cursor=None) -> ProductPrice:
+    """商品价格（缓存）；不在缓存中时重新加载一次，仍找不到抛出 ProductNotFound"""
+    product = _tables(cursor)[1].get(int(product_id))
+    if product is None:
+        reload_prices(cursor)
+        product = _products.get(int(product_id))
+    if product is None:
+        raise ProductNotFound("商品不存在")
+    return product
+
+
+subscribe("prices", _mark_dirty)
+
+
+# ========== 分时段价格表 ==========
+#
+# 规则（按顺序应用，后面的覆盖前面的）：
+#   {"court_ids": [1, 2] 或 "court_type": "羽毛球"（都不写表示全部场地），
+#    "days": ["weekday" | "weekend" | "holiday" | "all", ...]（默认 all），
+#    "start": "18:00", "end": "22:00"（end 早于 start 表示跨到次日凌晨，"24:00" 表示当天结束），
+#    "price_per_hour": 150 或 "multiplier": 1.5（相对场地标准价）}
+# 节假日取自 pricing.holidays_json（["2026-10-01", ...]）；节假日先套用周末规则，再套用节假日规则。
+
+DAY_WEEKDAY = "weekday"
+DAY_WEEKEND = "weekend"
+DAY_HOLIDAY = "holiday"
+DAY_TYPES = (DAY_WEEKDAY, DAY_WEEKEND, DAY_HOLIDAY)
+
+_SLOT_HOURS = SLOT_MINUTES / 60.0
+
+
+class PriceRule(NamedTuple):
+    court_ids: Optional[frozenset]
+    court_type: Optional[str]
+    days: frozenset
+    start_slot: int
+    end_slot: int
+    price_per_hour: Optional[float]
+    multiplier: Optional[float]
+
+
+def _slot_of(value: Any) -> Optional[int]:
+    """"HH:MM" → 当天第几个 15 分钟时段（向下取整），"24:00" 为 SLOTS_PER_DAY；格式不对返回 None"""
+    try:
+        hour, minute = str(value).strip().split(":")[:2]
+        minutes = int(hour) * 60 + int(minute)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if not 0 <= minutes <= 24 * 60:
+        return None
+    return minutes // SLOT_MINUTES
+
+
+def _parse_rules(raw: Optional[str]) -> Tuple[PriceRule, ...]:
+    """解析 court_price_rules_json（结果由设置缓存按版本缓存）；不合法的规则忽略"""
+    try:
+        items = json.loads(raw) if raw else []
+    except Exception:
+        logger.warning("court_price_rules_json 不是合法的 JSON，按标准价计价")
+        return ()
+    if not isinstance(items, list):
+        return ()
+
+    rules: List[PriceRule] = []
+    for it in items:
+        if not isinstance(it, dict) or not it.get("enabled", True):
+            continue
+        start_slot = _slot_of(it.get("start", "00:00"))
+        end_slot = _slot_of(it.get("end", "24:00"))
+        if start_slot is None or end_slot is None or start_slot == end_slot:
+            continue
+        days = it.get("days", it.get("day_type", "all"))
+        days = [days] if isinstance(days, str) else list(days or [])
+        day_set = frozenset(DAY_TYPES) if "all" in days else frozenset(d for d in days if d in DAY_TYPES)
+        if not day_set:
+            continue
+        price = multiplier = None
+        try:
+            if it.get("price_per_hour") is not None:
+                price = float(it["price_per_hour"])
+            elif it.get("multiplier") is not None:
+                multiplier = float(it["multiplier"])
+            else:
+                continue
+        except (TypeError, ValueError):
+            continue
+        if (price is not None and price < 0) or (multiplier is not None and multiplier < 0):
+            continue
+        try:
+            court_ids = frozenset(int(c) for c in it["court_ids"]) if it.get("court_ids") else None
+        except (TypeError, ValueError):
+            continue
+        rules.append(PriceRule(
+            court_ids, it.get("court_type") or None, day_set, start_slot, end_slot, price, multiplier
+        ))
+    return tuple(rules)
+
+
+def _parse_holidays(raw: Optional[str]) -> frozenset:
+    try:
+        items = json.loads(raw) if raw else []
+        return frozenset(date.fromisoformat(str(d)) for d in items)
+    except Exception:
+        logger.warning("holidays_json 不合法，节假日按周末/工作日计价")
+        return frozenset()
+
+
+def day_type(day: date, holidays: frozenset = frozenset()) -> str:
+    """日期的计价类型：节假日 > 周末 > 工作日"""
+    if day in holidays:
+        return DAY_HOLIDAY
+    return DAY_WEEKEND if day.weekday() >= 5 else DAY_WEEKDAY
+
+
+def _compile(court: CourtPrice, rules: Sequence[PriceRule]) -> Dict[str, List[float]]:
+    """把规则编译成 {日类型: 每时段价格的前缀和（SLOTS_PER_DAY + 1 项）}"""
+    base = court.price_per_hour * _SLOT_HOURS
+    matching = [
+        r for r in rules
+        if (r.court_ids is None or court.id in r.court_ids)
+        and (r.court_type is None or r.court_type == court.type)
+    ]
+
+    def apply(slots: List[float], kind: str) -> None:
+        for r in matching:
+            if kind not in r.days:
+                continue
+            value = r.price_per_hour * _SLOT_HOURS if r.price_per_hour is not None else base * r.multiplier
+            if r.start_slot < r.end_slot:
+                spans = ((r.start_slot, r.end_slot),)
+            else:
+                # 跨午夜：当天 start 之后 + 当天 0 点到 end
+                spans = ((r.start_slot, SLOTS_PER_DAY), (0, r.end_slot))
+            for lo, hi in spans:
+                slots[lo:hi] = [value] * (hi - lo)
+
+    tables: Dict[str, List[float]] = {}
+    for kind in DAY_TYPES:
+        slots = [base] * SLOTS_PER_DAY
+        if kind == DAY_HOLIDAY:
+            apply(slots, DAY_WEEKEND)
+        apply(slots, kind)
+        prefix = [0.0] * (SLOTS_PER_DAY + 1)
+        for i, v in enumerate(slots):
+            prefix[i + 1] = prefix[i] + v
+        tables[kind] = prefix
+    return tables
+
+
+_slot_lock = threading.Lock()
+_slot_tables: Dict[int, Dict[str, List[float]]] = {}
+_slot_key: Tuple[int, int] = (-1, -1)   # (价格表 _generation, 设置版本)
+
+
+def _price_tables(court: CourtPrice, cursor=None) -> Tuple[Dict[str, List[float]], frozenset]:
+    """场地的分时段前缀和表与节假日集合（按需编译，价格表或系统设置变化后重新编译）"""
+    global _slot_tables, _slot_key
+    rules = get_parsed("pricing", "court_price_rules_json", _parse_rules, cursor=cursor)
+    holidays = get_parsed("pricing", "holidays_json", _parse_holidays, cursor=cursor)
+    key = (_generation, settings_version())
+    with _slot_lock:
+        if _slot_key != key:
+            _slot_tables, _slot_key = {}, key
+        tables = _slot_tables.get(court.id)
+        if tables is None:
+            tables = _slot_tables[court.id] = _compile(court, rules)
+    return tables, holidays
+
+
+def _prefix_at(prefix: List[float], minutes: float) -> float:
+    """当天 0 点到 minutes 分钟的累计价格（不满一个时段的部分按比例）"""
+    index = min(int(minutes // SLOT_MINUTES), SLOTS_PER_DAY)
+    value = prefix[index]
+    if index < SLOTS_PER_DAY:
+        value += (prefix[index + 1] - prefix[index]) * (minutes - index * SLOT_MINUTES) / SLOT_MINUTES
+    return value
+
+
+def court_amount(court_id: int, start: datetime, end: datetime, cursor=None) -> float:
+    """[start, end) 的场地原价（未打折，四舍五入到分）：按天取对应日类型的前缀和相减"""
+    court = court_price(court_id, cursor)
+    if end <= start:
+        raise PricingError("预约时长必须大于0")
+    tables, holidays = _price_tables(court, cursor)
+    total = 0.0
+    day = start.date()
+    while datetime.combine(day, datetime.min.time()) < end:
+        day_start = datetime.combine(day, datetime.min.time())
+        lo = (max(start, day_start) - day_start).total_seconds() / 60.0
+        hi = (min(end, day_start + timedelta(days=1)) - day_start).total_seconds() / 60.0
+        prefix = tables[day_type(day, holidays)]
+        total += _prefix_at(prefix, hi) - _prefix_at(prefix, lo)
+        day += timedelta(days=1)
+    return round(total, 2)
+
+
+# ========== 会员折扣 ==========
+
+def resolve_member(cursor, member_id: Optional[int]) -> MemberPricing:
+    """
+    一条查询取会员等级与当前有效的卡，得出折扣；无会员或查询失败时不打折
+    传入的 cursor 需为 dictionary 游标
+    """
+    if not member_id:
+        return NO_MEMBER
+    try:
+        cursor.execute(
+            """
+            SELECT m.level AS member_level, c.*
+            FROM members m
+            LEFT JOIN member_cards c
+              ON c.member_id = m.id
+             AND c.start_date <= CURDATE()
+             AND c.end_date >= CURDATE()
+            WHERE m.id = %s
+            """,
+            (member_id,),
+        )
+        rows = cursor.fetchall() or []
+        if not rows:
+            return MemberPricing(int(member_id), 100.0, None, None)
+        level = rows[0].get("member_level")
+        cards = [{k: v for k, v in r.items() if k != "member_level"} for r in rows if r.get("id") is not None]
+        card, card_type = pick_best_card(cards)
+        if card and card.get("discount") is not None:
+            discount = _num(card.get("discount")) or 100.0
+        else:
+            discount = level_discount(level, cursor=cursor)
+        return MemberPricing(int(member_id), float(discount), card, card_type)
+    except Exception as e:
+        logger.warning(f"解析会员折扣失败，按原价计算: {e}")
+        return MemberPricing(int(member_id), 100.0, None, None)
+
+
+def apply_discount(amount: float, discount: float) -> float:
+    """按百分比折扣计算，四舍五入到分；100 及以上不打折"""
+    if amount > 0 and discount < 100:
+        return round(amount * discount / 100.0, 2)
+    return amount
+
+
+# ========== 批量计价 ==========
+
+def quote(
+    items: Iterable[Dict[str, Any]],
+    member_id: Optional[int] = None,
+    *,
+    cursor,
+    member: Optional[MemberPricing] = None,
+) -> Dict[str, Any]:
+    """
+    批量计价。items 每行为二者之一：
+    - 场地：{"court_id", "start", "end"}，可带 "base_amount"（手工指定的原价，不再按价格 × 时长计算）
+    - 商品：{"product_id", "quantity"}
+    返回 {"member_id", "discount", "card", "lines": [...], "total_amount"}，lines 与 items 一一对应，
+    每行含 kind / id / name / unit_price / quantity（场地为小时数）/ base_amount / amount；
+    场地的 unit_price 为标准价，base_amount 按分时段价格表计算。
+    已解析过会员折扣时传入 member，不再查询。
+    """
+    if member is None:
+        member = resolve_member(cursor, member_id)
+
+    lines: List[Dict[str, Any]] = []
+    for it in items:
+        if it.get("court_id") is not None:
+            court = court_price(it["court_id"], cursor)
+            start, end = it["start"], it["end"]
+            hours = (end - start).total_seconds() / 3600.0
+            if hours <= 0:
+                raise PricingError("预约时长必须大于0")
+            override = _num(it.get("base_amount"))
+            if override > 0:
+                base = override
+            else:
+                base = court_amount(court.id, start, end, cursor)
+                if base <= 0:
+                    raise PricingError("场地价格未配置")
+            lines.append({
+                "kind": "court",
+                "id": court.id,
+                "name": court.name,
+                "start": start,
+                "end": end,
+                "unit_price": court.price_per_hour,
+                "quantity": round(hours, 4),
+                "base_amount": base,
+                "amount": apply_discount(base, member.discount),
+            })
+        elif it.get("product_id") is not None:
+            product = product_price(it["product_id"], cursor)
+            try:
+                qty = int(it.get("quantity") or 0)
+            except (TypeError, ValueError):
+                raise PricingError("数量格式不正确")
+            if qty <= 0:
+                raise PricingError("数量必须大于 0")
+            base = round(product.price * qty, 2)
+            lines.append({
+                "kind": "product",
+                "id": product.id,
+                "name": product.name,
+                "unit_price": product.price,
+                "quantity": qty,
+                "base_amount": base,
+                "amount": apply_discount(base, member.discount),
+            })
+        else:
+            raise PricingError("计价明细需包含 court_id 或 product_id")
+
+    return {
+        "member_id": member.member_id,
+        "discount": member.discount,
+        "card": member.card,
+        "lines": lines,
+        "total_amount": round(sum(line["amount"] for line in lines), 2),
+    }
+
+
+def quote_member_court(cursor, member_id: int, court_id: int, start: datetime, end: datetime) -> Tuple[str, float]:
+    """单个场地时段的会员报价，返回 (场地名称, 金额)；传入的 cursor 需为 dictionary 游标"""
+    line = quote([{"court_id": court_id, "start": start, "end": end}], member_id, cursor=cursor)["lines"][0]
+    return line["name"], line["amount"]
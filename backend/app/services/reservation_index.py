@@ -0,0 +1,410 @@
+# app/services/reservation_index.py
+"""
+场地预约区间索引（进程内）
+
+后台下单、会员端下单、AI 助手下单都会执行
+    COUNT(*) ... WHERE court_id = %s AND status <> '已取消' AND NOT (end_time <= %s OR start_time >= %s)
+这种谓词用不好范围索引，表越大越慢。这里在进程内为今天起 RESERVATION_INDEX_DAYS 天内的
+场地占用（未取消的预约 + 排在场地上的培训排期，见 resource_calendar）建立按场地的有序区间数组：
+
+1. 启动时（或首次使用时）一次范围查询加载；之后按 RESERVATION_INDEX_TTL 兜底重新加载，跨天时也会重新加载
+2. 本进程创建/取消/修改状态后在 commit 之后直接更新索引（note_reservation_booked / note_reservation_released），
+   变化的区间只记在进程内缓冲里，下单请求不为此多借连接、多一次提交
+3. cache_bus 的轮询线程每轮（on_poll 钩子）把缓冲批量写入 reservation_index_changes，并按自增 id
+   增量读取各 worker 写入的区间变化直接应用，不再因为别处的一次下单丢弃整个索引重新加载；
+   加载索引时先在同一事务里读出变更表当前的最大 id，之后只读比它新的变化（不比较应用与数据库的时钟）；
+   多个 worker 的插入可能乱序提交，因此每次还会重放数据库时间最近 _REPLAY_SECONDS 秒内的变化。
+   本进程自己的变化也一并按 id 顺序重放：同一预约先后被不同 worker 修改时，以最后一次为准
+4. 批量变化（删除会员、场地停用、数据清理）和培训排期变化较少，仍经 reservations 频道让所有 worker 重新加载
+5. 冲突预检与可用性查询直接读索引（微秒级）；查询区间超出索引覆盖范围或索引不可用时返回 None，调用方回退查库
+
+索引只用于预检与展示，数据库仍在事务内做最终的冲突检测。
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from ..config import settings
+from ..database import cursor_scope
+from . import cache_bus
+from .cache_bus import on_poll, publish, subscribe
+from .resource_calendar import KIND_RESERVATION, occupancy_query
+
+logger = logging.getLogger(__name__)
+
+# 加载失败后的重试间隔（秒）
+_RETRY_INTERVAL = 5.0
+# 同步区间变化时重放的时间窗（秒），覆盖其他 worker 乱序提交的插入
+_REPLAY_SECONDS = 10
+# 进程内待写出的变化条数上限；超过时放弃增量同步，改为通知其他 worker 重新加载
+_PENDING_LIMIT = 10000
+# 变化记录保留时长（秒）
+_CHANGES_KEEP_SECONDS = 3600
+_PRUNE_INTERVAL = 600.0
+
+_CREATE_CHANGES_SQL = """
+CREATE TABLE IF NOT EXISTS reservation_index_changes (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    reservation_id BIGINT NOT NULL,
+    court_id INT NULL,                -- NULL 表示释放
+    start_time DATETIME NULL,
+    end_time DATETIME NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_reservation_index_changes_created (created_at)
+)
+"""
+
+
+# 区间条目的键：(kind, id)，kind 为 reservation / schedule
+Key = Tuple[str, int]
+
+
+class _CourtIntervals:
+    """单个场地的区间：按 (start, key) 排序，记录最长区间用于提前结束向前扫描"""
+
+    __slots__ = ("items", "max_len")
+
+    def __init__(self):
+        self.items: List[Tuple[datetime, Key, datetime]] = []
+        self.max_len = timedelta(0)
+
+    def add(self, key: Key, start: datetime, end: datetime) -> None:
+        insort(self.items, (start, key, end))
+        if end - start > self.max_len:
+            self.max_len = end - start
+
+    def remove(self, key: Key, start: datetime) -> None:
+        i = bisect_left(self.items, (start, key))
+        if i < len(self.items) and self.items[i][1] == key:
+            del self.items[i]
+
+    def overlapping(self, start: datetime, end: datetime, exclude: Optional[Key] = None):
+        """与 [start, end) 重叠的区间（边界相接不算重叠）"""
+        # 开始时间 >= end 的区间不可能重叠；从它前面往回扫，直到开始时间早于 start - 最长区间
+        i = bisect_left(self.items, (end,))
+        floor = start - self.max_len
+        while i > 0:
+            i -= 1
+            s, key, e = self.items[i]
+            if s < floor:
+                break
+            if e > start and key != exclude:
+                yield s, key, e
+
+
+class ReservationIndex:
+    """按场地的占用区间索引（预约 + 排期），覆盖 [今天 00:00, 今天 + days)"""
+
+    def __init__(self, days: int, ttl: float):
+        self.days = days
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._courts: Dict[int, _CourtIntervals] = {}
+        self._by_id: Dict[Key, Tuple[int, datetime, datetime]] = {}
+        self._window: Optional[Tuple[datetime, datetime]] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._retry_at = 0.0
+        self._change_floor: Optional[int] = None   # 加载时变更表的最大 id，更早的变化已包含在加载结果里；None 表示未知
+        self._change_seen = 0                      # 已应用的变化的最大 id
+
+    # ---------- 加载与失效 ----------
+
+    def _current_window(self) -> Tuple[datetime, datetime]:
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return today, today + timedelta(days=self.days)
+
+    def invalidate(self) -> None:
+        """丢弃索引，下次使用时重新加载（其他 worker 有预约变化时经 cache_bus 调用）"""
+        with self._lock:
+            self._generation += 1
+            self._window = None
+            self._retry_at = 0.0
+
+    def load(self, cursor=None) -> None:
+        """一次范围查询加载覆盖窗口内的全部占用（传入 cursor 时复用调用方连接）"""
+        generation = self._generation
+        window = self._current_window()
+        sql, params = occupancy_query(window[0], window[1])
+        with cursor_scope(cursor) as cur:
+            # 先读变更表的最大 id 再加载占用：此前写入的变化对应的预约都已提交，加载结果里已包含
+            floor = _changes_floor(cur)
+            cur.execute(sql, tuple(params))
+            rows = cur.fetchall() or []
+
+        courts: Dict[int, _CourtIntervals] = {}
+        by_id: Dict[Key, Tuple[int, datetime, datetime]] = {}
+        for row in rows:
+            # 行为 (court_id, start_time, end_time, id, kind)，kind 缺省视为预约
+            if isinstance(row, dict):
+                court_id, start, end = row["court_id"], row["start_time"], row["end_time"]
+                key = (row.get("kind") or KIND_RESERVATION, int(row["id"]))
+            else:
+                court_id, start, end = row[0], row[1], row[2]
+                key = (row[4] if len(row) > 4 else KIND_RESERVATION, int(row[3]))
+            courts.setdefault(int(court_id), _CourtIntervals()).add(key, start, end)
+            by_id[key] = (int(court_id), start, end)
+
+        with self._lock:
+            # 加载期间又发生过失效，则不覆盖（下次使用时再加载）
+            if self._generation != generation:
+                return
+            self._courts = courts
+            self._by_id = by_id
+            self._window = window
+            self._loaded_at = time.monotonic()
+            self._change_floor = floor
+            self._change_seen = floor or 0
+
+    def _ensure_fresh(self) -> Optional[Tuple[datetime, datetime]]:
+        """返回当前覆盖窗口；需要时重新加载，加载失败返回 None"""
+        window = self._window
+        if (
+            window is not None
+            and time.monotonic() - self._loaded_at < self.ttl
+            and window[0] == self._current_window()[0]
+        ):
+            return window
+        if time.monotonic() < self._retry_at:
+            return None
+        # 同一时间只有一个线程重新加载；其他线程回退查库
+        if not self._load_lock.acquire(blocking=False):
+            return None
+        try:
+            # 占用查询包含场地停用时段，启动时建表失败的话在这里补建（court_closures 依赖本模块，按需导入）
+            from .court_closures import ensure_table as ensure_closures_table
+
+            ensure_closures_table()
+            _ensure_changes_table()
+            self.load()
+        except Exception as e:
+            self._retry_at = time.monotonic() + _RETRY_INTERVAL
+            logger.warning(f"加载预约区间索引失败，暂时回退查库: {e}")
+            return None
+        finally:
+            self._load_lock.release()
+        return self._window
+
+    def _covers(self, start: datetime, end: datetime) -> bool:
+        window = self._ensure_fresh()
+        return window is not None and window[0] <= start and end <= window[1]
+
+    # ---------- 查询 ----------
+
+    def has_conflict(
+        self,
+        court_id: int,
+        start: datetime,
+        end: datetime,
+        exclude_id: Optional[int] = None,
+        exclude_kind: str = KIND_RESERVATION,
+    ) -> Optional[bool]:
+        """[start, end) 是否与该场地已有的预约/排期冲突；exclude_id 排除某一条（默认为预约 id）；索引无法回答时返回 None"""
+        if not self._covers(start, end):
+            return None
+        exclude = (exclude_kind, int(exclude_id)) if exclude_id is not None else None
+        with self._lock:
+            intervals = self._courts.get(int(court_id))
+            if intervals is None:
+                return False
+            return next(intervals.overlapping(start, end, exclude), None) is not None
+
+    def busy_rows(self, start: datetime, end: datetime) -> Optional[List[Tuple[int, datetime, datetime]]]:
+        """[start, end) 内所有占用区间 (court_id, start, end)，可直接交给 availability.merge_busy；无法回答时返回 None"""
+        if not self._covers(start, end):
+            return None
+        with self._lock:
+            return [
+                (court_id, s, e)
+                for court_id, intervals in self._courts.items()
+                for s, _, e in intervals.overlapping(start, end)
+            ]
+
+    # ---------- 本进程的增量更新（commit 之后调用） ----------
+    # 增量更新都会递增代数：正在进行的加载可能读到了更新之前的数据，其结果会被丢弃
+
+    def add(self, reservation_id: int, court_id: int, start: datetime, end: datetime) -> None:
+        key = (KIND_RESERVATION, int(reservation_id))
+        with self._lock:
+            self.remove(reservation_id)
+            window = self._window
+            if window is None or end <= window[0] or start >= window[1]:
+                return
+            self._courts.setdefault(int(court_id), _CourtIntervals()).add(key, start, end)
+            self._by_id[key] = (int(court_id), start, end)
+
+    def remove(self, reservation_id: int) -> None:
+        key = (KIND_RESERVATION, int(reservation_id))
+        with self._lock:
+            self._generation += 1
+            item = self._by_id.pop(key, None)
+            if item is not None:
+                court_id, start, _ = item
+                self._courts[court_id].remove(key, start)
+
+    # ---------- 各 worker 经变更表同步的区间变化 ----------
+
+    def change_cursor(self) -> Optional[Tuple[Optional[int], int]]:
+        """
+        同步变化的读取位置 (加载时的最大 id, 已应用的最大 id)；索引未加载时返回 None（加载时会读到最新数据）
+        加载时变更表尚未建好的，前者为 None
+        """
+        with self._lock:
+            if self._window is None:
+                return None
+            return self._change_floor, self._change_seen
+
+    def apply_changes(self, rows) -> None:
+        """按 id 顺序应用 (id, reservation_id, court_id, start, end)，court_id 为 None 表示释放"""
+        with self._lock:
+            if self._window is None:
+                return
+            for change_id, reservation_id, court_id, start, end in rows:
+                if court_id is None:
+                    self.remove(reservation_id)
+                else:
+                    self.add(reservation_id, court_id, start, end)
+                self._change_seen = max(self._change_seen, int(change_id))
+
+
+reservation_index = ReservationIndex(settings.RESERVATION_INDEX_DAYS, settings.RESERVATION_INDEX_TTL)
+
+_pending_lock = threading.Lock()
+_pending: List[Tuple[int, Optional[int], Optional[datetime], Optional[datetime]]] = []
+_changes_ready = False
+_pruned_at = 0.0
+
+
+def _record(changes) -> None:
+    """记下要同步给其他 worker 的区间变化；没有轮询线程（单 worker 部署）时无人读取，直接跳过"""
+    if not cache_bus.is_running():
+        return
+    overflow = False
+    with _pending_lock:
+        _pending.extend(changes)
+        if len(_pending) > _PENDING_LIMIT:
+            _pending.clear()
+            overflow = True
+    if overflow:
+        # 数据库长时间不可用时不无限积攒，恢复后让其他 worker 整体重新加载
+        publish("reservations", local=False)
+
+
+def _ensure_changes_table() -> None:
+    """建表（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _changes_ready
+    if not _changes_ready:
+        with cursor_scope() as cur:
+            cur.execute(_CREATE_CHANGES_SQL)
+        _changes_ready = True
+
+
+def _changes_floor(cursor) -> Optional[int]:
+    """变更表当前的最大 id（没有记录为 0）；本进程还没建好变更表时返回 None"""
+    if not _changes_ready:
+        return None
+    cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM reservation_index_changes")
+    row = cursor.fetchone()
+    if not row:
+        return 0
+    return int((row["max_id"] if isinstance(row, dict) else row[0]) or 0)
+
+
+def sync_changes() -> int:
+    """
+    把本进程积攒的区间变化一次写入 reservation_index_changes，再按 id 顺序应用各 worker 的变化
+    由 cache_bus 轮询线程调用；返回应用的条数
+    """
+    global _pruned_at
+    _ensure_changes_table()
+    with _pending_lock:
+        pending = list(_pending)
+        _pending.clear()
+    position = reservation_index.change_cursor()
+    rows = []
+    stale = False
+    try:
+        with cursor_scope() as cur:
+            if pending:
+                cur.executemany(
+                    """
+                    INSERT INTO reservation_index_changes (reservation_id, court_id, start_time, end_time)
+                    VALUES (%s, %s, %s, %s)
+                    """,
+                    pending,
+                )
+            if position is not None and position[0] is None:
+                # 加载索引时还没有变更表，不知道从哪里读起：下次使用时重新加载
+                stale = True
+            elif position is not None:
+                floor, seen = position
+                # 只按 id 翻页；重放窗口用数据库自己的时间，不受应用与数据库时区/时钟差异影响
+                cur.execute(
+                    """
+                    SELECT id, reservation_id, court_id, start_time, end_time
+                    FROM reservation_index_changes
+                    WHERE id > %s
+                      AND (id > %s OR created_at >= NOW() - INTERVAL %s SECOND)
+                    ORDER BY id
+                    """,
+                    (floor, seen, _REPLAY_SECONDS),
+                )
+                rows = cur.fetchall() or []
+            if time.monotonic() - _pruned_at > _PRUNE_INTERVAL:
+                cur.execute(
+                    "DELETE FROM reservation_index_changes WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT 10000",
+                    (_CHANGES_KEEP_SECONDS,),
+                )
+                _pruned_at = time.monotonic()
+    except Exception:
+        # 写出失败时放回缓冲，下一轮重试
+        with _pending_lock:
+            _pending[:0] = pending
+        raise
+    if stale:
+        reservation_index.invalidate()
+    reservation_index.apply_changes(rows)
+    return len(rows)
+
+
+subscribe("reservations", reservation_index.invalidate)
+on_poll(sync_changes)
+
+
+def note_reservation_booked(reservation_id: int, court_id: int, start: datetime, end: datetime) -> None:
+    """预约已创建/恢复占用（commit 之后调用）：更新本进程索引，区间变化由轮询线程同步给其他 worker"""
+    reservation_index.add(reservation_id, court_id, start, end)
+    _record([(int(reservation_id), int(court_id), start, end)])
+
+
+def note_reservations_booked(rows) -> None:
+    """批量创建的预约 [(reservation_id, court_id, start, end), ...]（commit 之后调用）"""
+    changes = []
+    for reservation_id, court_id, start, end in rows:
+        reservation_index.add(reservation_id, court_id, start, end)
+        changes.append((int(reservation_id), int(court_id), start, end))
+    _record(changes)
+
+
+def note_reservation_released(reservation_id: int) -> None:
+    """预约已取消/删除（commit 之后调用）：更新本进程索引，区间变化由轮询线程同步给其他 worker"""
+    reservation_index.remove(reservation_id)
+    _record([(int(reservation_id), None, None, None)])
+
+
+def note_reservations_released(reservation_ids) -> None:
+    """批量取消的预约（commit 之后调用）"""
+    changes = []
+    for reservation_id in reservation_ids:
+        reservation_index.remove(reservation_id)
+        changes.append((int(reservation_id), None, None, None))
+    _record(changes)
+
+
+def note_reservations_changed() -> None:
+    """批量变化（如删除会员的全部预约）或培训排期变化：所有 worker 重新加载索引"""
+    publish("reservations")
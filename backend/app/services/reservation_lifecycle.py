@@ -0,0 +1,203 @@
+# app/services/reservation_lifecycle.py
+"""
+场地预约状态推进（后台线程）
+
+以前预约状态 已预约 → 进行中 → 已完成 只在管理员调用 PUT /court-reservations/{id}/status 时变化，
+报表和会员端要么按起止时间现算状态，要么直接显示过期的状态。现在由后台线程定时按批推进：
+
+- 已预约 且 start_time <= now < end_time → 进行中
+- 已预约 / 进行中 且 end_time <= now       → 已完成
+
+每批一个短事务：按 (status, end_time) 索引加锁取出最多 RESERVATION_LIFECYCLE_BATCH_SIZE 条，
+一条 UPDATE ... WHERE id IN (...) 改状态，完成的预约在同一事务里用一条 executemany 给会员发通知；
+一批不满说明已推进完，本轮结束。
+
+只有在上一轮间隔（加少量宽限）内结束的预约才发完成通知：部署后首次运行或停机恢复后，
+积压的历史预约只静默补推状态，不会给会员发一堆几个月前预约的通知。多个 worker 同时运行时，后到的事务在行锁上等待，
+锁释放后重新判断条件，已被推进的行不会被重复处理。
+
+已完成/进行中都不是"已取消"，不影响场地占用（位图与区间索引），因此无需发 cache_bus 通知。
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from ..config import settings
+from ..database import cursor_scope
+from .notifications import create_member_notifications
+from .waitlist import sweep_expired_offers
+
+logger = logging.getLogger(__name__)
+
+STATUS_BOOKED = "已预约"
+STATUS_IN_USE = "进行中"
+STATUS_DONE = "已完成"
+
+INDEX_NAME = "idx_court_reservations_status_end"
+
+# 完成通知的时间窗口在推进间隔之外再放宽的时间（线程调度、单轮耗时）
+_NOTIFY_GRACE = timedelta(minutes=5)
+
+_index_ready = False
+_worker: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+
+
+def ensure_index() -> None:
+    """补建 (status, end_time) 索引（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _index_ready
+    if _index_ready:
+        return
+    with cursor_scope() as cur:
+        cur.execute(
+            """
+            SELECT 1
+            FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+              AND TABLE_NAME = 'court_reservations'
+              AND INDEX_NAME = %s
+            LIMIT 1
+            """,
+            (INDEX_NAME,),
+        )
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE court_reservations ADD INDEX {INDEX_NAME} (status, end_time)")
+    _index_ready = True
+
+
+def _row(row, key, index):
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+def _advance_batch(
+    cursor,
+    from_statuses: Sequence[str],
+    to_status: str,
+    now: datetime,
+    limit: int,
+    notify_since: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """
+    推进一批预约（需外部 commit），返回被推进的行
+    to_status 为 进行中 时取已开始未结束的，为 已完成 时取已结束的
+    notify_since: 只给 end_time 不早于它的已完成预约发通知，更早的静默补推；为 None 时都发
+    """
+    marks = ", ".join(["%s"] * len(from_statuses))
+    if to_status == STATUS_DONE:
+        cond, params = "end_time <= %s", [now]
+    else:
+        cond, params = "end_time > %s AND start_time <= %s", [now, now]
+    cursor.execute(
+        f"""
+        SELECT id, member_id, court_id, start_time, end_time
+        FROM court_reservations
+        WHERE status IN ({marks}) AND {cond}
+        ORDER BY end_time
+        LIMIT %s
+        FOR UPDATE
+        """,
+        (*from_statuses, *params, limit),
+    )
+    rows = [
+        {
+            "id": int(_row(r, "id", 0)),
+            "member_id": _row(r, "member_id", 1),
+            "court_id": _row(r, "court_id", 2),
+            "start_time": _row(r, "start_time", 3),
+            "end_time": _row(r, "end_time", 4),
+        }
+        for r in cursor.fetchall() or []
+    ]
+    if not rows:
+        return rows
+
+    ids = [r["id"] for r in rows]
+    cursor.execute(
+        f"""
+        UPDATE court_reservations
+        SET status = %s
+        WHERE id IN ({', '.join(['%s'] * len(ids))}) AND status IN ({marks})
+        """,
+        (to_status, *ids, *from_statuses),
+    )
+
+    if to_status == STATUS_DONE:
+        items = [
+            {
+                "member_id": r["member_id"],
+                "title": "场地预约已完成",
+                "content": f"您 {r['start_time']} 至 {r['end_time']} 的场地预约（编号 {r['id']}）已完成，欢迎再次光临。",
+            }
+            for r in rows
+            if r["member_id"] and (notify_since is None or r["end_time"] >= notify_since)
+        ]
+        if items:
+            try:
+                create_member_notifications(items, cursor=cursor)
+            except Exception as e:
+                # 通知失败不影响状态推进
+                logger.warning(f"预约完成通知写入失败: {e}")
+    return rows
+
+
+def advance_statuses(now: Optional[datetime] = None, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """
+    推进一轮：先把已结束的预约置为已完成，再把已开始的置为进行中；每批单独提交
+    只给上一轮间隔（加宽限）内结束的预约发完成通知；返回各目标状态推进的条数
+    """
+    now = now or datetime.now()
+    limit = batch_size or settings.RESERVATION_LIFECYCLE_BATCH_SIZE
+    notify_since = now - timedelta(seconds=max(settings.RESERVATION_LIFECYCLE_INTERVAL, 0)) - _NOTIFY_GRACE
+    counts = {STATUS_DONE: 0, STATUS_IN_USE: 0}
+    plan = (
+        ((STATUS_BOOKED, STATUS_IN_USE), STATUS_DONE),
+        ((STATUS_BOOKED,), STATUS_IN_USE),
+    )
+    for from_statuses, to_status in plan:
+        while True:
+            with cursor_scope() as cur:
+                rows = _advance_batch(cur, from_statuses, to_status, now, limit, notify_since)
+            counts[to_status] += len(rows)
+            if len(rows) < limit:
+                break
+    if counts[STATUS_DONE] or counts[STATUS_IN_USE]:
+        logger.info(f"预约状态推进：进行中 {counts[STATUS_IN_USE]} 条，已完成 {counts[STATUS_DONE]} 条")
+    return counts
+
+
+def _run_loop(interval: float) -> None:
+    while not _stop_event.wait(interval):
+        try:
+            advance_statuses()
+        except Exception as e:
+            logger.warning(f"推进预约状态失败: {e}")
+        try:
+            # 候补转成的预留过期未确认时，让给下一位候补
+            sweep_expired_offers()
+        except Exception as e:
+            logger.warning(f"清扫过期的候补预留失败: {e}")
+
+
+def start_lifecycle_worker() -> None:
+    """启动后台推进线程（应用启动时调用；间隔 <= 0 时不启动）"""
+    global _worker
+    interval = settings.RESERVATION_LIFECYCLE_INTERVAL
+    if interval <= 0 or (_worker is not None and _worker.is_alive()):
+        return
+    try:
+        ensure_index()
+    except Exception as e:
+        logger.warning(f"创建预约状态索引失败，状态推进将退化为全表扫描: {e}")
+    _stop_event.clear()
+    _worker = threading.Thread(target=_run_loop, args=(interval,), name="reservation-lifecycle", daemon=True)
+    _worker.start()
+
+
+def stop_lifecycle_worker() -> None:
+    """停止后台推进线程（应用关闭时调用）"""
+    global _worker
+    _stop_event.set()
+    if _worker is not None:
+        _worker.join(timeout=5)
+        _worker = None
@@ -0,0 +1,151 @@
+# app/services/resource_calendar.py
+"""
+场地资源日历：场地预约 + 培训排期 + 场地停用时段
+
+培训排期（schedules）的 venue 是自由文本；与某个场地名称（courts.name）相同时，视为占用该场地，
+资源 id 即 courts.id。以前排期只和其他排期按 venue 文本比对，场地预约只查 court_reservations，
+两边互相看不见，同一块场地可以既被预约又被排课。
+
+这里给出统一形状的占用查询，每行为 (court_id, start_time, end_time, id, kind)，kind 为 reservation / schedule / closure：
+- 区间索引加载、可用性网格/空闲时段、位图重建与精确复查都用它，预约、排期与停用时段互相可见
+- 排期的创建/修改/取消与预约一样经 court_slots.claim_court_slots / release_court_slots 占用与释放
+  （同一把 (场地, 日期) 位图行锁），因此跨模块也不会重复占用
+- 停用时段即 court_closure_jobs 中的一行（见 court_closures）：登记后整段视为占用，不能再预约或预留；
+  任务失败或停用被解除后（status 不再是 running / done）不再占用
+
+venue 不是场地名称的排期（如"1号教室"）不属于任何场地，仍只与同 venue 的排期比对。
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Any, List, Optional, Sequence, Tuple
+
+KIND_RESERVATION = "reservation"
+KIND_SCHEDULE = "schedule"
+KIND_CLOSURE = "closure"
+
+
+def occupancy_query(
+    start: datetime,
+    end: datetime,
+    *,
+    court_ids: Optional[Sequence[int]] = None,
+    court_type: Optional[str] = None,
+    exclude: Optional[Tuple[str, int]] = None,
+    lock: bool = False,
+) -> Tuple[str, List[Any]]:
+    """
+    [start, end) 内未取消的预约、正常的排期（排期按 venue = courts.name 映射到场地）与生效中的场地停用时段
+    exclude=(kind, id) 排除某一条（修改排期时排除自己）；lock=True 时为加锁读（持有位图行锁时使用）
+    """
+    suffix = " LOCK IN SHARE MODE" if lock else ""
+
+    res_sql = """
+        SELECT r.court_id, r.start_time, r.end_time, r.id, 'reservation' AS kind
+        FROM court_reservations r
+        WHERE r.status <> '已取消'
+          AND r.start_time < %s
+          AND r.end_time > %s
+    """
+    res_params: List[Any] = [end, start]
+
+    sch_sql = """
+        SELECT c.id AS court_id,
+               TIMESTAMP(s.date, s.start_time) AS start_time,
+               TIMESTAMP(s.date, s.end_time) AS end_time,
+               s.id,
+               'schedule' AS kind
+        FROM schedules s
+        JOIN courts c ON c.name = s.venue
+        WHERE s.status = '正常'
+          AND s.date BETWEEN %s AND %s
+          AND TIMESTAMP(s.date, s.start_time) < %s
+          AND TIMESTAMP(s.date, s.end_time) > %s
+    """
+    sch_params: List[Any] = [start.date(), end.date(), end, start]
+
+    clo_sql = """
+        SELECT j.court_id, j.start_time, j.end_time, j.id, 'closure' AS kind
+        FROM court_closure_jobs j
+        WHERE j.status IN ('running', 'done')
+          AND j.start_time < %s
+          AND j.end_time > %s
+    """
+    clo_params: List[Any] = [end, start]
+
+    if court_ids is not None:
+        ids = [int(c) for c in court_ids] or [0]
+        marks = ", ".join(["%s"] * len(ids))
+        res_sql += f" AND r.court_id IN ({marks})"
+        res_params.extend(ids)
+        sch_sql += f" AND c.id IN ({marks})"
+        sch_params.extend(ids)
+        clo_sql += f" AND j.court_id IN ({marks})"
+        clo_params.extend(ids)
+    if court_type:
+        res_sql += " AND r.court_id IN (SELECT id FROM courts WHERE type = %s)"
+        res_params.append(court_type)
+        sch_sql += " AND c.type = %s"
+        sch_params.append(court_type)
+        clo_sql += " AND j.court_id IN (SELECT id FROM courts WHERE type = %s)"
+        clo_params.append(court_type)
+    if exclude is not None:
+        kind, item_id = exclude
+        if kind == KIND_RESERVATION:
+            res_sql += " AND r.id <> %s"
+            res_params.append(item_id)
+        elif kind == KIND_CLOSURE:
+            clo_sql += " AND j.id <> %s"
+            clo_params.append(item_id)
+        else:
+            sch_sql += " AND s.id <> %s"
+            sch_params.append(item_id)
+
+    sql = (
+        f"({res_sql}{suffix}) UNION ALL ({sch_sql}{suffix}) UNION ALL ({clo_sql}{suffix}) "
+        "ORDER BY court_id, start_time"
+    )
+    return sql, res_params + sch_params + clo_params
+
+
+def occupancy_rows(cursor, start: datetime, end: datetime, **kwargs) -> List[Tuple[int, datetime, datetime, int, str]]:
+    """执行 occupancy_query，统一返回 (court_id, start, end, id, kind) 元组"""
+    sql, params = occupancy_query(start, end, **kwargs)
+    cursor.execute(sql, tuple(params))
+    out = []
+    for row in cursor.fetchall() or []:
+        if isinstance(row, dict):
+            out.append((int(row["court_id"]), row["start_time"], row["end_time"], row.get("id"), row.get("kind") or KIND_RESERVATION))
+        else:
+            out.append((int(row[0]), row[1], row[2], row[3] if len(row) > 3 else None, row[4] if len(row) > 4 else KIND_RESERVATION))
+    return out
+
+
+# ========== 排期 ↔ 场地 ==========
+
+def _as_time(value: Any) -> time:
+    """schedules.start_time/end_time 是 TIME 列，驱动返回 timedelta；也接受 time 与 "HH:MM[:SS]" """
+    if isinstance(value, time):
+        return value
+    if isinstance(value, timedelta):
+        return (datetime.min + value).time()
+    parts = [int(p) for p in str(value).strip().split(":")]
+    return time(*parts[:3])
+
+
+def schedule_interval(day: Any, start_time: Any, end_time: Any) -> Tuple[datetime, datetime]:
+    """排期的日期 + 起止时间 → [start, end) datetime"""
+    if isinstance(day, datetime):
+        day = day.date()
+    elif not isinstance(day, date):
+        day = date.fromisoformat(str(day)[:10])
+    return datetime.combine(day, _as_time(start_time)), datetime.combine(day, _as_time(end_time))
+
+
+def resolve_schedule_court(cursor, venue: Optional[str]) -> Optional[int]:
+    """venue 与场地名称相同时返回场地 id，否则 None（非场地的上课地点）"""
+    if not venue:
+        return None
+    cursor.execute("SELECT id FROM courts WHERE name = %s LIMIT 1", (venue,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return int(row["id"] if isinstance(row, dict) else row[0])
@@ -0,0 +1,98 @@
+# app/services/schema.py
+"""
+表结构注册表
+
+各 service 需要兼容不同版本的表结构（orders 有无 source / currency、notifications 有无 member_id 等），
+以前每次下单、退款、发通知都要执行 SHOW COLUMNS / SHOW TABLES。这里改为：
+
+1. 启动时（或首次使用时）通过 information_schema 一次性读取当前库所有表的列
+2. 之后 columns() / has_table() 直接读内存，不再有元数据查询
+3. 按列集合编译 INSERT 语句并缓存，create_court_order / create_refund_order / create_notification 复用
+4. 执行迁移后调用 cache_bus.publish("schema")，所有 worker 在下次使用时重新加载；
+   SCHEMA_CACHE_TTL 作为兜底刷新间隔
+"""
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, Optional, Sequence, Tuple
+
+from ..database import cursor_scope
+from .cache_bus import subscribe
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CACHE_TTL = 3600  # 兜底刷新间隔（秒），迁移后应 publish("schema")
+
+
+class SchemaRegistry:
+    """当前数据库的表 -> 列集合映射，以及按列集合缓存的 INSERT 语句"""
+
+    def __init__(self, ttl: float = SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tables: Optional[Dict[str, FrozenSet[str]]] = None
+        self._loaded_at = 0.0
+        self._insert_cache: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...]], str] = {}
+
+    def reload(self, cursor=None) -> Dict[str, FrozenSet[str]]:
+        """从 information_schema 重新读取全部表结构（传入 cursor 时复用调用方连接）"""
+        tables: Dict[str, set] = {}
+        with cursor_scope(cursor) as cur:
+            cur.execute(
+                """
+                SELECT TABLE_NAME, COLUMN_NAME
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                """
+            )
+            for row in cur.fetchall() or []:
+                if isinstance(row, dict):
+                    table, column = row["TABLE_NAME"], row["COLUMN_NAME"]
+                else:
+                    table, column = row[0], row[1]
+                tables.setdefault(table.lower(), set()).add(column)
+
+        loaded = {t: frozenset(cols) for t, cols in tables.items()}
+        with self._lock:
+            self._tables = loaded
+            self._loaded_at = time.time()
+            # 列变化后旧语句可能引用已删除的列，一并清空
+            self._insert_cache.clear()
+        logger.info(f"表结构注册表已加载，共 {len(loaded)} 张表")
+        return loaded
+
+    def invalidate(self) -> None:
+        """标记失效，下次使用时重新加载"""
+        with self._lock:
+            self._tables = None
+
+    def _ensure_loaded(self, cursor=None) -> Dict[str, FrozenSet[str]]:
+        tables = self._tables
+        if tables is None or time.time() - self._loaded_at >= self.ttl:
+            tables = self.reload(cursor)
+        return tables
+
+    def columns(self, table: str, cursor=None) -> FrozenSet[str]:
+        """返回表的列集合，表不存在时返回空集合"""
+        return self._ensure_loaded(cursor).get(table.lower(), frozenset())
+
+    def has_table(self, table: str, cursor=None) -> bool:
+        return table.lower() in self._ensure_loaded(cursor)
+
+    def insert_sql(self, table: str, columns: Sequence[str], values: Sequence[str]) -> str:
+        """
+        按列集合返回编译好的 INSERT 语句（带缓存）
+        values 与 columns 一一对应，为 "%s" 占位符或 NOW() 这类 SQL 表达式
+        """
+        key = (table, tuple(columns), tuple(values))
+        sql = self._insert_cache.get(key)
+        if sql is None:
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(values)})"
+            with self._lock:
+                self._insert_cache[key] = sql
+        return sql
+
+
+schema_registry = SchemaRegistry()
+
+subscribe("schema", schema_registry.invalidate)
@@ -0,0 +1,97 @@
+# app/services/settings_cache.py
+"""
+system_settings 进程内缓存
+
+几乎每条写路径都要读系统设置（订单号前缀/货币、会员等级折扣、审计开关……），
+以前每次都单独查库、重新解析 JSON。这里把整张表读成快照缓存在进程内：
+
+1. 快照按版本号缓存，版本号不变时直接读内存
+2. system_settings 的每个保存接口在 commit 之后 publish("settings")，
+   本进程和其他 worker（经 cache_bus 轮询）都会递增版本号，下次读取时重新加载
+3. JSON 等需要解析的值通过 get_parsed() 按版本缓存解析结果，不再每次 json.loads
+"""
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ..database import cursor_scope
+from .cache_bus import subscribe
+
+_lock = threading.Lock()
+_version = 0
+_snapshot: Dict[str, Dict[str, str]] = {}
+_snapshot_version = -1
+_parsed: Dict[Tuple[str, str, Callable], Any] = {}
+
+
+def settings_version() -> int:
+    return _version
+
+
+def bump_settings_version() -> int:
+    """设置已变更：递增本进程版本号，所有缓存在下次读取时失效（需在 commit 之后调用）
+    需要通知其他 worker 时用 cache_bus.publish("settings")
+    """
+    global _version
+    with _lock:
+        _version += 1
+        return _version
+
+
+def _load_snapshot(cursor=None) -> Dict[str, Dict[str, str]]:
+    grouped: Dict[str, Dict[str, str]] = {}
+    with cursor_scope(cursor) as cur:
+        cur.execute("SELECT group_key, setting_key, setting_value FROM system_settings")
+        for row in cur.fetchall() or []:
+            if isinstance(row, dict):
+                g, k, v = row["group_key"], row["setting_key"], row["setting_value"]
+            else:
+                g, k, v = row[0], row[1], row[2]
+            grouped.setdefault(g, {})[k] = v
+    return grouped
+
+
+def get_settings_snapshot(cursor=None) -> Dict[str, Dict[str, str]]:
+    """
+    返回 {group_key: {setting_key: setting_value}} 快照（只读，调用方不要修改）
+    传入 cursor 时复用调用方的连接加载
+    """
+    global _snapshot, _snapshot_version
+    version = _version
+    if _snapshot_version == version:
+        return _snapshot
+
+    grouped = _load_snapshot(cursor)
+    with _lock:
+        # 加载期间版本又变了，则不覆盖（下次读取会再加载）
+        if _version == version:
+            _snapshot = grouped
+            _snapshot_version = version
+            _parsed.clear()
+    return grouped
+
+
+def get_setting_value(group_key: str, setting_key: str, default: Optional[str] = None, cursor=None) -> Optional[str]:
+    """读取单个配置项的原始字符串值，不存在时返回 default"""
+    value = get_settings_snapshot(cursor).get(group_key, {}).get(setting_key)
+    return default if value is None else value
+
+
+def get_parsed(group_key: str, setting_key: str, parser: Callable[[Optional[str]], Any], cursor=None) -> Any:
+    """
+    读取配置项并用 parser 解析，解析结果按版本缓存
+    parser 接收原始字符串（可能为 None），返回值应视为只读
+    """
+    snapshot = get_settings_snapshot(cursor)
+    key = (group_key, setting_key, parser)
+    try:
+        return _parsed[key]
+    except KeyError:
+        pass
+    value = parser(snapshot.get(group_key, {}).get(setting_key))
+    with _lock:
+        if _snapshot is snapshot:
+            _parsed[key] = value
+    return value
+
+
+subscribe("settings", bump_settings_version)
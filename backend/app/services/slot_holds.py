@@ -0,0 +1,326 @@
+# app/services/slot_holds.py
+"""
+场地时段预留（会员端下单的两段式流程）
+
+以前会员下单在一个长事务里完成 计价 → 冲突检测 → 锁会员余额 → 插入预约 → 流水 → 订单，
+热门时段大量请求在锁住会员行之后才因冲突失败回滚。现在拆成两步：
+
+1. 预留（create_hold）：计价后在一个短事务里锁定 (场地, 日期) 位图行，检查预约与其他未过期的预留，
+   写入一条有效期 SLOT_HOLD_TTL_SECONDS 的预留记录；会员行只在最后加锁，用来串行化每个会员的预留上限计数，
+   不读写余额
+2. 确认（member_portal 的 confirm）：锁定位图行后锁定预留记录复核，只做扣款、写预约/流水/订单，成功后删除预留
+
+预留记录存在 court_slot_holds 表里（所有 worker 共享、重启不丢），进程内另有一份按 token 的 TTL 映射，
+供可用性网格和冲突预检直接读取；本进程的增删直接更新映射，其他 worker 经 cache_bus 的 holds 频道
+通知后从表里重新加载，加载失败时沿用映射中尚未过期的数据。
+
+最终的冲突检测仍在数据库里：court_slots.claim_court_slots 持有位图行锁时调用 hold_conflict_exists，
+过期的预留自动失效，无需后台清理（新建预留时顺带删除该场地已过期的记录）。
+"""
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ..config import settings
+from ..database import cursor_scope
+from .cache_bus import publish, subscribe
+
+logger = logging.getLogger(__name__)
+
+# 加载失败后的重试间隔（秒）
+_RETRY_INTERVAL = 1.0
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS court_slot_holds (
+    hold_token CHAR(32) NOT NULL PRIMARY KEY,
+    court_id INT NOT NULL,
+    member_id INT NOT NULL,
+    start_time DATETIME NOT NULL,
+    end_time DATETIME NOT NULL,
+    total_amount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+    remark VARCHAR(255) NULL,
+    expires_at DATETIME NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_court_slot_holds_court (court_id, start_time),
+    KEY idx_court_slot_holds_member (member_id, expires_at)
+)
+"""
+
+
+class HoldError(ValueError):
+    """预留不存在、已过期或超出数量限制"""
+
+
+class Hold(NamedTuple):
+    court_id: int
+    member_id: int
+    start: datetime
+    end: datetime
+    expires_at: datetime
+
+
+_lock = threading.Lock()
+_table_ready = False
+_holds: Dict[str, Hold] = {}
+_notified = 1      # 每收到一次 holds 通知 +1
+_loaded = 0        # 最近一次加载开始时的 _notified，二者不等说明需要重新加载
+_retry_at = 0.0
+
+
+def ensure_table() -> None:
+    """建表（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _table_ready
+    if not _table_ready:
+        with cursor_scope() as cur:
+            cur.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def _row(row, key, index):
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+# ========== 进程内 TTL 映射 ==========
+
+def _mark_dirty() -> None:
+    global _notified, _retry_at
+    with _lock:
+        _notified += 1
+        _retry_at = 0.0
+
+
+def refresh() -> None:
+    """从表里重新加载所有未过期的预留"""
+    global _holds, _loaded, _retry_at
+    notified = _notified
+    ensure_table()
+    with cursor_scope() as cur:
+        cur.execute(
+            """
+            SELECT hold_token, court_id, member_id, start_time, end_time, expires_at
+            FROM court_slot_holds
+            WHERE expires_at > %s
+            """,
+            (datetime.now(),),
+        )
+        rows = cur.fetchall() or []
+    holds = {
+        str(token): Hold(int(court_id), int(member_id), start, end, expires_at)
+        for token, court_id, member_id, start, end, expires_at in rows
+    }
+    with _lock:
+        _holds = holds
+        # 加载期间又收到通知时保持"需要加载"
+        _loaded = notified
+        _retry_at = 0.0
+
+
+def _active() -> List[Tuple[str, Hold]]:
+    """未过期的预留快照；需要时先重新加载，失败则沿用映射中的数据"""
+    global _retry_at
+    if _loaded != _notified and time.monotonic() >= _retry_at:
+        try:
+            refresh()
+        except Exception as e:
+            with _lock:
+                _retry_at = time.monotonic() + _RETRY_INTERVAL
+            logger.warning(f"加载场地预留失败，沿用进程内数据: {e}")
+    now = datetime.now()
+    with _lock:
+        expired = [token for token, h in _holds.items() if h.expires_at <= now]
+        for token in expired:
+            del _holds[token]
+        return list(_holds.items())
+
+
+def held_rows(start: datetime, end: datetime, exclude_token: Optional[str] = None) -> List[Tuple[int, datetime, datetime]]:
+    """[start, end) 内被预留的区间 (court_id, start, end)，可与预约占用一起交给 availability.merge_busy"""
+    return [
+        (h.court_id, h.start, h.end)
+        for token, h in _active()
+        if token != exclude_token and h.start < end and h.end > start
+    ]
+
+
+def has_held_conflict(court_id: int, start: datetime, end: datetime, exclude_token: Optional[str] = None) -> bool:
+    """预检：[start, end) 是否与该场地其他未过期的预留重叠（只读进程内映射）"""
+    return any(c == int(court_id) for c, _, _ in held_rows(start, end, exclude_token))
+
+
+def note_hold_added(token: str, hold: Hold) -> None:
+    """预留已写入（commit 之后调用）：更新本进程映射并通知其他 worker"""
+    with _lock:
+        _holds[token] = hold
+    publish("holds", local=False)
+
+
+def note_hold_removed(token: str) -> None:
+    """预留已确认/释放（commit 之后调用）：更新本进程映射并通知其他 worker"""
+    with _lock:
+        _holds.pop(token, None)
+    publish("holds", local=False)
+
+
+subscribe("holds", _mark_dirty)
+
+
+# ========== 数据库操作（需外部 commit） ==========
+
+def hold_conflict_exists(cursor, court_id: int, start: datetime, end: datetime, exclude_token: Optional[str] = None) -> bool:
+    """
+    持有 (场地, 日期) 位图行锁时检查其他未过期的预留
+    用加锁读，读到最新已提交的预留，不受事务快照影响
+    """
+    ensure_table()
+    cursor.execute(
+        """
+        SELECT hold_token
+        FROM court_slot_holds
+        WHERE court_id = %s
+          AND expires_at > %s
+          AND start_time < %s
+          AND end_time > %s
+          AND hold_token <> %s
+        LIMIT 1
+        LOCK IN SHARE MODE
+        """,
+        (court_id, datetime.now(), end, start, exclude_token or ""),
+    )
+    return cursor.fetchone() is not None
+
+
+def holds_in_range(cursor, court_ids, start: datetime, end: datetime) -> List[Tuple[int, datetime, datetime]]:
+    """一次加锁读取多个场地在 [start, end) 内未过期的预留（批量占用时使用）"""
+    ensure_table()
+    court_ids = sorted({int(c) for c in court_ids})
+    if not court_ids:
+        return []
+    cursor.execute(
+        f"""
+        SELECT court_id, start_time, end_time
+        FROM court_slot_holds
+        WHERE court_id IN ({', '.join(['%s'] * len(court_ids))})
+          AND expires_at > %s
+          AND start_time < %s
+          AND end_time > %s
+        LOCK IN SHARE MODE
+        """,
+        (*court_ids, datetime.now(), end, start),
+    )
+    return [
+        (int(_row(r, "court_id", 0)), _row(r, "start_time", 1), _row(r, "end_time", 2))
+        for r in cursor.fetchall() or []
+    ]
+
+
+def create_hold(
+    *,
+    member_id: int,
+    court_id: int,
+    start: datetime,
+    end: datetime,
+    total_amount: float,
+    remark: Optional[str] = None,
+    cursor,
+) -> Tuple[str, Hold]:
+    """
+    预留场地时段（需外部 commit，commit 后调用 note_hold_added）
+    时段被预约或被其他预留占用时抛出 court_slots.SlotConflict；超出每个会员的预留上限时抛出 HoldError
+    """
+    from .court_slots import claim_court_slots
+
+    ensure_table()
+    now = datetime.now()
+    # 锁定位图行并检查预约与其他预留，但不置位：预留只占预留表，确认时才真正占用
+    claim_court_slots(court_id, start, end, cursor=cursor, mark=False)
+
+    # 锁会员行后再数预留，同一会员的并发预留排队，不会一起越过上限；
+    # 放在锁位图行之后，与确认预留（先位图行、扣款时再锁会员行）的加锁顺序一致
+    cursor.execute("SELECT id FROM members WHERE id = %s FOR UPDATE", (member_id,))
+    cursor.fetchone()
+    cursor.execute(
+        "SELECT COUNT(*) AS cnt FROM court_slot_holds WHERE member_id = %s AND expires_at > %s",
+        (member_id, now),
+    )
+    row = cursor.fetchone()
+    if int((_row(row, "cnt", 0) if row else 0) or 0) >= settings.SLOT_HOLD_MAX_PER_MEMBER:
+        raise HoldError("预留数量已达上限，请先确认或释放已有预留")
+
+    cursor.execute(
+        "DELETE FROM court_slot_holds WHERE court_id = %s AND expires_at <= %s",
+        (court_id, now),
+    )
+
+    token = secrets.token_hex(16)
+    hold = Hold(int(court_id), int(member_id), start, end, now + timedelta(seconds=settings.SLOT_HOLD_TTL_SECONDS))
+    cursor.execute(
+        """
+        INSERT INTO court_slot_holds
+            (hold_token, court_id, member_id, start_time, end_time, total_amount, remark, expires_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        (token, court_id, member_id, start, end, total_amount, remark, hold.expires_at),
+    )
+    return token, hold
+
+
+def _fetch_hold(token: str, member_id: int, cursor, lock: bool) -> Dict:
+    cursor.execute(
+        f"""
+        SELECT hold_token, court_id, member_id, start_time, end_time, total_amount, remark, expires_at
+        FROM court_slot_holds
+        WHERE hold_token = %s AND member_id = %s
+        {"FOR UPDATE" if lock else ""}
+        """,
+        (token, member_id),
+    )
+    row = cursor.fetchone()
+    if not row:
+        raise HoldError("预留不存在或已失效")
+    if not isinstance(row, dict):
+        keys = ("hold_token", "court_id", "member_id", "start_time", "end_time", "total_amount", "remark", "expires_at")
+        row = dict(zip(keys, row))
+    if row["expires_at"] <= datetime.now():
+        raise HoldError("预留已过期，请重新选择时段")
+    return row
+
+
+def get_hold(token: str, member_id: int, *, cursor) -> Dict:
+    """
+    不加锁地读取会员自己的预留（确认时先用它取时段）；不存在或已过期时抛出 HoldError
+    确认时的加锁顺序与下单、创建预留一致：先锁位图行（claim_court_slots），再 lock_hold 复核
+    """
+    ensure_table()
+    return _fetch_hold(token, member_id, cursor, lock=False)
+
+
+def lock_hold(token: str, member_id: int, *, cursor) -> Dict:
+    """锁定会员自己的预留记录（确认时在锁定位图行之后调用）；不存在或已过期时抛出 HoldError"""
+    ensure_table()
+    return _fetch_hold(token, member_id, cursor, lock=True)
+
+
+def delete_holds_in_range(court_id: int, start: datetime, end: datetime, *, cursor) -> int:
+    """删除该场地与 [start, end) 重叠的全部预留（场地停用时调用，commit 后 publish("holds")），返回删除条数"""
+    ensure_table()
+    cursor.execute(
+        "DELETE FROM court_slot_holds WHERE court_id = %s AND start_time < %s AND end_time > %s",
+        (court_id, end, start),
+    )
+    return cursor.rowcount
+
+
+def delete_hold(token: str, *, cursor, member_id: Optional[int] = None) -> bool:
+    """删除预留记录（确认成功或会员主动释放），返回是否删除了记录"""
+    ensure_table()
+    if member_id is None:
+        cursor.execute("DELETE FROM court_slot_holds WHERE hold_token = %s", (token,))
+    else:
+        cursor.execute(
+            "DELETE FROM court_slot_holds WHERE hold_token = %s AND member_id = %s",
+            (token, member_id),
+        )
+    return cursor.rowcount > 0
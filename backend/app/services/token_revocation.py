@@ -0,0 +1,177 @@
+# app/services/token_revocation.py
+"""
+token 撤销表
+
+登录 token 里带上了认证需要的身份声明（角色、会员状态/等级……），认证时不再查库。
+声明签发之后如果账号发生变化，就在 token_revocations 里记一行，让该主体在此之前签发的 token 失效：
+
+- stale（声明过期）：员工角色/启用状态变化、会员资料/状态变化、账号删除。
+  这类 token 不再信任其中的声明，回退到查库认证（被禁用/删除的账号因此被拒绝，其他账号照常使用）
+- logout（强制下线）：修改/重置密码、管理员强制下线。这类 token 直接 401
+
+进程内只保存每个主体最近一次 stale/logout 的时间（超过 token 有效期的记录没有意义，会被清理），
+经 cache_bus 的 revocations 频道通知后按自增 id 增量拉取新记录，不重复加载整表。
+撤销表一次都没加载成功之前（如启动时数据库不可用）所有 token 都按 stale 处理，回退查库，不信任声明。
+
+时间精确到毫秒（token 的 iat 同样带毫秒）：修改密码后同一秒内重新登录拿到的新 token 不会被误判为已撤销。
+
+写入与业务数据在同一事务内（需外部 commit），commit 之后调用 publish("revocations")。
+"""
+import logging
+import math
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from ..config import settings
+from ..database import cursor_scope
+from .cache_bus import subscribe
+
+logger = logging.getLogger(__name__)
+
+TOKEN_OK = "ok"
+TOKEN_STALE = "stale"
+TOKEN_REVOKED = "revoked"
+
+# principal_id 为该值时对同类全部主体生效（如完全格式化清空会员表）
+ALL_PRINCIPALS = "*"
+
+# 加载失败后的重试间隔（秒），避免数据库不可用时每个请求都去重连
+_RETRY_INTERVAL = 1.0
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS token_revocations (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    principal_kind VARCHAR(16) NOT NULL,
+    principal_id VARCHAR(64) NOT NULL,
+    revoked_at BIGINT NOT NULL,          -- 毫秒时间戳
+    force_logout TINYINT(1) NOT NULL DEFAULT 0,
+    reason VARCHAR(64) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_token_revocations_revoked_at (revoked_at)
+)
+"""
+
+_lock = threading.Lock()
+_table_ready = False
+_last_id = 0
+_stale_before: Dict[Tuple[str, str], float] = {}
+_logout_before: Dict[Tuple[str, str], float] = {}
+_notified = 1      # 每收到一次 revocations 通知 +1
+_loaded = 0        # 最近一次加载开始时的 _notified，二者不等说明需要增量拉取
+_ready = False     # 是否至少加载成功过一次；之前不能信任任何声明
+_retry_at = 0.0
+
+
+def _token_lifetime() -> int:
+    return settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+def _ensure_table(cursor) -> None:
+    global _table_ready
+    if not _table_ready:
+        cursor.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def _mark_dirty() -> None:
+    global _notified, _retry_at
+    with _lock:
+        _notified += 1
+        _retry_at = 0.0
+
+
+def _apply(kind: str, principal_id: str, revoked_at: float, force_logout: bool) -> None:
+    """revoked_at 为秒（可带小数），此时刻及之前签发的 token 失效"""
+    key = (kind, str(principal_id))
+    target = _logout_before if force_logout else _stale_before
+    if revoked_at > target.get(key, 0):
+        target[key] = revoked_at
+
+
+def _prune(now: float) -> None:
+    # token 有效期之前的撤销记录不会再命中任何未过期 token
+    cutoff = now - _token_lifetime()
+    for target in (_stale_before, _logout_before):
+        for key in [k for k, v in target.items() if v < cutoff]:
+            del target[key]
+
+
+def refresh() -> None:
+    """增量拉取 id 大于上次位置的撤销记录（首次只拉取 token 有效期内的记录）"""
+    global _last_id, _loaded, _ready, _retry_at
+    notified = _notified
+    now = time.time()
+    with cursor_scope() as cur:
+        _ensure_table(cur)
+        cur.execute(
+            """
+            SELECT id, principal_kind, principal_id, revoked_at, force_logout
+            FROM token_revocations
+            WHERE id > %s AND revoked_at >= %s
+            ORDER BY id
+            """,
+            (_last_id, int((now - _token_lifetime()) * 1000)),
+        )
+        rows = cur.fetchall() or []
+
+    with _lock:
+        for row_id, kind, principal_id, revoked_at, force_logout in rows:
+            _apply(kind, principal_id, int(revoked_at) / 1000.0, bool(force_logout))
+            _last_id = max(_last_id, int(row_id))
+        _prune(now)
+        # 加载期间又收到通知时保持"需要拉取"，下次认证再补
+        _loaded = notified
+        _ready = True
+        _retry_at = 0.0
+
+
+def token_state(kind: str, principal_id, issued_at: Optional[float]) -> str:
+    """
+    判断某个主体在 issued_at（秒，可带小数）签发的 token 的状态：
+    TOKEN_OK / TOKEN_STALE（声明不可信，需查库） / TOKEN_REVOKED（已强制下线）
+    没有 iat 的旧 token 视为在撤销之前签发；撤销表还没加载成功过时一律返回 TOKEN_STALE
+    """
+    global _retry_at
+    if _loaded != _notified and time.monotonic() >= _retry_at:
+        try:
+            refresh()
+        except Exception as e:
+            with _lock:
+                _retry_at = time.monotonic() + _RETRY_INTERVAL
+            logger.warning(f"加载 token 撤销记录失败: {e}")
+    if not _ready:
+        return TOKEN_STALE
+
+    keys = ((kind, str(principal_id)), (kind, ALL_PRINCIPALS))
+    iat = float(issued_at) if issued_at is not None else 0.0
+    if any(iat <= _logout_before.get(key, -1.0) for key in keys):
+        return TOKEN_REVOKED
+    if any(iat <= _stale_before.get(key, -1.0) for key in keys):
+        return TOKEN_STALE
+    return TOKEN_OK
+
+
+def revoke_tokens(kind: str, principal_id, *, force_logout: bool = False, reason: Optional[str] = None, cursor=None) -> None:
+    """
+    使主体在此之前签发的 token 失效（需外部 commit，commit 后 publish("revocations")）
+    kind: "user" / "member"；force_logout=False 时只让声明失效（回退查库），True 时直接下线
+    principal_id 传 ALL_PRINCIPALS 时对该类全部主体生效
+    """
+    if not _table_ready:
+        # 建表是 DDL，会隐式提交当前事务，因此单独借连接执行
+        with cursor_scope() as own:
+            _ensure_table(own)
+    # 向上取整到毫秒：与 iat（向下取整）相等时也算撤销之前签发
+    revoked_at = math.ceil(time.time() * 1000)
+    with cursor_scope(cursor) as cur:
+        cur.execute(
+            """
+            INSERT INTO token_revocations (principal_kind, principal_id, revoked_at, force_logout, reason)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            (kind, str(principal_id), revoked_at, 1 if force_logout else 0, reason),
+        )
+
+
+subscribe("revocations", _mark_dirty)
@@ -0,0 +1,313 @@
+# app/services/waitlist.py
+"""
+满场时段候补
+
+热门晚间时段约满后，会员只能反复刷新会员端等别人取消。现在会员可以登记候补
+（指定场地，或只指定场地类型），有时段被释放时由服务端按登记顺序自动转为预留：
+
+1. 取消/退款释放时段后（commit 之后）调用 schedule_promotion(court_id, start, end)，
+   在后台线程里按 (status, start_time) 索引取出完全落在释放区间内的候补
+2. 按登记顺序逐条尝试：计价后经 slot_holds.create_hold 占住时段（与普通预留同一把位图行锁，
+   时段已被别人抢先占用时跳过），候补标记为 offered 并通知会员在预留有效期内确认
+3. 会员确认预留后候补标记为 booked；主动释放预留或预留过期后标记为 expired，
+   并对该区间重新执行一次转预留，轮到下一位（过期的由预约状态推进线程定时清扫）
+
+一条候补只转一次预留；同一区间的后续候补因预留冲突被跳过，继续等待。
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+from ..database import cursor_scope
+from .court_slots import SlotConflict
+from .notifications import create_notification
+from .pricing import PricingError, quote_member_court
+from .slot_holds import HoldError, create_hold, note_hold_added
+
+logger = logging.getLogger(__name__)
+
+STATUS_WAITING = "waiting"
+STATUS_OFFERED = "offered"
+STATUS_BOOKED = "booked"
+STATUS_EXPIRED = "expired"
+STATUS_CANCELLED = "cancelled"
+
+# 一次释放最多尝试的候补条数
+_PROMOTE_CANDIDATES = 20
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS court_waitlist (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    member_id INT NOT NULL,
+    court_id INT NULL,
+    court_type VARCHAR(50) NULL,
+    start_time DATETIME NOT NULL,
+    end_time DATETIME NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'waiting',
+    hold_token CHAR(32) NULL,
+    remark VARCHAR(255) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    offered_at DATETIME NULL,
+    KEY idx_court_waitlist_match (status, start_time, end_time),
+    KEY idx_court_waitlist_member (member_id, status),
+    KEY idx_court_waitlist_hold (hold_token)
+)
+"""
+
+_COLUMNS = "id, member_id, court_id, court_type, start_time, end_time, status, hold_token, remark, created_at, offered_at"
+
+_table_ready = False
+
+
+class WaitlistError(ValueError):
+    """候补登记不合法：重复登记、超出数量上限或候补不存在"""
+
+
+def ensure_table() -> None:
+    """建表（DDL 会隐式提交事务，因此单独借连接执行，且每个进程只执行一次）"""
+    global _table_ready
+    if not _table_ready:
+        with cursor_scope() as cur:
+            cur.execute(_CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def _row(row, key, index):
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+# ========== 会员登记 / 查询 / 取消（需外部 commit） ==========
+
+def join_waitlist(
+    *,
+    member_id: int,
+    court_id: Optional[int],
+    court_type: Optional[str],
+    start: datetime,
+    end: datetime,
+    remark: Optional[str] = None,
+    cursor,
+) -> int:
+    """登记候补（court_id 与 court_type 二选一，court_id 优先），返回候补 id"""
+    ensure_table()
+    if court_id is None and not court_type:
+        raise WaitlistError("请指定场地或场地类型")
+    if court_id is not None:
+        court_type = None
+
+    # 锁会员行后再计数与查重，同一会员的并发登记排队，不会一起越过上限或重复登记
+    cursor.execute("SELECT id FROM members WHERE id = %s FOR UPDATE", (member_id,))
+    cursor.fetchone()
+    cursor.execute(
+        "SELECT COUNT(*) AS cnt FROM court_waitlist WHERE member_id = %s AND status = %s AND end_time > %s",
+        (member_id, STATUS_WAITING, datetime.now()),
+    )
+    row = cursor.fetchone()
+    if int((_row(row, "cnt", 0) if row else 0) or 0) >= settings.WAITLIST_MAX_PER_MEMBER:
+        raise WaitlistError("候补数量已达上限，请先取消不需要的候补")
+
+    cursor.execute(
+        """
+        SELECT id FROM court_waitlist
+        WHERE member_id = %s AND status = %s AND start_time = %s AND end_time = %s
+          AND court_id <=> %s AND court_type <=> %s
+        LIMIT 1
+        """,
+        (member_id, STATUS_WAITING, start, end, court_id, court_type),
+    )
+    if cursor.fetchone():
+        raise WaitlistError("已登记过该时段的候补")
+
+    cursor.execute(
+        """
+        INSERT INTO court_waitlist (member_id, court_id, court_type, start_time, end_time, remark)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """,
+        (member_id, court_id, court_type, start, end, remark),
+    )
+    return cursor.lastrowid
+
+
+def list_member_waitlist(member_id: int, *, cursor) -> List[Dict[str, Any]]:
+    """会员自己的候补（最近登记的在前）；传入的 cursor 需为 dictionary 游标"""
+    ensure_table()
+    cursor.execute(
+        f"SELECT {_COLUMNS} FROM court_waitlist WHERE member_id = %s ORDER BY id DESC LIMIT 100",
+        (member_id,),
+    )
+    return cursor.fetchall() or []
+
+
+def cancel_waitlist(entry_id: int, member_id: int, *, cursor) -> None:
+    """取消尚在等待的候补；不存在或已转预留时抛出 WaitlistError"""
+    ensure_table()
+    cursor.execute(
+        "UPDATE court_waitlist SET status = %s WHERE id = %s AND member_id = %s AND status = %s",
+        (STATUS_CANCELLED, entry_id, member_id, STATUS_WAITING),
+    )
+    if cursor.rowcount == 0:
+        raise WaitlistError("候补不存在或已处理")
+
+
+def mark_hold_booked(hold_token: str, *, cursor) -> None:
+    """候补转成的预留已确认（与确认同一事务）"""
+    ensure_table()
+    cursor.execute(
+        "UPDATE court_waitlist SET status = %s WHERE hold_token = %s AND status = %s",
+        (STATUS_BOOKED, hold_token, STATUS_OFFERED),
+    )
+
+
+# ========== 转预留 ==========
+
+def expire_in_range(court_id: int, start: datetime, end: datetime, *, cursor) -> int:
+    """
+    场地停用：指定了该场地、与 [start, end) 重叠的候补（等待中 / 已转预留）标记为过期，返回条数（需外部 commit）
+    只指定场地类型的候补继续等待，之后只会转到其他可用场地
+    """
+    ensure_table()
+    cursor.execute(
+        """
+        UPDATE court_waitlist
+        SET status = %s
+        WHERE court_id = %s
+          AND status IN (%s, %s)
+          AND start_time < %s
+          AND end_time > %s
+        """,
+        (STATUS_EXPIRED, court_id, STATUS_WAITING, STATUS_OFFERED, end, start),
+    )
+    return cursor.rowcount
+
+
+def _candidates(cursor, court_id: int, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """完全落在 [start, end) 内、指定了该场地或其类型的等待中候补，按登记顺序"""
+    cursor.execute(
+        f"""
+        SELECT {_COLUMNS}
+        FROM court_waitlist
+        WHERE status = %s
+          AND start_time >= %s
+          AND end_time <= %s
+          AND end_time > %s
+          AND (court_id = %s OR (court_id IS NULL AND court_type = (SELECT type FROM courts WHERE id = %s)))
+        ORDER BY id
+        LIMIT %s
+        """,
+        (STATUS_WAITING, start, end, datetime.now(), court_id, court_id, _PROMOTE_CANDIDATES),
+    )
+    return cursor.fetchall() or []
+
+
+def _offer(entry: Dict[str, Any], court_id: int) -> bool:
+    """尝试把一条候补转为预留（单独事务），成功返回 True；时段已被占用/候补已处理时返回 False"""
+    with cursor_scope(dictionary=True) as cur:
+        cur.execute(
+            f"SELECT {_COLUMNS} FROM court_waitlist WHERE id = %s AND status = %s FOR UPDATE",
+            (entry["id"], STATUS_WAITING),
+        )
+        if not cur.fetchone():
+            return False
+        start, end = entry["start_time"], entry["end_time"]
+        try:
+            court_name, amount = quote_member_court(cur, entry["member_id"], court_id, start, end)
+            token, hold = create_hold(
+                member_id=entry["member_id"],
+                court_id=court_id,
+                start=start,
+                end=end,
+                total_amount=amount,
+                remark=entry.get("remark"),
+                cursor=cur,
+            )
+        except (SlotConflict, HoldError, PricingError):
+            # 冲突在写入预留之前发现，此前只补建了位图行，照常提交即可
+            return False
+        cur.execute(
+            "UPDATE court_waitlist SET status = %s, court_id = %s, hold_token = %s, offered_at = NOW() WHERE id = %s",
+            (STATUS_OFFERED, court_id, token, entry["id"]),
+        )
+        try:
+            create_notification(
+                member_id=entry["member_id"],
+                title="候补时段已为您预留",
+                content=(
+                    f"{court_name} {start.strftime('%Y-%m-%d %H:%M')}-{end.strftime('%H:%M')} 已为您预留，"
+                    f"金额 ¥{amount:.2f}，请在 {hold.expires_at.strftime('%H:%M')} 前确认，逾期自动释放"
+                ),
+                level="info",
+                cursor=cur,
+            )
+        except Exception as e:
+            logger.warning(f"候补转预留通知写入失败: {e}")
+    note_hold_added(token, hold)
+    return True
+
+
+def promote(court_id: int, start: datetime, end: datetime) -> int:
+    """[start, end) 在该场地上被释放后，按登记顺序把候补转为预留，返回转成的条数"""
+    ensure_table()
+    with cursor_scope(dictionary=True) as cur:
+        entries = _candidates(cur, court_id, start, end)
+    offered = 0
+    for entry in entries:
+        try:
+            if _offer(entry, court_id):
+                offered += 1
+        except Exception as e:
+            logger.warning(f"候补 {entry['id']} 转预留失败: {e}")
+    return offered
+
+
+def schedule_promotion(court_id: int, start: datetime, end: datetime) -> None:
+    """在后台线程里执行 promote（取消/退款 commit 之后调用，不拖慢取消请求）"""
+    def run():
+        try:
+            promote(court_id, start, end)
+        except Exception as e:
+            logger.warning(f"候补转预留失败: {e}")
+
+    threading.Thread(target=run, name="waitlist-promote", daemon=True).start()
+
+
+def release_offer(hold_token: str) -> None:
+    """会员主动释放候补转成的预留（commit 之后调用）：标记为 expired 并把区间让给下一位"""
+    ensure_table()
+    with cursor_scope(dictionary=True) as cur:
+        cur.execute(
+            f"SELECT {_COLUMNS} FROM court_waitlist WHERE hold_token = %s AND status = %s",
+            (hold_token, STATUS_OFFERED),
+        )
+        entry = cur.fetchone()
+        if not entry:
+            return
+        cur.execute("UPDATE court_waitlist SET status = %s WHERE id = %s", (STATUS_EXPIRED, entry["id"]))
+    schedule_promotion(int(entry["court_id"]), entry["start_time"], entry["end_time"])
+
+
+def sweep_expired_offers() -> int:
+    """预留已过期未确认的候补标记为 expired，并对其区间重新转预留；返回处理的条数"""
+    ensure_table()
+    with cursor_scope(dictionary=True) as cur:
+        cur.execute(
+            """
+            SELECT w.id, w.court_id, w.start_time, w.end_time
+            FROM court_waitlist w
+            LEFT JOIN court_slot_holds h ON h.hold_token = w.hold_token
+            WHERE w.status = %s
+              AND (h.hold_token IS NULL OR h.expires_at <= %s)
+            LIMIT 500
+            """,
+            (STATUS_OFFERED, datetime.now()),
+        )
+        rows = cur.fetchall() or []
+        if rows:
+            cur.execute(
+                f"UPDATE court_waitlist SET status = %s WHERE id IN ({', '.join(['%s'] * len(rows))}) AND status = %s",
+                (STATUS_EXPIRED, *[r["id"] for r in rows], STATUS_OFFERED),
+            )
+    for r in rows:
+        promote(int(r["court_id"]), r["start_time"], r["end_time"])
+    return len(rows)
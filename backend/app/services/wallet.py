@@ -0,0 +1,201 @@
+# app/services/wallet.py
+"""
+会员余额（钱包）变更
+
+以前每个扣款入口（后台预约、会员端预约、商品售卖、收支记录、AI 助手下单）都是
+SELECT balance ... FOR UPDATE → Python 里相减 → UPDATE members SET balance = %s → 写流水，
+会员行从加锁读开始一直锁到事务提交，同一家庭账户的并发消费只能排队。这里统一为：
+
+1. 扣款是一条条件更新：UPDATE members SET balance = balance - %s WHERE id = %s AND balance >= %s，
+   余额判断与扣减在数据库里原子完成，不需要事先加锁读；调用方可以把扣款放在事务的最后，缩短行锁持有时间
+2. 更新成功后在同一连接上读回新余额（本事务已持有该行的写锁，读到的就是本次扣减的结果；
+   MySQL 没有 UPDATE ... RETURNING），随即写入 member_transactions
+3. 条件不满足（余额不足 / 会员不存在 / 状态异常）时才补查一次原因，抛出对应的 WalletError
+4. 入账（退款 / 充值）同样是一条 balance = balance + %s 的更新；批量退款按会员合并成一次余额变更，
+   同样在更新后读回余额来计算流水余额
+
+所有函数都需外部 commit。
+"""
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+ACTIVE_STATUS = "正常"
+
+# 状态为空按"正常"处理
+_ACTIVE_COND = f"COALESCE(NULLIF(status, ''), '{ACTIVE_STATUS}') = '{ACTIVE_STATUS}'"
+
+_INSERT_TX_SQL = """
+INSERT INTO member_transactions (member_id, type, amount, balance_after, remark)
+VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+class WalletError(ValueError):
+    """余额变更失败"""
+
+
+class MemberNotFound(WalletError):
+    """会员不存在"""
+
+    def __init__(self, message: str = "会员不存在"):
+        super().__init__(message)
+
+
+class MemberInactive(WalletError):
+    """会员状态异常，不能使用余额"""
+
+    def __init__(self, message: str = "会员状态异常，无法使用余额支付"):
+        super().__init__(message)
+
+
+class InsufficientBalance(WalletError):
+    """余额不足；balance 为当前余额，amount 为需要扣除的金额"""
+
+    def __init__(self, balance: float, amount: float):
+        self.balance = balance
+        self.amount = amount
+        super().__init__(f"余额不足，当前余额：{balance:.2f}元，需要：{amount:.2f}元")
+
+
+class WalletResult(NamedTuple):
+    balance: float                   # 变更后的余额
+    transaction_id: Optional[int]    # 最后写入的一条流水 id
+
+
+def _row(row, key, index):
+    return row[key] if isinstance(row, dict) else row[index]
+
+
+def _money(value: Any) -> float:
+    return round(float(value or 0), 2)
+
+
+def ensure_member(cursor, member_id: int, *, require_active: bool = True) -> Dict[str, Any]:
+    """
+    不加锁地确认会员存在（且状态正常），返回 {"name", "balance", "status"}
+    扣款失败时用它补查原因；金额为 0 不需要扣款但仍要校验会员时也可直接调用
+    """
+    cursor.execute("SELECT name, balance, status FROM members WHERE id = %s", (member_id,))
+    row = cursor.fetchone()
+    if not row:
+        raise MemberNotFound()
+    info = {"name": _row(row, "name", 0), "balance": _money(_row(row, "balance", 1)), "status": _row(row, "status", 2)}
+    if require_active and str(info["status"] or ACTIVE_STATUS) != ACTIVE_STATUS:
+        raise MemberInactive()
+    return info
+
+
+def _read_balance(cursor, member_id: int) -> float:
+    # 本事务刚更新过该行并持有写锁，普通读即可读到本次变更后的值
+    cursor.execute("SELECT balance FROM members WHERE id = %s", (member_id,))
+    row = cursor.fetchone()
+    return _money(_row(row, "balance", 0) if row else 0)
+
+
+def debit_many(
+    cursor,
+    member_id: int,
+    entries: Sequence[Tuple[float, str]],
+    *,
+    tx_type: str = "消费",
+    require_active: bool = False,
+    negative_amount: bool = True,
+) -> WalletResult:
+    """
+    一次扣除多笔（合计一条条件更新），每笔各记一条流水，流水余额按顺序递减
+    entries 为 [(金额, 流水备注), ...]，金额需为正数；流水 amount 默认记为负数
+    （后台手工扣费沿用正数记录时传 negative_amount=False）
+    """
+    amounts = [round(float(a), 2) for a, _ in entries]
+    if not amounts or any(a <= 0 for a in amounts):
+        raise WalletError("扣款金额必须大于 0")
+    total = round(sum(amounts), 2)
+
+    cond = f" AND {_ACTIVE_COND}" if require_active else ""
+    cursor.execute(
+        f"UPDATE members SET balance = balance - %s WHERE id = %s AND balance >= %s{cond}",
+        (total, member_id, total),
+    )
+    if cursor.rowcount == 0:
+        info = ensure_member(cursor, member_id, require_active=require_active)
+        raise InsufficientBalance(info["balance"], total)
+
+    balance = _read_balance(cursor, member_id)
+    running = round(balance + total, 2)
+    rows = []
+    for amount, (_, remark) in zip(amounts, entries):
+        running = round(running - amount, 2)
+        rows.append((member_id, tx_type, -amount if negative_amount else amount, running, remark))
+    if len(rows) == 1:
+        cursor.execute(_INSERT_TX_SQL, rows[0])
+    else:
+        cursor.executemany(_INSERT_TX_SQL, rows)
+    return WalletResult(balance, cursor.lastrowid)
+
+
+def debit(
+    cursor,
+    member_id: int,
+    amount: float,
+    remark: str,
+    *,
+    tx_type: str = "消费",
+    require_active: bool = False,
+    negative_amount: bool = True,
+) -> WalletResult:
+    """扣除一笔并记流水；余额不足 / 会员不存在 / 状态异常（require_active）时抛出对应的 WalletError"""
+    return debit_many(
+        cursor,
+        member_id,
+        [(amount, remark)],
+        tx_type=tx_type,
+        require_active=require_active,
+        negative_amount=negative_amount,
+    )
+
+
+def credit(cursor, member_id: int, amount: float, remark: str, *, tx_type: str = "退款") -> Optional[WalletResult]:
+    """入账一笔并记流水；会员不存在时返回 None（不写流水）"""
+    amount = round(float(amount), 2)
+    if amount <= 0:
+        raise WalletError("入账金额必须大于 0")
+    cursor.execute("UPDATE members SET balance = balance + %s WHERE id = %s", (amount, member_id))
+    if cursor.rowcount == 0:
+        return None
+    balance = _read_balance(cursor, member_id)
+    cursor.execute(_INSERT_TX_SQL, (member_id, tx_type, amount, balance, remark))
+    return WalletResult(balance, cursor.lastrowid)
+
+
+def credit_many(cursor, credits: List[Dict[str, Any]]) -> None:
+    """
+    批量退款入账：同一会员的多笔合并成一条 balance = balance + 合计 的更新，按会员 id 顺序执行（加锁顺序一致，不会死锁）
+    credits 为 {"member_id", "amount", "remark"}；更新后读回余额，流水余额从入账前的余额逐笔递增，
+    一条 executemany 写入；不存在的会员跳过
+    """
+    if not credits:
+        return
+    by_member: "OrderedDict[int, List[Dict[str, Any]]]" = OrderedDict()
+    for c in sorted(credits, key=lambda c: c["member_id"]):
+        by_member.setdefault(c["member_id"], []).append(c)
+
+    transactions = []
+    for member_id, items in by_member.items():
+        total = sum((Decimal(str(c["amount"])) for c in items), Decimal("0"))
+        if total:
+            cursor.execute("UPDATE members SET balance = balance + %s WHERE id = %s", (str(total), member_id))
+            if cursor.rowcount == 0:
+                continue
+        # 本事务刚更新过该行并持有写锁（合计为 0 时只确认会员存在），读到的是入账后的余额
+        cursor.execute("SELECT balance FROM members WHERE id = %s", (member_id,))
+        row = cursor.fetchone()
+        if not row:
+            continue
+        balance = Decimal(str(_row(row, "balance", 0) or 0)) - total
+        for c in items:
+            balance += Decimal(str(c["amount"]))
+            transactions.append((member_id, "退款", str(c["amount"]), str(balance), c["remark"]))
+
+    if transactions:
+        cursor.executemany(_INSERT_TX_SQL, transactions)
@@ -0,0 +1,98 @@
+"""
+同步 / 异步数据库路径对比压测
+
+同步路径：mysql-connector 连接池 + 线程池（模拟 FastAPI 默认约 40 个线程）
+异步路径：aiomysql 连接池 + asyncio.gather（信号量控制并发）
+
+两条路径执行同一条 SQL、同样的并发数和请求数，输出吞吐和延迟分位数。
+
+用法（在 backend 目录下）：
+    python bench_db_paths.py --concurrency 100 --requests 2000
+    python bench_db_paths.py --sql "SELECT COUNT(*) FROM court_reservations"
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.async_database import AsyncUnitOfWork, close_async_pool
+from app.database import close_pool, get_db
+
+DEFAULT_SQL = (
+    "SELECT id, court_id, start_time, end_time, status "
+    "FROM court_reservations ORDER BY start_time DESC LIMIT 50"
+)
+
+
+def report(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    p50 = latencies[n // 2] * 1000
+    p95 = latencies[min(n - 1, int(n * 0.95))] * 1000
+    print(
+        f"[{name}] 请求 {n}，耗时 {elapsed:.2f}s，吞吐 {n / elapsed:.1f} req/s，"
+        f"平均 {statistics.mean(latencies) * 1000:.1f}ms，p50 {p50:.1f}ms，p95 {p95:.1f}ms"
+    )
+
+
+def run_sync(sql, total, concurrency, threads):
+    def one():
+        start = time.perf_counter()
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(sql)
+            cursor.fetchall()
+        finally:
+            cursor.close()
+            db.close()
+        return time.perf_counter() - start
+
+    # 线程数即同步路由的并发上限，超出的请求在队列里排队
+    workers = min(concurrency, threads)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(lambda _: one(), range(total)))
+    report(f"sync  x{workers}", latencies, time.perf_counter() - start)
+
+
+async def run_async(sql, total, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            async with AsyncUnitOfWork() as db:
+                cursor = await db.cursor(dictionary=True)
+                try:
+                    await cursor.execute(sql)
+                    await cursor.fetchall()
+                finally:
+                    await cursor.close()
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(total)))
+    report(f"async x{concurrency}", latencies, time.perf_counter() - start)
+    await close_async_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步/异步数据库路径对比压测")
+    parser.add_argument("--concurrency", type=int, default=100, help="并发数")
+    parser.add_argument("--requests", type=int, default=2000, help="总请求数")
+    parser.add_argument("--threads", type=int, default=40, help="同步路径线程数上限（FastAPI 默认 40）")
+    parser.add_argument("--sql", default=DEFAULT_SQL, help="压测使用的只读 SQL")
+    args = parser.parse_args()
+
+    print("=== 同步路径 ===")
+    run_sync(args.sql, args.requests, args.concurrency, args.threads)
+    close_pool()
+
+    print("\n=== 异步路径 ===")
+    asyncio.run(run_async(args.sql, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
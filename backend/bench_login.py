@@ -0,0 +1,85 @@
+"""
+登录高峰压测：密码验证对其他请求的影响
+
+模拟一波并发登录，同时有一批"只查库"的轻量请求（用 sleep 代替数据库往返）在跑，对比两种写法：
+1. 旧写法：密码验证和轻量请求共用同一个线程池（相当于同步路由直接调用 verify_password）
+2. 新写法：密码验证走 security 的专用哈希线程池（PASSWORD_HASH_WORKERS 个线程）
+
+输出登录吞吐量和轻量请求的 P50/P95 延迟。无需数据库。
+
+用法（在 backend 目录下）：
+    python bench_login.py --logins 200 --light 400 --threadpool 40
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import security
+from app.config import settings
+
+
+def light_request(db_latency: float) -> None:
+    time.sleep(db_latency)
+
+
+async def run(mode: str, args, hashed: str):
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=args.threadpool)
+    light_latencies = []
+
+    async def login():
+        if mode == "inline":
+            return await loop.run_in_executor(pool, security.verify_password, "bench-password", hashed)
+        ok, _ = await security.verify_and_update_password_async("bench-password", hashed)
+        return ok
+
+    async def light():
+        start = time.perf_counter()
+        await loop.run_in_executor(pool, light_request, args.db_latency)
+        light_latencies.append(time.perf_counter() - start)
+
+    async def timed_logins():
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        return time.perf_counter() - start
+
+    async def light_stream():
+        tasks = []
+        for _ in range(args.light):
+            tasks.append(asyncio.create_task(light()))
+            await asyncio.sleep(args.light_interval)
+        await asyncio.gather(*tasks)
+
+    login_elapsed, _ = await asyncio.gather(timed_logins(), light_stream())
+    pool.shutdown()
+
+    light_latencies.sort()
+    p95 = light_latencies[int(len(light_latencies) * 0.95) - 1]
+    print(
+        f"[{mode:9}] 登录 {args.logins / login_elapsed:7.1f} 次/秒 | "
+        f"轻量请求 P50 {statistics.median(light_latencies) * 1000:7.1f} ms  P95 {p95 * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录高峰压测")
+    parser.add_argument("--logins", type=int, default=200, help="并发登录次数")
+    parser.add_argument("--light", type=int, default=400, help="同期轻量请求数")
+    parser.add_argument("--light-interval", type=float, default=0.002, help="轻量请求发起间隔（秒）")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="轻量请求模拟的数据库耗时（秒）")
+    parser.add_argument("--threadpool", type=int, default=40, help="路由线程池大小（anyio 默认 40）")
+    args = parser.parse_args()
+
+    hashed = security.get_password_hash("bench-password")
+    print(
+        f"算法 {settings.PASSWORD_HASH_SCHEME}，迭代 {settings.PASSWORD_HASH_ROUNDS} 次，"
+        f"专用哈希线程 {settings.PASSWORD_HASH_WORKERS} 个，路由线程池 {args.threadpool}"
+    )
+    for mode in ("inline", "dedicated"):
+        asyncio.run(run(mode, args, hashed))
+
+
+if __name__ == "__main__":
+    main()
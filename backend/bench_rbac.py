@@ -0,0 +1,68 @@
+"""
+RBAC 鉴权开销微基准
+
+对比三种写法在单个请求上的鉴权耗时（不含 token 解析与数据库）：
+1. 旧写法：线性查找角色 + 每次重建 actions 字符串列表 + 列表成员判断
+2. PermissionIndex.allows：dict 查找 + frozenset 判断
+3. require_action 依赖函数本体（权限索引已缓存）
+
+用法（在 backend 目录下，无需数据库）：
+    python bench_rbac.py --roles 50 --actions 40 --iterations 200000
+"""
+import argparse
+import time
+
+from app import deps
+
+
+def legacy_has_action(roles, role, action_code):
+    role_conf = next((r for r in roles if r.get("code") == role), None)
+    actions = role_conf.get("actions") if role_conf else ["*"]
+    if not isinstance(actions, list) or not actions:
+        actions = ["*"]
+    actions = [str(a) for a in actions]
+    return "*" in actions or action_code in actions
+
+
+def make_roles(n_roles, n_actions):
+    roles = [{"code": "admin", "menus": ["*"], "actions": ["*"]}]
+    for i in range(n_roles):
+        roles.append({
+            "code": f"role{i}",
+            "menus": [f"menu{j}" for j in range(10)],
+            "actions": [f"module{j}.action" for j in range(n_actions)],
+        })
+    return roles
+
+
+def timeit(name, fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"[{name}] {elapsed / iterations * 1e9:8.0f} ns/次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RBAC 鉴权开销微基准")
+    parser.add_argument("--roles", type=int, default=50, help="角色数量")
+    parser.add_argument("--actions", type=int, default=40, help="每个角色的操作权限数量")
+    parser.add_argument("--iterations", type=int, default=200000, help="每种写法的调用次数")
+    args = parser.parse_args()
+
+    roles = make_roles(args.roles, args.actions)
+    last_role = f"role{args.roles - 1}"
+    action = f"module{args.actions - 1}.action"
+    user = {"id": 1, "username": "bench", "role": last_role, "is_active": 1}
+
+    index = deps.install_roles_config(roles)
+    dependency = deps.require_action(action)
+
+    print(f"角色 {len(roles)} 个，每个角色 {args.actions} 个操作权限，检查最后一个角色的最后一个权限")
+    timeit("旧写法 线性查找", lambda: legacy_has_action(roles, last_role, action), args.iterations)
+    timeit("PermissionIndex", lambda: index.allows(last_role, action), args.iterations)
+    timeit("require_action", lambda: dependency(current_user=user, db=None), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
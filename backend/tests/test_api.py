@@ -37,6 +37,11 @@ class TestHealthCheck:
         assert response.status_code == 200
         assert response.json()["status"] == "ok"
 
+    def test_db_pool_stats_requires_auth(self, client):
+        """连接池指标不对未登录请求开放"""
+        response = client.get("/health/db-pool")
+        assert response.status_code == 401
+
 
 class TestAuthAPI:
     """认证 API 测试"""
@@ -8,7 +8,7 @@
 4. 订单创建
 """
 import pytest
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, time, timedelta
 from decimal import Decimal
 import sys
 import os
@@ -166,6 +166,1349 @@ class TestOrderNoGeneration:
         assert len(order_nos) == 100, "订单号应该唯一"
 
 
+class TestSchemaRegistry:
+    """表结构注册表测试"""
+
+    class _FakeCursor:
+        def __init__(self, rows):
+            self.rows = rows
+            self.executed = []
+            self.lastrowid = 1
+
+        def execute(self, sql, params=None):
+            self.executed.append(sql)
+
+        def fetchall(self):
+            return self.rows
+
+    def test_columns_loaded_once(self):
+        """一次加载后多次查询不再访问数据库"""
+        from app.services.schema import SchemaRegistry
+
+        registry = SchemaRegistry()
+        cursor = self._FakeCursor([
+            {"TABLE_NAME": "orders", "COLUMN_NAME": "order_no"},
+            {"TABLE_NAME": "orders", "COLUMN_NAME": "source"},
+            ("Users", "id"),
+        ])
+
+        assert "source" in registry.columns("orders", cursor)
+        assert registry.has_table("users", cursor)
+        assert not registry.has_table("missing", cursor)
+        assert registry.columns("missing", cursor) == frozenset()
+        assert len(cursor.executed) == 1
+        assert "information_schema" in cursor.executed[0]
+
+    def test_insert_sql_cached_per_column_set(self):
+        """相同列集合复用同一条 INSERT，reload 后清空"""
+        from app.services.schema import SchemaRegistry
+
+        registry = SchemaRegistry()
+        sql1 = registry.insert_sql("orders", ["order_no", "created_at"], ["%s", "NOW()"])
+        sql2 = registry.insert_sql("orders", ("order_no", "created_at"), ("%s", "NOW()"))
+        assert sql1 is sql2
+        assert sql1 == "INSERT INTO orders (order_no, created_at) VALUES (%s, NOW())"
+
+        registry.reload(self._FakeCursor([]))
+        assert registry.insert_sql("orders", ["order_no"], ["%s"]) == "INSERT INTO orders (order_no) VALUES (%s)"
+
+    def test_refund_order_uses_registry(self, monkeypatch):
+        """生成退款订单时不再执行 SHOW COLUMNS"""
+        from app.services import orders
+        from app.services.schema import SchemaRegistry
+
+        registry = SchemaRegistry()
+        registry._tables = {"orders": frozenset({"order_no", "order_type", "total_amount", "status"})}
+        registry._loaded_at = float("inf")
+        monkeypatch.setattr(orders, "schema_registry", registry)
+        monkeypatch.setattr(orders, "_get_order_prefix_and_currency", lambda cursor=None: ("GYM", "CNY"))
+        # 不连库：直接指定 worker id 与前缀，免得生成订单号时去租用、读设置
+        from app.services import order_numbers
+        monkeypatch.setattr(order_numbers, "_worker_id", 1)
+        monkeypatch.setattr(order_numbers, "order_no_prefix", lambda cursor=None: "GYM")
+
+        cursor = self._FakeCursor([])
+        result = orders.create_refund_order(
+            cursor=cursor, original_order_id=1, original_order_no="GYM-C-1",
+            member_id=None, member_name=None, amount="10", order_type="court",
+        )
+
+        assert result["amount"] == -10.0
+        assert len(cursor.executed) == 1
+        assert cursor.executed[0].startswith("INSERT INTO orders (order_no, order_type, total_amount, status)")
+
+
+class TestSettingsCache:
+    """系统设置缓存测试"""
+
+    class _FakeCursor:
+        def __init__(self, rows):
+            self.rows = rows
+            self.executed = 0
+
+        def execute(self, sql, params=None):
+            self.executed += 1
+
+        def fetchall(self):
+            return self.rows
+
+    def test_snapshot_cached_until_version_bump(self):
+        """版本号不变时不再查库，保存接口递增版本后重新加载"""
+        from app.services import settings_cache
+
+        settings_cache.bump_settings_version()
+        cursor = self._FakeCursor([("order", "order_no_prefix", "ABC")])
+
+        assert settings_cache.get_setting_value("order", "order_no_prefix", cursor=cursor) == "ABC"
+        assert settings_cache.get_setting_value("order", "missing", "x", cursor=cursor) == "x"
+        assert cursor.executed == 1
+
+        cursor.rows = [{"group_key": "order", "setting_key": "order_no_prefix", "setting_value": "XYZ"}]
+        settings_cache.bump_settings_version()
+        assert settings_cache.get_setting_value("order", "order_no_prefix", cursor=cursor) == "XYZ"
+        assert cursor.executed == 2
+
+    def test_level_discount_parsed_once(self):
+        """会员等级 JSON 只解析一次，按 code 或 name 匹配 enabled 的等级"""
+        import json
+        from app.services import settings_cache
+        from app.services.discounts import _parse_discount_map
+
+        levels = [
+            {"code": "gold", "name": "金卡会员", "discount": 90, "enabled": True},
+            {"code": "vip", "name": "VIP", "discount": 80, "enabled": False},
+            {"code": "bad", "name": "异常", "discount": 0},
+        ]
+        settings_cache.bump_settings_version()
+        cursor = self._FakeCursor([("member", "member_levels_json", json.dumps(levels))])
+
+        m1 = settings_cache.get_parsed("member", "member_levels_json", _parse_discount_map, cursor=cursor)
+        m2 = settings_cache.get_parsed("member", "member_levels_json", _parse_discount_map, cursor=cursor)
+        assert m1 is m2
+        assert m1["gold"] == 90 and m1["金卡会员"] == 90
+        assert "vip" not in m1
+        assert m1["bad"] == 100
+
+
+class TestAvailabilityGrid:
+    """场地可用性网格测试"""
+
+    def test_merge_and_sweep(self):
+        """重叠/相接的预约合并后，与时段序列扫描得到空闲矩阵"""
+        from datetime import time
+        from app.services.availability import build_grid, merge_busy
+
+        day = date(2025, 1, 26)
+        rows = [
+            {"court_id": 1, "start_time": datetime(2025, 1, 26, 9, 30), "end_time": datetime(2025, 1, 26, 10, 0)},
+            {"court_id": 1, "start_time": datetime(2025, 1, 26, 9, 0), "end_time": datetime(2025, 1, 26, 9, 45)},
+            (1, datetime(2025, 1, 26, 10, 0), datetime(2025, 1, 26, 11, 0)),
+            (2, datetime(2025, 1, 25, 23, 0), datetime(2025, 1, 26, 8, 30)),
+        ]
+        busy = merge_busy(rows)
+        assert busy[1] == [(datetime(2025, 1, 26, 9, 0), datetime(2025, 1, 26, 11, 0))]
+
+        courts = [
+            {"id": 1, "name": "1号", "type": "羽毛球", "status": "可用"},
+            {"id": 2, "name": "2号", "type": "羽毛球", "status": "可用"},
+            {"id": 3, "name": "3号", "type": "羽毛球", "status": "维修"},
+        ]
+        grid = build_grid(courts, busy, [day], time(8, 0), time(12, 0), 60)
+        cells = {c["court_id"]: c["free"] for c in grid["days"][0]["courts"]}
+        assert grid["days"][0]["slots"] == ["08:00", "09:00", "10:00", "11:00"]
+        assert cells[1] == [True, False, False, True]
+        assert cells[2] == [False, True, True, True]
+        assert cells[3] == [False] * 4
+
+    def test_cache_key_tracks_content(self):
+        """占用不变时 cache_key 不变，新增预约后变化"""
+        from datetime import time
+        from app.services.availability import build_grid, merge_busy
+
+        day = date(2025, 1, 26)
+        courts = [{"id": 1, "status": "可用"}]
+        empty = build_grid(courts, {}, [day], time(8, 0), time(10, 0), 60)
+        assert empty["cache_key"] == build_grid(courts, {}, [day], time(8, 0), time(10, 0), 60)["cache_key"]
+
+        busy = merge_busy([(1, datetime(2025, 1, 26, 8, 0), datetime(2025, 1, 26, 9, 0))])
+        assert build_grid(courts, busy, [day], time(8, 0), time(10, 0), 60)["cache_key"] != empty["cache_key"]
+
+    def test_free_court_ids(self):
+        """整段空闲才算可用，边界相接不算冲突"""
+        from app.services.availability import free_court_ids, merge_busy
+
+        courts = [{"id": 1, "status": "可用"}, {"id": 2, "status": "可用"}]
+        busy = merge_busy([(1, datetime(2025, 1, 26, 9, 0), datetime(2025, 1, 26, 10, 0))])
+        assert free_court_ids(courts, busy, datetime(2025, 1, 26, 10, 0), datetime(2025, 1, 26, 11, 0)) == [1, 2]
+        assert free_court_ids(courts, busy, datetime(2025, 1, 26, 9, 30), datetime(2025, 1, 26, 11, 0)) == [2]
+
+    def test_next_available_gap_search(self):
+        """按开始时间归并多场地的空档，每个空档只给最早的开始时间，非整刻的占用结束向上取整"""
+        from datetime import time
+        from app.services.availability import merge_busy, next_available
+
+        at = lambda d, h, m=0: datetime(2025, 1, d, h, m)
+        courts = [
+            {"id": 1, "name": "A", "status": "可用", "price_per_hour": 40},
+            {"id": 2, "name": "B", "status": "可用", "price_per_hour": 60},
+            {"id": 3, "name": "C", "status": "维护中", "price_per_hour": 60},
+        ]
+        busy = merge_busy([
+            (1, at(26, 8), at(26, 12, 10)),
+            (1, at(26, 13), at(26, 22)),
+            (2, at(26, 8), at(26, 22)),
+        ])
+        days = [date(2025, 1, 26), date(2025, 1, 27)]
+        items = next_available(courts, busy, days, time(8, 0), time(22, 0), 120, limit=3)
+
+        # 场地 1 在 12:15-13:00 只有 45 分钟放不下；第一天无空档，次日两个场地 08:00 起都空
+        assert [(i["court_id"], i["start_time"]) for i in items] == [
+            (1, "2025-01-27 08:00"),
+            (2, "2025-01-27 08:00"),
+        ]
+        assert items[0]["price"] == 80.0 and items[1]["end_time"] == "2025-01-27 10:00"
+
+        shorter = next_available(courts, busy, days, time(8, 0), time(22, 0), 30, limit=2)
+        assert shorter[0]["start_time"] == "2025-01-26 12:15"
+
+        later = next_available(courts, {}, days, time(8, 0), time(22, 0), 60,
+                               not_before=at(26, 21, 5), limit=1)
+        assert later[0]["start_time"] == "2025-01-27 08:00"
+
+
+class TestReservationIndex:
+    """场地预约区间索引测试"""
+
+    @staticmethod
+    def _index(rows):
+        from app.services.reservation_index import ReservationIndex
+
+        index = ReservationIndex(days=7, ttl=3600)
+        index.load(cursor=TestSchemaRegistry._FakeCursor(rows))
+        return index
+
+    @staticmethod
+    def _at(day_offset, hour, minute=0):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return today + timedelta(days=day_offset, hours=hour, minutes=minute)
+
+    def test_conflict_matches_sql_predicate(self):
+        """与 NOT (end_time <= start OR start_time >= end) 一致：边界相接不冲突"""
+        at = self._at
+        index = self._index([
+            {"id": 1, "court_id": 1, "start_time": at(1, 10), "end_time": at(1, 12)},
+            (1, at(1, 8), at(1, 18), 2),  # 长区间，向前扫描不能提前结束（元组行为 court_id, start, end, id[, kind]）
+            (2, at(1, 14), at(1, 15), 3, "schedule"),
+        ])
+
+        assert index.has_conflict(1, at(1, 19), at(1, 20)) is False
+        assert index.has_conflict(1, at(1, 17), at(1, 19)) is True
+        assert index.has_conflict(2, at(1, 13), at(1, 14)) is False
+        assert index.has_conflict(2, at(1, 15), at(1, 16)) is False
+        assert index.has_conflict(2, at(1, 14, 30), at(1, 14, 45)) is True
+        assert index.has_conflict(3, at(1, 10), at(1, 11)) is False
+        # 超出覆盖窗口时无法回答，调用方回退查库
+        assert index.has_conflict(1, at(30, 10), at(30, 11)) is None
+
+    def test_incremental_updates(self):
+        """创建后立即占用，取消后立即释放"""
+        at = self._at
+        index = self._index([])
+
+        index.add(10, 5, at(2, 9), at(2, 10))
+        assert index.has_conflict(5, at(2, 9, 30), at(2, 11)) is True
+        assert index.has_conflict(5, at(2, 9, 30), at(2, 11), exclude_id=10) is False
+        assert index.busy_rows(at(2, 0), at(3, 0)) == [(5, at(2, 9), at(2, 10))]
+
+        index.remove(10)
+        assert index.has_conflict(5, at(2, 9, 30), at(2, 11)) is False
+        index.remove(10)  # 重复删除无副作用
+
+    def test_stale_load_discarded(self):
+        """加载期间发生过本地更新/失效，加载结果不覆盖索引"""
+        at = self._at
+        index = self._index([])
+        generation = index._generation
+
+        class SlowCursor(TestSchemaRegistry._FakeCursor):
+            def fetchall(self):
+                index.add(20, 1, at(1, 9), at(1, 10))
+                return self.rows
+
+        index.load(cursor=SlowCursor([]))
+        assert index._generation != generation
+        assert index.has_conflict(1, at(1, 9), at(1, 10)) is True
+
+
+    def test_sync_applies_other_workers_intervals(self, monkeypatch):
+        """下单只记进程内缓冲；轮询同步时批量写出，并按 id 顺序应用变更表里的区间而不整体重新加载"""
+        from contextlib import contextmanager
+        from app.services import cache_bus, reservation_index as module
+
+        at = self._at
+        table = []
+
+        class ChangesCursor:
+            def execute(self, sql, params=None):
+                self.sql, self.params = sql, params
+
+            def executemany(self, sql, rows):
+                for row in rows:
+                    table.append((len(table) + 1, *row))
+
+            def fetchall(self):
+                # 只按 id 翻页，参数里没有应用端的时间
+                if "SELECT" not in self.sql:
+                    return []
+                assert "WHERE id > %s" in self.sql and not any(isinstance(p, datetime) for p in self.params)
+                return [r for r in table if r[0] > self.params[0]]
+
+        @contextmanager
+        def scope(cursor=None, *, dictionary=False):
+            yield ChangesCursor()
+
+        local, remote, stale = self._index([]), self._index([]), self._index([])
+        # 加载时变更表为空
+        local._change_floor = remote._change_floor = 0
+        monkeypatch.setattr(module, "reservation_index", local)
+        monkeypatch.setattr(module, "cursor_scope", scope)
+        monkeypatch.setattr(module, "_changes_ready", True)
+        monkeypatch.setattr(module, "_pending", [])
+        monkeypatch.setattr(cache_bus, "is_running", lambda: True)
+        published = []
+        monkeypatch.setattr(module, "publish", lambda *a, **k: published.append(a))
+
+        module.note_reservation_booked(30, 4, at(1, 9), at(1, 10))
+        module.note_reservation_booked(31, 4, at(1, 11), at(1, 12))
+        module.note_reservation_released(30)
+        assert published == [] and table == []
+
+        module.sync_changes()
+        assert len(table) == 3
+        monkeypatch.setattr(module, "reservation_index", remote)
+        generation = remote._generation
+        module.sync_changes()
+        assert remote._window is not None and remote._generation != generation
+        assert remote.has_conflict(4, at(1, 9), at(1, 10)) is False
+        assert remote.has_conflict(4, at(1, 11), at(1, 12)) is True
+        assert remote._change_seen == 3
+
+        # 加载时还没有变更表（不知道从哪里读起）：整体重新加载，而不是重放整张表
+        assert stale._change_floor is None
+        monkeypatch.setattr(module, "reservation_index", stale)
+        module.sync_changes()
+        assert stale._window is None
+
+
+class TestResourceCalendar:
+    """场地资源日历（预约 + 排期）测试"""
+
+    def test_schedule_interval_accepts_time_column_values(self):
+        """TIME 列由驱动返回 timedelta，与 "HH:MM" 字符串得到同样的区间"""
+        from app.services.resource_calendar import schedule_interval
+
+        expected = (datetime(2025, 1, 26, 19, 0), datetime(2025, 1, 26, 20, 30))
+        assert schedule_interval(date(2025, 1, 26), timedelta(hours=19), timedelta(hours=20, minutes=30)) == expected
+        assert schedule_interval("2025-01-26", "19:00", "20:30:00") == expected
+
+    def test_occupancy_query_excludes_one_kind(self):
+        """exclude 只作用于对应的那部分查询（预约 / 排期 / 停用时段），加锁读每部分都带 LOCK IN SHARE MODE"""
+        from app.services.resource_calendar import KIND_SCHEDULE, occupancy_query
+
+        start, end = datetime(2025, 1, 26, 8), datetime(2025, 1, 26, 22)
+        sql, params = occupancy_query(start, end, court_ids=[3], exclude=(KIND_SCHEDULE, 9), lock=True)
+        reservation_part, schedule_part, closure_part = sql.split("UNION ALL")
+        assert "s.id <> %s" in schedule_part and "r.id <>" not in reservation_part and "j.id <>" not in closure_part
+        assert "court_closure_jobs" in closure_part and "j.status IN ('running', 'done')" in closure_part
+        assert sql.count("LOCK IN SHARE MODE") == 3
+        assert params[:3] == [end, start, 3] and params[-3:] == [end, start, 3] and params.count(9) == 1
+
+    def test_index_sees_schedules(self):
+        """区间索引同时包含排期，按 kind 排除时不会误排除同 id 的预约"""
+        at = TestReservationIndex._at
+        index = TestReservationIndex._index([
+            (1, at(1, 18), at(1, 20), 7, "schedule"),
+            (1, at(1, 20), at(1, 21), 7, "reservation"),
+        ])
+        assert index.has_conflict(1, at(1, 19), at(1, 19, 30)) is True
+        assert index.has_conflict(1, at(1, 19), at(1, 19, 30), exclude_id=7, exclude_kind="schedule") is False
+        assert index.has_conflict(1, at(1, 19), at(1, 20, 30), exclude_id=7, exclude_kind="schedule") is True
+
+    def test_court_rename_reloads_index(self, monkeypatch):
+        """排期按场地名称对应，场地改名时通知各 worker 重新加载区间索引"""
+        from app.routers import courts
+
+        class FakeCursor:
+            def execute(self, sql, params=None):
+                pass
+
+            def fetchone(self):
+                return (3, "1号场")
+
+            def fetchall(self):
+                return []
+
+            def close(self):
+                pass
+
+        class FakeDb:
+            def cursor(self, dictionary=False):
+                return FakeCursor()
+
+            def commit(self):
+                pass
+
+        published = []
+        monkeypatch.setattr(courts, "publish", lambda *channels: published.append(channels))
+        monkeypatch.setattr(courts, "reset_courts", lambda *a, **k: None)
+        form = {"type": "羽毛球", "price_per_hour": 80}
+        courts.update_court(3, {**form, "name": "1号场"}, FakeDb())
+        courts.update_court(3, {**form, "name": "VIP 1号场"}, FakeDb())
+        assert published == [("prices",), ("prices", "reservations")]
+
+
+class TestCourtDaySlots:
+    """场地日占用位图测试"""
+
+    class _FakeDb:
+        """按 SQL 关键字模拟 court_day_slots / 占用查询 / 预留表的游标（单线程逻辑测试）"""
+
+        def __init__(self, reservations=(), holds=()):
+            self.bitmaps = {}
+            self.reservations = list(reservations)
+            self.holds = list(holds)
+            self.exact_checks = 0
+            self.court_names = {}
+            self.statements = []
+            self.rowcount = 0
+            self._result = None
+
+        def execute(self, sql, params=None):
+            from app.services.court_slots import decode_bitmap, encode_bitmap
+
+            self.statements.append(sql)
+            if "FROM court_slot_holds" in sql and "court_id IN" in sql:
+                self._result = []
+            elif "FROM court_slot_holds" in sql:
+                court_id, _, end, start, exclude = params
+                self._result = [
+                    {"hold_token": t}
+                    for t, c, s, e in self.holds
+                    if c == court_id and t != exclude and s < end and e > start
+                ]
+            elif "ON DUPLICATE KEY UPDATE bitmap = bitmap" in sql:
+                key = (params[0], params[1])
+                self.rowcount = 0 if key in self.bitmaps else 1
+                self.bitmaps.setdefault(key, decode_bitmap(params[2]))
+            elif "ON DUPLICATE KEY UPDATE bitmap = VALUES" in sql:
+                self.bitmaps[(params[0], params[1])] = decode_bitmap(params[2])
+            elif "SELECT court_id, slot_date, bitmap" in sql:
+                keys = list(zip(params[::2], params[1::2]))
+                self._result = [(c, d, encode_bitmap(self.bitmaps[(c, d)])) for c, d in keys if (c, d) in self.bitmaps]
+            elif "SELECT court_id, slot_date" in sql:
+                keys = list(zip(params[::2], params[1::2]))
+                self._result = [(c, d) for c, d in keys if (c, d) in self.bitmaps]
+            elif "SELECT bitmap" in sql:
+                self._result = [{"bitmap": encode_bitmap(self.bitmaps[(params[0], params[1])])}]
+            elif "DELETE FROM court_day_slots" in sql:
+                self.bitmaps = {k: v for k, v in self.bitmaps.items() if k[0] not in params}
+            elif "SELECT id, name FROM courts" in sql:
+                self._result = [(params[0], self.court_names[params[0]])]
+            elif "SELECT id FROM courts WHERE name IN" in sql:
+                self._result = [(c,) for c, name in self.court_names.items() if name in params]
+            elif "UPDATE courts" in sql:
+                self.court_names[params[-1]] = params[0]
+            elif "UPDATE court_day_slots" in sql:
+                self.bitmaps[(params[1], params[2])] = decode_bitmap(params[0])
+            elif "UNION ALL" in sql:
+                # resource_calendar.occupancy_query：参数以 [end, start, court_id, ...] 开头
+                end, start, court_id = params[0], params[1], params[2]
+                whole_day = start.time() == time(0) and end - start == timedelta(days=1)
+                if not whole_day:
+                    self.exact_checks += 1
+                self._result = [
+                    (c, s, e, i, "reservation")
+                    for i, (c, s, e) in enumerate(self.reservations)
+                    if c == court_id and s < end and e > start
+                ]
+
+        def executemany(self, sql, rows):
+            for params in rows:
+                self.execute(sql, params)
+
+        def fetchone(self):
+            return self._result[0] if self._result else None
+
+        def fetchall(self):
+            return self._result
+
+        # 兼作 UnitOfWork，供路由函数直接调用
+        def cursor(self, dictionary=False):
+            return self
+
+        def close(self):
+            pass
+
+        def commit(self):
+            pass
+
+    @pytest.fixture(autouse=True)
+    def table_ready(self, monkeypatch):
+        from app.services import court_slots, slot_holds
+        monkeypatch.setattr(court_slots, "_table_ready", True)
+        monkeypatch.setattr(slot_holds, "_table_ready", True)
+
+    def test_day_masks(self):
+        """按 15 分钟向外取整，跨天预约拆分到两天"""
+        from app.services.court_slots import day_masks, decode_bitmap, encode_bitmap
+
+        d = date(2025, 1, 26)
+        masks = day_masks(datetime(2025, 1, 26, 10, 0), datetime(2025, 1, 26, 11, 0))
+        assert masks == {d: 0b1111 << 40}
+        assert day_masks(datetime(2025, 1, 26, 10, 10), datetime(2025, 1, 26, 10, 20))[d] == 0b11 << 40
+        overnight = day_masks(datetime(2025, 1, 26, 23, 30), datetime(2025, 1, 27, 0, 30))
+        assert overnight == {d: 0b11 << 94, date(2025, 1, 27): 0b11}
+        assert decode_bitmap(encode_bitmap(1 << 95 | 1)) == 1 << 95 | 1
+
+    def test_claim_sets_bits_and_rejects_overlap(self):
+        """首次建行时按已有预约重建；重叠时间段被拒绝，不相交时不查预约表"""
+        from app.services.court_slots import SlotConflict, claim_court_slots
+
+        at = lambda h, m=0: datetime(2025, 1, 26, h, m)
+        db = self._FakeDb(reservations=[(1, at(8), at(9))])
+
+        with pytest.raises(SlotConflict):
+            claim_court_slots(1, at(8, 30), at(9, 30), cursor=db)
+
+        claim_court_slots(1, at(9), at(10), cursor=db)
+        db.reservations.append((1, at(9), at(10)))
+        claim_court_slots(1, at(14), at(15), cursor=db)
+        assert db.exact_checks == 1
+        assert db.bitmaps[(1, date(2025, 1, 26))] == (0b11111111 << 32) | (0b1111 << 56)
+
+    def test_rows_created_and_locked_exclusively(self):
+        """建行与加锁一步完成（ON DUPLICATE KEY UPDATE），不用只加共享锁的 INSERT IGNORE"""
+        from app.services.court_slots import SlotConflict, claim_court_slots, claim_many
+
+        at = lambda d, h: datetime(2025, 1, d, h)
+        db = self._FakeDb(reservations=[(1, at(26, 8), at(26, 9))])
+        claim_court_slots(1, at(26, 10), at(26, 11), cursor=db)
+        claim_many([(1, at(26, 12), at(26, 13)), (1, at(27, 12), at(27, 13))], cursor=db)
+
+        assert not any("INSERT IGNORE" in sql for sql in db.statements)
+        assert db.bitmaps[(1, date(2025, 1, 26))] == (0b1111 << 32) | (0b1111 << 40) | (0b1111 << 48)
+        assert db.bitmaps[(1, date(2025, 1, 27))] == 0b1111 << 48
+        with pytest.raises(SlotConflict):
+            claim_many([(1, at(26, 8), at(26, 9))], cursor=db)
+
+    def test_booking_after_court_rename_sees_mapped_schedule(self, monkeypatch):
+        """改名后同名排期对应到该场地：位图行按新的对应关系重建，与排期重叠的预约被拒绝"""
+        from app.routers import courts
+        from app.services.court_slots import SlotConflict, claim_court_slots
+
+        at = lambda h: datetime(2025, 1, 26, h)
+        db = self._FakeDb()
+        db.court_names = {1: "1号场", 2: "VIP 1号场"}
+        claim_court_slots(1, at(8), at(9), cursor=db)
+        db.reservations.append((1, at(8), at(9)))
+        monkeypatch.setattr(courts, "publish", lambda *channels: None)
+
+        # "VIP 1号场" 18:00-20:00 有排期；改名前属于 2 号场地，改名后 1、2 号场地都按名称对应到它
+        courts.update_court(1, {"name": "VIP 1号场", "type": "羽毛球", "price_per_hour": 80}, db)
+        assert (1, date(2025, 1, 26)) not in db.bitmaps
+        db.reservations.append((1, at(18), at(20)))
+
+        with pytest.raises(SlotConflict):
+            claim_court_slots(1, at(19), at(20), cursor=db)
+        claim_court_slots(1, at(10), at(11), cursor=db)
+        assert db.bitmaps[(1, date(2025, 1, 26))] == (0b1111 << 32) | (0b1111 << 40) | (0xFF << 72)
+
+    def test_adjacent_unaligned_bookings_allowed(self):
+        """相邻的非整刻预约位图相交，按精确条件复查后放行"""
+        from app.services.court_slots import claim_court_slots
+
+        at = lambda h, m=0: datetime(2025, 1, 26, h, m)
+        db = self._FakeDb()
+        claim_court_slots(2, at(10), at(10, 10), cursor=db)
+        db.reservations.append((2, at(10), at(10, 10)))
+        claim_court_slots(2, at(10, 10), at(10, 30), cursor=db)
+        assert db.exact_checks == 1
+
+    def test_release_rebuilds_from_remaining(self):
+        """取消后按剩余预约重建，不误清共享时段的相邻预约"""
+        from app.services.court_slots import claim_court_slots, release_court_slots
+
+        at = lambda h, m=0: datetime(2025, 1, 26, h, m)
+        db = self._FakeDb()
+        claim_court_slots(3, at(10), at(10, 10), cursor=db)
+        db.reservations.append((3, at(10), at(10, 10)))
+        claim_court_slots(3, at(10, 10), at(10, 30), cursor=db)
+        db.reservations.append((3, at(10, 10), at(10, 30)))
+
+        db.reservations.pop()  # 第二个预约已取消
+        release_court_slots(3, at(10, 10), at(10, 30), cursor=db)
+        assert db.bitmaps[(3, date(2025, 1, 26))] == 1 << 40
+
+    def test_holds_block_others_but_not_owner(self):
+        """其他会员的预留视为冲突；创建预留只检查不置位，确认时跳过自己的预留"""
+        from app.services.court_slots import SlotConflict, claim_court_slots
+
+        at = lambda h, m=0: datetime(2025, 1, 26, h, m)
+        db = self._FakeDb(holds=[("t1", 4, at(18), at(19))])
+
+        with pytest.raises(SlotConflict):
+            claim_court_slots(4, at(18, 30), at(19, 30), cursor=db)
+        claim_court_slots(4, at(20), at(21), cursor=db, mark=False)
+        assert db.bitmaps[(4, date(2025, 1, 26))] == 0
+
+        claim_court_slots(4, at(18), at(19), cursor=db, hold_token="t1")
+        assert db.bitmaps[(4, date(2025, 1, 26))] == 0b1111 << 72
+
+
+class TestBatchReservationExpansion:
+    """批量/周期预约展开测试"""
+
+    def test_weekly_recurrence(self):
+        """每周一次共 12 次，跨零点的时段结束在次日"""
+        from app.routers.court_reservations import _expand_batch
+
+        first = (datetime.now() + timedelta(days=1)).date()
+        items = _expand_batch({
+            "court_id": 3,
+            "recurrence": {"start_date": first.isoformat(), "start_time": "19:00", "end_time": "21:00", "count": 12},
+        })
+        assert len(items) == 12
+        assert items[0] == (3, datetime.combine(first, datetime.min.time()).replace(hour=19),
+                            datetime.combine(first, datetime.min.time()).replace(hour=21))
+        assert all(b[1] - a[1] == timedelta(days=7) for a, b in zip(items, items[1:]))
+
+        overnight = _expand_batch({
+            "court_id": 3,
+            "recurrence": {"start_date": first.isoformat(), "start_time": "23:00", "end_time": "01:00", "count": 1},
+        })
+        assert overnight[0][2] - overnight[0][1] == timedelta(hours=2)
+
+    def test_rejects_internal_overlap_and_past(self):
+        """同一场地的时段互相重叠、或包含已结束的时段时整批拒绝"""
+        from fastapi import HTTPException
+        from app.routers.court_reservations import _expand_batch
+
+        day = (datetime.now() + timedelta(days=2)).strftime("%Y-%m-%d")
+        with pytest.raises(HTTPException):
+            _expand_batch({"court_id": 1, "slots": [
+                {"start_time": f"{day} 10:00:00", "end_time": f"{day} 11:00:00"},
+                {"start_time": f"{day} 10:30:00", "end_time": f"{day} 11:30:00"},
+            ]})
+        # 不同场地同一时段可以
+        items = _expand_batch({"court_id": 1, "slots": [
+            {"start_time": f"{day} 10:00:00", "end_time": f"{day} 11:00:00"},
+            {"court_id": 2, "start_time": f"{day} 10:00:00", "end_time": f"{day} 11:00:00"},
+        ]})
+        assert [c for c, _, _ in items] == [1, 2]
+
+        past = (datetime.now() - timedelta(days=1)).date().isoformat()
+        with pytest.raises(HTTPException):
+            _expand_batch({
+                "court_id": 1,
+                "recurrence": {"start_date": past, "start_time": "08:00", "end_time": "09:00", "count": 3},
+            })
+
+
+class TestSlotHoldCache:
+    """进程内预留映射测试"""
+
+    def test_held_rows_skip_expired_and_excluded(self, monkeypatch):
+        from app.services import slot_holds
+
+        now = datetime.now()
+        day = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        monkeypatch.setattr(slot_holds, "_holds", {})
+        monkeypatch.setattr(slot_holds, "_loaded", slot_holds._notified)
+        monkeypatch.setattr(slot_holds, "publish", lambda *a, **k: None)
+
+        slot_holds.note_hold_added("a", slot_holds.Hold(1, 7, day + timedelta(hours=18), day + timedelta(hours=19), now + timedelta(minutes=5)))
+        slot_holds.note_hold_added("b", slot_holds.Hold(2, 8, day + timedelta(hours=18), day + timedelta(hours=19), now - timedelta(seconds=1)))
+
+        rows = slot_holds.held_rows(day, day + timedelta(days=1))
+        assert rows == [(1, day + timedelta(hours=18), day + timedelta(hours=19))]
+        assert slot_holds.has_held_conflict(1, day + timedelta(hours=18, minutes=30), day + timedelta(hours=20))
+        assert not slot_holds.has_held_conflict(1, day + timedelta(hours=19), day + timedelta(hours=20))
+        assert not slot_holds.has_held_conflict(1, day + timedelta(hours=18), day + timedelta(hours=19), exclude_token="a")
+
+        slot_holds.note_hold_removed("a")
+        assert slot_holds.held_rows(day, day + timedelta(days=1)) == []
+
+    def test_member_limit_counted_under_member_lock(self, monkeypatch):
+        """预留上限在锁住会员行之后计数（位图行之后），同一会员的并发预留不会一起越过上限"""
+        from app.services import court_slots, slot_holds
+
+        statements = []
+
+        class FakeCursor:
+            def __init__(self, held):
+                self.held = held
+
+            def execute(self, sql, params=None):
+                statements.append(" ".join(sql.split()))
+
+            def fetchone(self):
+                return {"cnt": self.held}
+
+        monkeypatch.setattr(slot_holds, "_table_ready", True)
+        monkeypatch.setattr(court_slots, "claim_court_slots", lambda *a, **k: statements.append("claim"))
+        monkeypatch.setattr(slot_holds.settings, "SLOT_HOLD_MAX_PER_MEMBER", 2)
+        start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+        args = dict(member_id=7, court_id=1, start=start, end=start + timedelta(hours=1), total_amount=80)
+
+        slot_holds.create_hold(**args, cursor=FakeCursor(1))
+        assert statements[:3] == [
+            "claim",
+            "SELECT id FROM members WHERE id = %s FOR UPDATE",
+            "SELECT COUNT(*) AS cnt FROM court_slot_holds WHERE member_id = %s AND expires_at > %s",
+        ]
+        with pytest.raises(slot_holds.HoldError):
+            slot_holds.create_hold(**args, cursor=FakeCursor(2))
+
+    def test_confirm_locks_bitmap_before_hold(self, monkeypatch):
+        """确认预留时先锁位图行再锁预留，与下单、创建预留的加锁顺序一致"""
+        from app.routers import member_portal
+
+        day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        hold = {
+            "court_id": 1, "start_time": day + timedelta(hours=18), "end_time": day + timedelta(hours=19),
+            "total_amount": 80, "remark": None,
+        }
+        calls = []
+
+        class FakeCursor:
+            def execute(self, sql, params=None):
+                pass
+
+            def fetchone(self):
+                return {"name": "1号场"}
+
+            def close(self):
+                pass
+
+        class FakeConn:
+            def cursor(self, dictionary=False):
+                return FakeCursor()
+
+            def start_transaction(self):
+                pass
+
+            def commit(self):
+                calls.append("commit")
+
+            def rollback(self):
+                calls.append("rollback")
+
+        monkeypatch.setattr(member_portal, "get_hold", lambda *a, **k: calls.append("get_hold") or hold)
+        monkeypatch.setattr(member_portal, "claim_court_slots", lambda *a, **k: calls.append("claim"))
+        monkeypatch.setattr(member_portal, "lock_hold", lambda *a, **k: calls.append("lock_hold") or hold)
+        monkeypatch.setattr(member_portal, "_settle_member_reservation", lambda *a, **k: (5, {}))
+        monkeypatch.setattr(member_portal, "delete_hold", lambda *a, **k: True)
+        monkeypatch.setattr(member_portal, "mark_hold_booked", lambda *a, **k: None)
+        monkeypatch.setattr(member_portal, "note_hold_removed", lambda *a, **k: None)
+        monkeypatch.setattr(member_portal, "note_reservation_booked", lambda *a, **k: None)
+
+        result = member_portal.confirm_member_hold("t", {"id": 7, "name": "张三"}, FakeConn())
+        assert result["id"] == 5
+        assert calls == ["get_hold", "claim", "lock_hold", "commit"]
+
+
+class TestReservationLifecycle:
+    """预约状态后台推进测试"""
+
+    class _FakeCursor:
+        """按 SQL 关键字模拟 court_reservations 的加锁批量读取与按 id 更新"""
+
+        def __init__(self, rows):
+            self.rows = rows  # id -> [status, member_id, start, end]
+            self.updates = 0
+            self._result = []
+
+        def execute(self, sql, params=None):
+            if "FOR UPDATE" in sql:
+                limit = params[-1]
+                if "end_time <= %s" in sql:
+                    *statuses, now, _ = params
+                    hit = lambda s, e: e <= now
+                else:
+                    *statuses, now, _, _ = params
+                    hit = lambda s, e: e > now and s <= now
+                matched = sorted(
+                    (r[3], i) for i, r in self.rows.items() if r[0] in statuses and hit(r[2], r[3])
+                )[:limit]
+                self._result = [(i, self.rows[i][1], 1, self.rows[i][2], self.rows[i][3]) for _, i in matched]
+            elif sql.strip().startswith("UPDATE court_reservations"):
+                self.updates += 1
+                to_status, rest = params[0], params[1:]
+                for i in rest:
+                    if i in self.rows:
+                        self.rows[i][0] = to_status
+
+        def fetchall(self):
+            return self._result
+
+    def test_advance_in_batches(self, monkeypatch):
+        """已结束的置为已完成、已开始的置为进行中；按批提交，只给完成且有会员的预约发通知"""
+        from contextlib import contextmanager
+        from app.services import reservation_lifecycle as lc
+
+        now = datetime(2025, 1, 26, 12, 0)
+        rows = {
+            1: ["已预约", 7, now - timedelta(hours=3), now - timedelta(hours=2)],
+            2: ["进行中", None, now - timedelta(hours=2), now - timedelta(hours=1)],
+            3: ["已预约", 8, now - timedelta(hours=1), now - timedelta(minutes=30)],
+            4: ["已预约", 9, now - timedelta(minutes=30), now + timedelta(minutes=30)],
+            5: ["已预约", 9, now + timedelta(hours=1), now + timedelta(hours=2)],
+            6: ["已取消", 9, now - timedelta(hours=3), now - timedelta(hours=2)],
+        }
+        cur = self._FakeCursor(rows)
+        sent = []
+
+        @contextmanager
+        def fake_scope(cursor=None, **_):
+            yield cur
+
+        monkeypatch.setattr(lc, "cursor_scope", fake_scope)
+        monkeypatch.setattr(lc, "create_member_notifications", lambda items, cursor=None: sent.extend(items))
+        # 推进间隔足够长，这一轮结束的预约都在通知窗口内
+        monkeypatch.setattr(lc.settings, "RESERVATION_LIFECYCLE_INTERVAL", 4 * 3600)
+
+        counts = lc.advance_statuses(now=now, batch_size=2)
+        assert counts == {"已完成": 3, "进行中": 1}
+        assert [rows[i][0] for i in range(1, 7)] == ["已完成", "已完成", "已完成", "进行中", "已预约", "已取消"]
+        # 已完成 3 条按 2 条一批分两批，进行中 1 批
+        assert cur.updates == 3
+        assert sorted(it["member_id"] for it in sent) == [7, 8]
+
+    def test_backlog_completed_silently(self, monkeypatch):
+        """部署后首次运行/停机恢复：早于上一轮间隔加宽限结束的预约只补推状态，不发通知"""
+        from contextlib import contextmanager
+        from app.services import reservation_lifecycle as lc
+
+        now = datetime(2025, 1, 26, 12, 0)
+        rows = {
+            1: ["已预约", 7, now - timedelta(days=90, hours=1), now - timedelta(days=90)],
+            2: ["进行中", 8, now - timedelta(hours=1), now - timedelta(minutes=30)],
+            3: ["进行中", 9, now - timedelta(hours=1), now - timedelta(minutes=3)],
+        }
+        cur = self._FakeCursor(rows)
+        sent = []
+
+        @contextmanager
+        def fake_scope(cursor=None, **_):
+            yield cur
+
+        monkeypatch.setattr(lc, "cursor_scope", fake_scope)
+        monkeypatch.setattr(lc, "create_member_notifications", lambda items, cursor=None: sent.extend(items))
+        monkeypatch.setattr(lc.settings, "RESERVATION_LIFECYCLE_INTERVAL", 60.0)
+
+        assert lc.advance_statuses(now=now, batch_size=10) == {"已完成": 3, "进行中": 0}
+        assert [rows[i][0] for i in range(1, 4)] == ["已完成"] * 3
+        assert [it["member_id"] for it in sent] == [9]
+
+
+class TestCourtClosureCredits:
+    """场地停用批量退款入账测试"""
+
+    class _FakeCursor:
+        """模拟 balance = balance + %s 的条件更新与读回"""
+
+        def __init__(self, balances):
+            self.balances = balances
+            self.updates = []
+            self.many = []
+            self.rowcount = 0
+            self._row = None
+
+        def execute(self, sql, params=None):
+            if sql.startswith("UPDATE"):
+                amount, member_id = params
+                self.rowcount = 1 if member_id in self.balances else 0
+                if self.rowcount:
+                    self.balances[member_id] += Decimal(amount)
+                    self.updates.append((member_id, amount))
+            else:
+                member_id = params[0]
+                self._row = {"balance": self.balances[member_id]} if member_id in self.balances else None
+
+        def executemany(self, sql, rows):
+            self.many.append((sql, list(rows)))
+
+        def fetchone(self):
+            return self._row
+
+    def test_credits_grouped_per_member(self):
+        """同一会员多笔退款合并成一次原子加法（按 id 顺序），流水逐笔记录且余额递增；不存在的会员跳过"""
+        from app.services.wallet import credit_many
+
+        cur = self._FakeCursor({7: Decimal("10.00"), 8: Decimal("0")})
+        credit_many(cur, [
+            {"member_id": 8, "amount": Decimal("30"), "remark": "a"},
+            {"member_id": 7, "amount": Decimal("20"), "remark": "b"},
+            {"member_id": 7, "amount": Decimal("15.5"), "remark": "c"},
+            {"member_id": 99, "amount": Decimal("5"), "remark": "d"},
+        ])
+        assert cur.updates == [(7, "35.5"), (8, "30")]
+        assert cur.balances[7] == Decimal("45.50") and cur.balances[8] == Decimal("30")
+        ((_, transactions),) = cur.many
+        assert [(m, bal) for m, _, _, bal, _ in transactions] == [(7, "30.00"), (7, "45.50"), (8, "30")]
+
+
+class TestCourtClosureWindow:
+    """场地停用时段即占用测试"""
+
+    def test_index_treats_closure_as_busy(self):
+        """占用查询返回的停用时段（kind = closure）进入区间索引与可用性，预检直接判为冲突"""
+        at = TestReservationIndex._at
+        index = TestReservationIndex._index([(4, at(1, 8), at(2, 22), 12, "closure")])
+        assert index.has_conflict(4, at(1, 19), at(1, 20)) is True
+        assert index.has_conflict(4, at(2, 22), at(2, 23)) is False
+        assert index.busy_rows(at(1, 0), at(1, 12)) == [(4, at(1, 8), at(2, 22))]
+
+    def test_data_clean_clears_closures(self):
+        """数据清理时停用时段与区间变化一并清空，重置后旧的停用窗口不再拒绝预约"""
+        from app.routers.system_settings import _clear_reservation_runtime_tables
+
+        cursor = TestSchemaRegistry._FakeCursor([])
+        _clear_reservation_runtime_tables(cursor)
+        assert "DELETE FROM court_closure_jobs" in cursor.executed
+        assert "DELETE FROM reservation_index_changes" in cursor.executed
+
+    def test_create_job_occupies_window_and_clears_holds_waitlist(self, monkeypatch):
+        """登记停用：写入停用行、重建窗口内的位图、删除预留、候补过期，在同一事务里完成"""
+        from app.services import court_closures
+
+        class FakeCursor:
+            lastrowid = 12
+
+            def __init__(self):
+                self.executed = []
+
+            def execute(self, sql, params=None):
+                self.executed.append(sql)
+
+            def fetchone(self):
+                return {"cnt": 3}
+
+        calls = []
+        monkeypatch.setattr(court_closures, "_table_ready", True)
+        monkeypatch.setattr(court_closures, "release_many", lambda rows, cursor: calls.append(("bitmap", rows)))
+        monkeypatch.setattr(court_closures, "delete_holds_in_range",
+                            lambda c, s, e, cursor: calls.append(("holds", c, s, e)) or 2)
+        monkeypatch.setattr(court_closures, "expire_in_range",
+                            lambda c, s, e, cursor: calls.append(("waitlist", c, s, e)) or 1)
+
+        start, end = datetime(2025, 2, 1, 8), datetime(2025, 2, 3, 22)
+        cursor = FakeCursor()
+        job = court_closures.create_job(4, start, end, "检修", cursor=cursor)
+
+        assert job == {"job_id": 12, "total": 3, "holds_removed": 2, "waitlist_expired": 1}
+        assert "INSERT INTO court_closure_jobs" in cursor.executed[-1]
+        assert calls == [
+            ("bitmap", [{"court_id": 4, "start_time": start, "end_time": end}]),
+            ("holds", 4, start, end),
+            ("waitlist", 4, start, end),
+        ]
+
+    def test_lift_rebuilds_window_after_locking_bitmap(self, monkeypatch):
+        """解除停用：先锁窗口内的位图行、再改任务状态、最后重建位图；已解除的不能再解除"""
+        from app.services import court_closures
+
+        start, end = datetime(2025, 2, 1, 8), datetime(2025, 2, 3, 22)
+        job = {"id": 12, "court_id": 4, "start_time": start, "end_time": end, "status": "running"}
+        calls = []
+
+        class FakeCursor:
+            rowcount = 0
+
+            def execute(self, sql, params=None):
+                if "SELECT" in sql:
+                    self._one = dict(job)
+                elif "UPDATE court_closure_jobs" in sql:
+                    calls.append(("status", params[0]))
+                    self.rowcount = 1 if job["status"] in params[-2:] else 0
+                    if self.rowcount:
+                        job["status"] = params[0]
+
+            def fetchone(self):
+                return self._one
+
+        monkeypatch.setattr(court_closures, "_table_ready", True)
+        monkeypatch.setattr(court_closures, "lock_court_days", lambda c, s, e, cursor: calls.append(("lock", c)))
+        monkeypatch.setattr(court_closures, "release_many", lambda rows, cursor: calls.append(("rebuild", rows[0]["court_id"])))
+
+        court_closures.lift_job(4, 12, cursor=FakeCursor())
+        assert calls == [("lock", 4), ("status", "lifted"), ("rebuild", 4)]
+        with pytest.raises(court_closures.ClosureError):
+            court_closures.lift_job(4, 12, cursor=FakeCursor())
+        with pytest.raises(court_closures.ClosureNotFound):
+            court_closures.lift_job(5, 12, cursor=FakeCursor())
+
+    def test_failed_job_stops_occupying(self, monkeypatch):
+        """任务失败时标记 failed 并按剩余占用重建窗口，通知各 worker 重新加载"""
+        from contextlib import contextmanager
+        from app.services import court_closures
+
+        job = {"id": 12, "court_id": 4, "start_time": datetime(2025, 2, 1, 8), "end_time": datetime(2025, 2, 1, 22), "status": "running"}
+        deactivated, changed = [], []
+
+        @contextmanager
+        def scope(cursor=None, **_):
+            yield None
+
+        def boom(cursor, job, limit):
+            raise RuntimeError("db down")
+
+        monkeypatch.setattr(court_closures, "cursor_scope", scope)
+        monkeypatch.setattr(court_closures, "get_job", lambda job_id, cursor: job)
+        monkeypatch.setattr(court_closures, "_process_chunk", boom)
+        monkeypatch.setattr(court_closures, "_deactivate", lambda cur, j, status, error=None: deactivated.append((status, error)) or True)
+        monkeypatch.setattr(court_closures, "note_reservations_changed", lambda: changed.append(True))
+
+        court_closures.run_job(12)
+        assert deactivated == [("failed", "db down")] and changed == [True]
+
+
+class TestWallet:
+    """会员余额条件扣款测试"""
+
+    class _FakeCursor:
+        """按条件更新的语义模拟 members 表（dictionary 游标）"""
+
+        def __init__(self, members):
+            self.members = members
+            self.transactions = []
+            self.rowcount = 0
+            self.lastrowid = None
+            self._one = None
+
+        def execute(self, sql, params=None):
+            sql = " ".join(sql.split())
+            if sql.startswith("UPDATE members SET balance = balance - %s"):
+                amount, member_id, floor = params
+                m = self.members.get(member_id)
+                ok = m is not None and m["balance"] >= floor and ("status" not in sql or m["status"] in (None, "", "正常"))
+                if ok:
+                    m["balance"] = round(m["balance"] - amount, 2)
+                self.rowcount = 1 if ok else 0
+            elif sql.startswith("UPDATE members SET balance = balance + %s"):
+                amount, member_id = params
+                m = self.members.get(member_id)
+                if m is not None:
+                    m["balance"] = round(m["balance"] + amount, 2)
+                self.rowcount = 1 if m is not None else 0
+            elif sql.startswith("SELECT"):
+                self._one = self.members.get(params[0])
+            elif sql.startswith("INSERT INTO member_transactions"):
+                self.executemany(sql, [params])
+
+        def executemany(self, sql, rows):
+            for row in rows:
+                self.transactions.append(row)
+            self.lastrowid = len(self.transactions)
+
+        def fetchone(self):
+            return self._one
+
+    def test_debit_many_running_balance(self):
+        """多笔合计一次扣除，流水余额逐笔递减并以负数记录"""
+        from app.services.wallet import debit_many
+
+        cur = self._FakeCursor({7: {"name": "张三", "balance": 100.0, "status": "正常"}})
+        result = debit_many(cur, 7, [(30, "a"), (20.5, "b")], require_active=True)
+        assert result.balance == 49.5 and result.transaction_id == 2
+        assert [(amt, bal) for _, _, amt, bal, _ in cur.transactions] == [(-30.0, 70.0), (-20.5, 49.5)]
+
+    def test_debit_failures(self):
+        """余额不足 / 会员不存在 / 状态异常分别抛出对应错误，余额不变"""
+        from app.services.wallet import InsufficientBalance, MemberInactive, MemberNotFound, credit, debit
+
+        cur = self._FakeCursor({
+            7: {"name": "张三", "balance": 10.0, "status": "正常"},
+            8: {"name": "李四", "balance": 500.0, "status": "冻结"},
+        })
+        with pytest.raises(InsufficientBalance) as exc:
+            debit(cur, 7, 25, "x")
+        assert exc.value.balance == 10.0 and exc.value.amount == 25
+        with pytest.raises(MemberNotFound):
+            debit(cur, 99, 1, "x")
+        with pytest.raises(MemberInactive):
+            debit(cur, 8, 1, "x", require_active=True)
+        assert cur.members[7]["balance"] == 10.0 and cur.members[8]["balance"] == 500.0 and not cur.transactions
+
+        assert credit(cur, 99, 5, "x") is None
+        assert credit(cur, 7, 5, "refund").balance == 15.0
+        assert cur.transactions == [(7, "退款", 5.0, 15.0, "refund")]
+
+
+class TestWaitlistPromotion:
+    """满场候补转预留测试"""
+
+    class _FakeCursor:
+        def __init__(self, entries):
+            self.entries = entries
+            self.offered = []
+            self._one = None
+
+        def execute(self, sql, params=None):
+            if "FOR UPDATE" in sql:
+                self._one = {"id": params[0]}
+            elif sql.strip().startswith("UPDATE court_waitlist"):
+                self.offered.append((params[-1], params[1]))
+
+        def fetchone(self):
+            return self._one
+
+        def fetchall(self):
+            return self.entries
+
+    def test_promote_in_order_skipping_conflicts(self, monkeypatch):
+        """按登记顺序转预留；与已转出的预留冲突的候补跳过，不重叠的继续转"""
+        from contextlib import contextmanager
+        from app.services import waitlist
+        from app.services.court_slots import SlotConflict
+
+        day = datetime(2025, 1, 26)
+        entries = [
+            {"id": 1, "member_id": 7, "start_time": day.replace(hour=19), "end_time": day.replace(hour=20), "remark": None},
+            {"id": 2, "member_id": 8, "start_time": day.replace(hour=19), "end_time": day.replace(hour=20), "remark": None},
+            {"id": 3, "member_id": 9, "start_time": day.replace(hour=20), "end_time": day.replace(hour=21), "remark": None},
+        ]
+        cur = self._FakeCursor(entries)
+        held = []
+
+        @contextmanager
+        def fake_scope(cursor=None, **_):
+            yield cur
+
+        def fake_hold(*, member_id, court_id, start, end, total_amount, remark, cursor):
+            if any(s < end and e > start for s, e in held):
+                raise SlotConflict("conflict")
+            held.append((start, end))
+            return f"t{member_id}", type("H", (), {"expires_at": start})()
+
+        monkeypatch.setattr(waitlist, "ensure_table", lambda: None)
+        monkeypatch.setattr(waitlist, "cursor_scope", fake_scope)
+        monkeypatch.setattr(waitlist, "quote_member_court", lambda *a: ("1号场", 80.0))
+        monkeypatch.setattr(waitlist, "create_hold", fake_hold)
+        monkeypatch.setattr(waitlist, "create_notification", lambda **k: None)
+        monkeypatch.setattr(waitlist, "note_hold_added", lambda *a: None)
+
+        assert waitlist.promote(1, day.replace(hour=19), day.replace(hour=21)) == 2
+        assert cur.offered == [(1, 1), (3, 1)]
+
+    def test_join_counts_under_member_lock(self, monkeypatch):
+        """登记候补时先锁会员行再计数，同一会员的并发登记不会一起越过上限"""
+        from app.services import waitlist
+
+        statements = []
+
+        class FakeCursor:
+            lastrowid = 11
+
+            def __init__(self, waiting):
+                self.waiting = waiting
+                self._one = None
+
+            def execute(self, sql, params=None):
+                statements.append(" ".join(sql.split()))
+                self._one = {"cnt": self.waiting} if "COUNT(*)" in sql else None
+
+            def fetchone(self):
+                return self._one
+
+        monkeypatch.setattr(waitlist, "ensure_table", lambda: None)
+        monkeypatch.setattr(waitlist.settings, "WAITLIST_MAX_PER_MEMBER", 3)
+        start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+        args = dict(member_id=7, court_id=1, court_type=None, start=start, end=start + timedelta(hours=1))
+
+        assert waitlist.join_waitlist(**args, cursor=FakeCursor(2)) == 11
+        assert statements[0] == "SELECT id FROM members WHERE id = %s FOR UPDATE"
+        assert statements[1].startswith("SELECT COUNT(*)")
+        with pytest.raises(waitlist.WaitlistError):
+            waitlist.join_waitlist(**args, cursor=FakeCursor(3))
+
+
+class TestPricingEngine:
+    """统一计价引擎测试"""
+
+    class _FakeCursor:
+        def __init__(self, rows):
+            self.rows = rows
+            self.executed = 0
+
+        def execute(self, sql, params=None):
+            self.executed += 1
+
+        def fetchall(self):
+            return self.rows
+
+    @staticmethod
+    def _tables(monkeypatch):
+        from app.services import pricing
+
+        monkeypatch.setattr(pricing, "_courts", {1: pricing.CourtPrice(1, "1号场", "羽毛球", "可用", 60.0)})
+        monkeypatch.setattr(pricing, "_products", {5: pricing.ProductPrice(5, "矿泉水", "上架", 2.5)})
+        monkeypatch.setattr(pricing, "_loaded", pricing._notified)
+        monkeypatch.setattr(pricing, "_loaded_at", float("inf"))
+        # 未配置分时段规则与节假日
+        monkeypatch.setattr(pricing, "get_parsed", lambda group, key, parser, cursor=None: parser(None))
+        return pricing
+
+    def test_card_discount_from_single_query(self, monkeypatch):
+        """一条查询同时得到等级与有效卡；有折扣卡时按卡折扣，不再查等级折扣"""
+        pricing = self._tables(monkeypatch)
+        monkeypatch.setattr(pricing, "level_discount", lambda level, cursor=None: 95.0)
+        cursor = self._FakeCursor([
+            {"member_level": "vip", "id": 3, "discount": 90, "remaining_times": None, "card_type": "折扣卡"},
+            {"member_level": "vip", "id": 4, "discount": 80, "remaining_times": 0, "card_type": "折扣卡"},
+        ])
+
+        start = datetime(2025, 1, 26, 19)
+        result = pricing.quote(
+            [
+                {"court_id": 1, "start": start, "end": start + timedelta(minutes=90)},
+                {"product_id": 5, "quantity": 3},
+            ],
+            7,
+            cursor=cursor,
+        )
+        assert cursor.executed == 1
+        assert result["discount"] == 80.0 and result["card"]["id"] == 4
+        assert [line["amount"] for line in result["lines"]] == [72.0, 6.0]
+        assert result["total_amount"] == 78.0
+
+    def test_level_discount_and_manual_base(self, monkeypatch):
+        """没有卡时按等级折扣；手工指定的原价同样打折"""
+        pricing = self._tables(monkeypatch)
+        monkeypatch.setattr(pricing, "level_discount", lambda level, cursor=None: 90.0 if level == "gold" else 100.0)
+        cursor = self._FakeCursor([{"member_level": "gold", "id": None}])
+
+        start = datetime(2025, 1, 26, 19)
+        line = pricing.quote(
+            [{"court_id": 1, "start": start, "end": start + timedelta(hours=1), "base_amount": 100}], 7, cursor=cursor
+        )["lines"][0]
+        assert line["base_amount"] == 100.0 and line["amount"] == 90.0
+
+        with pytest.raises(pricing.PricingError):
+            pricing.quote([{"product_id": 5, "quantity": 0}], cursor=cursor, member=pricing.NO_MEMBER)
+
+
+class TestTimeOfDayPricing:
+    """分时段价格表测试"""
+
+    RULES = [
+        {"days": ["weekday"], "start": "18:00", "end": "22:00", "price_per_hour": 100},
+        {"days": ["weekend"], "multiplier": 1.5},
+        {"court_type": "网球", "days": "all", "start": "22:00", "end": "02:00", "price_per_hour": 20},
+        {"days": ["holiday"], "start": "08:00", "end": "12:00", "price_per_hour": 200},
+    ]
+
+    @staticmethod
+    def _pricing(monkeypatch, rules, holidays=()):
+        import json
+        from app.services import pricing
+
+        raw = {"court_price_rules_json": json.dumps(rules), "holidays_json": json.dumps(list(holidays))}
+        monkeypatch.setattr(pricing, "_courts", {
+            1: pricing.CourtPrice(1, "1号场", "羽毛球", "可用", 60.0),
+            2: pricing.CourtPrice(2, "网球场", "网球", "可用", 80.0),
+        })
+        monkeypatch.setattr(pricing, "_loaded", pricing._notified)
+        monkeypatch.setattr(pricing, "_loaded_at", float("inf"))
+        monkeypatch.setattr(pricing, "_generation", pricing._generation + 1)
+        monkeypatch.setattr(pricing, "get_parsed", lambda group, key, parser, cursor=None: parser(raw.get(key)))
+        return pricing
+
+    def test_peak_weekend_and_holiday(self, monkeypatch):
+        """跨高峰边界按时段累加；周末按倍率；节假日先套周末规则再套节假日规则"""
+        pricing = self._pricing(monkeypatch, self.RULES, holidays=["2025-10-01"])
+        weekday = datetime(2025, 1, 22)   # 周三
+        saturday = datetime(2025, 1, 25)
+
+        # 17:30-18:30：半小时标准价 30 + 半小时高峰价 50
+        assert pricing.court_amount(1, weekday.replace(hour=17, minute=30), weekday.replace(hour=18, minute=30)) == 80.0
+        # 不足一个时段按比例：18:00-18:10 = 100 / 6
+        assert pricing.court_amount(1, weekday.replace(hour=18), weekday.replace(hour=18, minute=10)) == 16.67
+        assert pricing.court_amount(1, saturday.replace(hour=19), saturday.replace(hour=21)) == 180.0
+        # 2025-10-01 为周三，但按节假日：10:00-13:00 = 2h × 200 + 1h × 60 × 1.5
+        holiday = datetime(2025, 10, 1)
+        assert pricing.court_amount(1, holiday.replace(hour=10), holiday.replace(hour=13)) == 490.0
+
+    def test_overnight_rule_and_quote(self, monkeypatch):
+        """跨午夜的规则与跨天的预约；quote 的原价取自价格表"""
+        pricing = self._pricing(monkeypatch, self.RULES)
+        start = datetime(2025, 1, 22, 21)
+        end = datetime(2025, 1, 23, 1)
+        # 21-22 工作日高峰 100，22-24 与 0-1 为 20/小时（后面的规则覆盖前面的）
+        assert pricing.court_amount(2, start, end) == 160.0
+
+        line = pricing.quote([{"court_id": 2, "start": start, "end": end}], member=pricing.NO_MEMBER, cursor=None)["lines"][0]
+        assert line["unit_price"] == 80.0 and line["quantity"] == 4 and line["base_amount"] == 160.0
+
+        with pytest.raises(pricing.PricingError):
+            pricing.court_amount(2, end, start)
+
+    def test_grid_prices(self, monkeypatch):
+        """可用性网格的每个时段带价格，价格变化时 cache_key 随之变化"""
+        from app.services.availability import build_grid
+
+        pricing = self._pricing(monkeypatch, self.RULES)
+        courts = [{"id": 1, "name": "1号场", "type": "羽毛球", "status": "可用"}]
+        day = date(2025, 1, 22)
+        grid = build_grid(courts, {}, [day], time(17), time(20), 60, price_of=pricing.court_amount)
+        assert grid["days"][0]["courts"][0]["prices"] == [60.0, 100.0, 100.0]
+
+        plain = build_grid(courts, {}, [day], time(17), time(20), 60)
+        assert "prices" not in plain["days"][0]["courts"][0]
+        assert plain["cache_key"] != grid["cache_key"]
+
+
+class TestBatchQuote:
+    """批量计价接口测试"""
+
+    def test_week_of_slots_in_one_pass(self, monkeypatch):
+        """多行场地与商品一次计价：会员折扣只查一次，返回逐行与合计金额"""
+        from app.routers.pricing import run_quote
+
+        pricing = TestPricingEngine._tables(monkeypatch)
+        monkeypatch.setattr(pricing, "level_discount", lambda level, cursor=None: 90.0)
+        cursor = TestPricingEngine._FakeCursor([{"member_level": "gold", "id": None}])
+
+        lines = [
+            {"court_id": 1, "start_time": f"2025-01-{20 + d} 19:00:00", "end_time": f"2025-01-{20 + d} 20:00:00"}
+            for d in range(7)
+        ] + [{"product_id": 5, "quantity": 2}]
+        result = run_quote(cursor, lines, 7)
+
+        assert cursor.executed == 1
+        assert len(result["lines"]) == 8
+        assert result["lines"][0]["start_time"] == "2025-01-20 19:00:00"
+        assert [line["amount"] for line in result["lines"]] == [54.0] * 7 + [4.5]
+        assert result["base_total"] == 425.0 and result["total_amount"] == 382.5
+
+    def test_invalid_lines(self, monkeypatch):
+        """缺字段、格式错误与找不到的场地分别返回 400 / 404"""
+        from fastapi import HTTPException
+        from app.routers.pricing import parse_quote_lines, run_quote
+
+        for lines in ([], [{"quantity": 1}], [{"court_id": 1, "start_time": "2025-01-20 19:00"}],
+                      [{"court_id": "x", "start_time": "2025-01-20 19:00", "end_time": "2025-01-20 20:00"}]):
+            with pytest.raises(HTTPException) as exc:
+                parse_quote_lines(lines)
+            assert exc.value.status_code == 400
+
+        pricing = TestPricingEngine._tables(monkeypatch)
+        monkeypatch.setattr(pricing, "reload_prices", lambda cursor=None: None)
+        with pytest.raises(HTTPException) as exc:
+            run_quote(None, [{"court_id": 99, "start_time": "2025-01-20 19:00", "end_time": "2025-01-20 20:00"}], None)
+        assert exc.value.status_code == 404
+
+
 class TestMemberBalanceLogic:
     """会员余额逻辑测试"""
     
@@ -115,6 +115,457 @@ class TestDatabaseConnectionPool:
         assert ".close()" in source, "应该有关闭连接的代码"
 
 
+class _FakeRawConnection:
+    """模拟 mysql-connector 物理连接"""
+
+    def __init__(self):
+        self.in_transaction = False
+        self.closed = False
+        self.pings = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.closed:
+            raise RuntimeError("connection lost")
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestBlockingConnectionPool:
+    """阻塞式连接池测试（不依赖真实数据库）"""
+
+    def _make_pool(self, **kwargs):
+        from app.database import ConnectionPool
+
+        created = []
+
+        def creator():
+            conn = _FakeRawConnection()
+            created.append(conn)
+            return conn
+
+        kwargs.setdefault("size", 2)
+        kwargs.setdefault("timeout", 1.0)
+        return ConnectionPool(creator, **kwargs), created
+
+    def test_close_returns_connection_to_pool(self):
+        """close() 归还而不是断开，连接被复用"""
+        pool, created = self._make_pool()
+        conn = pool.get_connection()
+        conn.close()
+        conn.close()  # 重复 close 无副作用
+        conn2 = pool.get_connection()
+        conn2.close()
+
+        assert len(created) == 1
+        assert created[0].closed is False
+        assert pool.stats()["idle"] == 1
+
+    def test_checkout_waits_instead_of_failing(self):
+        """连接耗尽时排队等待，而不是立即报 pool exhausted"""
+        pool, _ = self._make_pool(size=1, timeout=2.0)
+        held = pool.get_connection()
+        got = []
+
+        def worker():
+            c = pool.get_connection()
+            got.append(c)
+            c.close()
+
+        t = threading.Thread(target=worker)
+        t.start()
+        time.sleep(0.05)
+        assert pool.stats()["waiting"] == 1
+        held.close()
+        t.join(timeout=2)
+
+        assert len(got) == 1
+        stats = pool.stats()
+        assert stats["waits"] == 1
+        assert stats["timeouts"] == 0
+        assert stats["wait_time_max"] > 0
+
+    def test_checkout_timeout(self):
+        """等待超时抛出 PoolTimeoutError 并计数"""
+        from app.database import PoolTimeoutError
+
+        pool, _ = self._make_pool(size=1, timeout=0.05)
+        held = pool.get_connection()
+        with pytest.raises(PoolTimeoutError):
+            pool.get_connection()
+        held.close()
+        assert pool.stats()["timeouts"] == 1
+        assert pool.stats()["waiting"] == 0
+
+    def test_waiters_served_fifo(self):
+        """排队线程按先来后到拿到连接"""
+        pool, _ = self._make_pool(size=1, timeout=2.0)
+        held = pool.get_connection()
+        order = []
+
+        def worker(i):
+            c = pool.get_connection()
+            order.append(i)
+            time.sleep(0.01)
+            c.close()
+
+        threads = []
+        for i in range(4):
+            t = threading.Thread(target=worker, args=(i,))
+            t.start()
+            threads.append(t)
+            time.sleep(0.02)  # 保证入队顺序
+
+        held.close()
+        for t in threads:
+            t.join(timeout=2)
+        assert order == [0, 1, 2, 3]
+
+    def test_overflow_connections_closed_on_return(self):
+        """溢出连接在无人等待时归还即关闭"""
+        pool, created = self._make_pool(size=1, max_overflow=1)
+        c1 = pool.get_connection()
+        c2 = pool.get_connection()
+        assert pool.stats()["overflow"] == 1
+        c2.close()
+        c1.close()
+
+        stats = pool.stats()
+        assert stats["overflow"] == 0
+        assert stats["overflow_peak"] == 1
+        assert stats["total"] == 1
+        assert sum(1 for c in created if c.closed) == 1
+
+    def test_rollback_uncommitted_on_return(self):
+        """归还时回滚未提交事务"""
+        pool, created = self._make_pool()
+        conn = pool.get_connection()
+        created[0].in_transaction = True
+        conn.close()
+        assert created[0].rollbacks == 1
+
+    def test_recycle_and_pre_ping(self):
+        """超龄连接回收重建；空闲较久的连接先 ping，失效则重建"""
+        pool, created = self._make_pool(size=1, recycle=1, pre_ping=True, ping_interval=0)
+        conn = pool.get_connection()
+        conn.close()
+
+        # ping 失败 -> 重建
+        created[0].closed = True
+        conn = pool.get_connection()
+        conn.close()
+        assert len(created) == 2
+        assert pool.stats()["ping_failures"] == 1
+
+        # 超过 recycle 时间 -> 重建
+        pool._idle[0].created_at -= 5
+        conn = pool.get_connection()
+        conn.close()
+        assert len(created) == 3
+        assert pool.stats()["recycled"] == 1
+
+    def test_close_drains_pool(self):
+        """close() 关闭空闲连接，并等待借出中的连接归还"""
+        from mysql.connector.errors import PoolError
+
+        pool, created = self._make_pool(size=2)
+        busy = pool.get_connection()
+        idle = pool.get_connection()
+        idle.close()
+
+        threading.Timer(0.05, busy.close).start()
+        pool.close(timeout=2)
+
+        assert all(c.closed for c in created)
+        assert pool.stats()["total"] == 0
+        with pytest.raises(PoolError):
+            pool.get_connection()
+
+
+class TestUnitOfWork:
+    """请求级工作单元测试"""
+
+    class _FakeConn:
+        def __init__(self):
+            self.in_transaction = False
+            self.calls = []
+
+        def cursor(self, **kwargs):
+            self.calls.append("cursor")
+            self.in_transaction = True  # 模拟查询隐式开启事务
+            return object()
+
+        def start_transaction(self, **kwargs):
+            if self.in_transaction:
+                raise RuntimeError("Transaction already in progress")
+            self.calls.append("start_transaction")
+            self.in_transaction = True
+
+        def commit(self):
+            self.calls.append("commit")
+            self.in_transaction = False
+
+        def rollback(self):
+            self.calls.append("rollback")
+            self.in_transaction = False
+
+        def close(self):
+            self.calls.append("close")
+
+    def test_lazy_checkout_and_single_connection(self, monkeypatch):
+        """未访问数据库不借连接；多次取游标共用同一条连接"""
+        from app import database
+
+        conns = []
+
+        def fake_get_db():
+            conns.append(self._FakeConn())
+            return conns[-1]
+
+        monkeypatch.setattr(database, "get_db", fake_get_db)
+
+        gen = database.get_uow()
+        uow = next(gen)
+        assert conns == []
+
+        uow.cursor(dictionary=True)
+        uow.cursor()
+        assert len(conns) == 1
+
+        with pytest.raises(StopIteration):
+            next(gen)
+        assert conns[0].calls[-1] == "close"
+
+    def test_start_transaction_after_dependency_reads(self, monkeypatch):
+        """认证依赖的查询已隐式开启事务时，start_transaction 不应报错，也不提交"""
+        from app import database
+
+        conn = self._FakeConn()
+        monkeypatch.setattr(database, "get_db", lambda: conn)
+
+        uow = database.UnitOfWork()
+        uow.cursor(dictionary=True)  # 依赖阶段查询
+        uow.start_transaction()
+        uow.commit()
+        uow.release()
+
+        # 依赖阶段的只读事务被回滚而不是提交
+        assert conn.calls == ["cursor", "rollback", "start_transaction", "commit", "close"]
+
+    def test_nested_start_transaction_does_not_commit(self, monkeypatch):
+        """显式事务进行中再次 start_transaction 时报错，不替外层提交做了一半的修改"""
+        from app import database
+
+        conn = self._FakeConn()
+        monkeypatch.setattr(database, "get_db", lambda: conn)
+
+        uow = database.UnitOfWork()
+        uow.start_transaction()
+        uow.cursor()  # 外层写了一半
+        with pytest.raises(RuntimeError):
+            uow.start_transaction()
+        assert "commit" not in conn.calls
+
+        uow.rollback()
+        uow.start_transaction()
+        assert conn.calls == ["start_transaction", "cursor", "rollback", "start_transaction"]
+
+    def test_cursor_scope_reuses_external_cursor(self):
+        """service 传入外部 cursor 时不借新连接、不单独提交"""
+        from app.database import cursor_scope
+
+        external = object()
+        with cursor_scope(external) as cur:
+            assert cur is external
+
+
+class TestAsyncDatabasePath:
+    """异步数据库路径测试"""
+
+    class _FakeAsyncConn:
+        def __init__(self):
+            self.closed = False
+            self.in_transaction = True
+            self.calls = []
+
+        def get_transaction_status(self):
+            return self.in_transaction
+
+        async def rollback(self):
+            self.calls.append("rollback")
+            self.in_transaction = False
+
+        def close(self):
+            self.calls.append("close")
+            self.closed = True
+
+    def test_async_uow_rolls_back_before_release(self, monkeypatch):
+        """归还前回滚未提交事务，避免 aiomysql 直接关闭连接"""
+        import asyncio
+        from app import async_database
+
+        conn = self._FakeAsyncConn()
+
+        class FakePool:
+            async def release(self, c):
+                conn.calls.append("release")
+
+        async def fake_acquire(timeout=None):
+            return conn
+
+        async def run():
+            monkeypatch.setattr(async_database, "_async_pool", FakePool())
+            monkeypatch.setattr(async_database, "_async_pool_loop", asyncio.get_running_loop())
+            monkeypatch.setattr(async_database, "_acquire", fake_acquire)
+            async with async_database.AsyncUnitOfWork() as db:
+                assert await db.connection() is conn
+                assert await db.connection() is conn
+
+        asyncio.run(run())
+        assert conn.calls == ["rollback", "release"]
+
+    def test_execute_tool_runs_sync_tool_off_loop(self, monkeypatch):
+        """同步工具在线程池中执行，不阻塞事件循环"""
+        import asyncio
+        from app.agent import tools
+
+        seen = {}
+
+        def slow_tool(court_id: int, target_date: str, start_hour: int, end_hour: int, member_id=None):
+            seen["thread"] = threading.get_ident()
+            seen["member_id"] = member_id
+            return "ok"
+
+        monkeypatch.setitem(
+            tools.AVAILABLE_TOOLS,
+            "book_court",
+            {**tools.AVAILABLE_TOOLS["book_court"], "function": slow_tool},
+        )
+
+        result = asyncio.run(tools.execute_tool(
+            "book_court", member_id=7,
+            court_id=1, target_date="2025-01-27", start_hour=14, end_hour=16,
+        ))
+
+        assert result == "ok"
+        assert seen["member_id"] == 7
+        assert seen["thread"] != threading.get_ident()
+
+
+class TestCacheBus:
+    """跨进程缓存失效通道测试"""
+
+    def _fake_scope(self, rows):
+        from contextlib import contextmanager
+
+        class FakeCursor:
+            def execute(self, sql, params=None):
+                pass
+
+            def fetchall(self):
+                return rows
+
+            def fetchone(self):
+                return None
+
+        @contextmanager
+        def scope(cursor=None, *, dictionary=False):
+            yield FakeCursor()
+
+        return scope
+
+    def test_poll_fires_only_on_version_change(self, monkeypatch):
+        """首次轮询只记录基线，其他 worker 递增版本后触发回调"""
+        from app.services import cache_bus
+
+        monkeypatch.setattr(cache_bus, "_handlers", {})
+        monkeypatch.setattr(cache_bus, "_seen_versions", {})
+        monkeypatch.setattr(cache_bus, "_baseline_ready", False)
+        rows = [("roles", 3)]
+        monkeypatch.setattr(cache_bus, "cursor_scope", self._fake_scope(rows))
+
+        fired = []
+        cache_bus.subscribe("roles", lambda: fired.append("roles"))
+
+        assert cache_bus.poll_once() == []
+        rows[0] = ("roles", 4)
+        assert cache_bus.poll_once() == ["roles"]
+        assert cache_bus.poll_once() == []
+        rows.append(("members", 1))  # 基线之后新出现的频道也要触发
+        assert cache_bus.poll_once() == ["members"]
+        assert fired == ["roles"]
+
+    def test_publish_invalidates_locally_when_db_unavailable(self, monkeypatch):
+        """写 cache_versions 失败时本进程仍立即失效"""
+        from contextlib import contextmanager
+        from app.services import cache_bus
+
+        @contextmanager
+        def broken_scope(cursor=None, *, dictionary=False):
+            raise RuntimeError("db down")
+            yield
+
+        monkeypatch.setattr(cache_bus, "_handlers", {})
+        monkeypatch.setattr(cache_bus, "cursor_scope", broken_scope)
+
+        fired = []
+        cache_bus.subscribe("settings", lambda: fired.append("settings"))
+        cache_bus.publish("settings")
+        assert fired == ["settings"]
+
+    def test_publish_does_not_hide_other_workers_bumps(self, monkeypatch):
+        """publish 只在版本恰好 +1 时记为已见；中间夹着其他 worker 的递增时留给轮询触发"""
+        from contextlib import contextmanager
+        from app.services import cache_bus
+
+        versions = {"holds": 5}
+
+        class VersionCursor:
+            def execute(self, sql, params=None):
+                if sql.lstrip().startswith("INSERT"):
+                    versions[params[0]] = versions.get(params[0], 0) + 1
+
+            def fetchone(self):
+                return (versions["holds"],)
+
+            def fetchall(self):
+                return list(versions.items())
+
+        @contextmanager
+        def scope(cursor=None, *, dictionary=False):
+            yield VersionCursor()
+
+        monkeypatch.setattr(cache_bus, "_handlers", {})
+        monkeypatch.setattr(cache_bus, "_seen_versions", {"holds": 5})
+        monkeypatch.setattr(cache_bus, "_baseline_ready", True)
+        monkeypatch.setattr(cache_bus, "_table_ready", True)
+        monkeypatch.setattr(cache_bus, "cursor_scope", scope)
+        fired = []
+        cache_bus.subscribe("holds", lambda: fired.append("holds"))
+
+        cache_bus.publish("holds", local=False)          # 5 -> 6，自己的递增
+        assert cache_bus.poll_once() == []
+        versions["holds"] += 1                           # 其他 worker：6 -> 7
+        cache_bus.publish("holds", local=False)          # 7 -> 8，不能把 7 一并吞掉
+        assert cache_bus.poll_once() == ["holds"]
+        assert fired == ["holds"]
+
+    def test_roles_cache_subscribed(self):
+        """角色缓存注册了 roles 频道的失效回调"""
+        from app import deps
+        from app.services import cache_bus
+
+        deps._roles_cache["data"] = [{"code": "admin"}]
+        cache_bus._fire("roles")
+        assert deps._roles_cache["data"] is None
+
+
 class TestTransactionHandling:
     """事务处理测试"""
     
@@ -149,5 +600,229 @@ class TestCacheManagement:
         assert COLUMNS_CACHE_TTL <= 3600  # 不应太长
 
 
+class TestCourtSlotStress:
+    """场地位图并发压力测试：多个事务同时抢同一场地的重叠时段，不能出现重复预约"""
+
+    @pytest.mark.database
+    @pytest.mark.slow
+    def test_no_double_booking_under_contention(self):
+        from app.database import get_db
+        from app.services.court_slots import SlotConflict, claim_court_slots
+
+        try:
+            setup_db = get_db()
+        except Exception as e:
+            pytest.skip(f"数据库不可用: {e}")
+
+        setup_cursor = setup_db.cursor()
+        setup_cursor.execute("SELECT id FROM courts LIMIT 1")
+        row = setup_cursor.fetchone()
+        if not row:
+            setup_cursor.close()
+            setup_db.close()
+            pytest.skip("没有可用于测试的场地")
+        court_id = int(row[0])
+
+        # 远期日期，避免与真实数据冲突；请求在 10:00-14:00 内以 15/20 分钟为步长互相重叠
+        day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=3650)
+        requests = [
+            (day + timedelta(hours=10, minutes=m), day + timedelta(hours=10, minutes=m + 60))
+            for m in list(range(0, 180, 15)) + list(range(5, 180, 20))
+        ] * 2
+        booked = []
+        errors = []
+        inserted_ids = []
+        barrier = threading.Barrier(len(requests))
+
+        def worker(start, end):
+            db = get_db()
+            cursor = db.cursor()
+            try:
+                barrier.wait()
+                db.start_transaction()
+                claim_court_slots(court_id, start, end, cursor=cursor)
+                cursor.execute(
+                    """
+                    INSERT INTO court_reservations
+                        (court_id, member_id, start_time, end_time, total_amount, status, remark, source)
+                    VALUES (%s, NULL, %s, %s, 0, '已预约', 'slot stress test', '后台')
+                    """,
+                    (court_id, start, end),
+                )
+                inserted_ids.append(cursor.lastrowid)
+                db.commit()
+                booked.append((start, end))
+            except SlotConflict:
+                db.rollback()
+            except Exception as e:
+                db.rollback()
+                errors.append(repr(e))
+            finally:
+                cursor.close()
+                db.close()
+
+        threads = [threading.Thread(target=worker, args=r) for r in requests]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            assert not errors, errors
+            assert booked
+            booked.sort()
+            for (_, prev_end), (next_start, _) in zip(booked, booked[1:]):
+                assert prev_end <= next_start, f"重复预约: {booked}"
+        finally:
+            if inserted_ids:
+                placeholders = ",".join(["%s"] * len(inserted_ids))
+                setup_cursor.execute(f"DELETE FROM court_reservations WHERE id IN ({placeholders})", inserted_ids)
+            setup_cursor.execute(
+                "DELETE FROM court_day_slots WHERE court_id = %s AND slot_date = %s",
+                (court_id, day.date()),
+            )
+            setup_db.commit()
+            setup_cursor.close()
+            setup_db.close()
+
+
+def _generate_order_nos(worker_id, count):
+    """子进程：以指定 worker id 连续生成订单号（前缀显式传入，不查库）"""
+    from app.services.order_numbers import next_order_no, set_worker_id
+
+    set_worker_id(worker_id)
+    start = time.perf_counter()
+    numbers = [next_order_no("court", prefix="GYM") for _ in range(count)]
+    return numbers, time.perf_counter() - start
+
+
+class TestOrderNoGenerator:
+    """订单号生成器：多进程并发生成不重复，同一进程内严格递增"""
+
+    @pytest.mark.slow
+    def test_unique_across_processes(self):
+        import multiprocessing
+
+        processes, per_process = 4, 20000
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes) as pool:
+            results = pool.starmap(_generate_order_nos, [(i, per_process) for i in range(processes)])
+
+        all_numbers = []
+        for numbers, elapsed in results:
+            assert numbers == sorted(numbers) and len(set(numbers)) == len(numbers)
+            # 不查库，每个进程每秒至少能生成数万个
+            assert per_process / elapsed > 20000, f"生成过慢: {per_process / elapsed:.0f}/s"
+            all_numbers.extend(numbers)
+        assert len(set(all_numbers)) == processes * per_process
+        assert all(len(n.split("-")) == 3 for n in all_numbers)
+
+    def test_sequence_overflow_and_clock_rollback(self, monkeypatch):
+        from app.services import order_numbers
+
+        monkeypatch.setattr(order_numbers, "_worker_id", None)
+        order_numbers.set_worker_id(7)
+        monkeypatch.setattr(order_numbers, "SEQ_LIMIT", 3)
+        clock = iter([1000.0] * 5 + [990.0, 1003.0])
+        monkeypatch.setattr(order_numbers.time, "time", lambda: next(clock))
+
+        stamps = [order_numbers._next_stamp() for _ in range(7)]
+        # 一秒内用尽序号借用下一秒；时钟回拨沿用上次的秒
+        assert stamps == [
+            (1000, 7, 0), (1000, 7, 1), (1000, 7, 2), (1001, 7, 0), (1001, 7, 1), (1001, 7, 2), (1003, 7, 0),
+        ]
+
+    def test_lease_expiry_stops_using_worker_id(self, monkeypatch):
+        """续租一直失败超过租期后不再使用旧 worker id：租不到就报错，租到新的 id 后才继续生成"""
+        from contextlib import contextmanager
+        from app.services import order_numbers
+
+        clock = {"now": 1000.0}
+        db = {"up": True, "rows": {}}  # worker_id -> [owner, expires_at]
+
+        class FakeCursor:
+            rowcount = 0
+
+            def __init__(self):
+                self._row = None
+
+            def execute(self, sql, params=()):
+                rows, now = db["rows"], clock["now"]
+                if "expires_at < NOW() ORDER BY" in sql:
+                    expired = sorted(w for w, (_, exp) in rows.items() if exp < now)
+                    self._row = (expired[0],) if expired else None
+                elif "SET owner" in sql:
+                    owner, ttl, wid = params
+                    ok = wid in rows and rows[wid][1] < now
+                    if ok:
+                        rows[wid] = [owner, now + ttl]
+                    self.rowcount = int(ok)
+                elif "COALESCE(MAX" in sql:
+                    self._row = (max(rows) + 1 if rows else 0,)
+                elif sql.startswith("INSERT"):
+                    wid, owner, ttl = params
+                    rows[wid] = [owner, now + ttl]
+                elif "SET expires_at = NOW() + INTERVAL" in sql:
+                    ttl, wid, owner = params
+                    ok = wid in rows and rows[wid][0] == owner
+                    if ok:
+                        rows[wid][1] = now + ttl
+                    self.rowcount = int(ok)
+                elif "SELECT owner" in sql:
+                    self._row = (rows[params[0]][0],) if params[0] in rows else None
+
+            def fetchone(self):
+                return self._row
+
+        @contextmanager
+        def fake_scope(cursor=None, **kwargs):
+            if not db["up"]:
+                raise ConnectionError("数据库不可用")
+            yield FakeCursor()
+
+        monkeypatch.setattr(order_numbers, "cursor_scope", fake_scope)
+        monkeypatch.setattr(order_numbers, "_table_ready", True)
+        monkeypatch.setattr(order_numbers.settings, "ORDER_NO_WORKER_ID", -1)
+        monkeypatch.setattr(order_numbers.settings, "ORDER_NO_LEASE_TTL", 120.0)
+        monkeypatch.setattr(order_numbers.time, "monotonic", lambda: clock["now"])
+        monkeypatch.setattr(order_numbers, "_worker_id", None)
+        monkeypatch.setattr(order_numbers, "_worker_leased", False)
+        monkeypatch.setattr(order_numbers, "_lease_deadline", 0.0)
+
+        # 首次生成时租到 0 号
+        assert order_numbers._next_stamp()[1] == 0
+
+        # 续租成功顺延截止时间
+        clock["now"] += 100
+        order_numbers._renew_lease()
+        clock["now"] += 100
+        assert order_numbers._next_stamp()[1] == 0
+
+        # 数据库不可用、续租失败，超过截止时间后拒绝继续使用 0 号
+        db["up"] = False
+        with pytest.raises(ConnectionError):
+            order_numbers._renew_lease()
+        clock["now"] += 120
+        with pytest.raises(order_numbers.WorkerIdUnavailable):
+            order_numbers.next_order_no("booking", prefix="GYM")
+
+        # 期间 0 号已被其他进程接管；数据库恢复后租到新的 id
+        db["rows"][0] = ["other", clock["now"] + 120]
+        db["up"] = True
+        assert order_numbers._next_stamp()[1] == 1
+
+        # 重新租到同一个 id 时沿用序号，同一秒内不会重复发出
+        monkeypatch.setattr(order_numbers.time, "time", lambda: 1_800_000_000.0)
+        first = order_numbers._next_stamp()
+        order_numbers.set_worker_id(1, lease_deadline=clock["now"] + 100)
+        assert order_numbers._next_stamp() == (first[0], 1, first[2] + 1)
+
+        # 续租时发现租约已被接管：立即换用新的 id
+        db["rows"][1][0] = "other"
+        order_numbers._renew_lease()
+        assert order_numbers._worker_id == 2
+        assert order_numbers._next_stamp()[1] == 2
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -55,6 +55,55 @@ class TestPasswordSecurity:
         assert verify_password("non_empty", empty_hash) is False
 
 
+class TestPasswordRehash:
+    """密码哈希升级与专用哈希线程池测试"""
+
+    def test_low_rounds_hash_upgraded(self):
+        """迭代次数不足的旧哈希验证成功时返回新哈希，当前哈希不需要升级"""
+        from passlib.hash import pbkdf2_sha256
+        from app.config import settings
+        from app.security import get_password_hash, verify_and_update_password, verify_password
+
+        legacy = pbkdf2_sha256.using(rounds=1000).hash("secret123")
+        ok, new_hash = verify_and_update_password("secret123", legacy)
+        assert ok is True
+        assert new_hash and f"${settings.PASSWORD_HASH_ROUNDS}$" in new_hash
+        assert verify_password("secret123", new_hash)
+
+        assert verify_and_update_password("wrong", legacy) == (False, None)
+        assert verify_and_update_password("secret123", get_password_hash("secret123")) == (True, None)
+
+    def test_async_verify_runs_in_bounded_pool(self):
+        """异步验证在专用线程池执行，并发线程数不超过 PASSWORD_HASH_WORKERS"""
+        import asyncio
+        import threading
+        from app import security
+        from app.config import settings
+
+        hashed = security.get_password_hash("secret123")
+        threads = set()
+        original = security.pwd_context.verify_and_update
+
+        def recording(secret, hash_):
+            threads.add(threading.current_thread().name)
+            return original(secret, hash_)
+
+        async def burst():
+            return await asyncio.gather(*(
+                security.verify_and_update_password_async("secret123", hashed) for _ in range(12)
+            ))
+
+        security.pwd_context.verify_and_update = recording
+        try:
+            results = asyncio.run(burst())
+        finally:
+            del security.pwd_context.verify_and_update
+
+        assert all(ok for ok, _ in results)
+        assert threads and all(name.startswith("pwd-hash") for name in threads)
+        assert len(threads) <= max(1, settings.PASSWORD_HASH_WORKERS)
+
+
 class TestJWTToken:
     """JWT Token 测试"""
     
@@ -109,6 +158,248 @@ class TestJWTToken:
             assert exc_info.value.status_code == 401
 
 
+class TestPrincipalCache:
+    """认证主体缓存测试"""
+
+    class _FakeUow:
+        def __init__(self, row):
+            self.row = row
+            self.queries = 0
+
+        def cursor(self, dictionary=False):
+            uow = self
+
+            class Cursor:
+                def execute(self, sql, params=None):
+                    uow.queries += 1
+
+                def fetchone(self):
+                    return dict(uow.row) if uow.row else None
+
+                def close(self):
+                    pass
+
+            return Cursor()
+
+    def test_member_token_variants_share_cache(self):
+        """三种会员 token 写法都能解析，同一 token 只查一次库"""
+        from app.principals import principal_cache, resolve_member
+        from app.security import create_access_token
+
+        principal_cache.invalidate("member")
+        db = self._FakeUow({"id": 901, "name": "张三", "phone": "13800000000", "level": "normal", "status": "正常"})
+
+        token = create_access_token({"sub": "901", "member_id": 901, "role": "member"})
+        first = resolve_member(token, db)
+        first["name"] = "被调用方修改"
+        second = resolve_member(token, db)
+        assert db.queries == 1
+        assert second["name"] == "张三"
+        assert second["mobile"] == "13800000000"
+
+        for claims in ({"sub": "901", "scope": "member"}, {"sub": "901", "user_type": "member"}):
+            assert resolve_member(create_access_token(claims, expires_delta=timedelta(minutes=5)), db)["id"] == 901
+
+    def test_status_change_invalidates(self):
+        """会员状态变化后经 members 频道失效，被禁用会员不再通过认证"""
+        from fastapi import HTTPException
+        from app.principals import principal_cache, resolve_member
+        from app.security import create_access_token
+        from app.services import cache_bus
+
+        principal_cache.invalidate("member")
+        db = self._FakeUow({"id": 902, "name": "李四", "phone": "13900000000", "level": "normal", "status": "正常"})
+        token = create_access_token({"sub": "902", "member_id": 902, "role": "member"})
+        resolve_member(token, db)
+
+        db.row["status"] = "禁用"
+        cache_bus._fire("members")
+        with pytest.raises(HTTPException) as exc_info:
+            resolve_member(token, db)
+        assert exc_info.value.status_code == 403
+
+    def test_admin_token_rejected_as_member(self):
+        """管理端 token 不能当会员 token 使用"""
+        from fastapi import HTTPException
+        from app.principals import resolve_member
+        from app.security import create_access_token
+
+        token = create_access_token({"sub": "1", "role": "admin"})
+        with pytest.raises(HTTPException) as exc_info:
+            resolve_member(token, self._FakeUow(None))
+        assert exc_info.value.status_code == 401
+
+
+class TestTokenClaims:
+    """带声明 token 与撤销表测试"""
+
+    @pytest.fixture(autouse=True)
+    def revocations(self):
+        """撤销表视为已加载（不查库），测试结束后清空"""
+        from app.services import token_revocation
+
+        token_revocation._loaded = token_revocation._notified
+        token_revocation._ready = True
+        yield token_revocation
+        token_revocation._stale_before.clear()
+        token_revocation._logout_before.clear()
+
+    def test_claims_resolve_without_db(self):
+        """声明可信时管理端/会员端认证都不查库"""
+        from app.principals import member_claims, resolve_member, resolve_user, user_claims
+        from app.security import create_access_token
+
+        db = TestPrincipalCache._FakeUow(None)
+        user = resolve_user(create_access_token(user_claims({"id": 7, "username": "boss", "role": "admin"})), db)
+        assert user == {"id": 7, "username": "boss", "role": "admin", "is_active": 1}
+
+        member = resolve_member(create_access_token(member_claims(
+            {"id": 903, "name": "王五", "phone": "13700000000", "level": "gold", "status": "正常"}
+        )), db)
+        assert member["level"] == "gold" and member["mobile"] == "13700000000"
+        assert db.queries == 0
+
+    def test_stale_claims_fall_back_to_db(self, revocations):
+        """签发后被标记 stale 的 token 回退查库，禁用状态因此生效"""
+        import time
+        from fastapi import HTTPException
+        from app.principals import member_claims, resolve_member
+        from app.security import create_access_token
+
+        token = create_access_token(member_claims(
+            {"id": 904, "name": "赵六", "phone": "13600000000", "level": "normal", "status": "正常"}
+        ))
+        revocations._apply("member", "904", time.time(), force_logout=False)
+
+        db = TestPrincipalCache._FakeUow({"id": 904, "name": "赵六", "phone": "13600000000", "level": "normal", "status": "禁用"})
+        with pytest.raises(HTTPException) as exc_info:
+            resolve_member(token, db)
+        assert exc_info.value.status_code == 403
+        assert db.queries == 1
+
+    def test_force_logout_rejects_token(self, revocations):
+        """强制下线之前签发的 token 直接 401（不带声明的旧 token 同样生效）"""
+        import time
+        from fastapi import HTTPException
+        from app.principals import resolve_user, user_claims
+        from app.security import create_access_token
+
+        tokens = [
+            create_access_token(user_claims({"id": 8, "username": "clerk", "role": "staff"})),
+            create_access_token({"sub": "8", "role": "staff"}),
+        ]
+        revocations._apply("user", "8", time.time(), force_logout=True)
+        for token in tokens:
+            with pytest.raises(HTTPException) as exc_info:
+                resolve_user(token, TestPrincipalCache._FakeUow({"id": 8, "username": "clerk", "role": "staff", "is_active": 1}))
+            assert exc_info.value.status_code == 401
+
+    def test_relogin_in_same_second_is_not_revoked(self, revocations, monkeypatch):
+        """修改密码（强制下线）后同一秒内重新登录，新 token 可用，旧 token 仍被拒绝"""
+        from datetime import datetime, timezone
+        from fastapi import HTTPException
+        from app import security
+        from app.principals import resolve_user, user_claims
+
+        import time
+
+        second = float(int(time.time()))
+        clock = {"now": second + 0.2}
+
+        class _Clock(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.fromtimestamp(clock["now"], tz=timezone.utc)
+
+        monkeypatch.setattr(security, "datetime", _Clock)
+        claims = user_claims({"id": 9, "username": "cashier", "role": "staff"})
+        old_token = security.create_access_token(claims)
+
+        revocations._apply("user", "9", second + 0.5, force_logout=True)
+        clock["now"] = second + 0.7
+        new_token = security.create_access_token(claims)
+
+        db = TestPrincipalCache._FakeUow({"id": 9, "username": "cashier", "role": "staff", "is_active": 1})
+        with pytest.raises(HTTPException) as exc_info:
+            resolve_user(old_token, db)
+        assert exc_info.value.status_code == 401
+        assert resolve_user(new_token, db)["id"] == 9
+
+    def test_revoke_all_principals(self, revocations):
+        """ALL_PRINCIPALS 撤销对同类所有主体生效（完全格式化清空会员表）"""
+        import time
+        from app.services.token_revocation import ALL_PRINCIPALS, TOKEN_OK, TOKEN_REVOKED
+
+        issued = time.time()
+        revocations._apply("member", ALL_PRINCIPALS, issued + 0.001, force_logout=True)
+        assert revocations.token_state("member", "906", issued) == TOKEN_REVOKED
+        assert revocations.token_state("member", "906", issued + 1) == TOKEN_OK
+        assert revocations.token_state("user", "906", issued) == TOKEN_OK
+
+    def test_claims_not_trusted_before_first_load(self, revocations, monkeypatch):
+        """撤销表从未加载成功（数据库不可用）时不信任声明，回退查库"""
+        from app.services.token_revocation import TOKEN_STALE
+
+        def fail():
+            raise RuntimeError("db down")
+
+        monkeypatch.setattr(revocations, "_ready", False)
+        monkeypatch.setattr(revocations, "_loaded", revocations._notified - 1)
+        monkeypatch.setattr(revocations, "_retry_at", 0.0)
+        monkeypatch.setattr(revocations, "refresh", fail)
+        assert revocations.token_state("member", "905", 1_800_000_000.0) == TOKEN_STALE
+
+
+class TestPermissionIndex:
+    """RBAC 权限索引测试"""
+
+    def test_compiled_rules_match_legacy_semantics(self):
+        """通配符、未配置角色、空 actions 的判断规则保持不变"""
+        from app.deps import PermissionIndex
+
+        index = PermissionIndex([
+            {"code": "admin", "menus": ["*"], "actions": ["*"]},
+            {"code": "staff", "menus": ["dashboard"], "actions": ["view", 1]},
+            {"code": "empty", "actions": []},
+            {"code": "staff", "actions": ["*"]},  # 重复 code 以靠前的为准
+        ])
+
+        assert index.allows("admin", "member.delete")
+        assert index.allows("staff", "view")
+        assert index.allows("staff", "1")
+        assert not index.allows("staff", "member.delete")
+        assert index.allows("empty", "anything")
+        assert index.allows("unknown", "anything")
+        assert index.has_menu("staff", "dashboard")
+        assert not index.has_menu("staff", "orders")
+
+    def test_install_swaps_index_without_db(self):
+        """保存角色配置后直接替换索引，鉴权不查库"""
+        from app import deps
+
+        deps.install_roles_config([{"code": "staff", "actions": ["view"]}])
+        assert not deps._user_has_action({"role": "staff"}, "member.create")
+
+        deps.install_roles_config([{"code": "staff", "actions": ["view", "member.create"]}])
+        assert deps._user_has_action({"role": "staff"}, "member.create")
+        assert deps._load_roles_config()[0]["actions"] == ["view", "member.create"]
+        deps._invalidate_roles_cache()
+
+    def test_require_action_dependency_cached(self):
+        """同一权限码返回同一个依赖函数，无权限时 403"""
+        from fastapi import HTTPException
+        from app import deps
+
+        assert deps.require_action("member.create") is deps.require_action("member.create")
+
+        deps.install_roles_config([{"code": "staff", "actions": ["view"]}])
+        dependency = deps.require_action("member.create")
+        with pytest.raises(HTTPException) as exc_info:
+            dependency(current_user={"role": "staff"}, db=None)
+        assert exc_info.value.status_code == 403
+        deps._invalidate_roles_cache()
+
+
 class TestConfigSecurity:
     """配置安全测试"""
     